@@ -0,0 +1,351 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+
+Benchmark and scaling check of configuration loading.
+
+Generates configuration trees of various sizes and shapes, writes them to a
+local directory and to a fake S3 bucket (see ``fakes.py``), and loads each
+with :py:class:`ecsjobs.config.Config`, recording the wall time of each stage
+(``config.load``, ``config.download``, ``config.parse_yaml``,
+``config.validate`` and ``config.make_jobs``) from
+:py:attr:`ecsjobs.config.Config.timings`. Shapes are:
+
+* ``single`` - one file containing the global settings and all jobs
+* ``multi`` - a ``global.yml`` file plus one file per job
+* ``overrides`` - as ``multi``, with large ``overrides`` blocks on every
+  ``EcsTask`` job
+* ``cron`` - as ``multi``, with a ``cron_expression`` on every job
+
+For each shape, source and stage, the scaling exponent between the smallest
+and largest sizes is calculated (1.0 is linear); if it exceeds
+``--max-exponent`` for any stage whose time at the largest size is at least
+``--min-time``, the offending stages are listed and the exit code is 1.
+Usage, from the repository root, with ecsjobs installed::
+
+    python benchmarks/bench_config.py --output results.json
+    python benchmarks/bench_config.py --sizes 100,1000 --shapes multi
+"""
+
+import os
+import sys
+import math
+import json
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+from datetime import datetime
+
+import yaml
+import boto3
+
+from fakes import FakeAws
+from bench_runner import make_config
+
+#: Default numbers of jobs to benchmark.
+DEFAULT_SIZES = [100, 1000, 5000]
+
+#: Config shapes to benchmark.
+SHAPES = ['single', 'multi', 'overrides', 'cron']
+
+#: Config sources to benchmark.
+SOURCES = ['local', 's3']
+
+#: Timing stages reported.
+STAGES = [
+    'config.load', 'config.download', 'config.parse_yaml', 'config.validate',
+    'config.make_jobs'
+]
+
+#: Fake S3 bucket and prefix for configs.
+BUCKET = 'ecsjobs-bench'
+PREFIX = 'config/'
+
+#: Number of environment variables in each ``overrides`` block.
+OVERRIDE_VARS = 50
+
+#: Cron expressions used by the ``cron`` shape, in rotation.
+CRON_EXPRESSIONS = [
+    '* * * * *', '0 4 * * *', '*/15 * * * *', '30 2 * * 1-5', '0 0 1 * *',
+    '0,30 8-18 * * *', '15 3 */2 * *', '0 12 * * 0'
+]
+
+
+def make_files(num_jobs, shape):
+    """
+    Return the files of a configuration with ``num_jobs`` jobs, of the given
+    shape.
+
+    :param num_jobs: number of jobs
+    :type num_jobs: int
+    :param shape: one of :py:data:`~.SHAPES`
+    :type shape: str
+    :return: dict of filename to YAML content
+    :rtype: dict
+    """
+    conf = make_config(num_jobs)[0]
+    for idx, j in enumerate(conf['jobs']):
+        if shape == 'overrides' and j['class_name'] == 'EcsTask':
+            j['overrides'] = {'containerOverrides': [{
+                'name': 'main',
+                'command': ['/bin/run', '--job', j['name']],
+                'environment': [
+                    {'name': 'VAR_%03d' % i, 'value': '%s-%d' % (j['name'], i)}
+                    for i in range(OVERRIDE_VARS)
+                ]
+            }]}
+        elif shape == 'cron':
+            j['cron_expression'] = CRON_EXPRESSIONS[
+                idx % len(CRON_EXPRESSIONS)
+            ]
+    if shape == 'single':
+        return {'ecsjobs.yml': yaml.safe_dump(conf)}
+    res = {'global.yml': yaml.safe_dump(conf['global'])}
+    for j in conf['jobs']:
+        res['%s.yml' % j['name']] = yaml.safe_dump(j)
+    return res
+
+
+def load(source, files, aws, tmpdir):
+    """
+    Write the config files to the local filesystem or fake S3 bucket, load
+    them with :py:class:`ecsjobs.config.Config`, and return the wall time of
+    each stage.
+
+    :param source: one of :py:data:`~.SOURCES`
+    :type source: str
+    :param files: dict of filename to YAML content
+    :type files: dict
+    :param aws: the fake AWS APIs
+    :type aws: fakes.FakeAws
+    :param tmpdir: temporary directory to write local configs in
+    :type tmpdir: str
+    :return: dict of stage name to wall seconds
+    :rtype: dict
+    """
+    from ecsjobs.config import Config
+    for k in ['ECSJOBS_LOCAL_CONF_PATH', 'ECSJOBS_BUCKET', 'ECSJOBS_KEY']:
+        os.environ.pop(k, None)
+    aws.s3_objects.clear()
+    if len(files) == 1:
+        name = list(files.keys())[0]
+    else:
+        name = ''
+    if source == 'local':
+        for fname, content in files.items():
+            with open(os.path.join(tmpdir, fname), 'w') as fh:
+                fh.write(content)
+        os.environ['ECSJOBS_LOCAL_CONF_PATH'] = os.path.join(tmpdir, name)
+    else:
+        for fname, content in files.items():
+            aws.s3_objects[(BUCKET, PREFIX + fname)] = content.encode('utf-8')
+        os.environ['ECSJOBS_BUCKET'] = BUCKET
+        os.environ['ECSJOBS_KEY'] = PREFIX + name
+    conf = Config()
+    res = dict((s, 0.0) for s in STAGES)
+    for t in conf.timings.records:
+        res[t['name']] = t['wall_sec']
+    return res
+
+
+def run(sizes, shapes, repeat=3):
+    """
+    Benchmark loading each shape and size of config from each source,
+    ``repeat`` times, and return the minimum time of each stage.
+
+    :param sizes: numbers of jobs
+    :type sizes: list
+    :param shapes: config shapes
+    :type shapes: list
+    :param repeat: number of times to load each config
+    :type repeat: int
+    :return: list of result dicts
+    :rtype: list
+    """
+    boto3.setup_default_session(
+        aws_access_key_id='fake', aws_secret_access_key='fake',
+        region_name='us-east-1'
+    )
+    aws = FakeAws()
+    aws.install(boto3.DEFAULT_SESSION)
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            files = make_files(size, shape)
+            for source in SOURCES:
+                times = []
+                for _ in range(repeat):
+                    tmpdir = tempfile.mkdtemp(prefix='ecsjobs-bench-')
+                    try:
+                        times.append(load(source, files, aws, tmpdir))
+                    finally:
+                        shutil.rmtree(tmpdir)
+                results.append({
+                    'shape': shape,
+                    'source': source,
+                    'jobs': size,
+                    'files': len(files),
+                    'bytes': sum(len(x) for x in files.values()),
+                    'stages': dict(
+                        (s, min(t[s] for t in times)) for s in STAGES
+                    )
+                })
+                sys.stderr.write('%s %s %d jobs: %s\n' % (
+                    shape, source, size, ', '.join(
+                        '%s=%.3fs' % (s[7:], results[-1]['stages'][s])
+                        for s in STAGES
+                    )
+                ))
+    return results
+
+
+def scaling(results, max_exponent=1.25, min_time=0.05):
+    """
+    Calculate the scaling exponent of each stage, for each shape and source,
+    between the smallest and largest sizes benchmarked.
+
+    :param results: results, as returned by :py:func:`~.run`
+    :type results: list
+    :param max_exponent: maximum acceptable exponent
+    :type max_exponent: float
+    :param min_time: minimum time at the largest size, in seconds, for a
+      stage to be checked; below this, timings are too noisy to compare
+    :type min_time: float
+    :return: list of dicts describing each stage's scaling, with a boolean
+      ``ok`` key
+    :rtype: list
+    """
+    res = []
+    groups = {}
+    for r in results:
+        groups.setdefault((r['shape'], r['source']), []).append(r)
+    for (shape, source), rs in sorted(groups.items()):
+        rs = sorted(rs, key=lambda x: x['jobs'])
+        small, large = rs[0], rs[-1]
+        if small['jobs'] == large['jobs']:
+            continue
+        for s in STAGES:
+            if small['stages'][s] <= 0 or large['stages'][s] <= 0:
+                continue
+            exp = math.log(
+                large['stages'][s] / small['stages'][s]
+            ) / math.log(large['jobs'] / small['jobs'])
+            res.append({
+                'shape': shape, 'source': source, 'stage': s,
+                'exponent': exp,
+                'ok': exp <= max_exponent or large['stages'][s] < min_time
+            })
+    return res
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(
+        description='Benchmark ecsjobs config loading and check that each '
+                    'stage scales linearly'
+    )
+    p.add_argument('--sizes', dest='sizes', action='store', type=str,
+                   default=','.join(str(x) for x in DEFAULT_SIZES),
+                   help='comma-separated numbers of jobs to benchmark '
+                        '(default: %(default)s)')
+    p.add_argument('--shapes', dest='shapes', action='store', type=str,
+                   default=','.join(SHAPES),
+                   help='comma-separated config shapes to benchmark '
+                        '(default: %(default)s)')
+    p.add_argument('--repeat', dest='repeat', type=int, default=3,
+                   help='number of times to load each config; the minimum '
+                        'time is used (default: %(default)s)')
+    p.add_argument('--max-exponent', dest='max_exponent', type=float,
+                   default=1.25, help='maximum acceptable scaling exponent '
+                                      'of any stage (default: %(default)s)')
+    p.add_argument('--min-time', dest='min_time', type=float, default=0.05,
+                   help='do not check stages taking less than this many '
+                        'seconds at the largest size (default: %(default)s)')
+    p.add_argument('-o', '--output', dest='output', action='store',
+                   default='-', help='path to write JSON results to, or - '
+                                     'for STDOUT (default: %(default)s)')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.ERROR)
+    from ecsjobs.version import VERSION
+    shapes = args.shapes.split(',')
+    for s in shapes:
+        if s not in SHAPES:
+            raise RuntimeError('ERROR: Unknown shape: %s' % s)
+    results = run(
+        [int(x) for x in args.sizes.split(',')], shapes, repeat=args.repeat
+    )
+    scale = scaling(
+        results, max_exponent=args.max_exponent, min_time=args.min_time
+    )
+    doc = {
+        'benchmark': 'config',
+        'ecsjobs_version': VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(),
+        'params': {
+            'repeat': args.repeat,
+            'max_exponent': args.max_exponent,
+            'min_time': args.min_time,
+            'override_vars': OVERRIDE_VARS
+        },
+        'results': results,
+        'scaling': scale
+    }
+    if args.output == '-':
+        json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(doc, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+    failed = [x for x in scale if not x['ok']]
+    for x in failed:
+        sys.stderr.write(
+            'SUPER-LINEAR: %s %s %s scales with exponent %.2f\n' % (
+                x['shape'], x['source'], x['stage'], x['exponent']
+            )
+        )
+    if len(failed) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,347 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+
+
+Benchmark and scaling check of HTML report building.
+
+Renders a report for a fixed number of jobs (200 by default) with
+:py:class:`ecsjobs.reporter.Reporter`, at several sizes of output per job, and
+records the wall time and the peak memory allocated (via :py:mod:`tracemalloc`)
+while adding every job (:py:meth:`~ecsjobs.reporter.Reporter.add_job`) and
+building the final report. Job output is generated before measurement starts,
+so peak memory does not include the outputs themselves. Modes are:
+
+* ``inline`` - the ``report_inline_output_chars`` and
+  ``report_inline_total_chars`` limits are disabled, so every job's full output
+  is escaped into the report
+* ``budget`` - the default limits apply, so output beyond them is cut to
+  head/tail excerpts in the report and compressed to gzip attachments
+
+For each mode, the scaling exponents of time and of peak memory with total
+output size, between the smallest and largest sizes, are calculated (1.0 is
+linear). If either exceeds ``--max-exponent`` (ignoring times below
+``--min-time`` at the largest size), the offending modes are listed and the
+exit code is 1. Usage, from the repository root, with ecsjobs installed::
+
+    python benchmarks/bench_report.py --output results.json
+    python benchmarks/bench_report.py --sizes 1024,65536 --modes inline
+"""
+
+import sys
+import math
+import json
+import time
+import logging
+import argparse
+import platform
+import tracemalloc
+from datetime import datetime, timedelta
+
+#: Default numbers of characters of output per job to benchmark.
+DEFAULT_SIZES = [4096, 32768, 262144]
+
+#: Default number of jobs in each report.
+DEFAULT_JOBS = 200
+
+#: Report modes to benchmark.
+MODES = ['inline', 'budget']
+
+#: Line of job output; includes characters that must be HTML-escaped.
+OUTPUT_LINE = 'line %08d: <value> & "quoted" text, \'single\' too\n'
+
+
+class BenchConfig(object):
+    """
+    Minimal stand-in for :py:class:`ecsjobs.config.Config`, providing the
+    default global settings with the given overrides.
+    """
+
+    def __init__(self, overrides):
+        from ecsjobs.config import Config
+        self._globals = dict(Config._global_defaults)
+        self._globals.update(overrides)
+
+    def get_global(self, k):
+        return self._globals[k]
+
+
+def make_output(num_chars):
+    """
+    Return job output of (approximately) ``num_chars`` characters.
+
+    :param num_chars: number of characters
+    :type num_chars: int
+    :rtype: str
+    """
+    lines = max(1, num_chars // len(OUTPUT_LINE % 0))
+    return ''.join(OUTPUT_LINE % i for i in range(lines))
+
+
+def make_jobs(num_jobs, num_chars):
+    """
+    Return ``num_jobs`` finished jobs, each with ``num_chars`` characters of
+    output; every 10th job has failed.
+
+    :param num_jobs: number of jobs
+    :type num_jobs: int
+    :param num_chars: number of characters of output per job
+    :type num_chars: int
+    :rtype: list
+    """
+    from ecsjobs.jobs.local_command import LocalCommand
+    start = datetime(2017, 11, 23, 12, 0, 0)
+    res = []
+    for i in range(num_jobs):
+        j = LocalCommand('job%05d' % i, 'bench', command=['true'])
+        j._started = True
+        j._finished = True
+        j._start_time = start
+        j._finish_time = start + timedelta(seconds=i)
+        j._exit_code = 1 if i % 10 == 9 else 0
+        # distinct string objects, as each job's output would be
+        j._output = make_output(num_chars) + str(i)
+        res.append(j)
+    return res
+
+
+def build(mode, jobs, sink_path):
+    """
+    Add every job to a new Reporter and build the final report.
+
+    :param mode: one of :py:data:`~.MODES`
+    :type mode: str
+    :param jobs: jobs to report on
+    :type jobs: list
+    :param sink_path: path for the (unused) file report sink
+    :type sink_path: str
+    :return: 2-tuple of the report length in characters and number of
+      attachments
+    :rtype: tuple
+    """
+    from ecsjobs.reporter import Reporter
+    overrides = {'report_sinks': [{'type': 'file', 'path': sink_path}]}
+    if mode == 'inline':
+        overrides['report_inline_output_chars'] = None
+        overrides['report_inline_total_chars'] = None
+    r = Reporter(BenchConfig(overrides))
+    for j in jobs:
+        r.add_job(j)
+    start = jobs[0].start_time
+    end = max(j.finish_time for j in jobs)
+    report = r._make_report(jobs, [], {}, start, end)
+    num_attachments = len(r._attachments)
+    r._close_attachments()
+    return len(report), num_attachments
+
+
+def run(sizes, modes, num_jobs=DEFAULT_JOBS, repeat=3):
+    """
+    Benchmark building the report for each mode and size of output per job.
+    Time is the minimum of ``repeat`` builds without tracing; peak memory is
+    measured in one further build with :py:mod:`tracemalloc` running.
+
+    :param sizes: numbers of characters of output per job
+    :type sizes: list
+    :param modes: report modes
+    :type modes: list
+    :param num_jobs: number of jobs in each report
+    :type num_jobs: int
+    :param repeat: number of times to build each report
+    :type repeat: int
+    :return: list of result dicts
+    :rtype: list
+    """
+    sink_path = '/dev/null'
+    results = []
+    for mode in modes:
+        for size in sizes:
+            jobs = make_jobs(num_jobs, size)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                report_chars, attachments = build(mode, jobs, sink_path)
+                times.append(time.perf_counter() - start)
+            tracemalloc.start()
+            try:
+                base = tracemalloc.get_traced_memory()[0]
+                build(mode, jobs, sink_path)
+                peak = tracemalloc.get_traced_memory()[1] - base
+            finally:
+                tracemalloc.stop()
+            output_chars = sum(len(j.output) for j in jobs)
+            results.append({
+                'mode': mode,
+                'jobs': num_jobs,
+                'output_chars_per_job': size,
+                'output_chars': output_chars,
+                'report_chars': report_chars,
+                'attachments': attachments,
+                'build_sec': min(times),
+                'peak_alloc_bytes': peak
+            })
+            sys.stderr.write(
+                '%s %d chars/job: %.3fs, peak %.1f MiB, report %d chars, '
+                '%d attachments\n' % (
+                    mode, size, min(times), peak / 1048576.0, report_chars,
+                    attachments
+                )
+            )
+            del jobs
+    return results
+
+
+def scaling(results, max_exponent=1.25, min_time=0.05):
+    """
+    Calculate the scaling exponents of build time and peak memory with total
+    output size, for each mode, between the smallest and largest sizes
+    benchmarked.
+
+    :param results: results, as returned by :py:func:`~.run`
+    :type results: list
+    :param max_exponent: maximum acceptable exponent
+    :type max_exponent: float
+    :param min_time: minimum build time at the largest size, in seconds, for
+      time to be checked; below this, timings are too noisy to compare
+    :type min_time: float
+    :return: list of dicts describing each mode's scaling, with a boolean
+      ``ok`` key
+    :rtype: list
+    """
+    res = []
+    groups = {}
+    for r in results:
+        groups.setdefault(r['mode'], []).append(r)
+    for mode, rs in sorted(groups.items()):
+        rs = sorted(rs, key=lambda x: x['output_chars'])
+        small, large = rs[0], rs[-1]
+        if small['output_chars'] == large['output_chars']:
+            continue
+        ratio = math.log(large['output_chars'] / small['output_chars'])
+        for metric in ['build_sec', 'peak_alloc_bytes']:
+            if small[metric] <= 0 or large[metric] <= 0:
+                continue
+            exp = math.log(large[metric] / small[metric]) / ratio
+            ok = exp <= max_exponent
+            if metric == 'build_sec' and large[metric] < min_time:
+                ok = True
+            res.append({
+                'mode': mode, 'metric': metric, 'exponent': exp, 'ok': ok
+            })
+    return res
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(
+        description='Benchmark ecsjobs HTML report building and check that '
+                    'time and memory scale linearly with output size'
+    )
+    p.add_argument('--sizes', dest='sizes', action='store', type=str,
+                   default=','.join(str(x) for x in DEFAULT_SIZES),
+                   help='comma-separated numbers of characters of output per '
+                        'job to benchmark (default: %(default)s)')
+    p.add_argument('--jobs', dest='jobs', type=int, default=DEFAULT_JOBS,
+                   help='number of jobs in each report (default: '
+                        '%(default)s)')
+    p.add_argument('--modes', dest='modes', action='store', type=str,
+                   default=','.join(MODES),
+                   help='comma-separated report modes to benchmark '
+                        '(default: %(default)s)')
+    p.add_argument('--repeat', dest='repeat', type=int, default=3,
+                   help='number of times to build each report; the minimum '
+                        'time is used (default: %(default)s)')
+    p.add_argument('--max-exponent', dest='max_exponent', type=float,
+                   default=1.25, help='maximum acceptable scaling exponent '
+                                      'of time or memory (default: '
+                                      '%(default)s)')
+    p.add_argument('--min-time', dest='min_time', type=float, default=0.05,
+                   help='do not check times of less than this many seconds '
+                        'at the largest size (default: %(default)s)')
+    p.add_argument('-o', '--output', dest='output', action='store',
+                   default='-', help='path to write JSON results to, or - '
+                                     'for STDOUT (default: %(default)s)')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.ERROR)
+    from ecsjobs.version import VERSION
+    modes = args.modes.split(',')
+    for m in modes:
+        if m not in MODES:
+            raise RuntimeError('ERROR: Unknown mode: %s' % m)
+    results = run(
+        [int(x) for x in args.sizes.split(',')], modes, num_jobs=args.jobs,
+        repeat=args.repeat
+    )
+    scale = scaling(
+        results, max_exponent=args.max_exponent, min_time=args.min_time
+    )
+    doc = {
+        'benchmark': 'report',
+        'ecsjobs_version': VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(),
+        'params': {
+            'jobs': args.jobs,
+            'repeat': args.repeat,
+            'max_exponent': args.max_exponent,
+            'min_time': args.min_time
+        },
+        'results': results,
+        'scaling': scale
+    }
+    if args.output == '-':
+        json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(doc, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+    failed = [x for x in scale if not x['ok']]
+    for x in failed:
+        sys.stderr.write(
+            'SUPER-LINEAR: %s %s scales with exponent %.2f\n' % (
+                x['mode'], x['metric'], x['exponent']
+            )
+        )
+    if len(failed) > 0:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
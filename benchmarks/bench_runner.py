@@ -0,0 +1,333 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+
+Benchmark of ecsjobs runner overhead at scale.
+
+Drives :py:class:`ecsjobs.runner.EcsJobsRunner` with synthetic configs of
+equal numbers of ``EcsTask``, ``DockerExec``, ``EcsDockerExec`` and
+``LocalCommand`` jobs, with ECS, CloudWatch Logs, SES and Docker replaced by
+the deterministic fakes in ``fakes.py``. Each size is run in a fresh
+subprocess, so that peak RSS is comparable, and the results are written as a
+JSON document. Usage, from the repository root, with ecsjobs installed::
+
+    python benchmarks/bench_runner.py --output results.json
+    python benchmarks/bench_runner.py --sizes 10,100 --output -
+
+For each size, the result records:
+
+* ``config_sec`` - wall time to load, validate and instantiate the config
+* ``run_sec`` - wall time of the run, from the start of prefetch until the
+  report has been sent and metrics exported
+* ``job_runtime_sec`` - time spent in job processes; only ``LocalCommand``
+  jobs run real processes, as the fakes respond immediately and the
+  inter-poll sleep is 0
+* ``overhead_sec`` and ``overhead_per_job_ms`` - ``run_sec`` less
+  ``job_runtime_sec``, i.e. time spent in ecsjobs, botocore and the fakes
+* ``aws_api_calls``, ``aws_api_calls_per_job`` and ``aws_api_calls_by_op``
+* ``docker_calls``, ``docker_calls_per_job`` and ``docker_calls_by_method``
+* ``peak_rss_kb`` - peak resident set size of the benchmark process
+* ``report_bytes`` - size of the HTML (or raw MIME) report sent via SES
+* ``job_states`` - number of jobs in each result state
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+from unittest.mock import patch
+
+import yaml
+import boto3
+
+from fakes import FakeAws, FakeDocker, FakeContainer
+
+#: Default numbers of jobs to benchmark.
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+#: Job classes in the synthetic configs, in the order they are assigned.
+JOB_CLASSES = ['EcsTask', 'DockerExec', 'EcsDockerExec', 'LocalCommand']
+
+
+def make_config(num_jobs):
+    """
+    Return a synthetic configuration with ``num_jobs`` jobs, spread evenly
+    over :py:data:`~.JOB_CLASSES`, and the containers that the fake Docker
+    must list for its EcsDockerExec jobs.
+
+    :param num_jobs: number of jobs
+    :type num_jobs: int
+    :return: 2-tuple of config dict and list of FakeContainer
+    :rtype: tuple
+    """
+    jobs = []
+    containers = []
+    for i in range(num_jobs):
+        cls = JOB_CLASSES[i % len(JOB_CLASSES)]
+        j = {
+            'name': 'job%05d-%s' % (i, cls),
+            'schedule': 'bench',
+            'class_name': cls
+        }
+        if cls == 'EcsTask':
+            j.update({
+                'cluster_name': 'bench',
+                'task_definition_family': 'family%05d' % i,
+                'overrides': {'containerOverrides': [{
+                    'name': 'main', 'environment': [
+                        {'name': 'JOB_NUMBER', 'value': str(i)}
+                    ]
+                }]}
+            })
+        elif cls == 'DockerExec':
+            j.update({
+                'container_name': 'container%05d' % i,
+                'command': ['/bin/echo', j['name']]
+            })
+        elif cls == 'EcsDockerExec':
+            j.update({
+                'task_definition_family': 'family%05d' % i,
+                'container_name': 'main',
+                'command': ['/bin/echo', j['name']]
+            })
+            containers.append(FakeContainer(
+                'ecs-family%05d-main' % i, labels={
+                    'com.amazonaws.ecs.container-name': 'main',
+                    'com.amazonaws.ecs.task-definition-family':
+                        'family%05d' % i
+                }
+            ))
+        else:
+            j['command'] = ['/bin/echo', j['name']]
+        jobs.append(j)
+    conf = {
+        'global': {
+            'from_email': 'ecsjobs@example.com',
+            'to_email': 'ops@example.com',
+            'inter_poll_sleep_sec': 0,
+            'max_total_runtime_sec': 86400,
+            'prefetch_concurrency': 8
+        },
+        'jobs': jobs
+    }
+    return conf, containers
+
+
+def run_one(num_jobs, polls_to_stop=2, fail_every=10, log_lines=20):
+    """
+    Benchmark a single run of ``num_jobs`` jobs in this process.
+
+    :param num_jobs: number of jobs
+    :type num_jobs: int
+    :param polls_to_stop: DescribeTasks calls before each ECS task stops
+    :type polls_to_stop: int
+    :param fail_every: make every Nth ECS task fail; 0 for never
+    :type fail_every: int
+    :param log_lines: number of lines of output from each fake ECS task and
+      Docker exec
+    :type log_lines: int
+    :return: benchmark result
+    :rtype: dict
+    """
+    # imported here so that the fakes are in place before any clients exist
+    from ecsjobs.aws import api_accounting
+    from ecsjobs.config import Config
+    from ecsjobs.runner import EcsJobsRunner
+
+    conf_dict, containers = make_config(num_jobs)
+    tmpdir = tempfile.mkdtemp(prefix='ecsjobs-bench-')
+    conf_path = os.path.join(tmpdir, 'ecsjobs.yml')
+    with open(conf_path, 'w') as fh:
+        yaml.safe_dump(conf_dict, fh)
+    os.environ['ECSJOBS_LOCAL_CONF_PATH'] = conf_path
+    os.environ.pop('ECSJOBS_BUCKET', None)
+
+    boto3.setup_default_session(
+        aws_access_key_id='fake', aws_secret_access_key='fake',
+        region_name='us-east-1'
+    )
+    aws = FakeAws(
+        polls_to_stop=polls_to_stop, fail_every=fail_every,
+        log_lines=log_lines
+    )
+    aws.install(boto3.DEFAULT_SESSION)
+    api_accounting.install()
+    dkr = FakeDocker(containers_list=containers, output_lines=log_lines)
+
+    with patch('docker.from_env', dkr.from_env):
+        start = time.perf_counter()
+        conf = Config()
+        config_sec = time.perf_counter() - start
+        runner = EcsJobsRunner(conf)
+        start = time.perf_counter()
+        runner.run_schedules(['bench'])
+        run_sec = time.perf_counter() - start
+
+    job_runtime_sec = sum(
+        j.duration.total_seconds() for j in conf.jobs
+        if j.__class__.__name__ == 'LocalCommand' and j.duration is not None
+    )
+    api_by_op = {}
+    for rec in api_accounting.records:
+        k = '%s:%s' % (rec['service'], rec['operation'])
+        api_by_op[k] = api_by_op.get(k, 0) + rec['calls']
+    api_calls = sum(api_by_op.values())
+    docker_calls = sum(dkr.calls.values())
+    job_states = {}
+    for rec in runner._reporter.records:
+        job_states[rec['state']] = job_states.get(rec['state'], 0) + 1
+    os.unlink(conf_path)
+    os.rmdir(tmpdir)
+    return {
+        'jobs': num_jobs,
+        'config_sec': config_sec,
+        'run_sec': run_sec,
+        'job_runtime_sec': job_runtime_sec,
+        'overhead_sec': run_sec - job_runtime_sec,
+        'overhead_per_job_ms': (run_sec - job_runtime_sec) * 1000 / num_jobs,
+        'aws_api_calls': api_calls,
+        'aws_api_calls_per_job': api_calls / num_jobs,
+        'aws_api_calls_by_op': dict(sorted(api_by_op.items())),
+        'docker_calls': docker_calls,
+        'docker_calls_per_job': docker_calls / num_jobs,
+        'docker_calls_by_method': dict(sorted(dkr.calls.items())),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'report_bytes': sum(aws.report_bytes),
+        'job_states': dict(sorted(job_states.items()))
+    }
+
+
+def run_sizes(sizes, args):
+    """
+    Benchmark each size in a separate subprocess (running this script with
+    ``--child``) and return the list of results.
+
+    :param sizes: numbers of jobs to benchmark
+    :type sizes: list
+    :param args: parsed command line arguments
+    :type args: argparse.Namespace
+    :rtype: list
+    """
+    results = []
+    for size in sizes:
+        sys.stderr.write('Benchmarking %d jobs...\n' % size)
+        out = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--child',
+            '--sizes', str(size),
+            '--polls-to-stop', str(args.polls_to_stop),
+            '--fail-every', str(args.fail_every),
+            '--log-lines', str(args.log_lines)
+        ])
+        results.append(json.loads(out.decode('utf-8')))
+        sys.stderr.write(
+            '%d jobs: run %.3fs, overhead %.3fms/job, %.2f AWS calls/job, '
+            'peak RSS %d KiB, report %d bytes\n' % (
+                size, results[-1]['run_sec'],
+                results[-1]['overhead_per_job_ms'],
+                results[-1]['aws_api_calls_per_job'],
+                results[-1]['peak_rss_kb'], results[-1]['report_bytes']
+            )
+        )
+    return results
+
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(
+        description='Benchmark ecsjobs runner overhead with fake AWS and '
+                    'Docker APIs'
+    )
+    p.add_argument('--sizes', dest='sizes', action='store', type=str,
+                   default=','.join(str(x) for x in DEFAULT_SIZES),
+                   help='comma-separated numbers of jobs to benchmark '
+                        '(default: %(default)s)')
+    p.add_argument('--polls-to-stop', dest='polls_to_stop', type=int,
+                   default=2, help='DescribeTasks calls before each ECS '
+                                   'task stops (default: %(default)s)')
+    p.add_argument('--fail-every', dest='fail_every', type=int, default=10,
+                   help='make every Nth ECS task fail; 0 for never '
+                        '(default: %(default)s)')
+    p.add_argument('--log-lines', dest='log_lines', type=int, default=20,
+                   help='lines of output from each ECS task and Docker exec '
+                        '(default: %(default)s)')
+    p.add_argument('-o', '--output', dest='output', action='store',
+                   default='-', help='path to write JSON results to, or - '
+                                     'for STDOUT (default: %(default)s)')
+    p.add_argument('--child', dest='child', action='store_true',
+                   default=False, help=argparse.SUPPRESS)
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.ERROR)
+    sizes = [int(x) for x in args.sizes.split(',')]
+    if args.child:
+        print(json.dumps(run_one(
+            sizes[0], polls_to_stop=args.polls_to_stop,
+            fail_every=args.fail_every, log_lines=args.log_lines
+        )))
+        return
+    from ecsjobs.version import VERSION
+    doc = {
+        'benchmark': 'runner',
+        'ecsjobs_version': VERSION,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.now().isoformat(),
+        'params': {
+            'polls_to_stop': args.polls_to_stop,
+            'fail_every': args.fail_every,
+            'log_lines': args.log_lines
+        },
+        'results': run_sizes(sizes, args)
+    }
+    if args.output == '-':
+        json.dump(doc, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(doc, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+
+Deterministic in-process fakes of the AWS and Docker APIs that ecsjobs uses,
+for benchmarks. AWS fakes are installed as botocore ``before-send`` handlers
+on a boto3 session, so requests are fully serialized and responses fully
+parsed by botocore (and counted by :py:data:`ecsjobs.aws.api_accounting`)
+without any network I/O.
+"""
+
+import io
+import json
+import hashlib
+import threading
+from itertools import count
+from urllib.parse import parse_qs, urlsplit, unquote
+from xml.sax.saxutils import escape
+
+from botocore.awsrequest import AWSResponse
+
+#: Fixed timestamp (2017-11-23T12:00:00Z) that fake ECS task lifecycle
+#: timestamps are relative to.
+EPOCH = 1511438400.0
+
+#: Fake AWS account ID.
+ACCOUNT_ID = '123456789012'
+
+
+class FakeRawResponse(object):
+    """
+    Minimal stand-in for a urllib3 response, as wrapped by
+    :py:class:`botocore.awsrequest.AWSResponse`.
+    """
+
+    def __init__(self, body):
+        self._body = body
+        self._fh = io.BytesIO(body)
+
+    def stream(self, **kwargs):
+        yield self._body
+
+    def read(self, amt=None):
+        return self._fh.read(amt)
+
+
+class FakeAws(object):
+    """
+    Fake ECS, CloudWatch Logs, SES, CloudWatch and S3 APIs.
+
+    Each ECS task is reported as RUNNING by DescribeTasks until it has been
+    described ``polls_to_stop`` times, and then as STOPPED; every
+    ``fail_every``-th task (if non-zero) has a container exit code of 1. Each
+    container's CloudWatch Logs stream has ``log_lines`` events, and the size
+    of each report sent via SES is recorded in :py:attr:`~.report_bytes`.
+    S3 ListObjects and GetObject requests are served from
+    :py:attr:`~.s3_objects`, a dict of (bucket, key) to bytes.
+    """
+
+    #: Maximum number of keys returned per ListObjects page.
+    S3_MAX_KEYS = 1000
+
+    def __init__(self, polls_to_stop=2, fail_every=10, log_lines=20):
+        """
+        :param polls_to_stop: DescribeTasks calls before a task is STOPPED
+        :type polls_to_stop: int
+        :param fail_every: make every Nth task fail; 0 for never
+        :type fail_every: int
+        :param log_lines: number of log events per container
+        :type log_lines: int
+        """
+        self.polls_to_stop = polls_to_stop
+        self.fail_every = fail_every
+        self.log_lines = log_lines
+        self.report_bytes = []
+        self.s3_objects = {}
+        self._tasks = {}
+        self._task_ids = count(1)
+        self._lock = threading.Lock()
+        self._handlers = {
+            'ecs.DescribeTaskDefinition': self._describe_task_definition,
+            'ecs.RunTask': self._run_task,
+            'ecs.DescribeTasks': self._describe_tasks,
+            'cloudwatch-logs.FilterLogEvents': self._filter_log_events,
+            'ses.SendEmail': self._send_email,
+            'ses.SendRawEmail': self._send_raw_email,
+            'cloudwatch.PutMetricData': self._put_metric_data,
+            's3.ListObjects': self._list_objects,
+            's3.GetObject': self._get_object
+        }
+
+    def install(self, session):
+        """
+        Register the fakes on a boto3 session. Requests for any operation
+        that is not faked raise an exception instead of being sent.
+
+        :param session: session to register on
+        :type session: boto3.session.Session
+        """
+        session.events.register('before-send', self._before_send)
+
+    def _before_send(self, request, event_name=None, **kwargs):
+        op = event_name.split('.', 1)[1]
+        if op not in self._handlers:
+            raise RuntimeError('ERROR: No fake for AWS operation %s' % op)
+        status, body = self._handlers[op](request)
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        return AWSResponse(
+            request.url, status, {
+                'x-amzn-RequestId': 'fake',
+                'Content-Length': str(len(body))
+            }, FakeRawResponse(body)
+        )
+
+    @staticmethod
+    def _json(request):
+        return json.loads(request.body.decode('utf-8'))
+
+    @staticmethod
+    def _query(request):
+        body = request.body
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        return parse_qs(body)
+
+    @staticmethod
+    def _xml(op, result=''):
+        return (
+            '<%sResponse xmlns="http://ses.amazonaws.com/doc/2010-12-01/">'
+            '<%sResult>%s</%sResult><ResponseMetadata><RequestId>fake'
+            '</RequestId></ResponseMetadata></%sResponse>' % (
+                op, op, result, op, op
+            )
+        ).encode('utf-8')
+
+    def _describe_task_definition(self, request):
+        family = self._json(request)['taskDefinition']
+        return 200, {'taskDefinition': {
+            'family': family,
+            'containerDefinitions': [{
+                'name': 'main',
+                'logConfiguration': {
+                    'logDriver': 'awslogs',
+                    'options': {
+                        'awslogs-group': 'bench',
+                        'awslogs-stream-prefix': family
+                    }
+                }
+            }]
+        }}
+
+    def _run_task(self, request):
+        req = self._json(request)
+        tasks = []
+        with self._lock:
+            for _ in range(req.get('count', 1)):
+                num = next(self._task_ids)
+                arn = 'arn:aws:ecs:us-east-1:%s:task/%s/%032x' % (
+                    ACCOUNT_ID, req.get('cluster', 'default'), num
+                )
+                self._tasks[arn] = {'num': num, 'describes': 0}
+                tasks.append(self._task(arn))
+        return 200, {'tasks': tasks, 'failures': []}
+
+    def _describe_tasks(self, request):
+        tasks = []
+        with self._lock:
+            for arn in self._json(request)['tasks']:
+                self._tasks[arn]['describes'] += 1
+                tasks.append(self._task(arn))
+        return 200, {'tasks': tasks, 'failures': []}
+
+    def _task(self, arn):
+        """
+        Return the current description of a task.
+        """
+        t = self._tasks[arn]
+        start = EPOCH + t['num']
+        res = {
+            'taskArn': arn,
+            'lastStatus': 'PROVISIONING',
+            'createdAt': start,
+            'containers': [{
+                'containerArn': arn.replace(':task/', ':container/'),
+                'name': 'main',
+                'lastStatus': 'PENDING'
+            }]
+        }
+        if t['describes'] < 1:
+            return res
+        res.update({
+            'lastStatus': 'RUNNING', 'pullStartedAt': start + 1,
+            'pullStoppedAt': start + 3, 'startedAt': start + 4
+        })
+        res['containers'][0]['lastStatus'] = 'RUNNING'
+        if t['describes'] < self.polls_to_stop:
+            return res
+        res.update({
+            'lastStatus': 'STOPPED', 'stoppingAt': start + 60,
+            'stoppedAt': start + 61,
+            'stoppedReason': 'Essential container in task exited'
+        })
+        failed = self.fail_every and t['num'] % self.fail_every == 0
+        res['containers'][0].update({
+            'lastStatus': 'STOPPED', 'exitCode': 1 if failed else 0
+        })
+        return res
+
+    def _filter_log_events(self, request):
+        stream = self._json(request)['logStreamNames'][0]
+        return 200, {'events': [
+            {
+                'logStreamName': stream,
+                'timestamp': int((EPOCH + i) * 1000),
+                'message': 'log line %d of %s' % (i, stream),
+                'ingestionTime': int((EPOCH + i) * 1000),
+                'eventId': str(i)
+            } for i in range(self.log_lines)
+        ], 'searchedLogStreams': []}
+
+    def _send_email(self, request):
+        q = self._query(request)
+        self.report_bytes.append(
+            len(q['Message.Body.Html.Data'][0].encode('utf-8'))
+        )
+        return 200, self._xml(
+            'SendEmail', '<MessageId>fake-message-id</MessageId>'
+        )
+
+    def _send_raw_email(self, request):
+        q = self._query(request)
+        self.report_bytes.append(len(q['RawMessage.Data'][0]))
+        return 200, self._xml(
+            'SendRawEmail', '<MessageId>fake-message-id</MessageId>'
+        )
+
+    @staticmethod
+    def _s3_location(request):
+        """
+        Return the bucket, key and query parameters of an S3 request, in
+        either virtual-hosted or path style.
+        """
+        url = urlsplit(request.url)
+        path = unquote(url.path).lstrip('/')
+        if url.netloc.startswith('s3.') or url.netloc.startswith('s3-'):
+            bucket, _, key = path.partition('/')
+        else:
+            bucket, key = url.netloc.split('.')[0], path
+        return bucket, key, parse_qs(url.query)
+
+    def _list_objects(self, request):
+        bucket, _, q = self._s3_location(request)
+        prefix = q.get('prefix', [''])[0]
+        marker = q.get('marker', [''])[0]
+        keys = sorted(
+            k for b, k in self.s3_objects.keys()
+            if b == bucket and k.startswith(prefix) and k > marker
+        )
+        truncated = len(keys) > self.S3_MAX_KEYS
+        body = '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/' \
+               '2006-03-01/"><Name>%s</Name><Prefix>%s</Prefix><Marker>%s' \
+               '</Marker><MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>' % (
+                   escape(bucket), escape(prefix), escape(marker),
+                   self.S3_MAX_KEYS, 'true' if truncated else 'false'
+               )
+        for k in keys[:self.S3_MAX_KEYS]:
+            body += '<Contents><Key>%s</Key><Size>%d</Size>' \
+                    '<StorageClass>STANDARD</StorageClass></Contents>' % (
+                        escape(k), len(self.s3_objects[(bucket, k)])
+                    )
+        return 200, (body + '</ListBucketResult>').encode('utf-8')
+
+    def _get_object(self, request):
+        bucket, key, _ = self._s3_location(request)
+        return 200, self.s3_objects[(bucket, key)]
+
+    def _put_metric_data(self, request):
+        return 200, (
+            '<PutMetricDataResponse xmlns="http://monitoring.amazonaws.com/'
+            'doc/2010-08-01/"><ResponseMetadata><RequestId>fake</RequestId>'
+            '</ResponseMetadata></PutMetricDataResponse>'
+        ).encode('utf-8')
+
+
+class FakeContainer(object):
+    """
+    Fake :py:class:`docker.models.containers.Container`.
+    """
+
+    def __init__(self, name, labels=None):
+        self.name = name
+        self.id = hashlib.sha256(name.encode('utf-8')).hexdigest()
+        self.short_id = self.id[:12]
+        self.status = 'running'
+        self.labels = labels or {}
+
+
+class FakeContainers(object):
+    """
+    Fake :py:class:`docker.models.containers.ContainerCollection`.
+    """
+
+    def __init__(self, docker):
+        self._docker = docker
+
+    def get(self, name):
+        self._docker.count('containers.get')
+        return FakeContainer(name)
+
+    def list(self):
+        self._docker.count('containers.list')
+        return self._docker.containers_list
+
+
+class FakeDockerApi(object):
+    """
+    Fake :py:class:`docker.APIClient`; every exec prints ``output_lines`` lines
+    and exits 0.
+    """
+
+    def __init__(self, docker):
+        self._docker = docker
+        self._ids = count(1)
+
+    def exec_create(self, container, cmd, **kwargs):
+        self._docker.count('exec_create')
+        return {'Id': 'exec-%d' % next(self._ids)}
+
+    def exec_start(self, exec_id, **kwargs):
+        self._docker.count('exec_start')
+        return '\n'.join(
+            'exec output line %d of %s' % (i, exec_id)
+            for i in range(self._docker.output_lines)
+        ).encode('utf-8')
+
+    def exec_inspect(self, exec_id):
+        self._docker.count('exec_inspect')
+        return {'Pid': 1234, 'ExitCode': 0}
+
+
+class FakeDocker(object):
+    """
+    Fake :py:class:`docker.DockerClient`, shared by all jobs; use
+    :py:meth:`~.from_env` in place of :py:func:`docker.from_env`. Calls are
+    counted by method name in :py:attr:`~.calls`.
+    """
+
+    def __init__(self, containers_list=None, output_lines=20):
+        """
+        :param containers_list: containers returned by ``containers.list()``,
+          e.g. with ECS Agent labels for EcsDockerExec jobs
+        :type containers_list: list
+        :param output_lines: number of lines of output from each exec
+        :type output_lines: int
+        """
+        self.containers_list = containers_list or []
+        self.output_lines = output_lines
+        self.calls = {}
+        self.containers = FakeContainers(self)
+        self.api = FakeDockerApi(self)
+        self._lock = threading.Lock()
+
+    def from_env(self, *args, **kwargs):
+        self.count('from_env')
+        return self
+
+    def ping(self):
+        self.count('ping')
+        return True
+
+    def count(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
@@ -0,0 +1,552 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from math import ceil
+from time import perf_counter, monotonic, sleep
+
+import boto3
+from botocore.config import Config as BotoConfig
+
+logger = logging.getLogger(__name__)
+
+#: Name of the Job whose :py:meth:`~ecsjobs.jobs.base.Job.run`,
+#: :py:meth:`~ecsjobs.jobs.base.Job.poll` or
+#: :py:meth:`~ecsjobs.jobs.base.Job.prefetch` is currently executing, if any.
+_current_job = ContextVar('ecsjobs_current_job', default=None)
+
+
+@contextmanager
+def job_context(name):
+    """
+    Context manager to attribute AWS API calls made within it (in the current
+    thread or asyncio context) to the named Job.
+
+    :param name: name of the Job
+    :type name: str
+    """
+    token = _current_job.set(name)
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+class ApiAccounting(object):
+    """
+    Count AWS API calls, errors, retries, throttling errors and latency by
+    service, operation and (when made in a :py:func:`~.job_context`) Job,
+    via botocore's event system.
+
+    Handlers are registered on a boto3 Session by :py:meth:`~.install`, and
+    are copied to every client or resource created from that session
+    afterwards; since all of ecsjobs' clients are created from the default
+    session, installing on it before loading the configuration instruments
+    all of them.
+
+    If per-operation budgets are set via :py:attr:`~.budgets`, a warning is
+    logged (once) when the number of calls exceeds a budget.
+    """
+
+    #: Error codes that indicate the request was throttled.
+    THROTTLING_CODES = frozenset([
+        'Throttling', 'ThrottlingException', 'ThrottledException',
+        'RequestThrottledException', 'TooManyRequestsException',
+        'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+        'BandwidthLimitExceeded', 'LimitExceededException',
+        'RequestThrottled', 'SlowDown', 'EC2ThrottledException'
+    ])
+
+    #: Key in the botocore request context used to store accounting state.
+    CONTEXT_KEY = 'ecsjobs_api_accounting'
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stats = {}
+        self._budgets = {}
+        self._over_budget = set()
+        self._sessions = []
+
+    def install(self, session=None):
+        """
+        Register the accounting handlers on a boto3 Session. This has no
+        effect on clients already created from the session, and is a no-op
+        if already installed on it.
+
+        :param session: session to install on; defaults to the boto3 default
+          session, which is set up if needed
+        :type session: boto3.session.Session
+        """
+        if session is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+        if any(s is session for s in self._sessions):
+            return
+        session.events.register(
+            'before-parameter-build', self._before_call
+        )
+        session.events.register('needs-retry', self._needs_retry)
+        session.events.register('after-call', self._after_call)
+        session.events.register('after-call-error', self._after_call_error)
+        self._sessions.append(session)
+        logger.debug('Installed AWS API accounting on %s', session)
+
+    @property
+    def budgets(self):
+        """
+        Return the per-operation call budgets; a dict whose keys are
+        ``service:Operation`` (e.g. ``ecs:RunTask``) or ``service:*`` (all
+        operations of a service) and values are maximum numbers of calls.
+
+        :rtype: dict
+        """
+        return self._budgets
+
+    @budgets.setter
+    def budgets(self, budgets):
+        self._budgets = dict(budgets or {})
+        self._over_budget = set()
+
+    def _before_call(self, model, context, **kwargs):
+        """
+        botocore ``before-parameter-build`` handler; record the start of an
+        API call. This event is used rather than ``before-call`` because it is
+        always emitted, whereas ``before-call`` handlers may short-circuit
+        the rest (as botocore's Stubber does).
+        """
+        context[self.CONTEXT_KEY] = {
+            'service': model.service_model.service_name,
+            'operation': model.name,
+            'job': _current_job.get(),
+            'start': perf_counter(),
+            'throttles': 0
+        }
+
+    def _needs_retry(self, response=None, request_dict=None, **kwargs):
+        """
+        botocore ``needs-retry`` handler, called after every attempt; count
+        throttled attempts. Always returns None, so that retry decisions are
+        left to botocore's own handlers.
+        """
+        if response is None or request_dict is None:
+            return None
+        state = request_dict.get('context', {}).get(self.CONTEXT_KEY)
+        if state is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in self.THROTTLING_CODES:
+            state['throttles'] += 1
+        return None
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        """
+        botocore ``after-call`` handler; account for a completed API call.
+        """
+        state = context.get(self.CONTEXT_KEY)
+        if state is None:
+            return
+        code = None
+        if http_response.status_code >= 300:
+            code = parsed.get('Error', {}).get('Code', 'Unknown')
+        throttles = state['throttles']
+        if code in self.THROTTLING_CODES:
+            throttles = max(throttles, 1)
+        self._record(
+            state, retries=parsed.get('ResponseMetadata', {}).get(
+                'RetryAttempts', 0
+            ), throttles=throttles, error=code is not None,
+            rate_limit_wait=self._rate_limit_wait(context)
+        )
+
+    def _after_call_error(self, context, **kwargs):
+        """
+        botocore ``after-call-error`` handler; account for an API call that
+        raised an exception (e.g. a connection error) after any retries.
+        """
+        state = context.get(self.CONTEXT_KEY)
+        if state is None:
+            return
+        self._record(
+            state, retries=0, throttles=state['throttles'], error=True,
+            rate_limit_wait=self._rate_limit_wait(context)
+        )
+
+    @staticmethod
+    def _rate_limit_wait(context):
+        """
+        Return the total time an API call spent waiting for the
+        :py:class:`~.RateLimiter`, from its request context.
+
+        :param context: botocore request context
+        :type context: dict
+        :return: seconds waited
+        :rtype: float
+        """
+        return context.get(RateLimiter.CONTEXT_KEY, {}).get('wait_sec', 0.0)
+
+    def _record(self, state, retries, throttles, error, rate_limit_wait=0.0):
+        """
+        Add one API call to the statistics, and check budgets.
+
+        :param state: per-call state stored by :py:meth:`~._before_call`
+        :type state: dict
+        :param retries: number of retries made for the call
+        :type retries: int
+        :param throttles: number of throttled attempts
+        :type throttles: int
+        :param error: whether the call ultimately failed
+        :type error: bool
+        :param rate_limit_wait: seconds spent waiting for the rate limiter
+        :type rate_limit_wait: float
+        """
+        latency = perf_counter() - state['start']
+        key = (state['service'], state['operation'], state['job'])
+        with self._lock:
+            if key not in self._stats:
+                self._stats[key] = {
+                    'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0,
+                    'latency_sec': 0.0, 'max_latency_sec': 0.0,
+                    'rate_limit_wait_sec': 0.0
+                }
+            s = self._stats[key]
+            s['calls'] += 1
+            s['errors'] += 1 if error else 0
+            s['retries'] += retries
+            s['throttles'] += throttles
+            s['latency_sec'] += latency
+            s['max_latency_sec'] = max(s['max_latency_sec'], latency)
+            s['rate_limit_wait_sec'] += rate_limit_wait
+            if len(self._budgets) > 0:
+                self._check_budgets(state['service'], state['operation'])
+
+    def _check_budgets(self, service, operation):
+        """
+        Log a warning the first time the number of calls to an operation (or
+        to all operations of its service) exceeds its budget. Must be called
+        with ``self._lock`` held.
+
+        :param service: service name
+        :type service: str
+        :param operation: operation name
+        :type operation: str
+        """
+        for bkey in ['%s:%s' % (service, operation), '%s:*' % service]:
+            if bkey not in self._budgets or bkey in self._over_budget:
+                continue
+            calls = sum(
+                v['calls'] for k, v in self._stats.items()
+                if k[0] == service and (
+                    bkey.endswith(':*') or k[1] == operation
+                )
+            )
+            if calls > self._budgets[bkey]:
+                self._over_budget.add(bkey)
+                logger.warning(
+                    'AWS API call budget exceeded for %s: %d calls (budget '
+                    '%d)', bkey, calls, self._budgets[bkey]
+                )
+
+    @property
+    def records(self):
+        """
+        Return the API call statistics as a list of JSON-serializable dicts
+        sorted by service, operation and Job, with keys ``service``,
+        ``operation``, ``job`` (None for calls not made in a Job's context),
+        ``calls``, ``errors``, ``retries``, ``throttles``, ``latency_sec``
+        (total, including any time spent waiting for the rate limiter),
+        ``max_latency_sec`` and ``rate_limit_wait_sec`` (total time spent
+        waiting for the :py:class:`~.RateLimiter`).
+
+        :rtype: list
+        """
+        with self._lock:
+            items = sorted(
+                self._stats.items(),
+                key=lambda x: (x[0][0], x[0][1], x[0][2] or '')
+            )
+            return [
+                dict(
+                    v, service=k[0], operation=k[1], job=k[2],
+                    latency_sec=round(v['latency_sec'], 6),
+                    max_latency_sec=round(v['max_latency_sec'], 6),
+                    rate_limit_wait_sec=round(v['rate_limit_wait_sec'], 6)
+                ) for k, v in items
+            ]
+
+
+#: The process-wide API accounting instance, installed on the default boto3
+#: session by :py:func:`ecsjobs.runner.main`.
+api_accounting = ApiAccounting()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket, refilled continuously at ``rate`` tokens per
+    second up to ``burst`` tokens.
+
+    Tokens are reserved in the order they are requested (the bucket may go
+    negative), so waiting callers are served first-come, first-served and
+    each sleeps only as long as needed for its own token.
+
+    :param rate: tokens added per second
+    :type rate: float
+    :param burst: maximum number of tokens in the bucket, which it starts
+      full with
+    :type burst: int
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = monotonic()
+        self._lock = Lock()
+
+    def acquire(self):
+        """
+        Take one token from the bucket, sleeping until it is available.
+
+        :return: seconds spent waiting
+        :rtype: float
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait > 0:
+            sleep(wait)
+        return wait
+
+
+class RateLimiter(object):
+    """
+    Client-side rate limiting of AWS API requests, shared by every Job (and
+    thread) in the process, via botocore's event system.
+
+    Limits are token buckets keyed by ``service:Operation`` (e.g.
+    ``ecs:RunTask``) or ``service:*`` (shared by all operations of a
+    service), set via :py:attr:`~.limits`. Before each HTTP request is sent,
+    including botocore's own retries, a token is taken from every bucket
+    that matches the request, waiting for one to become available rather
+    than letting the request be throttled by AWS. The time spent waiting is
+    accounted by :py:class:`~.ApiAccounting`.
+
+    Like :py:class:`~.ApiAccounting`, handlers are registered on a boto3
+    Session by :py:meth:`~.install` and apply to every client created from
+    it afterwards.
+    """
+
+    #: Key in the botocore request context used to store rate limiter state.
+    CONTEXT_KEY = 'ecsjobs_rate_limiter'
+
+    def __init__(self):
+        self._limits = {}
+        self._buckets = {}
+        self._sessions = []
+
+    def install(self, session=None):
+        """
+        Register the rate limiting handlers on a boto3 Session. This has no
+        effect on clients already created from the session, and is a no-op
+        if already installed on it.
+
+        :param session: session to install on; defaults to the boto3 default
+          session, which is set up if needed
+        :type session: boto3.session.Session
+        """
+        if session is None:
+            if boto3.DEFAULT_SESSION is None:
+                boto3.setup_default_session()
+            session = boto3.DEFAULT_SESSION
+        if any(s is session for s in self._sessions):
+            return
+        session.events.register(
+            'before-parameter-build', self._before_call
+        )
+        session.events.register('before-send', self._before_send)
+        self._sessions.append(session)
+        logger.debug('Installed AWS API rate limiter on %s', session)
+
+    @property
+    def limits(self):
+        """
+        Return the rate limits; a dict whose keys are ``service:Operation``
+        or ``service:*`` and values are dicts with keys ``rate`` (requests
+        per second) and optionally ``burst`` (maximum number of requests
+        sent at once without waiting; defaults to ``rate`` rounded up).
+
+        :rtype: dict
+        """
+        return self._limits
+
+    @limits.setter
+    def limits(self, limits):
+        self._limits = dict(limits or {})
+        self._buckets = {
+            k: TokenBucket(
+                v['rate'], v.get('burst', max(1, int(ceil(v['rate']))))
+            ) for k, v in self._limits.items()
+        }
+
+    def _before_call(self, model, context, **kwargs):
+        """
+        botocore ``before-parameter-build`` handler; store the service and
+        operation of an API call in its request context, for
+        :py:meth:`~._before_send`.
+        """
+        context[self.CONTEXT_KEY] = {
+            'keys': [
+                '%s:%s' % (model.service_model.service_name, model.name),
+                '%s:*' % model.service_model.service_name
+            ],
+            'wait_sec': 0.0
+        }
+
+    def _before_send(self, request, **kwargs):
+        """
+        botocore ``before-send`` handler, called before every HTTP request
+        (attempt); wait for a token from each matching bucket. Always returns
+        None, so that the request is sent.
+        """
+        state = (request.context or {}).get(self.CONTEXT_KEY)
+        if state is None:
+            return None
+        for key in state['keys']:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            wait = bucket.acquire()
+            if wait > 0:
+                logger.debug(
+                    'Waited %.3fs for AWS API rate limit %s', wait, key
+                )
+                state['wait_sec'] += wait
+        return None
+
+
+#: The process-wide rate limiter instance, installed on the default boto3
+#: session by :py:func:`ecsjobs.runner.main`.
+rate_limiter = RateLimiter()
+
+
+#: Keys of a per-service ``aws_clients`` setting that are passed directly to
+#: :py:func:`boto3.client` / :py:func:`boto3.resource`.
+CLIENT_KWARGS = ('endpoint_url', 'region_name')
+
+#: Keys of a per-service ``aws_clients`` setting that are passed to
+#: :py:class:`botocore.config.Config`.
+BOTOCORE_CONFIG_KEYS = (
+    'connect_timeout', 'read_timeout', 'max_pool_connections'
+)
+
+#: The current ``aws_clients`` global setting; see
+#: :py:func:`~.configure_clients`.
+_client_settings = {}
+
+
+def configure_clients(settings):
+    """
+    Set the per-service client settings used by :py:func:`~.client` and
+    :py:func:`~.resource` for all clients created afterwards.
+
+    :param settings: the ``aws_clients`` global setting; a dict whose keys are
+      boto3 service names or ``default`` and whose values are dicts of
+      client settings, or None to use boto3's defaults for everything.
+    :type settings: dict
+    """
+    global _client_settings
+    _client_settings = settings or {}
+    logger.debug('AWS client settings: %s', _client_settings)
+
+
+def client_kwargs(service):
+    """
+    Return the keyword arguments to create a boto3 client or resource for the
+    given service with, from the ``default`` and per-service client settings
+    (with the latter taking precedence).
+
+    :param service: boto3 service name
+    :type service: str
+    :return: keyword arguments for :py:func:`boto3.client`
+    :rtype: dict
+    """
+    settings = dict(_client_settings.get('default', {}))
+    settings.update(_client_settings.get(service, {}))
+    kwargs = {k: settings[k] for k in CLIENT_KWARGS if k in settings}
+    conf = {k: settings[k] for k in BOTOCORE_CONFIG_KEYS if k in settings}
+    retries = {}
+    if 'retry_mode' in settings:
+        retries['mode'] = settings['retry_mode']
+    if 'max_attempts' in settings:
+        retries['total_max_attempts'] = settings['max_attempts']
+    if retries:
+        conf['retries'] = retries
+    if conf:
+        kwargs['config'] = BotoConfig(**conf)
+    return kwargs
+
+
+def client(service):
+    """
+    Return a new boto3 client for the given service, honoring the
+    ``aws_clients`` global setting.
+
+    :param service: boto3 service name
+    :type service: str
+    :return: boto3 client
+    """
+    return boto3.client(service, **client_kwargs(service))
+
+
+def resource(service):
+    """
+    Return a new boto3 resource for the given service, honoring the
+    ``aws_clients`` global setting.
+
+    :param service: boto3 service name
+    :type service: str
+    :return: boto3 service resource
+    """
+    return boto3.resource(service, **client_kwargs(service))
@@ -0,0 +1,350 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import errno
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CgroupV2(object):
+    """
+    Manage a cgroup v2 child group for a single process, with optional CPU,
+    memory and IO limits.
+
+    The group is created under the cgroup that the ecsjobs process itself is
+    in, which must be delegated to (writable by) ecsjobs. Because of the
+    cgroup v2 "no internal processes" rule, controllers can't be enabled for
+    the children of a group that contains processes; so before enabling them,
+    all processes in that group (including ecsjobs itself) are moved to a
+    leaf child group named :py:attr:`~.LEAF_NAME`, and job groups are created
+    alongside it. If the group can't be created, for example on hosts without
+    cgroup v2 or without delegation, a warning is logged and
+    :py:meth:`~.create` returns False so that callers can run the process
+    without limits.
+
+    The process to be limited should join the group itself, between fork and
+    exec, by passing :py:meth:`~.join` as the ``preexec_fn`` argument to
+    :py:class:`subprocess.Popen` or :py:func:`subprocess.run`. This ensures
+    that it, and anything it starts, is limited from the start.
+    """
+
+    #: Path to the list of mounted filesystems, used to find the cgroup2 mount.
+    MOUNTS_PATH = '/proc/self/mounts'
+
+    #: Path to the cgroup membership of the current process.
+    PROC_CGROUP_PATH = '/proc/self/cgroup'
+
+    #: Default CPU bandwidth period, in microseconds.
+    CPU_PERIOD_USEC = 100000
+
+    #: Name of the leaf group that processes in ecsjobs' own cgroup are moved
+    #: to before enabling controllers for its children.
+    LEAF_NAME = 'runner'
+
+    def __init__(self, name, cpu_quota=None, memory_max=None, io_weight=None):
+        """
+        :param name: name for the child cgroup
+        :type name: str
+        :param cpu_quota: maximum CPU usage, as a number of CPUs (e.g. ``0.5``
+          for half of one CPU), or None for no limit
+        :type cpu_quota: ``float`` or ``None``
+        :param memory_max: hard memory limit, as either an integer number of
+          bytes or a string accepted by the kernel's ``memory.max`` (e.g.
+          ``512M``), or None for no limit
+        :type memory_max: ``int``, ``str`` or ``None``
+        :param io_weight: proportional IO weight (1-10000; default 100), or
+          None to leave the default
+        :type io_weight: ``int`` or ``None``
+        """
+        self._name = name
+        self._cpu_quota = cpu_quota
+        self._memory_max = memory_max
+        self._io_weight = io_weight
+        self._path = None
+
+    @property
+    def path(self):
+        """
+        Return the filesystem path of the created cgroup, or None if it has not
+        been created.
+
+        :rtype: ``str`` or ``None``
+        """
+        return self._path
+
+    @property
+    def controllers(self):
+        """
+        Return the list of cgroup controllers required for the configured
+        limits.
+
+        :rtype: list
+        """
+        res = []
+        if self._cpu_quota is not None:
+            res.append('cpu')
+        if self._memory_max is not None:
+            res.append('memory')
+        if self._io_weight is not None:
+            res.append('io')
+        return res
+
+    def _read(self, path):
+        with open(path, 'r') as fh:
+            return fh.read()
+
+    def _write(self, path, value):
+        with open(path, 'w') as fh:
+            fh.write(value)
+
+    def _parent_path(self):
+        """
+        Return the filesystem path of the cgroup v2 group that this process is
+        in (or, if this process has already been moved to the
+        :py:attr:`~.LEAF_NAME` leaf group, the parent of that group), or None
+        if cgroup v2 is not mounted.
+
+        :rtype: ``str`` or ``None``
+        """
+        mount = None
+        for line in self._read(self.MOUNTS_PATH).splitlines():
+            parts = line.split()
+            if len(parts) > 2 and parts[2] == 'cgroup2':
+                mount = parts[1]
+                break
+        if mount is None:
+            return None
+        for line in self._read(self.PROC_CGROUP_PATH).splitlines():
+            if line.startswith('0::'):
+                path = os.path.join(mount, line[3:].strip().lstrip('/'))
+                if os.path.basename(path) == self.LEAF_NAME:
+                    path = os.path.dirname(path)
+                return path
+        return None
+
+    def _move_to_leaf(self, parent):
+        """
+        Move all processes in the ``parent`` cgroup into its
+        :py:attr:`~.LEAF_NAME` child group (creating it if needed), so that
+        controllers can be enabled in the parent's ``cgroup.subtree_control``.
+
+        :param parent: filesystem path of the parent cgroup
+        :type parent: str
+        """
+        pids = self._read(os.path.join(parent, 'cgroup.procs')).split()
+        if len(pids) == 0:
+            return
+        leaf = os.path.join(parent, self.LEAF_NAME)
+        if not os.path.isdir(leaf):
+            os.mkdir(leaf)
+        logger.debug('Moving PIDs %s from cgroup %s to %s', pids, parent, leaf)
+        for pid in pids:
+            try:
+                self._write(os.path.join(leaf, 'cgroup.procs'), pid)
+            except OSError as ex:
+                # the process may have exited since we listed it
+                if ex.errno != errno.ESRCH:
+                    raise
+
+    def create(self):
+        """
+        Create the cgroup and apply the configured limits.
+
+        :return: whether or not the cgroup was created
+        :rtype: bool
+        """
+        try:
+            parent = self._parent_path()
+        except Exception:
+            logger.warning('Unable to determine cgroup v2 parent for %s',
+                           self._name, exc_info=True)
+            return False
+        if parent is None:
+            logger.warning('cgroup v2 is not available; running %s without '
+                           'resource limits', self._name)
+            return False
+        path = os.path.join(parent, self._name)
+        try:
+            available = self._read(
+                os.path.join(parent, 'cgroup.controllers')
+            ).split()
+            missing = [c for c in self.controllers if c not in available]
+            if len(missing) > 0:
+                raise RuntimeError(
+                    'controllers %s not available in %s' % (missing, parent)
+                )
+            enabled = self._read(
+                os.path.join(parent, 'cgroup.subtree_control')
+            ).split()
+            to_enable = [c for c in self.controllers if c not in enabled]
+            if len(to_enable) > 0:
+                self._move_to_leaf(parent)
+                self._write(
+                    os.path.join(parent, 'cgroup.subtree_control'),
+                    ' '.join(['+%s' % c for c in to_enable])
+                )
+            os.mkdir(path)
+            self._path = path
+            if self._cpu_quota is not None:
+                self._write(
+                    os.path.join(path, 'cpu.max'), '%d %d' % (
+                        int(self._cpu_quota * self.CPU_PERIOD_USEC),
+                        self.CPU_PERIOD_USEC
+                    )
+                )
+            if self._memory_max is not None:
+                self._write(
+                    os.path.join(path, 'memory.max'), str(self._memory_max)
+                )
+            if self._io_weight is not None:
+                self._write(
+                    os.path.join(path, 'io.weight'),
+                    'default %d' % self._io_weight
+                )
+        except Exception:
+            logger.warning('Unable to create cgroup %s; running without '
+                           'resource limits', path, exc_info=True)
+            self.remove()
+            return False
+        logger.debug('Created cgroup %s with cpu_quota=%s memory_max=%s '
+                     'io_weight=%s', path, self._cpu_quota, self._memory_max,
+                     self._io_weight)
+        return True
+
+    def join(self):
+        """
+        Move the calling process into the cgroup. This is intended to be
+        passed as the ``preexec_fn`` of :py:class:`subprocess.Popen`, so that
+        the child process joins the cgroup before it executes the command; it
+        therefore uses only low-level file operations, and any exception it
+        raises causes the ``Popen`` call to fail.
+        """
+        fd = os.open(os.path.join(self._path, 'cgroup.procs'), os.O_WRONLY)
+        try:
+            os.write(fd, str(os.getpid()).encode())
+        finally:
+            os.close(fd)
+
+    def kill(self):
+        """
+        Kill all processes in the cgroup, via ``cgroup.kill`` (Linux 5.14+).
+        """
+        try:
+            self._write(os.path.join(self._path, 'cgroup.kill'), '1')
+        except Exception:
+            logger.debug('Unable to kill cgroup %s', self._path,
+                         exc_info=True)
+
+    def usage(self):
+        """
+        Read usage counters from the cgroup. Counters that aren't available
+        are omitted.
+
+        :return: dict of usage counters
+        :rtype: dict
+        """
+        res = {}
+        try:
+            stat = self._keyed(self._read(os.path.join(self._path, 'cpu.stat')))
+            res['cgroup_cpu_usec'] = stat.get('usage_usec')
+            res['cgroup_cpu_throttled_usec'] = stat.get('throttled_usec')
+        except Exception:
+            logger.debug('Unable to read cpu.stat', exc_info=True)
+        try:
+            res['cgroup_memory_peak_bytes'] = int(
+                self._read(os.path.join(self._path, 'memory.peak'))
+            )
+        except Exception:
+            logger.debug('Unable to read memory.peak', exc_info=True)
+        try:
+            events = self._keyed(
+                self._read(os.path.join(self._path, 'memory.events'))
+            )
+            res['cgroup_oom_kills'] = events.get('oom_kill')
+        except Exception:
+            logger.debug('Unable to read memory.events', exc_info=True)
+        try:
+            rbytes = 0
+            wbytes = 0
+            for line in self._read(
+                os.path.join(self._path, 'io.stat')
+            ).splitlines():
+                for field in line.split()[1:]:
+                    k, v = field.split('=', 1)
+                    if k == 'rbytes':
+                        rbytes += int(v)
+                    elif k == 'wbytes':
+                        wbytes += int(v)
+            res['cgroup_io_read_bytes'] = rbytes
+            res['cgroup_io_write_bytes'] = wbytes
+        except Exception:
+            logger.debug('Unable to read io.stat', exc_info=True)
+        return {k: v for k, v in res.items() if v is not None}
+
+    @staticmethod
+    def _keyed(content):
+        """
+        Parse a cgroup "flat keyed" file into a dict of integers.
+
+        :param content: file content
+        :type content: str
+        :rtype: dict
+        """
+        res = {}
+        for line in content.splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                res[parts[0]] = int(parts[1])
+        return res
+
+    def remove(self):
+        """
+        Remove the cgroup, if it was created. The cgroup must not contain any
+        processes.
+        """
+        if self._path is None:
+            return
+        try:
+            os.rmdir(self._path)
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                logger.warning('Unable to remove cgroup %s', self._path,
+                               exc_info=True)
+                return
+        self._path = None
@@ -42,10 +42,13 @@ from copy import copy, deepcopy
 from datetime import datetime
 
 import yaml
-import boto3
 
+from ecsjobs import aws
 from ecsjobs.jobs import get_job_classes
+from ecsjobs.jobs.local_command import LocalCommand
 from ecsjobs.schema import Schema
+from ecsjobs.script_cache import ScriptCache
+from ecsjobs.timing import Timings
 
 logger = logging.getLogger(__name__)
 
@@ -61,17 +64,57 @@ class Config(object):
         'max_total_runtime_sec': 3600,
         'email_subject': 'ECSJobs Report',
         'failure_html_path': None,
-        'failure_command': None
+        'failure_command': None,
+        'script_cache_dir': None,
+        'script_cache_max_bytes': 104857600,
+        'script_fetch_timeout_sec': 60,
+        'prefetch_concurrency': 8,
+        'report_inline_output_chars': 65536,
+        'report_inline_total_chars': 2097152,
+        'email_max_bytes': 9437184,
+        'output_s3_bucket': None,
+        'output_s3_prefix': 'ecsjobs/{date}/',
+        'output_s3_presign_sec': 604800,
+        'report_sinks': [{'type': 'ses'}],
+        'run_result_path': None,
+        'run_result_format': 'json',
+        'prometheus_textfile_path': None,
+        'prometheus_pushgateway_url': None,
+        'prometheus_pushgateway_job': 'ecsjobs',
+        'cloudwatch_namespace': None,
+        'cloudwatch_dimensions': None,
+        'aws_api_budgets': None,
+        'aws_clients': None,
+        'aws_rate_limits': None,
+        'trace_file_path': None,
+        'trace_otlp_url': None,
+        'trace_otlp_headers': None
     }
 
     def __init__(self):
-        self.s3 = boto3.resource('s3')
+        self.s3 = aws.resource('s3')
         self._raw_conf = {}
         self._global_conf = {}
         self._jobs = []
-        self._load_config()
-        self._validate_config()
-        self._make_jobs()
+        self._script_cache = None
+        self._timings = Timings()
+        with self._timings.time('config.load'):
+            self._load_config()
+        with self._timings.time('config.validate'):
+            self._validate_config()
+        with self._timings.time('config.make_jobs'):
+            self._make_jobs()
+
+    @property
+    def timings(self):
+        """
+        Return the wall-clock and CPU time spent loading, validating and
+        instantiating the configuration, including downloading and parsing
+        YAML.
+
+        :rtype: ecsjobs.timing.Timings
+        """
+        return self._timings
 
     @property
     def schedule_names(self):
@@ -201,8 +244,9 @@ class Config(object):
         :return: deserialized YAML file contents
         :rtype: dict
         """
-        with open(path, 'r') as fh:
-            return yaml.load(fh, Loader=yaml.FullLoader)
+        with self._timings.time('config.parse_yaml'):
+            with open(path, 'r') as fh:
+                return yaml.load(fh, Loader=yaml.FullLoader)
 
     def _key_is_yaml(self, key):
         """
@@ -266,7 +310,8 @@ class Config(object):
                 )
             )
         try:
-            body = obj.get()['Body'].read()
+            with self._timings.time('config.download'):
+                body = obj.get()['Body'].read()
         except Exception:
             logger.error('Unable to read s3://%s/%s', bucket.name, key,
                          exc_info=True)
@@ -276,7 +321,8 @@ class Config(object):
                 )
             )
         try:
-            res = yaml.load(body, Loader=yaml.FullLoader)
+            with self._timings.time('config.parse_yaml'):
+                res = yaml.load(body, Loader=yaml.FullLoader)
         except Exception:
             logger.error('Unable to load YAML from s3://%s/%s', bucket.name,
                          key, exc_info=True)
@@ -294,12 +340,18 @@ class Config(object):
         """
         Schema().validate(self._raw_conf)
         self._global_conf = self._raw_conf['global']
+        dt = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
         if self._global_conf.get('failure_html_path', None) is not None:
             self._global_conf[
                 'failure_html_path'
             ] = self._global_conf[
                 'failure_html_path'
-            ].format(date=datetime.now().strftime('%Y-%m-%dT%H-%M-%S'))
+            ].format(date=dt)
+        if self._global_conf.get('output_s3_bucket', None) is not None:
+            self._global_conf['output_s3_prefix'] = self._global_conf.get(
+                'output_s3_prefix',
+                self._global_defaults['output_s3_prefix']
+            ).format(date=dt)
 
     def _make_jobs(self):
         """
@@ -320,3 +372,16 @@ class Config(object):
             del conf['class_name']
             self._jobs.append(cls(**conf))
         logger.info('Created %d Job instances', len(self._jobs))
+        local_jobs = [j for j in self._jobs if isinstance(j, LocalCommand)]
+        fetch_timeout = self.get_global('script_fetch_timeout_sec')
+        for j in local_jobs:
+            j.set_script_fetch_timeout(fetch_timeout)
+        cache_dir = self.get_global('script_cache_dir')
+        if cache_dir is None:
+            return
+        self._script_cache = ScriptCache(
+            cache_dir, max_bytes=self.get_global('script_cache_max_bytes'),
+            timeout=fetch_timeout
+        )
+        for j in local_jobs:
+            j.set_script_cache(self._script_cache)
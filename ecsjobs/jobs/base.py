@@ -41,6 +41,8 @@ import re
 import time
 from cronex import CronExpression
 
+from ecsjobs.timing import Timings
+
 logger = logging.getLogger(__name__)
 
 
@@ -100,6 +102,8 @@ class Job(object):
         self._summary_regex = summary_regex
         self._skip_reason = None
         self._cron_expression = None
+        self._resource_usage = None
+        self._timings = Timings()
         if cron_expression is not None:
             self._cron_expression = CronExpression(cron_expression)
             if not self._cron_expression.check_trigger(
@@ -202,6 +206,88 @@ class Job(object):
         """
         return self._output
 
+    @property
+    def resource_usage(self):
+        """
+        For Job subclasses that run processes locally, return a dict of the
+        resources used by the process and its children, or None if not
+        available. Keys are ``user_cpu_sec`` and ``system_cpu_sec`` (float
+        seconds of user and system CPU time), ``max_rss_kb`` (integer maximum
+        resident set size in KiB), ``block_input_ops`` and ``block_output_ops``
+        (integer filesystem block I/O operations), and
+        ``voluntary_ctx_switches`` and ``involuntary_ctx_switches``.
+
+        :return: resource usage of the job's process
+        :rtype: ``dict`` or ``None``
+        """
+        return self._resource_usage
+
+    @property
+    def lifecycle(self):
+        """
+        For Job subclasses that run ECS Tasks, return a dict of task lifecycle
+        timestamps and the latencies derived from them, or None if not
+        available. Keys are ``placement_delay_sec`` (task creation until image
+        pull started, or until started if there was no pull),
+        ``image_pull_sec``, ``run_sec`` (started until stopping) and
+        ``stop_detection_sec`` (stopped until ecsjobs observed the task as
+        stopped), each the maximum over all of the job's tasks or None, and
+        ``tasks``, a list of per-task dicts with the task ARN, ISO8601
+        timestamps, ``stopped_reason`` and the same derived latencies.
+
+        :return: task lifecycle information for the job
+        :rtype: ``dict`` or ``None``
+        """
+        return None
+
+    @property
+    def shards(self):
+        """
+        For Job subclasses that run as multiple independent shards (such as
+        :py:class:`~ecsjobs.jobs.ecs_task.EcsTask` in array mode), return a
+        list of per-shard result dicts, or None if not applicable. Keys are
+        ``index``, ``overrides``, ``task_arn``, ``state`` (``pending``,
+        ``running``, ``stopped`` or ``failed``, the last for shards that
+        could not be started), ``exit_code``, ``reason`` (stopped reason or
+        failure description), ``start_time`` and ``finish_time`` (ISO8601)
+        and ``duration_sec``.
+
+        :return: per-shard results
+        :rtype: ``list`` or ``None``
+        """
+        return None
+
+    @property
+    def capacity_wait_sec(self):
+        """
+        For Job subclasses that run ECS Tasks, return the number of seconds
+        the job has spent waiting for cluster capacity to place its tasks, or
+        None if not applicable.
+
+        :return: seconds spent waiting for capacity
+        :rtype: ``float`` or ``None``
+        """
+        return None
+
+    @property
+    def timings(self):
+        """
+        Return the :py:class:`~ecsjobs.timing.Timings` that the Job records
+        the wall-clock and CPU time of its sub-steps (such as API calls or
+        retrieving output) in.
+
+        :return: the Job's sub-step timings
+        :rtype: ecsjobs.timing.Timings
+        """
+        return self._timings
+
+    def release_output(self):
+        """
+        Discard the Job's output to free memory, once it has been rendered into
+        the report. After this is called, :py:attr:`~.output` will be None.
+        """
+        self._output = None
+
     def summary(self):
         """
         Retrieve a simple one-line summary of the Job output/status.
@@ -241,6 +327,72 @@ class Job(object):
             return None
         return self._finish_time - self._start_time
 
+    @property
+    def start_time(self):
+        """
+        Return the time the job was started, or None if it did not start.
+
+        :return: job start time
+        :rtype: ``datetime.datetime`` or ``None``
+        """
+        return self._start_time
+
+    @property
+    def finish_time(self):
+        """
+        Return the time the job finished, or None if it did not finish.
+
+        :return: job finish time
+        :rtype: ``datetime.datetime`` or ``None``
+        """
+        return self._finish_time
+
+    @property
+    def needs_prefetch(self):
+        """
+        Return whether or not this Job has anything to retrieve in
+        :py:meth:`~.prefetch` before it is run.
+
+        :rtype: bool
+        """
+        return False
+
+    def prefetch(self):
+        """
+        Retrieve anything the Job needs before running, such as a remote
+        script. This is called by the runner (concurrently for all jobs) before
+        any jobs are run, so that retrieval latency is not on the critical path
+        of each job and retrieval failures are detected up-front. Exceptions
+        raised here will be reported as exceptions running the Job, and the
+        Job will not be run.
+        """
+        pass
+
+    def cleanup(self):
+        """
+        Remove anything that :py:meth:`~.prefetch` retrieved but that was not
+        used because the Job was never run (for example, because it was
+        skipped, or the run's time limit was reached before its turn). This is
+        called by the runner for every Job at the end of each run, and also
+        when a prefetch that was abandoned at the time limit finishes. The
+        default implementation does nothing.
+
+        This method should not raise exceptions.
+        """
+        pass
+
+    def terminate(self):
+        """
+        Stop a job that is still running when the run's
+        ``max_total_runtime_sec`` time limit is reached, and clean up anything
+        it started; this is called by the runner before generating the report,
+        in which the job is shown as unfinished. Any partial output should be
+        kept in ``self._output``. The default implementation does nothing.
+
+        This method should not raise exceptions.
+        """
+        pass
+
     @abc.abstractmethod
     def run(self):
         """
@@ -40,6 +40,8 @@ from datetime import datetime
 
 import docker
 
+from ecsjobs import tracing
+
 logger = logging.getLogger(__name__)
 
 
@@ -54,27 +56,36 @@ class DockerExecMixin(object):
         as appropriate.
         """
         logger.debug('Connecting to Docker...')
-        self._docker = docker.from_env()
-        self._docker.ping()
+        with self._timings.time('docker_connect'):
+            self._docker = docker.from_env()
+            self._docker.ping()
         logger.debug('Getting Docker container %s', self._container_name)
-        self._container = self._docker.containers.get(self._container_name)
+        with self._timings.time('container_get'):
+            self._container = self._docker.containers.get(
+                self._container_name
+            )
         logger.debug('Got container %s', self._container.short_id)
+        tracing.current_span().set_attribute('container.id', self._container.id)
         logger.info('Executing "%s" against container %s (%s)', self._command,
                     self._container_name, self._container.short_id)
         self._started = True
         self._start_time = datetime.now()
         try:
-            e = self._docker.api.exec_create(
-                self._container.id, self._command, stdout=self._stdout,
-                stderr=self._stderr, tty=self._tty, privileged=self._privileged,
-                user=self._user, environment=self._environment
-            )
+            with self._timings.time('exec_create'):
+                e = self._docker.api.exec_create(
+                    self._container.id, self._command, stdout=self._stdout,
+                    stderr=self._stderr, tty=self._tty,
+                    privileged=self._privileged, user=self._user,
+                    environment=self._environment
+                )
             logger.debug('Created exec instance %s on container %s; running',
                          e['Id'], self._container.short_id)
-            self._output = self._docker.api.exec_start(
-                e['Id'], tty=self._tty
-            ).decode().strip()
-            res = self._docker.api.exec_inspect(e['Id'])
+            with self._timings.time('exec_start'):
+                self._output = self._docker.api.exec_start(
+                    e['Id'], tty=self._tty
+                ).decode().strip()
+            with self._timings.time('exec_inspect'):
+                res = self._docker.api.exec_inspect(e['Id'])
             logger.debug('Exec instance finished; PID %d exited %d',
                          res['Pid'], res['ExitCode'])
             self._exit_code = res['ExitCode']
@@ -180,7 +180,8 @@ class EcsDockerExec(Job, DockerExecMixin):
 
         :return: True if command exited 0, False otherwise.
         """
-        self._container_name = self._find_container()
+        with self._timings.time('_find_container'):
+            self._container_name = self._find_container()
         self._docker_run()
         return self._exit_code == 0
 
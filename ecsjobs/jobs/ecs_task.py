@@ -38,8 +38,9 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 import abc  # noqa
 from ecsjobs.jobs.base import Job
 import logging
-import boto3
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+
+from ecsjobs import aws, tracing
 
 logger = logging.getLogger(__name__)
 
@@ -52,8 +53,68 @@ class EcsTask(Job):
 
     - if only one container in the task, the exit code of that container
     - otherwise, the maximum exit code of all containers
+
+    If ``count`` or a list of ``overrides`` is given, the job runs in "array"
+    mode: the Task Definition is run as multiple tasks ("shards"), either
+    ``count`` identical ones or one per set of overrides. Shards are launched
+    in as few RunTask calls as possible (consecutive shards with the same
+    overrides are batched, up to :py:attr:`~.RUN_TASK_MAX_COUNT` per call),
+    at most ``max_concurrency`` at a time, and are polled together. The job
+    finishes when all shards have stopped; its exit code is the maximum exit
+    code of all shards (at least 1 if any shard failed to start or has no
+    exit code), its output is the output of each shard in turn, and
+    per-shard results are available via :py:attr:`~.shards`.
+
+    If RunTask cannot place a task because the cluster is out of capacity
+    (failure reasons ``RESOURCE:*``, such as ``RESOURCE:MEMORY``, or
+    ``AGENT``), the job (or the affected shards) is queued instead of failing,
+    and RunTask is retried from :py:meth:`~.poll` with exponential backoff
+    (from :py:attr:`~.CAPACITY_BACKOFF_INITIAL_SEC` up to
+    :py:attr:`~.CAPACITY_BACKOFF_MAX_SEC`) while other jobs continue, until
+    the task is placed or the run's ``max_total_runtime_sec`` is reached.
+    Time spent waiting for capacity is available via
+    :py:attr:`~.capacity_wait_sec`; waiting before the job's first task is
+    started is excluded from the job's duration.
+    Other RunTask failures raise an exception (or, in array mode, fail the
+    affected shards).
     """
 
+    #: Maximum number of tasks that can be started by one RunTask call.
+    RUN_TASK_MAX_COUNT = 10
+
+    #: Maximum number of tasks that can be described by one DescribeTasks call.
+    DESCRIBE_TASKS_MAX = 100
+
+    #: Seconds to wait before the first RunTask retry after a capacity
+    #: failure; doubled after each further capacity failure.
+    CAPACITY_BACKOFF_INITIAL_SEC = 5
+
+    #: Maximum seconds to wait between RunTask retries after capacity
+    #: failures.
+    CAPACITY_BACKOFF_MAX_SEC = 120
+
+    #: Task lifecycle timestamp fields in DescribeTasks responses, and the
+    #: keys they are stored under in :py:attr:`~.lifecycle`.
+    LIFECYCLE_FIELDS = [
+        ('createdAt', 'created_at'),
+        ('pullStartedAt', 'pull_started_at'),
+        ('pullStoppedAt', 'pull_stopped_at'),
+        ('startedAt', 'started_at'),
+        ('stoppingAt', 'stopping_at'),
+        ('stoppedAt', 'stopped_at')
+    ]
+
+    #: Latencies derived from task lifecycle timestamps; 3-tuples of key and
+    #: the keys of the start and end timestamps. Where a start or end key is
+    #: a list, the first available timestamp is used.
+    LIFECYCLE_LATENCIES = [
+        ('placement_delay_sec', 'created_at',
+         ['pull_started_at', 'started_at']),
+        ('image_pull_sec', 'pull_started_at', 'pull_stopped_at'),
+        ('run_sec', 'started_at', ['stopping_at', 'stopped_at']),
+        ('stop_detection_sec', 'stopped_at', 'observed_stopped_at')
+    ]
+
     #: Dictionary describing the configuration file schema, to be validated
     #: with `jsonschema <https://github.com/Julian/jsonschema>`_.
     _schema_dict = {
@@ -63,8 +124,13 @@ class EcsTask(Job):
             'task_definition_family': {
                 'type': 'string'
             },
-            'overrides': {'type': 'object'},
-            'network_configuration': {'type': 'object'}
+            'overrides': {
+                'type': ['object', 'array'],
+                'items': {'type': 'object'}
+            },
+            'network_configuration': {'type': 'object'},
+            'count': {'type': 'integer', 'minimum': 1},
+            'max_concurrency': {'type': 'integer', 'minimum': 1}
         },
         'required': [
             'cluster_name',
@@ -75,7 +141,8 @@ class EcsTask(Job):
     def __init__(self, name, schedule, summary_regex=None,
                  cron_expression=None, cluster_name=None,
                  task_definition_family=None, overrides=None,
-                 network_configuration=None):
+                 network_configuration=None, count=None,
+                 max_concurrency=None):
         """
         :param name: unique name for this job
         :type name: str
@@ -98,12 +165,19 @@ class EcsTask(Job):
         :type task_definition_family: str
         :param overrides: RunTask overrides hash/mapping/dict to pass to ECS
           RunTask API call, as specified in the documentation for
-          :py:meth:`ECS.Client.run_task`
-        :type overrides: dict
+          :py:meth:`ECS.Client.run_task`; or a list of them, to run one shard
+          with each
+        :type overrides: ``dict`` or ``list``
         :param networkConfiguration: RunTask networkConfiguration parameter to
           pass to ECS API call, as specified in the documentation for
           :py:meth:`ECS.Client.run_task`
         :type networkConfiguration: dict
+        :param count: number of identical shards to run; mutually exclusive
+          with a list of ``overrides``
+        :type count: int
+        :param max_concurrency: maximum number of shards to run at once;
+          defaults to all of them
+        :type max_concurrency: int
         """
         super(EcsTask, self).__init__(
             name, schedule, summary_regex=summary_regex,
@@ -119,6 +193,31 @@ class EcsTask(Job):
         self._cw = None
         self._task_arn = None
         self._log_sources = None
+        self._task_lifecycles = {}
+        self._max_concurrency = max_concurrency
+        self._capacity_wait_sec = 0.0
+        self._capacity_queued_since = None
+        self._capacity_backoff = None
+        self._next_launch_time = None
+        self._shards = None
+        if isinstance(overrides, list):
+            if count is not None:
+                raise RuntimeError(
+                    'ERROR: EcsTask %s: count and a list of overrides are '
+                    'mutually exclusive' % name
+                )
+            shard_overrides = overrides
+        elif count is not None:
+            shard_overrides = [overrides] * count
+        else:
+            return
+        self._shards = [
+            {
+                'index': idx, 'overrides': o, 'task_arn': None,
+                'state': 'pending', 'exit_code': None, 'start_time': None,
+                'finish_time': None, 'reason': None, 'output': None
+            } for idx, o in enumerate(shard_overrides)
+        ]
 
     def run(self):
         """
@@ -128,11 +227,24 @@ class EcsTask(Job):
         :return: ``None``
         """
         logger.debug('Connecting to ECS')
-        self._ecs = boto3.client('ecs')
-        self._cw = boto3.client('logs')
-        self._log_sources = self._log_info_for_task(self._family)
+        self._ecs = aws.client('ecs')
+        self._cw = aws.client('logs')
+        with self._timings.time('_log_info_for_task'):
+            self._log_sources = self._log_info_for_task(self._family)
         self._started = True
         self._start_time = datetime.now()
+        if self._shards is not None:
+            self._launch_shards()
+            return
+        self._run_task()
+
+    def _run_task(self):
+        """
+        Start the job's task. If it cannot be placed for lack of capacity,
+        queue the job to retry from :py:meth:`~.poll`.
+
+        :raises: RuntimeError if RunTask fails for any other reason
+        """
         logger.info(
             'Running ECS Task cluster=%s taskDefinition=%s count=1 '
             'overrides=%s networkConfiguration=%s', self._cluster_name,
@@ -147,11 +259,270 @@ class EcsTask(Job):
             run_kwargs['overrides'] = self._overrides
         if self._network_config is not None:
             run_kwargs['networkConfiguration'] = self._network_config
-        res = self._ecs.run_task(**run_kwargs)
+        with self._timings.time('run_task'):
+            res = self._ecs.run_task(**run_kwargs)
         logger.debug('RunTask response: %s', res)
+        if len(res.get('tasks', [])) == 0:
+            failures = res.get('failures', [])
+            if self._is_capacity_failure(failures):
+                self._capacity_queued(failures)
+                return
+            raise RuntimeError(
+                'ERROR: RunTask for job %s failed: %s' % (
+                    self.name, self._failure_reasons(failures)
+                )
+            )
+        if self._capacity_dequeued():
+            self._start_time = datetime.now()
         self._task_arn = res['tasks'][0]['taskArn']
+        tracing.current_span().set_attribute(
+            'aws.ecs.task.arn', self._task_arn
+        )
         logger.info('Started task %s', self._task_arn)
 
+    def _retry_run_task(self):
+        """
+        Retry :py:meth:`~._run_task` for a job waiting for capacity. If it
+        fails for any other reason, stop waiting, set the job as finished and
+        re-raise the exception for the runner to record, as it would for a
+        failure in :py:meth:`~.run`.
+        """
+        try:
+            self._run_task()
+        except Exception:
+            logger.error('Retrying RunTask for job %s failed', self.name,
+                         exc_info=True)
+            self._capacity_dequeued()
+            self._finished = True
+            self._finish_time = datetime.now()
+            raise
+
+    @staticmethod
+    def _failure_reasons(failures):
+        """
+        Return a string describing the ``failures`` of a RunTask or
+        DescribeTasks response.
+
+        :param failures: RunTask or DescribeTasks response failures
+        :type failures: list
+        :rtype: str
+        """
+        return '; '.join(
+            '%s (%s)' % (f.get('reason'), f['arn']) if f.get('arn')
+            else str(f.get('reason'))
+            for f in failures
+        )
+
+    @staticmethod
+    def _is_capacity_failure(failures):
+        """
+        Return whether a RunTask call failed only because the cluster does not
+        currently have the capacity to place the task(s), i.e. all failure
+        reasons are ``RESOURCE:*`` or ``AGENT``.
+
+        :param failures: RunTask response failures
+        :type failures: list
+        :rtype: bool
+        """
+        return len(failures) > 0 and all(
+            str(f.get('reason')).startswith('RESOURCE:') or
+            f.get('reason') == 'AGENT'
+            for f in failures
+        )
+
+    def _capacity_queued(self, failures):
+        """
+        Queue the job's task(s) to be retried after a capacity failure, with
+        exponential backoff.
+
+        :param failures: RunTask response failures
+        :type failures: list
+        """
+        if self._capacity_queued_since is None:
+            self._capacity_queued_since = datetime.now()
+            self._capacity_backoff = self.CAPACITY_BACKOFF_INITIAL_SEC
+        else:
+            self._capacity_backoff = min(
+                self._capacity_backoff * 2, self.CAPACITY_BACKOFF_MAX_SEC
+            )
+        self._next_launch_time = datetime.now() + timedelta(
+            seconds=self._capacity_backoff
+        )
+        logger.warning(
+            'Insufficient capacity to run ECS Task for job %s (%s); retrying '
+            'in %ss', self.name, self._failure_reasons(failures),
+            self._capacity_backoff
+        )
+
+    def _capacity_dequeued(self):
+        """
+        If the job was waiting for capacity, stop waiting and account for the
+        time spent.
+
+        :return: whether the job was waiting for capacity
+        :rtype: bool
+        """
+        if self._capacity_queued_since is None:
+            return False
+        waited = (datetime.now() - self._capacity_queued_since).total_seconds()
+        self._capacity_wait_sec += waited
+        self._timings.add(
+            'capacity_wait', self._capacity_queued_since, waited, 0.0
+        )
+        logger.info(
+            'Job %s waited %.3fs for ECS capacity', self.name, waited
+        )
+        self._capacity_queued_since = None
+        self._capacity_backoff = None
+        self._next_launch_time = None
+        return True
+
+    def _launch_ready(self):
+        """
+        Return whether it is time to (re)try launching tasks; i.e. the job is
+        not waiting for capacity, or its backoff has elapsed.
+
+        :rtype: bool
+        """
+        return self._next_launch_time is None or \
+            datetime.now() >= self._next_launch_time
+
+    @property
+    def capacity_wait_sec(self):
+        """
+        Return the number of seconds the job has spent waiting for ECS
+        cluster capacity to run its task(s), including any ongoing wait. See
+        :py:attr:`ecsjobs.jobs.base.Job.capacity_wait_sec`.
+
+        :rtype: float
+        """
+        res = self._capacity_wait_sec
+        if self._capacity_queued_since is not None:
+            res += (
+                datetime.now() - self._capacity_queued_since
+            ).total_seconds()
+        return res
+
+    def _launch_shards(self):
+        """
+        Launch as many pending shards as ``max_concurrency`` allows, batching
+        consecutive shards with the same overrides into RunTask calls of up
+        to :py:attr:`~.RUN_TASK_MAX_COUNT` tasks. If waiting for capacity,
+        do nothing until the backoff has elapsed; if a RunTask call fails for
+        lack of capacity, stop launching and leave the remaining shards
+        pending.
+        """
+        if not self._launch_ready():
+            return
+        limit = len(self._shards)
+        if self._max_concurrency is not None:
+            limit = self._max_concurrency
+        running = len([s for s in self._shards if s['state'] == 'running'])
+        pending = [
+            s for s in self._shards if s['state'] == 'pending'
+        ][:max(limit - running, 0)]
+        batches = []
+        for shard in pending:
+            if (
+                len(batches) > 0 and
+                len(batches[-1]) < self.RUN_TASK_MAX_COUNT and
+                batches[-1][0]['overrides'] == shard['overrides']
+            ):
+                batches[-1].append(shard)
+            else:
+                batches.append([shard])
+        for batch in batches:
+            if not self._run_task_batch(batch):
+                return
+        if len(batches) > 0:
+            self._capacity_dequeued()
+
+    def _run_task_batch(self, batch):
+        """
+        Start a batch of shards with the same overrides in one RunTask call.
+        Shards that could not be started for lack of capacity are left
+        pending and the job is queued to retry; those that could not be
+        started for any other reason are marked as failed.
+
+        :param batch: shards to start
+        :type batch: list
+        :return: False if any shards could not be started for lack of
+          capacity, True otherwise
+        :rtype: bool
+        """
+        overrides = batch[0]['overrides']
+        logger.info(
+            'Running ECS Task cluster=%s taskDefinition=%s count=%d '
+            'overrides=%s networkConfiguration=%s for shards %s',
+            self._cluster_name, self._family, len(batch), overrides,
+            self._network_config, [s['index'] for s in batch]
+        )
+        run_kwargs = {
+            'cluster': self._cluster_name,
+            'taskDefinition': self._family,
+            'count': len(batch)
+        }
+        if overrides is not None:
+            run_kwargs['overrides'] = overrides
+        if self._network_config is not None:
+            run_kwargs['networkConfiguration'] = self._network_config
+        try:
+            with self._timings.time('run_task'):
+                res = self._ecs.run_task(**run_kwargs)
+        except Exception as exc:
+            logger.warning(
+                'Exception running ECS Task for job %s', self.name,
+                exc_info=True
+            )
+            for shard in batch:
+                self._shard_failed(shard, 'RunTask failed: %s: %s' % (
+                    exc.__class__.__name__, exc
+                ))
+            return True
+        logger.debug('RunTask response: %s', res)
+        now = datetime.now()
+        tasks = res.get('tasks', [])
+        if (
+            len(tasks) > 0 and self._capacity_queued_since is not None and
+            all(s['task_arn'] is None for s in self._shards)
+        ):
+            # first task started after waiting for capacity
+            self._start_time = now
+        for shard, task in zip(batch, tasks):
+            shard['task_arn'] = task['taskArn']
+            shard['state'] = 'running'
+            shard['start_time'] = now
+            logger.info(
+                'Started task %s for shard %d', task['taskArn'], shard['index']
+            )
+        if len(tasks) == len(batch):
+            return True
+        failures = res.get('failures', [])
+        if self._is_capacity_failure(failures):
+            self._capacity_queued(failures)
+            return False
+        reason = 'RunTask failure: %s' % self._failure_reasons(failures)
+        for shard in batch[len(tasks):]:
+            self._shard_failed(shard, reason)
+        return True
+
+    def _shard_failed(self, shard, reason):
+        """
+        Mark a shard that could not be started, or whose task can no longer
+        be described, as failed.
+
+        :param shard: the shard
+        :type shard: dict
+        :param reason: description of the failure
+        :type reason: str
+        """
+        logger.warning(
+            'Job %s shard %d failed: %s', self.name, shard['index'], reason
+        )
+        shard['state'] = 'failed'
+        shard['reason'] = reason
+        shard['finish_time'] = datetime.now()
+
     def _log_info_for_task(self, task_family):
         """
         Return a dictionary of container name to 2-tuple of Log Group Name and
@@ -192,6 +563,8 @@ class EcsTask(Job):
 
         :rtype: str
         """
+        if self._shards is not None:
+            return '%s (%d shards)' % (self._family, len(self._shards))
         if self._overrides is not None:
             return '%s (with overrides)' % self._family
         return self._family
@@ -204,12 +577,20 @@ class EcsTask(Job):
         :return: whether or not the Task is finished
         :rtype: bool
         """
+        if self._shards is not None:
+            return self._poll_shards()
+        if self._task_arn is None:
+            # waiting for capacity
+            if self._launch_ready():
+                self._retry_run_task()
+            return False
         taskid = self._task_arn.split('/')[-1]
         try:
             logger.debug('Calling DescribeTasks for task %s', self._task_arn)
-            res = self._ecs.describe_tasks(
-                cluster=self._cluster_name, tasks=[self._task_arn]
-            )
+            with self._timings.time('describe_tasks'):
+                res = self._ecs.describe_tasks(
+                    cluster=self._cluster_name, tasks=[self._task_arn]
+                )
         except Exception:
             logger.warning('Exception describing Task %s', self._task_arn,
                            exc_info=True)
@@ -217,38 +598,263 @@ class EcsTask(Job):
         task = res['tasks'][0]
         if task['lastStatus'] != 'STOPPED':
             logger.info('Task %s status: %s', taskid, task['lastStatus'])
+            self._update_lifecycle(task)
             return False
+        self._update_lifecycle(
+            task, observed_stopped_at=datetime.now(timezone.utc)
+        )
         self._finished = True
         logger.info('Task %s is now STOPPED', taskid)
         self._finish_time = datetime.now()
         ecodes = {c['name']: c['exitCode'] for c in task['containers']}
         self._exit_code = max(ecodes.values())
         logger.info('Task container exit codes: %s', ecodes)
+        self._output = self._output_for_task(task)
+        return True
+
+    def _poll_shards(self):
+        """
+        Poll to check status on all running shards with as few DescribeTasks
+        calls as possible, collect the output of any that have stopped, mark
+        any that DescribeTasks reports as failures (i.e. ``MISSING``) as
+        failed, and launch pending shards in their place. If all shards are
+        finished, set this Job as finished.
+
+        :return: whether or not all shards are finished
+        :rtype: bool
+        """
+        running = {
+            s['task_arn']: s for s in self._shards if s['state'] == 'running'
+        }
+        arns = list(running.keys())
+        for i in range(0, len(arns), self.DESCRIBE_TASKS_MAX):
+            chunk = arns[i:i + self.DESCRIBE_TASKS_MAX]
+            try:
+                logger.debug('Calling DescribeTasks for tasks %s', chunk)
+                with self._timings.time('describe_tasks'):
+                    res = self._ecs.describe_tasks(
+                        cluster=self._cluster_name, tasks=chunk
+                    )
+            except Exception:
+                logger.warning('Exception describing Tasks %s', chunk,
+                               exc_info=True)
+                continue
+            for task in res['tasks']:
+                if task['lastStatus'] != 'STOPPED':
+                    self._update_lifecycle(task)
+                    continue
+                self._update_lifecycle(
+                    task, observed_stopped_at=datetime.now(timezone.utc)
+                )
+                self._shard_stopped(running[task['taskArn']], task)
+            for failure in res.get('failures', []):
+                shard = running.get(failure.get('arn'))
+                if shard is None:
+                    continue
+                self._shard_failed(shard, 'DescribeTasks failure: %s' % (
+                    self._failure_reasons([failure])
+                ))
+        self._launch_shards()
+        if any(s['state'] in ['pending', 'running'] for s in self._shards):
+            return False
+        self._finish_shards()
+        return True
+
+    def _shard_stopped(self, shard, task):
+        """
+        Record the exit code, stopped reason and output of a shard whose task
+        has stopped.
+
+        :param shard: the shard
+        :type shard: dict
+        :param task: task description, from the DescribeTasks response
+        :type task: dict
+        """
+        logger.info(
+            'Task %s (shard %d) is now STOPPED', task['taskArn'], shard['index']
+        )
+        shard['state'] = 'stopped'
+        shard['finish_time'] = datetime.now()
+        shard['reason'] = task.get('stoppedReason')
+        ecodes = [
+            c['exitCode'] for c in task['containers']
+            if c.get('exitCode') is not None
+        ]
+        if len(ecodes) > 0:
+            shard['exit_code'] = max(ecodes)
+        shard['output'] = self._output_for_task(task)
+
+    def _finish_shards(self):
+        """
+        Set this Job as finished once all shards have finished, combining
+        their exit codes and output.
+        """
+        self._finished = True
+        self._finish_time = datetime.now()
+        ecodes = [s['exit_code'] for s in self._shards]
+        self._exit_code = max([e for e in ecodes if e is not None] + [
+            1 if None in ecodes else 0
+        ])
+        logger.info('Job %s shard exit codes: %s', self.name, ecodes)
         self._output = ''
+        for shard in self._shards:
+            if shard['task_arn'] is None:
+                self._output += '==== Shard %d: %s\n' % (
+                    shard['index'], shard['reason']
+                )
+                continue
+            if shard['state'] == 'failed':
+                self._output += '==== Shard %d (task %s): %s\n' % (
+                    shard['index'], shard['task_arn'].split('/')[-1],
+                    shard['reason']
+                )
+                continue
+            self._output += '==== Shard %d (task %s, exit code %s)\n' % (
+                shard['index'], shard['task_arn'].split('/')[-1],
+                shard['exit_code']
+            )
+            self._output += shard['output']
+            shard['output'] = None
+
+    def _output_for_task(self, task):
+        """
+        Return the output of all containers in a stopped task.
+
+        :param task: task description, from the DescribeTasks response
+        :type task: dict
+        :return: output of the task's containers
+        :rtype: str
+        """
+        taskid = task['taskArn'].split('/')[-1]
+        output = ''
         if len(self._log_sources) == 0:
-            self._output += 'No output available for Task %s containers:' \
-                            '\n' % taskid
+            output += 'No output available for Task %s containers:\n' % taskid
             for c in task['containers']:
-                self._output += '%s %s (exit code %s)\n' % (
-                    c['name'], c['containerArn'].split('/')[-1], c['exitCode']
+                output += '%s %s (exit code %s)\n' % (
+                    c['name'], c['containerArn'].split('/')[-1],
+                    c.get('exitCode')
                 )
-            return True
+            return output
         # else we have log sources
         for c in task['containers']:
             try:
-                self._output += 'Output for container "%s" (exitCode %s)\n' % (
-                    c['name'], c['exitCode']
+                output += 'Output for container "%s" (exitCode %s)\n' % (
+                    c['name'], c.get('exitCode')
                 )
-                self._output += self._output_for_task_container(
-                    taskid, c['name']
-                ) + "\n"
+                with self._timings.time('_output_for_task_container'), \
+                        tracing.span('logs.collect', attributes={
+                            'aws.ecs.task.arn': task['taskArn'],
+                            'container.name': c['name']
+                        }):
+                    output += self._output_for_task_container(
+                        taskid, c['name']
+                    ) + "\n"
             except Exception as exc:
                 logger.warning('Exception getting CloudWatch logs for task %s'
                                'container %s', taskid, c['name'], exc_info=True)
-                self._output += 'Exception getting output: %s: %s\n' % (
+                output += 'Exception getting output: %s: %s\n' % (
                     exc.__class__.__name__, exc
                 )
-        return True
+        return output
+
+    def _update_lifecycle(self, task, observed_stopped_at=None):
+        """
+        Store the lifecycle timestamps and stopped reason from a
+        DescribeTasks response for a task.
+
+        :param task: task description, from the DescribeTasks response
+        :type task: dict
+        :param observed_stopped_at: time the task was first seen as STOPPED
+        :type observed_stopped_at: datetime.datetime
+        """
+        lc = self._task_lifecycles.setdefault(task['taskArn'], {})
+        for field, key in self.LIFECYCLE_FIELDS:
+            if task.get(field) is not None:
+                lc[key] = task[field]
+        if task.get('stoppedReason') is not None:
+            lc['stopped_reason'] = task['stoppedReason']
+        if observed_stopped_at is not None:
+            lc['observed_stopped_at'] = observed_stopped_at
+
+    @staticmethod
+    def _latency(lc, start, end):
+        """
+        Return the number of seconds between two lifecycle timestamps, or None
+        if either is not available.
+
+        :param lc: stored lifecycle timestamps for one task
+        :type lc: dict
+        :param start: key, or list of keys, of the start timestamp
+        :type start: ``str`` or ``list``
+        :param end: key, or list of keys, of the end timestamp
+        :type end: ``str`` or ``list``
+        :rtype: ``float`` or ``None``
+        """
+        vals = []
+        for keys in [start, end]:
+            if not isinstance(keys, list):
+                keys = [keys]
+            vals.append(next((lc[k] for k in keys if k in lc), None))
+        if None in vals:
+            return None
+        return (vals[1] - vals[0]).total_seconds()
+
+    @property
+    def lifecycle(self):
+        """
+        Return the lifecycle timestamps of the job's ECS Task(s) and the
+        latencies derived from them, or None if the task has not been
+        described yet. See :py:attr:`ecsjobs.jobs.base.Job.lifecycle`.
+
+        :return: task lifecycle information for the job
+        :rtype: ``dict`` or ``None``
+        """
+        if len(self._task_lifecycles) == 0:
+            return None
+        res = {'tasks': []}
+        for arn, lc in self._task_lifecycles.items():
+            t = {'task_arn': arn, 'stopped_reason': lc.get('stopped_reason')}
+            for key in [x[1] for x in self.LIFECYCLE_FIELDS] + [
+                'observed_stopped_at'
+            ]:
+                t[key] = lc[key].isoformat() if key in lc else None
+            for key, start, end in self.LIFECYCLE_LATENCIES:
+                t[key] = self._latency(lc, start, end)
+            res['tasks'].append(t)
+        for key, _, _ in self.LIFECYCLE_LATENCIES:
+            vals = [t[key] for t in res['tasks'] if t[key] is not None]
+            res[key] = max(vals) if len(vals) > 0 else None
+        return res
+
+    @property
+    def shards(self):
+        """
+        Return per-shard results if the job runs in array mode, or None. See
+        :py:attr:`ecsjobs.jobs.base.Job.shards`.
+
+        :return: per-shard results
+        :rtype: ``list`` or ``None``
+        """
+        if self._shards is None:
+            return None
+        res = []
+        for shard in self._shards:
+            r = {
+                k: shard[k] for k in [
+                    'index', 'overrides', 'task_arn', 'state', 'exit_code',
+                    'reason'
+                ]
+            }
+            for k in ['start_time', 'finish_time']:
+                r[k] = None if shard[k] is None else shard[k].isoformat()
+            r['duration_sec'] = None
+            if shard['start_time'] is not None and \
+                    shard['finish_time'] is not None:
+                r['duration_sec'] = (
+                    shard['finish_time'] - shard['start_time']
+                ).total_seconds()
+            res.append(r)
+        return res
 
     def _output_for_task_container(self, taskid, cont_name):
         """
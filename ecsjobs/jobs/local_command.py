@@ -36,26 +36,119 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 import abc  # noqa
+import os
+import re
 from os import unlink, fdopen, chmod
 from stat import S_IRUSR, S_IWUSR, S_IXUSR
-from datetime import datetime
+from datetime import datetime, timedelta
+from time import sleep
+from collections import deque
+from hashlib import sha256
 from ecsjobs.jobs.base import Job
+from ecsjobs.cgroup import CgroupV2
+from ecsjobs import aws
 import logging
 import subprocess
+import threading
 import requests
-import boto3
 from tempfile import mkstemp
 
 logger = logging.getLogger(__name__)
 
 
+class OutputBuffer(object):
+    """
+    Thread-safe, size-bounded buffer for process output. Once more than
+    ``max_bytes`` have been written, the oldest data is discarded so that only
+    the most recent ``max_bytes`` of output are retained.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: maximum number of bytes of output to retain
+        :type max_bytes: int
+        """
+        self._max_bytes = max_bytes
+        self._chunks = deque()
+        self._size = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        """
+        Append a chunk of output to the buffer, discarding the oldest output
+        if the buffer is over its size limit.
+
+        :param chunk: output to append
+        :type chunk: bytes
+        """
+        with self._lock:
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+            while self._size > self._max_bytes:
+                excess = self._size - self._max_bytes
+                first = self._chunks[0]
+                if len(first) <= excess:
+                    self._chunks.popleft()
+                    self._size -= len(first)
+                    self._dropped += len(first)
+                else:
+                    self._chunks[0] = first[excess:]
+                    self._size -= excess
+                    self._dropped += excess
+
+    @property
+    def dropped_bytes(self):
+        """
+        Return the number of bytes of output that have been discarded.
+
+        :rtype: int
+        """
+        return self._dropped
+
+    def getvalue(self):
+        """
+        Return the retained output as a string. If any output was discarded,
+        a note about how much is prepended.
+
+        :rtype: str
+        """
+        with self._lock:
+            data = b''.join(self._chunks)
+            dropped = self._dropped
+        res = data.decode(errors='replace')
+        if dropped > 0:
+            res = '[... %d bytes of earlier output discarded ...]\n%s' % (
+                dropped, res
+            )
+        return res
+
+
 class LocalCommand(Job):
     """
     Job class to run a local command via :py:func:`subprocess.run`. The
     :py:attr:`~.output` property of this class contains combined STDOUT and
     STDERR.
+
+    If the ``background`` option is set, the command is instead started via
+    :py:class:`subprocess.Popen` and :py:meth:`~.run` returns immediately;
+    output is drained by a reader thread into an :py:class:`~.OutputBuffer`
+    and completion, timeout and exit code are handled by :py:meth:`~.poll`.
+    This allows many local commands to run concurrently.
     """
 
+    #: Maximum number of bytes of output to retain for background commands;
+    #: if a command produces more output than this, only the last
+    #: ``BACKGROUND_OUTPUT_MAX_BYTES`` will be kept.
+    BACKGROUND_OUTPUT_MAX_BYTES = 16 * 1024 * 1024
+
+    #: Size of each read from a background command's output pipe.
+    _READ_CHUNK_BYTES = 65536
+
+    #: Seconds to wait for a background command to exit after SIGTERM, when
+    #: it is stopped by :py:meth:`~.terminate`, before killing it.
+    TERMINATE_GRACE_SEC = 5
+
     #: Dictionary describing the configuration file schema, to be validated
     #: with `jsonschema <https://github.com/Julian/jsonschema>`_.
     _schema_dict = {
@@ -83,13 +176,36 @@ class LocalCommand(Job):
                 'type': 'string',
                 'format': 'url',
                 'pattern': '^(s3|http|https)://.*$'
+            },
+            'script_sha256': {
+                'type': 'string',
+                'pattern': '^[0-9a-fA-F]{64}$'
+            },
+            'background': {'type': 'boolean'},
+            'cpu_quota': {
+                'type': 'number',
+                'minimum': 0,
+                'exclusiveMinimum': True
+            },
+            'memory_max': {
+                'oneOf': [
+                    {'type': 'integer', 'minimum': 1},
+                    {'type': 'string', 'pattern': '^[0-9]+[KMGT]?$'}
+                ]
+            },
+            'io_weight': {
+                'type': 'integer',
+                'minimum': 1,
+                'maximum': 10000
             }
         }
     }
 
     def __init__(self, name, schedule, summary_regex=None,
                  cron_expression=None, command=None,
-                 shell=False, timeout=None, script_source=None):
+                 shell=False, timeout=None, script_source=None,
+                 script_sha256=None, background=False, cpu_quota=None,
+                 memory_max=None, io_weight=None):
         """
         :param name: unique name for this job
         :type name: str
@@ -127,6 +243,29 @@ class LocalCommand(Job):
           setting will cause ecsjobs to download and execute code from a
           potentially untrusted location.
         :type script_source: str
+        :param script_sha256: If specified, the expected hex SHA-256 digest of
+          the script retrieved from ``script_source``. The job will fail if the
+          downloaded script does not match. When the script cache is enabled,
+          a cached script matching this digest is used without re-downloading.
+        :type script_sha256: str
+        :param background: If True, start the command in the background and
+          return from :py:meth:`~.run` immediately, allowing other jobs to run
+          concurrently. Completion (and ``timeout``) is then checked by
+          :py:meth:`~.poll`, subject to the overall ``max_total_runtime_sec``.
+          Only the last :py:attr:`~.BACKGROUND_OUTPUT_MAX_BYTES` of output are
+          retained.
+        :type background: bool
+        :param cpu_quota: The maximum CPU the command may use, as a number of
+          CPUs (e.g. ``0.5``). Applied via a cgroup v2 child group; see
+          :py:class:`~ecsjobs.cgroup.CgroupV2`.
+        :type cpu_quota: float
+        :param memory_max: The hard memory limit for the command, as an
+          integer number of bytes or a string with a ``K``, ``M``, ``G`` or
+          ``T`` suffix. Applied via a cgroup v2 child group.
+        :type memory_max: :py:obj:`int` or :py:obj:`str`
+        :param io_weight: The proportional IO weight (1-10000, default 100)
+          for the command. Applied via a cgroup v2 child group.
+        :type io_weight: int
         """
         super(LocalCommand, self).__init__(
             name,
@@ -138,6 +277,20 @@ class LocalCommand(Job):
         self._shell = shell
         self._timeout = timeout
         self._script_source = script_source
+        self._script_sha256 = script_sha256
+        self._script_cache = None
+        self._script_fetch_timeout = 60
+        self._script_is_cached = False
+        self._script_pinned = False
+        self._prefetched_command = None
+        self._background = background
+        self._process = None
+        self._output_buffer = None
+        self._reader = None
+        self._cpu_quota = cpu_quota
+        self._memory_max = memory_max
+        self._io_weight = io_weight
+        self._cgroup = None
         if command is None and script_source is None:
             raise RuntimeError(
                 'LocalCommand must have either "command" or "script_source" '
@@ -147,24 +300,28 @@ class LocalCommand(Job):
     def run(self):
         """
         Run the command for the job. Either raise an exception or return
-        True if the command exited 0, False if it exited non-zero.
+        True if the command exited 0, False if it exited non-zero. If the job
+        is configured to run in the background, start the command and return
+        None.
 
-        :return: True if command exited 0, False otherwise.
+        :return: True if command exited 0, False otherwise; None if running
+          in the background.
         """
-        if self._script_source is not None:
-            self._command = self._get_script(self._script_source)
+        if self._prefetched_command is not None:
+            self._command = self._prefetched_command
+            self._prefetched_command = None
+        elif self._script_source is not None:
+            with self._timings.time('_get_script'):
+                self._command = self._get_script(self._script_source)
+        if self._background:
+            return self._run_background()
         logger.debug('Job %s: Running command %s shell=%s timeout=%s',
                      self.name, self._command, self._shell, self._timeout)
+        self._make_cgroup()
         try:
             self._started = True
             self._start_time = datetime.now()
-            s = subprocess.run(
-                self._command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=self._shell,
-                timeout=self._timeout
-            )
+            s = self._run_process()
             self._exit_code = s.returncode
             self._output = s.stdout.decode()
             logger.debug('Job %s: command finished.', self.name)
@@ -176,13 +333,358 @@ class LocalCommand(Job):
         finally:
             self._finished = True
             self._finish_time = datetime.now()
-            if self._script_source is not None:
-                if isinstance(self._command, type([])):
-                    unlink(self._command[0])
-                else:
-                    unlink(self._command)
+            self._finish_cgroup()
+            self._remove_script()
         return self._exit_code == 0
 
+    def _run_process(self):
+        """
+        Run the command in the foreground and wait for it to exit, like
+        :py:func:`subprocess.run`. The process is reaped with
+        :py:meth:`~._reap_process`, so ``self._resource_usage`` is the usage
+        of this command alone rather than of all of ecsjobs' children (whose
+        ``max_rss_kb`` would be the largest of any command run so far). Note
+        that on Linux, a command's ``max_rss_kb`` is never less than the RSS
+        of ecsjobs itself when the command was started.
+
+        :return: the completed process
+        :rtype: subprocess.CompletedProcess
+        :raises: :py:exc:`subprocess.TimeoutExpired` if the command ran for
+          longer than ``timeout`` and was killed
+        """
+        self._process = subprocess.Popen(
+            self._command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=self._shell,
+            preexec_fn=self._preexec_fn()
+        )
+        chunks = []
+        stream = self._process.stdout
+
+        def drain():
+            try:
+                for chunk in iter(
+                    lambda: stream.read1(self._READ_CHUNK_BYTES), b''
+                ):
+                    chunks.append(chunk)
+            finally:
+                stream.close()
+
+        reader = threading.Thread(
+            target=drain, name='ecsjobs-%s-output' % self.name
+        )
+        reader.daemon = True
+        reader.start()
+        reader.join(self._timeout)
+        timed_out = False
+        while not self._reap_process():
+            if self._timeout is not None and (
+                datetime.now() - self._start_time
+            ).total_seconds() >= self._timeout:
+                timed_out = True
+                if self._cgroup is not None:
+                    self._cgroup.kill()
+                self._process.kill()
+                self._reap_process(block=True)
+                break
+            sleep(0.01)
+        # processes started by the command may still hold its output open
+        reader.join(1)
+        output = b''.join(chunks)
+        if timed_out:
+            raise subprocess.TimeoutExpired(
+                self._command, self._timeout, output=output
+            )
+        return subprocess.CompletedProcess(
+            self._command, self._process.returncode, stdout=output
+        )
+
+    @staticmethod
+    def _usage_dict(ru):
+        """
+        Convert a :py:func:`os.wait4` resource usage result into the dict
+        returned by :py:attr:`~.resource_usage`.
+
+        :param ru: resource usage
+        :type ru: resource.struct_rusage
+        :rtype: dict
+        """
+        fields = {
+            'user_cpu_sec': 'ru_utime',
+            'system_cpu_sec': 'ru_stime',
+            'block_input_ops': 'ru_inblock',
+            'block_output_ops': 'ru_oublock',
+            'voluntary_ctx_switches': 'ru_nvcsw',
+            'involuntary_ctx_switches': 'ru_nivcsw'
+        }
+        res = {'max_rss_kb': ru.ru_maxrss}
+        for k, attr in fields.items():
+            res[k] = getattr(ru, attr)
+        res['user_cpu_sec'] = round(res['user_cpu_sec'], 6)
+        res['system_cpu_sec'] = round(res['system_cpu_sec'], 6)
+        return res
+
+    def _remove_script(self, command=None):
+        """
+        If the command was downloaded from ``script_source``, remove the
+        temporary script file.
+
+        :param command: the command to remove the script of; defaults to
+          ``self._command``
+        :type command: :py:obj:`str` or :py:obj:`list`
+        """
+        if self._script_source is None or self._script_is_cached:
+            return
+        if command is None:
+            command = self._command
+        if isinstance(command, type([])):
+            unlink(command[0])
+        else:
+            unlink(command)
+
+    def _run_background(self):
+        """
+        Start the command via :py:class:`subprocess.Popen` and start a thread
+        to drain its output into ``self._output_buffer``.
+
+        :return: None
+        """
+        logger.debug('Job %s: Starting background command %s shell=%s '
+                     'timeout=%s', self.name, self._command, self._shell,
+                     self._timeout)
+        self._make_cgroup()
+        self._started = True
+        self._start_time = datetime.now()
+        try:
+            self._process = subprocess.Popen(
+                self._command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=self._shell,
+                preexec_fn=self._preexec_fn()
+            )
+        except Exception:
+            self._finished = True
+            self._finish_time = datetime.now()
+            self._remove_script()
+            if self._cgroup is not None:
+                self._cgroup.remove()
+            raise
+        logger.info('Job %s: started background command as PID %s',
+                    self.name, self._process.pid)
+        self._output_buffer = OutputBuffer(self.BACKGROUND_OUTPUT_MAX_BYTES)
+        self._reader = threading.Thread(
+            target=self._drain_output, name='ecsjobs-%s-output' % self.name
+        )
+        self._reader.daemon = True
+        self._reader.start()
+        return None
+
+    def _make_cgroup(self):
+        """
+        If any cgroup resource limits are configured, create a cgroup v2 child
+        group for the command and set ``self._cgroup``. If the group can't be
+        created, the command will run without limits.
+        """
+        if self._cpu_quota is None and self._memory_max is None and \
+                self._io_weight is None:
+            return
+        cg = CgroupV2(
+            'ecsjobs-%s-%d' % (
+                re.sub(r'[^A-Za-z0-9_.-]', '_', self.name), os.getpid()
+            ),
+            cpu_quota=self._cpu_quota,
+            memory_max=self._memory_max,
+            io_weight=self._io_weight
+        )
+        if cg.create():
+            self._cgroup = cg
+
+    def _preexec_fn(self):
+        """
+        Return the ``preexec_fn`` for the command's process; the cgroup's
+        :py:meth:`~ecsjobs.cgroup.CgroupV2.join` method if a cgroup was
+        created by :py:meth:`~._make_cgroup`, otherwise None.
+
+        :rtype: ``callable`` or ``None``
+        """
+        if self._cgroup is None:
+            return None
+        return self._cgroup.join
+
+    def _finish_cgroup(self):
+        """
+        If the command ran in a cgroup, add the group's usage counters to
+        :py:attr:`~.resource_usage` and remove the group.
+        """
+        if self._cgroup is None:
+            return
+        usage = self._cgroup.usage()
+        if self._resource_usage is not None:
+            self._resource_usage.update(usage)
+        self._cgroup.remove()
+
+    def _drain_output(self):
+        """
+        Target for the output reader thread; read the background process'
+        combined STDOUT/STDERR into ``self._output_buffer`` until EOF.
+        """
+        stream = self._process.stdout
+        # keep a reference; self._output_buffer is cleared once collected
+        buf = self._output_buffer
+        try:
+            for chunk in iter(
+                lambda: stream.read1(self._READ_CHUNK_BYTES), b''
+            ):
+                buf.write(chunk)
+        except Exception:
+            logger.warning('Job %s: exception reading command output',
+                           self.name, exc_info=True)
+        finally:
+            stream.close()
+
+    def _reap_process(self, block=False):
+        """
+        Check whether the command's process has exited, using
+        :py:func:`os.wait4` to also collect its resource usage (including that
+        of its waited-for children) into ``self._resource_usage``.
+
+        :param block: whether to block until the process exits
+        :type block: bool
+        :return: whether or not the process has exited
+        :rtype: bool
+        """
+        if self._process.returncode is not None:
+            return True
+        try:
+            pid, status, ru = os.wait4(
+                self._process.pid, 0 if block else os.WNOHANG
+            )
+        except ChildProcessError:
+            # already reaped elsewhere; no usage information available
+            return self._process.poll() is not None
+        if pid == 0:
+            return False
+        self._process.returncode = os.waitstatus_to_exitcode(status)
+        self._resource_usage = self._usage_dict(ru)
+        return True
+
+    def poll(self):
+        """
+        For background commands, check whether the process has exited. If it
+        has, or if it has exceeded its ``timeout`` (in which case it is
+        killed), collect the exit code and output and return True.
+
+        :return: :py:attr:`~.is_finished`
+        :rtype: bool
+        """
+        if self._finished or self._process is None:
+            return self.is_finished
+        timed_out = False
+        if not self._reap_process():
+            if self._timeout is None or (
+                datetime.now() - self._start_time
+            ).total_seconds() < self._timeout:
+                return False
+            logger.warning('LocalCommand %s timed out after %s seconds; '
+                           'killing PID %s', self.name, self._timeout,
+                           self._process.pid)
+            timed_out = True
+            if self._cgroup is not None:
+                self._cgroup.kill()
+            try:
+                self._process.kill()
+                self._reap_process(block=True)
+            except Exception:
+                logger.error('Unable to kill PID %s for job %s',
+                             self._process.pid, self.name, exc_info=True)
+                return False
+        note = None
+        if timed_out:
+            note = '\nLocalCommand %s timed out after %s seconds and was ' \
+                   'killed.\n' % (self.name, self._timeout)
+        self._collect(note=note)
+        self._finished = True
+        logger.info('Job %s: background command exited %s', self.name,
+                    self._exit_code)
+        return True
+
+    def terminate(self):
+        """
+        If a background command is still running when the run's time limit is
+        reached, send it SIGTERM and wait up to
+        :py:attr:`~.TERMINATE_GRACE_SEC` for it to exit before killing it (and
+        everything in its cgroup). The process is then reaped and its partial
+        output kept, and its cgroup and script are cleaned up. The job remains
+        unfinished.
+        """
+        if self._finished or self._process is None:
+            return
+        logger.warning('Job %s: run time limit reached; terminating PID %s',
+                       self.name, self._process.pid)
+        try:
+            if not self._reap_process():
+                self._process.terminate()
+                deadline = datetime.now() + timedelta(
+                    seconds=self.TERMINATE_GRACE_SEC
+                )
+                while not self._reap_process():
+                    if datetime.now() >= deadline:
+                        if self._cgroup is not None:
+                            self._cgroup.kill()
+                        self._process.kill()
+                        self._reap_process(block=True)
+                        break
+                    sleep(0.1)
+        except Exception:
+            logger.error('Unable to terminate PID %s for job %s',
+                         self._process.pid, self.name, exc_info=True)
+            return
+        if self._cgroup is not None:
+            # kill anything the command left behind, so the group is empty
+            self._cgroup.kill()
+        self._collect(
+            note='\nLocalCommand %s was terminated when the run time limit '
+                 'was reached.\n' % self.name
+        )
+
+    def _collect(self, note=None):
+        """
+        Once the background process has exited, record its finish time, exit
+        code and output (with ``note`` appended, if given), discard the output
+        buffer, and then clean up its cgroup and script.
+
+        :param note: message to append to the output
+        :type note: str
+        """
+        self._finish_time = datetime.now()
+        # the pipe may be held open by a grandchild; don't block on it forever
+        self._reader.join(1)
+        if self._reader.is_alive():
+            logger.warning('Job %s: output pipe still open after command '
+                           'exited; output may be incomplete', self.name)
+        self._exit_code = self._process.returncode
+        self._output = self._output_buffer.getvalue()
+        self._output_buffer = None
+        if note is not None:
+            self._output += note
+        self._finish_cgroup()
+        try:
+            self._remove_script()
+        except Exception:
+            logger.warning('Job %s: unable to remove script', self.name,
+                           exc_info=True)
+
+    def release_output(self):
+        """
+        Discard the Job's output, and the buffer that a background command's
+        output was read into (if it is still held), to free memory once the
+        job has been rendered into the report.
+        """
+        super(LocalCommand, self).release_output()
+        self._output_buffer = None
+
     def report_description(self):
         """
         Return a one-line description of the Job for use in reports.
@@ -193,9 +695,70 @@ class LocalCommand(Job):
             return self._script_source
         return self._command
 
+    @property
+    def needs_prefetch(self):
+        """
+        Return whether or not this Job has a ``script_source`` to retrieve in
+        :py:meth:`~.prefetch` before it is run.
+
+        :rtype: bool
+        """
+        return self._script_source is not None
+
+    def prefetch(self):
+        """
+        If ``script_source`` is specified, retrieve the script ahead of
+        :py:meth:`~.run` and store the resulting command for use when run.
+        """
+        if self._script_source is None:
+            return
+        with self._timings.time('_get_script'):
+            self._prefetched_command = self._get_script(self._script_source)
+
+    def cleanup(self):
+        """
+        If a script was retrieved by :py:meth:`~.prefetch` but the job was
+        never run, remove its temporary file. If the script was retrieved via
+        the script cache, release it so that it may be evicted.
+        """
+        if self._script_pinned:
+            self._script_pinned = False
+            self._script_cache.release(self._script_source)
+        command = self._prefetched_command
+        if command is None:
+            return
+        self._prefetched_command = None
+        try:
+            self._remove_script(command)
+        except Exception:
+            logger.warning('Job %s: unable to remove prefetched script',
+                           self.name, exc_info=True)
+
+    def set_script_cache(self, cache):
+        """
+        Set the :py:class:`~ecsjobs.script_cache.ScriptCache` to retrieve
+        ``script_source`` through, instead of downloading it to a temporary
+        file on every run.
+
+        :param cache: the script cache to use
+        :type cache: ecsjobs.script_cache.ScriptCache
+        """
+        self._script_cache = cache
+
+    def set_script_fetch_timeout(self, timeout):
+        """
+        Set the connect and read timeout for retrieving ``script_source`` over
+        HTTP/HTTPS, from the ``script_fetch_timeout_sec`` global setting.
+
+        :param timeout: timeout in seconds
+        :type timeout: float
+        """
+        self._script_fetch_timeout = timeout
+
     def _get_script(self, script_url):
         """
-        Download a script from HTTP/HTTPS or S3 to a temporary path, make it
+        Download a script from HTTP/HTTPS or S3 to a temporary path (or
+        retrieve it via the script cache, if one is set), make it
         executable, and return the command to execute.
 
         :param script_url: URL to download - HTTP/HTTPS or S3
@@ -206,6 +769,14 @@ class LocalCommand(Job):
           then contains ``self._command``.
         :rtype: str
         """
+        if self._script_cache is not None:
+            path = self._script_cache.get(
+                script_url, sha256=self._script_sha256
+            )
+            self._script_is_cached = True
+            self._script_pinned = True
+            logger.info('Using cached script for %s: %s', self.name, path)
+            return self._command_for_script(path)
         if script_url.startswith('s3://'):
             url = script_url[5:]
             bkt, key = url.split('/', 1)
@@ -213,7 +784,7 @@ class LocalCommand(Job):
                 'Retrieving script for %s from S3; bucket=%s key=%s',
                 self.name, bkt, key
             )
-            s3 = boto3.client('s3')
+            s3 = aws.client('s3')
             content = s3.get_object(
                 Bucket=bkt,
                 Key=key
@@ -222,10 +793,14 @@ class LocalCommand(Job):
         elif script_url.startswith('http'):
             logger.debug('Retrieving script for %s from: %s', self.name,
                          script_url)
-            content = requests.get(script_url).text
+            content = requests.get(
+                script_url, timeout=self._script_fetch_timeout
+            ).text
             logger.debug('Got script:\n%s', content)
         else:
             raise RuntimeError('Error: unsupported URL scheme: %s' % script_url)
+        if self._script_sha256 is not None:
+            self._verify_script(script_url, content)
         fmode = 'w'
         if isinstance(content, type(b'')):
             fmode = 'wb'
@@ -235,6 +810,39 @@ class LocalCommand(Job):
         fh.write(content)
         fh.close()
         chmod(path, S_IRUSR | S_IWUSR | S_IXUSR)
+        return self._command_for_script(path)
+
+    def _verify_script(self, script_url, content):
+        """
+        Ensure that downloaded script content matches ``self._script_sha256``.
+
+        :param script_url: URL the script was retrieved from
+        :type script_url: str
+        :param content: script content
+        :type content: ``str`` or ``bytes``
+        :raises: RuntimeError
+        """
+        if not isinstance(content, type(b'')):
+            content = content.encode()
+        digest = sha256(content).hexdigest()
+        if digest != self._script_sha256.lower():
+            raise RuntimeError(
+                'ERROR: script from %s has SHA-256 %s; expected %s' % (
+                    script_url, digest, self._script_sha256
+                )
+            )
+
+    def _command_for_script(self, path):
+        """
+        Return the command to execute for a downloaded script at ``path``.
+
+        :param path: path to the executable script
+        :type path: str
+        :return: ``path`` if ``self._command`` is an empty string, empty array,
+          or None. Otherwise, a list whose first element is ``path``, and then
+          contains ``self._command``.
+        :rtype: ``str`` or ``list``
+        """
         if self._command == '' or self._command == [] or self._command is None:
             return path
         if isinstance(self._command, type('')):
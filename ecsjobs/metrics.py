@@ -0,0 +1,614 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import re
+import json
+import logging
+from datetime import datetime, timezone
+from tempfile import mkstemp
+from urllib.parse import quote
+
+import requests
+
+from ecsjobs import aws
+
+logger = logging.getLogger(__name__)
+
+
+class PrometheusExporter(object):
+    """
+    Export per-job and run-level metrics, built from the per-job records of
+    :py:meth:`ecsjobs.reporter.Reporter.add_job`, in the Prometheus text
+    exposition format. Metrics can be written atomically to a node_exporter
+    textfile collector file and/or pushed to a Pushgateway-compatible
+    endpoint.
+
+    Per-job metrics have ``job_name``, ``schedule`` and ``class`` labels
+    (``job_name`` rather than ``job``, which Prometheus uses for the scrape or
+    push job). Since only the jobs in the current run have results, the
+    ``ecsjobs_job_last_success_timestamp_seconds`` values of other jobs, and
+    of jobs that did not succeed in this run, are carried over from the
+    previous contents of the textfile, if there is one.
+
+    Metrics exported (all gauges) are:
+
+    * ``ecsjobs_job_duration_seconds`` - duration of the job
+    * ``ecsjobs_job_exit_code`` - exit code (or 0/1 status) of the job
+    * ``ecsjobs_job_success`` - 1 if the job succeeded, 0 if it failed, raised
+      an exception or was unfinished; not set for skipped jobs
+    * ``ecsjobs_job_last_success_timestamp_seconds`` - time the job last
+      finished successfully
+    * ``ecsjobs_job_placement_delay_seconds``,
+      ``ecsjobs_job_image_pull_seconds``, ``ecsjobs_job_task_run_seconds`` and
+      ``ecsjobs_job_stop_detection_seconds`` - ECS Task lifecycle latencies
+      of the job (see :py:attr:`ecsjobs.jobs.base.Job.lifecycle`); only
+      present for jobs that have them
+    * ``ecsjobs_run_jobs`` - number of jobs in the run, with a ``state``
+      label (``succeeded``, ``failed``, ``skipped``, ``exception`` or
+      ``unfinished``)
+    * ``ecsjobs_run_failures`` - 1 if any job failed, raised an exception or
+      was unfinished, otherwise 0
+    * ``ecsjobs_run_duration_seconds``,
+      ``ecsjobs_run_start_timestamp_seconds`` and
+      ``ecsjobs_run_end_timestamp_seconds`` - duration, start and end time of
+      the run
+    """
+
+    #: Prometheus text exposition format content type.
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    #: Name of the per-job last success timestamp metric.
+    LAST_SUCCESS = 'ecsjobs_job_last_success_timestamp_seconds'
+
+    #: Job states, as in the per-job records; counted by ``ecsjobs_run_jobs``.
+    STATES = ['succeeded', 'failed', 'skipped', 'exception', 'unfinished']
+
+    #: ECS Task lifecycle latency metrics; 3-tuples of the key in the job's
+    #: ``lifecycle`` record, metric name and help text.
+    LIFECYCLE_METRICS = [
+        ('placement_delay_sec', 'ecsjobs_job_placement_delay_seconds',
+         'Time from ECS Task creation until image pull or start.'),
+        ('image_pull_sec', 'ecsjobs_job_image_pull_seconds',
+         'Time taken to pull the ECS Task container images.'),
+        ('run_sec', 'ecsjobs_job_task_run_seconds',
+         'Time from ECS Task start until stopping.'),
+        ('stop_detection_sec', 'ecsjobs_job_stop_detection_seconds',
+         'Time from ECS Task stop until ecsjobs observed it.')
+    ]
+
+    def __init__(self, textfile_path=None, pushgateway_url=None,
+                 pushgateway_job='ecsjobs', timeout=10):
+        """
+        :param textfile_path: path to write metrics to, for the node_exporter
+          textfile collector; should end in ``.prom``
+        :type textfile_path: str
+        :param pushgateway_url: base URL of a Pushgateway-compatible endpoint
+          to push metrics to
+        :type pushgateway_url: str
+        :param pushgateway_job: value of the ``job`` grouping key to push with
+        :type pushgateway_job: str
+        :param timeout: timeout in seconds for pushing metrics
+        :type timeout: int
+        """
+        self._textfile_path = textfile_path
+        self._pushgateway_url = pushgateway_url
+        self._pushgateway_job = pushgateway_job
+        self._timeout = timeout
+
+    def export(self, records, start_dt, end_dt):
+        """
+        Render metrics for a run and write and/or push them.
+
+        :param records: per-job result dicts
+        :type records: list
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        """
+        text = self.render(
+            records, start_dt, end_dt,
+            last_success=self._read_last_success()
+        )
+        if self._textfile_path is not None:
+            self.write_textfile(text)
+        if self._pushgateway_url is not None:
+            self.push(text)
+
+    def render(self, records, start_dt, end_dt, last_success=None):
+        """
+        Render metrics for a run in the Prometheus text exposition format.
+
+        :param records: per-job result dicts
+        :type records: list
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        :param last_success: previous last success timestamps, keyed by label
+          string, to carry over
+        :type last_success: dict
+        :return: metrics text
+        :rtype: str
+        """
+        last_success = dict(last_success or {})
+        duration = []
+        exit_code = []
+        success = []
+        lifecycle = dict((x[0], []) for x in self.LIFECYCLE_METRICS)
+        counts = dict((s, 0) for s in self.STATES)
+        for rec in records:
+            labels = self._labels(rec)
+            counts[rec['state']] = counts.get(rec['state'], 0) + 1
+            if rec['duration_sec'] is not None:
+                duration.append((labels, rec['duration_sec']))
+            for key, vals in lifecycle.items():
+                if (rec.get('lifecycle') or {}).get(key) is not None:
+                    vals.append((labels, rec['lifecycle'][key]))
+            if rec['exit_code'] is not None:
+                exit_code.append((labels, rec['exit_code']))
+            if rec['state'] == 'skipped':
+                continue
+            success.append((labels, 1 if rec['state'] == 'succeeded' else 0))
+            if rec['state'] == 'succeeded':
+                if rec.get('finish_time') is not None:
+                    last_success[labels] = datetime.fromisoformat(
+                        rec['finish_time']
+                    ).timestamp()
+                else:
+                    last_success[labels] = end_dt.timestamp()
+        lines = []
+        self._metric(
+            lines, 'ecsjobs_job_duration_seconds',
+            'Duration of the most recent run of the job.', duration
+        )
+        self._metric(
+            lines, 'ecsjobs_job_exit_code',
+            'Exit code (or 0/1 status) of the most recent run of the job.',
+            exit_code
+        )
+        self._metric(
+            lines, 'ecsjobs_job_success',
+            'Whether the most recent run of the job succeeded.', success
+        )
+        self._metric(
+            lines, self.LAST_SUCCESS,
+            'Time the job most recently finished successfully.',
+            sorted(last_success.items())
+        )
+        for key, name, help in self.LIFECYCLE_METRICS:
+            if len(lifecycle[key]) > 0:
+                self._metric(lines, name, help, lifecycle[key])
+        self._metric(
+            lines, 'ecsjobs_run_jobs', 'Number of jobs in the run, by state.',
+            [
+                ('state="%s"' % s, counts[s]) for s in sorted(counts.keys())
+            ]
+        )
+        self._metric(
+            lines, 'ecsjobs_run_failures',
+            'Whether any job in the run failed, raised an exception or was '
+            'unfinished.',
+            [('', 1 if sum(
+                counts[s] for s in ['failed', 'exception', 'unfinished']
+            ) > 0 else 0)]
+        )
+        self._metric(
+            lines, 'ecsjobs_run_duration_seconds', 'Duration of the run.',
+            [('', (end_dt - start_dt).total_seconds())]
+        )
+        self._metric(
+            lines, 'ecsjobs_run_start_timestamp_seconds',
+            'Time the run started.', [('', start_dt.timestamp())]
+        )
+        self._metric(
+            lines, 'ecsjobs_run_end_timestamp_seconds',
+            'Time the run finished.', [('', end_dt.timestamp())]
+        )
+        return ''.join(lines)
+
+    def _labels(self, rec):
+        """
+        Return the label string for a per-job record.
+
+        :param rec: per-job result dict
+        :type rec: dict
+        :return: label string, without braces
+        :rtype: str
+        """
+        return 'class="%s",job_name="%s",schedule="%s"' % (
+            self._escape(rec.get('class')), self._escape(rec['name']),
+            self._escape(rec.get('schedule'))
+        )
+
+    @staticmethod
+    def _escape(value):
+        """
+        Escape a label value.
+        """
+        if value is None:
+            return ''
+        return str(value).replace('\\', '\\\\').replace(
+            '"', '\\"'
+        ).replace('\n', '\\n')
+
+    @staticmethod
+    def _metric(lines, name, help, samples):
+        """
+        Append the HELP, TYPE and sample lines for a gauge to ``lines``.
+
+        :param lines: list of lines to append to
+        :type lines: list
+        :param name: metric name
+        :type name: str
+        :param help: metric help text
+        :type help: str
+        :param samples: list of 2-tuples of (label string, value)
+        :type samples: list
+        """
+        lines.append('# HELP %s %s\n' % (name, help))
+        lines.append('# TYPE %s gauge\n' % name)
+        for labels, value in samples:
+            if labels:
+                lines.append('%s{%s} %s\n' % (name, labels, repr(value)))
+            else:
+                lines.append('%s %s\n' % (name, repr(value)))
+
+    def _read_last_success(self):
+        """
+        Read the last success timestamps from the existing textfile, if any.
+
+        :return: timestamps keyed by label string
+        :rtype: dict
+        """
+        if self._textfile_path is None:
+            return {}
+        res = {}
+        expr = re.compile(
+            r'^' + self.LAST_SUCCESS + r'\{(.*)\} (\S+)$'
+        )
+        try:
+            with open(self._textfile_path, 'r') as fh:
+                for line in fh:
+                    m = expr.match(line.rstrip('\n'))
+                    if m is not None:
+                        res[m.group(1)] = float(m.group(2))
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning('Unable to read previous metrics from %s',
+                           self._textfile_path, exc_info=True)
+        return res
+
+    def write_textfile(self, text):
+        """
+        Atomically write metrics to ``textfile_path``, by writing a temporary
+        file in the same directory and renaming it into place.
+
+        :param text: metrics text
+        :type text: str
+        """
+        path = self._textfile_path
+        fd, tmp = mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix='.%s.' % os.path.basename(path)
+        )
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                fh.write(text)
+                fh.flush()
+                os.fsync(fh.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+        logger.info('Wrote metrics to %s', path)
+
+    def push(self, text):
+        """
+        Push metrics to the Pushgateway, replacing all metrics in the
+        ``job`` grouping key.
+
+        :param text: metrics text
+        :type text: str
+        """
+        url = '%s/metrics/job/%s' % (
+            self._pushgateway_url.rstrip('/'),
+            quote(self._pushgateway_job, safe='')
+        )
+        resp = requests.put(
+            url, data=text.encode('utf-8'),
+            headers={'Content-Type': self.CONTENT_TYPE},
+            timeout=self._timeout
+        )
+        resp.raise_for_status()
+        logger.info('Pushed metrics to %s: HTTP %s', url, resp.status_code)
+
+
+class CloudWatchMetrics(object):
+    """
+    Gather per-job and per-run metric datapoints during a run, and send them
+    to CloudWatch in as few ``PutMetricData`` calls as the API limits allow.
+
+    Per-job datapoints have ``JobName``, ``Schedule`` and ``Class``
+    dimensions (plus any configured static dimensions), and are timestamped
+    with the job's finish time:
+
+    * ``JobDuration`` (Seconds)
+    * ``JobExitCode`` (None)
+    * ``JobSuccess`` (Count) - 1 if the job succeeded, 0 if it failed, raised
+      an exception or was unfinished; not sent for skipped jobs
+    * ``JobPlacementDelay``, ``JobImagePull``, ``JobTaskRun`` and
+      ``JobStopDetection`` (Seconds) - ECS Task lifecycle latencies (see
+      :py:attr:`ecsjobs.jobs.base.Job.lifecycle`); only sent for jobs that
+      have them
+
+    Per-run datapoints have only the static dimensions:
+
+    * ``JobDuration`` (Seconds) - a statistic set of all job durations
+    * ``JobExitCode`` (None) - values and counts of all job exit codes
+    * ``RunDuration`` (Seconds)
+    * ``JobCount`` (Count) - with an additional ``State`` dimension
+    """
+
+    #: Maximum number of MetricDatum per PutMetricData call.
+    MAX_DATUMS_PER_CALL = 1000
+
+    #: Maximum (estimated) request payload size per PutMetricData call. The
+    #: API limit is 1 MB; some headroom is left for the estimate.
+    MAX_PAYLOAD_BYTES = 900 * 1024
+
+    #: Maximum number of Values (and Counts) in a single MetricDatum.
+    MAX_VALUES_PER_DATUM = 150
+
+    #: Job states, as in the per-job records; counted by ``JobCount``.
+    STATES = ['succeeded', 'failed', 'skipped', 'exception', 'unfinished']
+
+    #: ECS Task lifecycle latency metrics; 2-tuples of the key in the job's
+    #: ``lifecycle`` record and metric name.
+    LIFECYCLE_METRICS = [
+        ('placement_delay_sec', 'JobPlacementDelay'),
+        ('image_pull_sec', 'JobImagePull'),
+        ('run_sec', 'JobTaskRun'),
+        ('stop_detection_sec', 'JobStopDetection')
+    ]
+
+    def __init__(self, namespace, dimensions=None, client=None):
+        """
+        :param namespace: CloudWatch namespace to send metrics to
+        :type namespace: str
+        :param dimensions: static dimension names and values to add to all
+          metrics
+        :type dimensions: dict
+        :param client: CloudWatch client to use; if None, one will be created
+        :type client: ``botocore.client.CloudWatch``
+        """
+        self._namespace = namespace
+        self._dimensions = [
+            {'Name': k, 'Value': str(v)}
+            for k, v in sorted((dimensions or {}).items())
+        ]
+        self._client = client
+        self._data = []
+        self._durations = []
+        self._exit_codes = {}
+        self._counts = dict((x, 0) for x in self.STATES)
+
+    @property
+    def client(self):
+        """
+        Return the CloudWatch client, creating it if necessary.
+
+        :return: boto3 CloudWatch client
+        :rtype: ``botocore.client.CloudWatch``
+        """
+        if self._client is None:
+            self._client = aws.client('cloudwatch')
+        return self._client
+
+    @property
+    def num_jobs(self):
+        """
+        Return the number of job records added so far.
+
+        :rtype: int
+        """
+        return sum(self._counts.values())
+
+    def add_job(self, rec, default_dt=None):
+        """
+        Gather datapoints for a finished job.
+
+        :param rec: per-job result dict, as built by
+          :py:meth:`ecsjobs.reporter.Reporter.add_job`
+        :type rec: dict
+        :param default_dt: timestamp to use if the job has no finish time;
+          defaults to now
+        :type default_dt: datetime.datetime
+        """
+        self._counts[rec['state']] = self._counts.get(rec['state'], 0) + 1
+        if rec.get('finish_time') is not None:
+            ts = datetime.fromisoformat(rec['finish_time'])
+        else:
+            ts = default_dt if default_dt is not None else datetime.now()
+        ts = self._utc(ts)
+        dims = self._dimensions + [
+            {'Name': 'JobName', 'Value': rec['name']},
+            {'Name': 'Schedule', 'Value': str(rec.get('schedule'))},
+            {'Name': 'Class', 'Value': str(rec.get('class'))}
+        ]
+        if rec['duration_sec'] is not None:
+            self._durations.append(rec['duration_sec'])
+            self._data.append({
+                'MetricName': 'JobDuration', 'Dimensions': dims,
+                'Timestamp': ts, 'Value': rec['duration_sec'],
+                'Unit': 'Seconds'
+            })
+        if rec['exit_code'] is not None:
+            self._exit_codes[rec['exit_code']] = self._exit_codes.get(
+                rec['exit_code'], 0
+            ) + 1
+            self._data.append({
+                'MetricName': 'JobExitCode', 'Dimensions': dims,
+                'Timestamp': ts, 'Value': rec['exit_code'], 'Unit': 'None'
+            })
+        if rec['state'] != 'skipped':
+            self._data.append({
+                'MetricName': 'JobSuccess', 'Dimensions': dims,
+                'Timestamp': ts,
+                'Value': 1 if rec['state'] == 'succeeded' else 0,
+                'Unit': 'Count'
+            })
+        lifecycle = rec.get('lifecycle') or {}
+        for key, name in self.LIFECYCLE_METRICS:
+            if lifecycle.get(key) is not None:
+                self._data.append({
+                    'MetricName': name, 'Dimensions': dims,
+                    'Timestamp': ts, 'Value': lifecycle[key],
+                    'Unit': 'Seconds'
+                })
+
+    @staticmethod
+    def _utc(dt):
+        """
+        Return a timezone-aware UTC copy of ``dt``. Naive datetimes (as used
+        throughout ecsjobs) are local time, but botocore serializes naive
+        datetimes as UTC.
+
+        :param dt: datetime to convert
+        :type dt: datetime.datetime
+        :rtype: datetime.datetime
+        """
+        return dt.astimezone(timezone.utc)
+
+    def _run_data(self, start_dt, end_dt):
+        """
+        Return the per-run MetricDatum list.
+
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        :rtype: list
+        """
+        duration = (end_dt - start_dt).total_seconds()
+        end_dt = self._utc(end_dt)
+        data = [{
+            'MetricName': 'RunDuration', 'Dimensions': self._dimensions,
+            'Timestamp': end_dt, 'Unit': 'Seconds', 'Value': duration
+        }]
+        for state in sorted(self._counts.keys()):
+            data.append({
+                'MetricName': 'JobCount', 'Timestamp': end_dt,
+                'Dimensions': self._dimensions + [
+                    {'Name': 'State', 'Value': state}
+                ],
+                'Value': self._counts[state], 'Unit': 'Count'
+            })
+        if len(self._durations) > 0:
+            data.append({
+                'MetricName': 'JobDuration', 'Dimensions': self._dimensions,
+                'Timestamp': end_dt, 'Unit': 'Seconds',
+                'StatisticValues': {
+                    'SampleCount': len(self._durations),
+                    'Sum': sum(self._durations),
+                    'Minimum': min(self._durations),
+                    'Maximum': max(self._durations)
+                }
+            })
+        codes = sorted(self._exit_codes.keys())
+        for i in range(0, len(codes), self.MAX_VALUES_PER_DATUM):
+            chunk = codes[i:i + self.MAX_VALUES_PER_DATUM]
+            data.append({
+                'MetricName': 'JobExitCode', 'Dimensions': self._dimensions,
+                'Timestamp': end_dt, 'Unit': 'None',
+                'Values': [float(x) for x in chunk],
+                'Counts': [float(self._exit_codes[x]) for x in chunk]
+            })
+        return data
+
+    def _batches(self, data):
+        """
+        Split a list of MetricDatum into batches within the PutMetricData
+        count and payload size limits.
+
+        :param data: list of MetricDatum dicts
+        :type data: list
+        :return: generator of lists of MetricDatum dicts
+        :rtype: ``generator``
+        """
+        batch = []
+        size = 0
+        for datum in data:
+            dsize = len(json.dumps(datum, default=str))
+            if len(batch) > 0 and (
+                len(batch) >= self.MAX_DATUMS_PER_CALL or
+                size + dsize > self.MAX_PAYLOAD_BYTES
+            ):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(datum)
+            size += dsize
+        if len(batch) > 0:
+            yield batch
+
+    def flush(self, start_dt, end_dt):
+        """
+        Send all gathered per-job datapoints, plus the per-run datapoints, to
+        CloudWatch.
+
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        :return: number of PutMetricData calls made
+        :rtype: int
+        """
+        data = self._data + self._run_data(start_dt, end_dt)
+        calls = 0
+        for batch in self._batches(data):
+            self.client.put_metric_data(
+                Namespace=self._namespace, MetricData=batch
+            )
+            calls += 1
+        logger.info('Sent %d datapoints to CloudWatch namespace %s in %d '
+                    'PutMetricData call(s)', len(data), self._namespace, calls)
+        self._data = []
+        return calls
@@ -0,0 +1,204 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+import cProfile
+import pstats
+import tracemalloc
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+#: The active :py:class:`~.Profiler`, or None if profiling is disabled.
+_profiler = None
+
+#: The active :py:class:`~.MemoryTracker`, or None if disabled.
+_memory_tracker = None
+
+
+class Profiler(object):
+    """
+    Run the process under :py:mod:`cProfile`, writing a pstats file and a
+    plain-text summary of the top functions by cumulative time when stopped.
+    """
+
+    def __init__(self, path, top=25):
+        """
+        :param path: path to write the pstats file to; the summary is written
+          to the same path with ``.txt`` appended.
+        :type path: str
+        :param top: number of functions to include in the summary
+        :type top: int
+        """
+        self._path = path
+        self._top = top
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        """Start profiling."""
+        self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the pstats file and summary.
+        """
+        self._profile.disable()
+        self._profile.dump_stats(self._path)
+        with open(self._path + '.txt', 'w') as fh:
+            stats = pstats.Stats(self._profile, stream=fh)
+            stats.sort_stats('cumulative').print_stats(self._top)
+        logger.warning(
+            'Wrote profile to %s and summary to %s.txt', self._path, self._path
+        )
+
+
+class MemoryTracker(object):
+    """
+    Trace memory allocations via :py:mod:`tracemalloc`, appending a summary
+    of each labeled snapshot to a text file: the current and peak traced
+    memory, the top source lines by allocated size, and the top changes
+    since the previous snapshot.
+    """
+
+    #: Filters excluding allocations made by the import system and by
+    #: tracemalloc itself.
+    FILTERS = [
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<unknown>')
+    ]
+
+    def __init__(self, path, top=25):
+        """
+        :param path: path to write the snapshot summaries to
+        :type path: str
+        :param top: number of source lines to include for each snapshot
+        :type top: int
+        """
+        self._path = path
+        self._top = top
+        self._previous = None
+
+    def start(self):
+        """Start tracing allocations and truncate the output file."""
+        open(self._path, 'w').close()
+        tracemalloc.start()
+
+    def snapshot(self, label):
+        """
+        Take a snapshot and append its summary to the output file. Only the
+        most recent snapshot is retained, for comparison with the next one.
+
+        :param label: label for the snapshot, e.g. ``config.load``
+        :type label: str
+        """
+        if not tracemalloc.is_tracing():
+            return
+        snap = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [
+            '==== %s at %s: current=%d peak=%d bytes' % (
+                label, datetime.now().isoformat(), current, peak
+            ),
+            '-- Top %d lines by size:' % self._top
+        ]
+        for stat in snap.statistics('lineno')[:self._top]:
+            lines.append(str(stat))
+        if self._previous is not None:
+            lines.append('-- Top %d changes since previous snapshot:' % (
+                self._top
+            ))
+            for stat in snap.compare_to(self._previous, 'lineno')[:self._top]:
+                lines.append(str(stat))
+        self._previous = snap
+        with open(self._path, 'a') as fh:
+            fh.write('\n'.join(lines) + '\n\n')
+
+    def stop(self):
+        """Stop tracing allocations."""
+        self._previous = None
+        tracemalloc.stop()
+        logger.warning('Wrote memory allocation snapshots to %s', self._path)
+
+
+def start(profile_path=None, tracemalloc_path=None, top=25):
+    """
+    Start CPU profiling and/or memory allocation tracing, if the respective
+    paths are specified.
+
+    :param profile_path: path to write the pstats file to, or None
+    :type profile_path: str
+    :param tracemalloc_path: path to write memory snapshot summaries to, or
+      None
+    :type tracemalloc_path: str
+    :param top: number of entries to include in each summary
+    :type top: int
+    """
+    global _profiler, _memory_tracker
+    if tracemalloc_path is not None:
+        _memory_tracker = MemoryTracker(tracemalloc_path, top=top)
+        _memory_tracker.start()
+        _memory_tracker.snapshot('start')
+    if profile_path is not None:
+        _profiler = Profiler(profile_path, top=top)
+        _profiler.start()
+
+
+def snapshot(label):
+    """
+    Take a labeled memory snapshot, if memory allocation tracing is enabled.
+
+    :param label: label for the snapshot
+    :type label: str
+    """
+    if _memory_tracker is not None:
+        _memory_tracker.snapshot(label)
+
+
+def stop():
+    """
+    Stop profiling and/or memory allocation tracing, writing their output.
+    """
+    global _profiler, _memory_tracker
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
+    if _memory_tracker is not None:
+        _memory_tracker.snapshot('end')
+        _memory_tracker.stop()
+        _memory_tracker = None
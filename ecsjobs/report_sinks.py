@@ -0,0 +1,658 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import abc
+import sys
+import json
+import time
+import base64
+import logging
+import threading
+from uuid import uuid4
+from html import escape
+from tempfile import SpooledTemporaryFile
+from subprocess import Popen, PIPE, STDOUT
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import requests
+
+from ecsjobs import aws
+
+logger = logging.getLogger(__name__)
+
+#: Report sinks to use if the ``report_sinks`` global setting is not given.
+DEFAULT_SINKS = [{'type': 'ses'}]
+
+
+class RunReport(object):
+    """
+    The result of one run of ecsjobs, as delivered to each
+    :py:class:`~.ReportSink`.
+    """
+
+    def __init__(self, html, subject, records, start_dt, end_dt,
+                 have_failures, attachments=None, only_email_if_problems=False,
+                 timings=None, api_calls=None):
+        """
+        :param html: HTML report
+        :type html: str
+        :param subject: report subject
+        :type subject: str
+        :param records: list of per-job result dicts, as built by
+          :py:meth:`ecsjobs.reporter.Reporter.add_job`
+        :type records: list
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        :param have_failures: whether any job failed, raised an exception or
+          was unfinished
+        :type have_failures: bool
+        :param attachments: list of 2-tuples of (filename, binary file-like
+          object) gzip-compressed full job outputs to attach to emails
+        :type attachments: list
+        :param only_email_if_problems: If True, only send email if
+          ``have_failures`` is True.
+        :type only_email_if_problems: bool
+        :param timings: run phase timings, as returned by
+          :py:attr:`ecsjobs.timing.Timings.records`
+        :type timings: list
+        :param api_calls: AWS API call statistics, as returned by
+          :py:attr:`ecsjobs.aws.ApiAccounting.records`
+        :type api_calls: list
+        """
+        self.html = html
+        self.subject = subject
+        self.records = records
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.have_failures = have_failures
+        self.attachments = attachments if attachments is not None else []
+        self.only_email_if_problems = only_email_if_problems
+        self.timings = timings if timings is not None else []
+        self.api_calls = api_calls if api_calls is not None else []
+
+    def as_dict(self):
+        """
+        Return the report (other than its HTML and attachments) as a
+        JSON-serializable dict.
+
+        :rtype: dict
+        """
+        return {
+            'subject': self.subject,
+            'start_time': self.start_dt.isoformat(),
+            'end_time': self.end_dt.isoformat(),
+            'duration_sec': (self.end_dt - self.start_dt).total_seconds(),
+            'have_failures': self.have_failures,
+            'timings': self.timings,
+            'api_calls': self.api_calls,
+            'jobs': self.records
+        }
+
+
+class ReportSink(object, metaclass=abc.ABCMeta):
+    """
+    Base class for destinations that a :py:class:`~.RunReport` is delivered
+    to. Subclasses must implement :py:meth:`~.deliver`.
+
+    All configured sinks are run in parallel by :py:func:`~.deliver_all`, each
+    in its own thread. A sink's :py:meth:`~.deliver` is retried up to
+    ``retries`` times, with ``retry_delay_sec`` seconds between attempts, as
+    long as ``timeout_sec`` seconds have not passed since the sink started.
+    Anything that needs to be created up-front (such as AWS clients, which
+    cannot be safely created concurrently) should be created in ``__init__``.
+    """
+
+    def __init__(self, config, timeout_sec=300, retries=0, retry_delay_sec=10):
+        """
+        :param config: Configuration
+        :type config: ecsjobs.config.Config
+        :param timeout_sec: maximum time to spend delivering the report,
+          including retries
+        :type timeout_sec: int
+        :param retries: number of times to retry a failed delivery
+        :type retries: int
+        :param retry_delay_sec: seconds to wait between retries
+        :type retry_delay_sec: float
+        """
+        self._config = config
+        self.timeout_sec = timeout_sec
+        self.retries = retries
+        self.retry_delay_sec = retry_delay_sec
+        self.exception = None
+        #: Whether :py:meth:`~.run` is in progress, in a thread started by
+        #: :py:func:`~.deliver_all`.
+        self.running = False
+
+    def __repr__(self):
+        return '<%s>' % type(self).__name__
+
+    @abc.abstractmethod
+    def deliver(self, report):
+        """
+        Deliver the report. Raise an exception on failure.
+
+        :param report: the report to deliver
+        :type report: RunReport
+        """
+
+    def run(self, report):
+        """
+        Call :py:meth:`~.deliver`, retrying on failure. Sets
+        :py:attr:`~.exception` to the last exception raised, or None on
+        success.
+
+        :param report: the report to deliver
+        :type report: RunReport
+        """
+        deadline = time.time() + self.timeout_sec
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self.deliver(report)
+                    self.exception = None
+                    return
+                except Exception as ex:
+                    self.exception = ex
+                    logger.warning(
+                        'Report sink %s failed (attempt %d of %d)', self,
+                        attempt + 1, self.retries + 1, exc_info=True
+                    )
+                if time.time() + self.retry_delay_sec >= deadline:
+                    return
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay_sec)
+        finally:
+            self.running = False
+
+    def _format_path(self, path, report):
+        """
+        Replace ``{date}`` in a path with the run start time.
+        """
+        return path.format(date=report.start_dt.strftime('%Y-%m-%dT%H-%M-%S'))
+
+
+class SesSink(ReportSink):
+    """
+    Send the HTML report via SES to the ``to_email`` recipients. If any job
+    output was truncated in the report, the full outputs are attached and the
+    email is sent via SES ``SendRawEmail``; otherwise, it is sent via
+    ``SendEmail``. See :py:meth:`~._build_message` for how the message is
+    kept within the ``email_max_bytes`` global setting.
+    """
+
+    #: Approximate number of bytes added to each MIME part for its headers.
+    MIME_PART_OVERHEAD_BYTES = 512
+
+    #: Size of the serialized MIME message to hold in memory before spooling
+    #: it to a temporary file on disk.
+    RAW_SPOOL_BYTES = 1024 * 1024
+
+    #: Number of bytes of each attachment to base64-encode at a time; a
+    #: multiple of 57, so that each chunk encodes to whole 76-character lines.
+    ENCODE_CHUNK_BYTES = 57 * 1024
+
+    def __init__(self, config, **kwargs):
+        super(SesSink, self).__init__(config, **kwargs)
+        self._ses = aws.client('ses')
+
+    def deliver(self, report):
+        if report.only_email_if_problems and not report.have_failures:
+            logger.info('only_email_if_problems is True and no problems; '
+                        'not sending email')
+            return
+        to_addr = self._config.get_global('to_email')
+        if not isinstance(to_addr, type([])):
+            to_addr = [to_addr]
+        html, attach, raw = self._build_message(report, to_addr)
+        with raw:
+            if len(attach) > 0:
+                self._send_raw_email(raw, to_addr)
+            else:
+                self._send_email(report, html, to_addr)
+
+    def _send_email(self, report, html, to_addr):
+        """
+        Send the report as a simple HTML email via SES ``SendEmail``.
+
+        :param report: the report to send
+        :type report: RunReport
+        :param html: the HTML report, as returned by
+          :py:meth:`~._build_message`
+        :type html: str
+        :param to_addr: list of recipient addresses
+        :type to_addr: list
+        """
+        resp = self._ses.send_email(
+            Source=self._config.get_global('from_email'),
+            Destination={
+                'ToAddresses': to_addr
+            },
+            Message={
+                'Subject': {
+                    'Data': report.subject,
+                    'Charset': 'utf-8'
+                },
+                'Body': {
+                    'Html': {
+                        'Data': html,
+                        'Charset': 'utf-8'
+                    }
+                }
+            },
+            ReturnPath=self._config.get_global('from_email'),
+        )
+        logger.info('Sent email via SES: %s', resp)
+
+    def _send_raw_email(self, raw, to_addr):
+        """
+        Send a serialized MIME message via SES ``SendRawEmail``. The API takes
+        the whole message in one request, so it is read into memory here;
+        its size is bounded by the ``email_max_bytes`` global setting.
+
+        :param raw: serialized message, as returned by
+          :py:meth:`~._build_message`
+        :type raw: ``tempfile.SpooledTemporaryFile``
+        :param to_addr: list of recipient addresses
+        :type to_addr: list
+        """
+        raw.seek(0)
+        resp = self._ses.send_raw_email(
+            Source=self._config.get_global('from_email'),
+            Destinations=to_addr,
+            RawMessage={'Data': raw.read()}
+        )
+        logger.info('Sent email via SES: %s', resp)
+
+    def _build_message(self, report, to_addr):
+        """
+        Build the report email as a MIME message, with the HTML report as the
+        body and the full output of each truncated job attached as a gzip
+        file, and serialize it to a temporary file. Attachments are added in
+        the order the jobs finished, as long as the estimated encoded size of
+        the message (see :py:meth:`~._encoded_size`) stays within the
+        ``email_max_bytes`` global setting. If the serialized message is still
+        larger than that, attachments are dropped, last first, until it fits.
+        Attachments that are not sent are listed at the end of the report.
+
+        :param report: the report to send
+        :type report: RunReport
+        :param to_addr: list of recipient addresses
+        :type to_addr: list
+        :return: 3-tuple of the HTML report as sent, the list of
+          (filename, file-like object) attachments included in the message,
+          and the serialized message
+        :rtype: tuple
+        :raises: RuntimeError if the message is larger than
+          ``email_max_bytes`` even without attachments
+        """
+        max_bytes = self._config.get_global('email_max_bytes')
+        total = self._encoded_size(len(report.html.encode('utf-8')))
+        attach = []
+        omitted = []
+        for fname, fh in report.attachments:
+            fh.seek(0, 2)
+            size = self._encoded_size(fh.tell())
+            if max_bytes is not None and total + size > max_bytes:
+                omitted.append(fname)
+                continue
+            total += size
+            attach.append((fname, fh))
+        while True:
+            html = report.html
+            if len(omitted) > 0:
+                html += '<p>Full output not attached (message size limit ' \
+                        'of %d bytes): %s</p>' % (
+                            max_bytes, escape(', '.join(omitted))
+                        )
+            raw = self._serialize(report, to_addr, html, attach)
+            size = raw.tell()
+            logger.debug('Email message is %d bytes', size)
+            if max_bytes is None or size <= max_bytes:
+                break
+            raw.close()
+            if len(attach) == 0:
+                raise RuntimeError(
+                    'ERROR: Report email is %d bytes, larger than '
+                    'email_max_bytes (%d) even without attachments' % (
+                        size, max_bytes
+                    )
+                )
+            omitted.append(attach.pop()[0])
+        if len(omitted) > 0:
+            logger.warning(
+                'Not attaching full output %s to email; would exceed '
+                'email_max_bytes (%s)', omitted, max_bytes
+            )
+        return html, attach, raw
+
+    def _serialize(self, report, to_addr, html, attach):
+        """
+        Serialize the report email as a MIME message to a temporary file,
+        which is only held in memory up to :py:attr:`~.RAW_SPOOL_BYTES`. The
+        message headers and HTML part are generated by :py:mod:`email`, but
+        the multipart structure is written here, so that each attachment can
+        be base64-encoded straight from its file into the message in chunks
+        of :py:attr:`~.ENCODE_CHUNK_BYTES`, without holding the attachment or
+        its encoded form in memory.
+
+        :param report: the report to send
+        :type report: RunReport
+        :param to_addr: list of recipient addresses
+        :type to_addr: list
+        :param html: the HTML report
+        :type html: str
+        :param attach: list of (filename, file-like object) attachments
+        :type attach: list
+        :return: the serialized message, positioned at its end
+        :rtype: ``tempfile.SpooledTemporaryFile``
+        """
+        boundary = '===============ecsjobs%s==' % uuid4().hex
+        sep = ('--%s\n' % boundary).encode('ascii')
+        raw = SpooledTemporaryFile(max_size=self.RAW_SPOOL_BYTES)
+        gen = BytesGenerator(raw, mangle_from_=False)
+        msg = MIMEMultipart('mixed', boundary=boundary)
+        msg['Subject'] = report.subject
+        msg['From'] = self._config.get_global('from_email')
+        msg['To'] = ', '.join(to_addr)
+        # headers only; the parts are written below
+        msg.set_payload('')
+        gen.flatten(msg)
+        raw.write(sep)
+        gen.flatten(MIMEText(html.encode('utf-8'), 'html', 'utf-8'))
+        for fname, fh in attach:
+            part = MIMEBase('application', 'gzip')
+            part['Content-Transfer-Encoding'] = 'base64'
+            part.add_header('Content-Disposition', 'attachment', filename=fname)
+            part.set_payload('')
+            raw.write(b'\n' + sep)
+            gen.flatten(part)
+            fh.seek(0)
+            for chunk in iter(lambda: fh.read(self.ENCODE_CHUNK_BYTES), b''):
+                raw.write(base64.encodebytes(chunk))
+        raw.write(('\n--%s--\n' % boundary).encode('ascii'))
+        return raw
+
+    def _encoded_size(self, num_bytes):
+        """
+        Estimate the size of a MIME part, including headers, containing
+        ``num_bytes`` of data base64-encoded in 76-character lines.
+
+        :param num_bytes: size of the unencoded data
+        :type num_bytes: int
+        :return: estimated size of the encoded MIME part, in bytes
+        :rtype: int
+        """
+        encoded = ((num_bytes + 2) // 3) * 4
+        return encoded + (encoded // 76) * 2 + self.MIME_PART_OVERHEAD_BYTES
+
+
+class FileSink(ReportSink):
+    """
+    Write the HTML report to a local file. The string ``{date}`` in ``path``
+    is replaced with the run start time in ``%Y-%m-%dT%H-%M-%S`` format.
+    """
+
+    def __init__(self, config, path, **kwargs):
+        super(FileSink, self).__init__(config, **kwargs)
+        self._path = path
+
+    def deliver(self, report):
+        path = self._format_path(self._path, report)
+        with open(path, 'w') as fh:
+            fh.write(report.html)
+        logger.info('HTML report written to: %s', path)
+
+
+class S3Sink(ReportSink):
+    """
+    Upload the HTML report to S3. The string ``{date}`` in ``key`` is replaced
+    with the run start time in ``%Y-%m-%dT%H-%M-%S`` format.
+    """
+
+    def __init__(self, config, bucket, key='ecsjobs/{date}.html', **kwargs):
+        super(S3Sink, self).__init__(config, **kwargs)
+        self._bucket = bucket
+        self._key = key
+        self._s3 = aws.client('s3')
+
+    def deliver(self, report):
+        key = self._format_path(self._key, report)
+        self._s3.put_object(
+            Bucket=self._bucket, Key=key, Body=report.html.encode('utf-8'),
+            ContentType='text/html; charset=utf-8'
+        )
+        logger.info('HTML report uploaded to: s3://%s/%s', self._bucket, key)
+
+
+class WebhookSink(ReportSink):
+    """
+    POST the report, as the JSON document from
+    :py:meth:`~.RunReport.as_dict`, to an HTTP(S) URL. If ``include_html`` is
+    True, the HTML report is included in the document as ``html``.
+    """
+
+    def __init__(self, config, url, headers=None, include_html=False,
+                 **kwargs):
+        super(WebhookSink, self).__init__(config, **kwargs)
+        self._url = url
+        self._headers = headers
+        self._include_html = include_html
+
+    def deliver(self, report):
+        doc = report.as_dict()
+        if self._include_html:
+            doc['html'] = report.html
+        resp = requests.post(
+            self._url, json=doc, headers=self._headers,
+            timeout=self.timeout_sec
+        )
+        resp.raise_for_status()
+        logger.info('Report POSTed to %s: HTTP %s', self._url,
+                    resp.status_code)
+
+
+class JsonSink(ReportSink):
+    """
+    Write the report as JSON to a local file or, if ``path`` is ``-``, to
+    STDOUT. The string ``{date}`` in ``path`` is replaced with the run start
+    time in ``%Y-%m-%dT%H-%M-%S`` format.
+
+    If ``format`` is ``json``, the file is overwritten with the document from
+    :py:meth:`~.RunReport.as_dict`. If ``format`` is ``jsonl`` (JSON Lines),
+    one line with ``record_type`` ``run`` and the run-level fields, followed
+    by one line with ``record_type`` ``job`` for each job, are appended to the
+    file. Each job line also includes the ``run_start_time``.
+    """
+
+    def __init__(self, config, path='-', format='json', **kwargs):
+        super(JsonSink, self).__init__(config, **kwargs)
+        self._path = path
+        self._format = format
+
+    def _lines(self, report):
+        """
+        Generate the lines of JSON to write for a report.
+
+        :param report: the report to write
+        :type report: RunReport
+        :return: generator of JSON strings, without trailing newlines
+        :rtype: ``generator``
+        """
+        doc = report.as_dict()
+        if self._format != 'jsonl':
+            yield json.dumps(doc, sort_keys=True)
+            return
+        jobs = doc.pop('jobs')
+        doc['record_type'] = 'run'
+        yield json.dumps(doc, sort_keys=True)
+        for rec in jobs:
+            rec = dict(rec)
+            rec['record_type'] = 'job'
+            rec['run_start_time'] = doc['start_time']
+            yield json.dumps(rec, sort_keys=True)
+
+    def deliver(self, report):
+        if self._path == '-':
+            for line in self._lines(report):
+                sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+            return
+        path = self._format_path(self._path, report)
+        with open(path, 'a' if self._format == 'jsonl' else 'w') as fh:
+            for line in self._lines(report):
+                fh.write(line + "\n")
+        logger.info('JSON report written to: %s', path)
+
+
+class CommandSink(ReportSink):
+    """
+    Run a command with the HTML report on STDIN. ``command`` should be an
+    array beginning with the absolute path to the executable, suitable for
+    passing to ``subprocess.Popen()``. The command exiting non-zero is a
+    failure.
+    """
+
+    def __init__(self, config, command, **kwargs):
+        super(CommandSink, self).__init__(config, **kwargs)
+        self._command = command
+
+    def deliver(self, report):
+        p = Popen(
+            self._command, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+            universal_newlines=True
+        )
+        out = p.communicate(input=report.html, timeout=self.timeout_sec)[0]
+        if p.returncode != 0:
+            raise RuntimeError(
+                'ERROR: Report command %s exited %s: %s' % (
+                    self._command, p.returncode, out
+                )
+            )
+        logger.info('Report command %s exited 0 with output:\n%s',
+                    self._command, out)
+
+
+#: Mapping of ``type`` values in the ``report_sinks`` global setting to
+#: :py:class:`~.ReportSink` classes.
+SINK_TYPES = {
+    'ses': SesSink,
+    'file': FileSink,
+    's3': S3Sink,
+    'webhook': WebhookSink,
+    'json': JsonSink,
+    'command': CommandSink
+}
+
+
+def make_sinks(config):
+    """
+    Instantiate the :py:class:`~.ReportSink` classes listed in the
+    ``report_sinks`` global setting (or :py:data:`~.DEFAULT_SINKS`), plus a
+    :py:class:`~.JsonSink` for the ``run_result_path`` global setting, if set.
+
+    :param config: Configuration
+    :type config: ecsjobs.config.Config
+    :return: list of ReportSink instances
+    :rtype: list
+    """
+    sink_confs = config.get_global('report_sinks')
+    if sink_confs is None:
+        sink_confs = DEFAULT_SINKS
+    result_path = config.get_global('run_result_path')
+    if result_path is not None:
+        sink_confs = list(sink_confs) + [{
+            'type': 'json',
+            'path': result_path,
+            'format': config.get_global('run_result_format') or 'json'
+        }]
+    sinks = []
+    for sconf in sink_confs:
+        kwargs = dict(sconf)
+        stype = kwargs.pop('type')
+        if stype not in SINK_TYPES:
+            raise RuntimeError(
+                'ERROR: Unknown report sink type "%s"' % stype
+            )
+        sinks.append(SINK_TYPES[stype](config, **kwargs))
+    return sinks
+
+
+def deliver_all(sinks, report):
+    """
+    Deliver a report to all sinks in parallel, each in its own daemon thread,
+    waiting at most each sink's ``timeout_sec`` for it to finish. A sink that
+    is still running when its timeout expires is abandoned, and will not
+    prevent the process from exiting; its :py:attr:`~.ReportSink.running`
+    attribute remains True until it finishes.
+
+    :param sinks: ReportSink instances to deliver to
+    :type sinks: list
+    :param report: the report to deliver
+    :type report: RunReport
+    :return: list of 2-tuples of (ReportSink, Exception) for each sink that
+      failed or timed out
+    :rtype: list
+    """
+    start = time.time()
+    threads = []
+    for sink in sinks:
+        sink.running = True
+        t = threading.Thread(
+            target=sink.run, args=(report,), daemon=True,
+            name='ecsjobs-report-%s' % type(sink).__name__
+        )
+        t.start()
+        threads.append((sink, t))
+    failures = []
+    for sink, t in threads:
+        t.join(max(0, start + sink.timeout_sec - time.time()))
+        if t.is_alive():
+            logger.error('Report sink %s did not finish within %s seconds',
+                         sink, sink.timeout_sec)
+            failures.append((sink, RuntimeError(
+                'ERROR: Report sink %s timed out after %s seconds' % (
+                    sink, sink.timeout_sec
+                )
+            )))
+        elif sink.exception is not None:
+            failures.append((sink, sink.exception))
+    return failures
@@ -37,20 +37,40 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 
 from os import close as os_close
 import logging
+import re
+import gzip
+from io import StringIO, TextIOWrapper
+from shutil import copyfileobj
 from getpass import getuser
 from socket import gethostname
 from datetime import datetime
 from html import escape
-from tempfile import mkstemp
+from tempfile import mkstemp, SpooledTemporaryFile
 from subprocess import Popen, PIPE, STDOUT
 
-import boto3
+from ecsjobs.s3_output import S3OutputStore
+from ecsjobs.report_sinks import RunReport, make_sinks, deliver_all
 
 logger = logging.getLogger(__name__)
 
 
 class Reporter(object):
-    """ECSJobs Report Generator and SES Sender"""
+    """
+    ECSJobs Report Generator. The report is delivered to each of the
+    :py:mod:`~ecsjobs.report_sinks` configured in the ``report_sinks`` global
+    setting.
+    """
+
+    #: Number of characters of job output to escape and write at a time.
+    ESCAPE_CHUNK_CHARS = 65536
+
+    #: Size of pre-rendered job detail sections to hold in memory before
+    #: spooling them to a temporary file on disk.
+    DETAIL_SPOOL_BYTES = 1024 * 1024
+
+    #: Size of compressed output attachments to hold in memory before spooling
+    #: them to a temporary file on disk.
+    ATTACHMENT_SPOOL_BYTES = 1024 * 1024
 
     def __init__(self, config):
         """
@@ -60,11 +80,79 @@ class Reporter(object):
         :type config: ecsjobs.config.Config
         """
         self._config = config
-        self._ses = boto3.client('ses')
+        self._sinks = make_sinks(config)
+        self._attachments = []
+        self._records = []
+        self._s3_output = None
+        self._inline_remaining = config.get_global(
+            'report_inline_total_chars'
+        )
+        if config.get_global('output_s3_bucket') is not None:
+            self._s3_output = S3OutputStore(
+                config.get_global('output_s3_bucket'),
+                config.get_global('output_s3_prefix'),
+                presign_sec=config.get_global('output_s3_presign_sec')
+            )
+        self._reset()
+
+    def _reset(self):
+        """
+        Clear all pre-rendered job fragments and the failure flag.
+        """
         self._have_failures = False
+        self._rows = []
+        self._details = SpooledTemporaryFile(
+            max_size=self.DETAIL_SPOOL_BYTES, mode='w+', encoding='utf-8'
+        )
+        self._rendered = set()
+
+    @property
+    def records(self):
+        """
+        Return the machine-readable per-job results (as built by
+        :py:meth:`~._record_for_job`) of every job rendered so far, in the
+        order they were rendered. After :py:meth:`~.run`, this includes the
+        unfinished jobs.
+
+        :return: list of per-job result dicts
+        :rtype: list
+        """
+        return self._records
+
+    def add_job(self, job, exc=None, unfinished=False):
+        """
+        Render the table row and detail section for a job that has reached a
+        terminal state, and store them for inclusion in the final report. This
+        allows the runner to render each job as soon as it is done, and then
+        free the job's output; the final report just stitches the pre-rendered
+        fragments together.
+
+        :param job: the Job to render
+        :type job: ecsjobs.jobs.base.Job
+        :param exc: None or 2-tuple of Exception caught when running job and
+          traceback formatted as a string.
+        :type exc: ``2-tuple`` or ``None``
+        :param unfinished: whether or not the job was killed before being
+          finished.
+        :type unfinished: bool
+        :return: the job's machine-readable result, from
+          :py:meth:`~._record_for_job`
+        :rtype: dict
+        """
+        rec = self._record_for_job(job, exc=exc, unfinished=unfinished)
+        self._records.append(rec)
+        if unfinished:
+            self._rows.append(self._tr_for_job(job, unfinished=True))
+            self._write_div_for_job(self._details, job, unfinished=True)
+        else:
+            self._rows.append(self._tr_for_job(job, exc=exc))
+            self._write_div_for_job(self._details, job, exc=exc)
+        self._details.write('<hr />' + "\n")
+        self._rendered.add(job)
+        return rec
 
     def run(self, finished, unfinished, excs, start_dt, end_dt,
-            only_email_if_problems=False):
+            only_email_if_problems=False, timings=None, api_calls=None):
         """
         Generate and send the report.
 
@@ -84,74 +172,106 @@ class Reporter(object):
           were failures, exceptions, or unfinished jobs. Otherwise, always send
           email.
         :type only_email_if_problems: bool
+        :param timings: run phase timings, as returned by
+          :py:attr:`ecsjobs.timing.Timings.records`
+        :type timings: list
+        :param api_calls: AWS API call statistics, as returned by
+          :py:attr:`ecsjobs.aws.ApiAccounting.records`
+        :type api_calls: list
         """
-        self._have_failures = False
-        report = self._make_report(finished, unfinished, excs, start_dt, end_dt)
-        if only_email_if_problems and not self._have_failures:
-            logger.info('only_email_if_problems is True and no problems; '
-                        'not sending email')
-            return
-        to_addr = self._config.get_global('to_email')
-        if not isinstance(to_addr, type([])):
-            to_addr = [to_addr]
         try:
-            resp = self._ses.send_email(
-                Source=self._config.get_global('from_email'),
-                Destination={
-                    'ToAddresses': to_addr
-                },
-                Message={
-                    'Subject': {
-                        'Data': self._config.get_global('email_subject'),
-                        'Charset': 'utf-8'
-                    },
-                    'Body': {
-                        'Html': {
-                            'Data': report,
-                            'Charset': 'utf-8'
-                        }
-                    }
-                },
-                ReturnPath=self._config.get_global('from_email'),
+            self._send(
+                finished, unfinished, excs, start_dt, end_dt,
+                only_email_if_problems=only_email_if_problems, timings=timings,
+                api_calls=api_calls
             )
-            logger.info('Sent email via SES: %s', resp)
-        except Exception:
-            logger.error('ERROR sending email to %s via SES. Email Body:\n%s',
-                         self._config.get_global('to_email'), report,
-                         exc_info=True)
-            failure_cmd = self._config.get_global('failure_command')
-            if failure_cmd is not None:
-                try:
-                    p = Popen(
-                        *failure_cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
-                        universal_newlines=True
-                    )
-                    out = p.communicate(input='\n\n%s' % report, timeout=120)[0]
-                    logger.warning(
-                        'Failure command (%s) exited %s with output:\n%s',
-                        failure_cmd, p.returncode, out
-                    )
-                except Exception:
-                    logger.error(
-                        'Exception while running failure_cmd %s', failure_cmd,
-                        exc_info=True
-                    )
-            failure_path = self._config.get_global('failure_html_path')
-            if failure_path is None:
-                fd, path = mkstemp(prefix='ecsjobs', text=True, suffix='.html')
-                with open(path, 'w') as fh:
-                    fh.write(report)
-                os_close(fd)
-                logger.warning('HTML report written to: %s', path)
-            else:
-                with open(failure_path, 'w') as fh:
-                    fh.write(report)
-                logger.warning('HTML report written to: %s', failure_path)
-            raise
-
-    def _make_report(self, finished, unfinished, excs, start_dt, end_dt):
-        """
-        Generate the HTML email report
+        finally:
+            self._close_attachments()
+
+    def _send(self, finished, unfinished, excs, start_dt, end_dt,
+              only_email_if_problems=False, timings=None, api_calls=None):
+        """
+        Generate the report and deliver it to all sinks in parallel; see
+        :py:meth:`~.run` for parameters. Failures of any sink are logged. If
+        the primary sink (the first one in ``report_sinks``; by default, SES
+        email) fails, the ``failure_command`` and ``failure_html_path``
+        fallbacks are run and its exception is re-raised.
+        """
+        report = self._make_report(
+            finished, unfinished, excs, start_dt, end_dt, timings=timings,
+            api_calls=api_calls
+        )
+        failures = deliver_all(self._sinks, RunReport(
+            report, self._config.get_global('email_subject'), self._records,
+            start_dt, end_dt, self._have_failures,
+            attachments=self._attachments,
+            only_email_if_problems=only_email_if_problems, timings=timings,
+            api_calls=api_calls
+        ))
+        for sink, exc in failures:
+            logger.error('ERROR sending report via %s: %s', sink, exc)
+        primary = [x for x in failures if x[0] is self._sinks[0]]
+        if len(primary) == 0:
+            return
+        logger.error('Report Body:\n%s', report)
+        failure_cmd = self._config.get_global('failure_command')
+        if failure_cmd is not None:
+            try:
+                p = Popen(
+                    *failure_cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT,
+                    universal_newlines=True
+                )
+                out = p.communicate(input='\n\n%s' % report, timeout=120)[0]
+                logger.warning(
+                    'Failure command (%s) exited %s with output:\n%s',
+                    failure_cmd, p.returncode, out
+                )
+            except Exception:
+                logger.error(
+                    'Exception while running failure_cmd %s', failure_cmd,
+                    exc_info=True
+                )
+        failure_path = self._config.get_global('failure_html_path')
+        if failure_path is None:
+            fd, path = mkstemp(prefix='ecsjobs', text=True, suffix='.html')
+            with open(path, 'w') as fh:
+                fh.write(report)
+            os_close(fd)
+            logger.warning('HTML report written to: %s', path)
+        else:
+            with open(failure_path, 'w') as fh:
+                fh.write(report)
+            logger.warning('HTML report written to: %s', failure_path)
+        raise primary[0][1]
+
+    def _close_attachments(self):
+        """
+        Close and discard all compressed output attachments. If any sink is
+        still running (i.e. it timed out, and its thread was abandoned), the
+        attachments are discarded without closing them, as the sink may still
+        be reading them; they are closed when garbage-collected.
+        """
+        if any(s.running for s in self._sinks):
+            logger.warning('Report sink still running; not closing report '
+                           'attachments')
+            self._attachments = []
+            return
+        for _, fh in self._attachments:
+            fh.close()
+        self._attachments = []
+
+    def _make_report(self, finished, unfinished, excs, start_dt, end_dt,
+                     timings=None, api_calls=None):
+        """
+        Generate the HTML email report, via :py:meth:`~._write_report`.
+
+        The whole report is returned as a string, as that is what every report
+        sink (SES, webhook, command, etc.) and the failure fallbacks need.
+        This full copy is bounded: job output inlined in the report is limited
+        by the ``report_inline_output_chars`` and ``report_inline_total_chars``
+        global settings, with the rest going to attachments or S3, so the
+        report's size depends on those limits and the number of jobs, not on
+        the total size of job output (see ``benchmarks/bench_report.py``).
 
         :param finished: Finished Job instances.
         :type finished: list
@@ -165,34 +285,196 @@ class Reporter(object):
         :type start_dt: datetime.datetime
         :param end_dt: datetime instance when run was finished
         :type end_dt: datetime.datetime
+        :param timings: run phase timings, as returned by
+          :py:attr:`ecsjobs.timing.Timings.records`
+        :type timings: list
+        :param api_calls: AWS API call statistics, as returned by
+          :py:attr:`ecsjobs.aws.ApiAccounting.records`
+        :type api_calls: list
         :returns: HTML email report content
         :rtype: str
         """
-        html = "<p>ECSJobs run report for %s@%s at %s</p>\n" % (
-            getuser(), gethostname(),
-            datetime.now().strftime('%A, %Y-%m-%d %H:%M:%S %Z')
+        buf = StringIO()
+        self._write_report(
+            buf, finished, unfinished, excs, start_dt, end_dt, timings=timings,
+            api_calls=api_calls
         )
-        html += '<p>Total Duration: %s</p>\n' % str(end_dt - start_dt)
-        html += '<table style="border: 1px solid black; ' \
-                'border-collapse: collapse;">' + "\n"
-        html += '<tr>'
-        html += self.th('Job Name')
-        html += self.th('Exit Code')
-        html += self.th('Duration')
-        html += self.th('Message')
-        html += '</tr>' + "\n"
-        for j in finished:
-            html += self._tr_for_job(j, exc=excs.get(j, None))
-        for j in unfinished:
-            html += self._tr_for_job(j, unfinished=True)
-        html += '</table>' + "\n"
+        return buf.getvalue()
+
+    def _write_report(self, fh, finished, unfinished, excs, start_dt, end_dt,
+                      timings=None, api_calls=None):
+        """
+        Write the HTML email report to a file-like object, one piece at a time.
+        Any jobs that were not already rendered via :py:meth:`~.add_job` are
+        rendered first, then the pre-rendered fragments are stitched together.
+        Job output is escaped and written in chunks of
+        :py:attr:`~.ESCAPE_CHUNK_CHARS`, so no additional full copies of any
+        job's output are made. The pre-rendered fragments are cleared
+        afterwards.
+
+        :param fh: file-like object to write the report to
+        :type fh: ``io.TextIOBase``
+        :param finished: Finished Job instances.
+        :type finished: list
+        :param unfinished: Unfinished (timed-out) Job instances.
+        :type unfinished: list
+        :param excs: Dict of Jobs that generated an exception while running;
+          keys are Job class instances and values are 2-tuples of the caught
+          Exception objects and string formatted tracebacks.
+        :type excs: dict
+        :param start_dt: datetime instance when run was started
+        :type start_dt: datetime.datetime
+        :param end_dt: datetime instance when run was finished
+        :type end_dt: datetime.datetime
+        :param timings: run phase timings, as returned by
+          :py:attr:`ecsjobs.timing.Timings.records`
+        :type timings: list
+        :param api_calls: AWS API call statistics, as returned by
+          :py:attr:`ecsjobs.aws.ApiAccounting.records`
+        :type api_calls: list
+        """
         for j in finished:
-            html += self._div_for_job(j, exc=excs.get(j, None))
-            html += '<hr />' + "\n"
+            if j not in self._rendered:
+                self.add_job(j, exc=excs.get(j, None))
         for j in unfinished:
-            html += self._div_for_job(j, unfinished=True)
-            html += '<hr />' + "\n"
-        return html
+            if j not in self._rendered:
+                self.add_job(j, unfinished=True)
+        fh.write("<p>ECSJobs run report for %s@%s at %s</p>\n" % (
+            getuser(), gethostname(),
+            datetime.now().strftime('%A, %Y-%m-%d %H:%M:%S %Z')
+        ))
+        fh.write('<p>Total Duration: %s</p>\n' % str(end_dt - start_dt))
+        fh.write('<table style="border: 1px solid black; '
+                 'border-collapse: collapse;">' + "\n")
+        fh.write('<tr>')
+        fh.write(self.th('Job Name'))
+        fh.write(self.th('Exit Code'))
+        fh.write(self.th('Duration'))
+        fh.write(self.th('Message'))
+        fh.write('</tr>' + "\n")
+        for row in self._rows:
+            fh.write(row)
+        fh.write('</table>' + "\n")
+        self._details.seek(0)
+        copyfileobj(self._details, fh)
+        self._details.close()
+        if timings:
+            fh.write(self._timings_table('Run Phase Timings', timings))
+        if api_calls:
+            fh.write(self._api_calls_table(api_calls))
+        have_failures = self._have_failures
+        self._reset()
+        self._have_failures = have_failures
+
+    def _write_escaped(self, fh, s):
+        """
+        HTML-escape a string and write it to a file-like object, in chunks of
+        :py:attr:`~.ESCAPE_CHUNK_CHARS`.
+
+        :param fh: file-like object to write to
+        :type fh: ``io.TextIOBase``
+        :param s: string to escape and write
+        :type s: str
+        """
+        for i in range(0, len(s), self.ESCAPE_CHUNK_CHARS):
+            fh.write(escape(s[i:i + self.ESCAPE_CHUNK_CHARS]))
+
+    def _upload_output(self, job):
+        """
+        If ``output_s3_bucket`` is configured, upload a job's full output to
+        S3 via :py:class:`~ecsjobs.s3_output.S3OutputStore`. Upload failures
+        are logged, and the output handled as if S3 was not configured.
+
+        :param job: the Job whose output to upload
+        :type job: ecsjobs.jobs.base.Job
+        :return: 2-tuple of the ``s3://`` URI of the output (or None, if not
+          uploaded) and the presigned URL for it (or None)
+        :rtype: tuple
+        """
+        if self._s3_output is None or job.output is None:
+            return None, None
+        try:
+            return self._s3_output.upload(job.name, job.output)
+        except Exception:
+            logger.error('Unable to upload output of job %s to S3', job.name,
+                         exc_info=True)
+        return None, None
+
+    def _write_output(self, fh, job, s3_uri=None):
+        """
+        Write a job's HTML-escaped output to a file-like object. If the output
+        is longer than the ``report_inline_output_chars`` global setting, or
+        than what is left of the ``report_inline_total_chars`` budget shared
+        by all jobs in the report, only the head and tail of it are written
+        (half of the limit each). Unless the full output has been uploaded to
+        ``s3_uri``, it is compressed to an attachment via
+        :py:meth:`~._attach_output`.
+
+        :param fh: file-like object to write to
+        :type fh: ``io.TextIOBase``
+        :param job: the Job whose output to write
+        :type job: ecsjobs.jobs.base.Job
+        :param s3_uri: S3 URI the job's full output was uploaded to, if any
+        :type s3_uri: str
+        """
+        output = job.output
+        limit = self._config.get_global('report_inline_output_chars')
+        if self._inline_remaining is not None:
+            if limit is None or self._inline_remaining < limit:
+                limit = self._inline_remaining
+        if output is None or limit is None or len(output) <= limit:
+            if output is not None:
+                self._use_inline(len(output))
+            self._write_escaped(fh, output)
+            return
+        if s3_uri is None:
+            where = 'attached as %s' % self._attach_output(job.name, output)
+        else:
+            where = 'at %s' % escape(s3_uri)
+        half = limit // 2
+        self._use_inline(half * 2)
+        self._write_escaped(fh, output[:half])
+        fh.write(
+            '\n\n<strong>[... %d characters omitted; full output %s ...]'
+            '</strong>\n\n' % (len(output) - (half * 2), where)
+        )
+        self._write_escaped(fh, output[len(output) - half:])
+
+    def _use_inline(self, num_chars):
+        """
+        Deduct characters of output written inline from the
+        ``report_inline_total_chars`` budget, if one is set.
+
+        :param num_chars: number of characters of output written inline
+        :type num_chars: int
+        """
+        if self._inline_remaining is None:
+            return
+        self._inline_remaining = max(0, self._inline_remaining - num_chars)
+
+    def _attach_output(self, name, output):
+        """
+        Compress a job's full output to a gzip attachment, written in chunks
+        of :py:attr:`~.ESCAPE_CHUNK_CHARS` to a temporary file (which is only
+        held in memory up to :py:attr:`~.ATTACHMENT_SPOOL_BYTES`).
+
+        :param name: job name
+        :type name: str
+        :param output: job output
+        :type output: str
+        :return: attachment filename
+        :rtype: str
+        """
+        fname = '%s.txt.gz' % re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        fh = SpooledTemporaryFile(max_size=self.ATTACHMENT_SPOOL_BYTES)
+        with gzip.GzipFile(filename=fname[:-3], fileobj=fh, mode='wb') as gz:
+            txt = TextIOWrapper(gz, encoding='utf-8')
+            for i in range(0, len(output), self.ESCAPE_CHUNK_CHARS):
+                txt.write(output[i:i + self.ESCAPE_CHUNK_CHARS])
+            txt.flush()
+            txt.detach()
+        self._attachments.append((fname, fh))
+        return fname
 
     def th(self, s):
         return '<th style="border: 1px solid black;">%s</th>' % s
@@ -200,6 +482,77 @@ class Reporter(object):
     def td(self, s):
         return '<td style="border: 1px solid black; padding: 1em;">%s</td>' % s
 
+    def _record_for_job(self, job, exc=None, unfinished=False):
+        """
+        Build the machine-readable result of a specific job, for
+        :py:attr:`ecsjobs.report_sinks.RunReport.records`.
+
+        :param job: the Job to build a record for
+        :type job: ecsjobs.jobs.base.Job
+        :param exc: None or 2-tuple of Exception caught when running job and
+          traceback formatted as a string.
+        :type exc: ``2-tuple`` or ``None``
+        :param unfinished: whether or not the job was killed before being
+          finished.
+        :type unfinished: bool
+        :return: job result
+        :rtype: dict
+        """
+        rec = {
+            'name': job.name,
+            'class': job.__class__.__name__,
+            'schedule': job.schedule_name,
+            'exit_code': None,
+            'start_time': None,
+            'finish_time': None,
+            'duration_sec': None,
+            'summary': None,
+            'output_bytes': None,
+            'exception': None,
+            'timings': job.timings.records,
+            'resource_usage': job.resource_usage,
+            'lifecycle': job.lifecycle,
+            'shards': job.shards,
+            'capacity_wait_sec': job.capacity_wait_sec
+        }
+        if job.start_time is not None:
+            rec['start_time'] = job.start_time.isoformat()
+        if job.finish_time is not None:
+            rec['finish_time'] = job.finish_time.isoformat()
+        if job.duration is not None:
+            rec['duration_sec'] = job.duration.total_seconds()
+        if job.output is not None:
+            rec['output_bytes'] = self._utf8_len(job.output)
+        if exc is not None:
+            rec['state'] = 'exception'
+            rec['exception'] = exc[0].__class__.__name__
+        elif unfinished:
+            rec['state'] = 'unfinished'
+        elif job.skip is not None:
+            rec['state'] = 'skipped'
+        else:
+            rec['exit_code'] = job.exitcode
+            rec['summary'] = job.summary()
+            rec['state'] = 'succeeded' if job.exitcode == 0 else 'failed'
+        return rec
+
+    def _utf8_len(self, s):
+        """
+        Return the length of a string encoded as UTF-8, encoding it in chunks
+        of :py:attr:`~.ESCAPE_CHUNK_CHARS` to avoid making a full copy.
+
+        :param s: string to measure
+        :type s: str
+        :return: length in bytes
+        :rtype: int
+        """
+        if s.isascii():
+            return len(s)
+        return sum(
+            len(s[i:i + self.ESCAPE_CHUNK_CHARS].encode('utf-8', 'replace'))
+            for i in range(0, len(s), self.ESCAPE_CHUNK_CHARS)
+        )
+
     def _tr_for_job(self, job, exc=None, unfinished=False):
         """
         Generate a row in the results table for a specific job.
@@ -265,19 +618,222 @@ class Reporter(object):
         :return: HTML div for the report
         :rtype: str
         """
-        res = '<div><p><strong><a name="%s">%s</a></strong> - %s</p>' % (
+        buf = StringIO()
+        self._write_div_for_job(buf, job, exc=exc, unfinished=unfinished)
+        return buf.getvalue()
+
+    def _write_div_for_job(self, fh, job, exc=None, unfinished=False):
+        """
+        Write a div for the results email with the output or exception of a
+        specific job to a file-like object.
+
+        :param fh: file-like object to write to
+        :type fh: ``io.TextIOBase``
+        :param job: the Job to generate a div for
+        :type job: ecsjobs.jobs.base.Job
+        :param exc: Exception caught when running job, or None
+        :type exc: ``Exception`` or ``None``
+        :param unfinished: whether or not the job was killed before being
+          finished.
+        :type unfinished: bool
+        """
+        fh.write('<div><p><strong><a name="%s">%s</a></strong> - %s</p>' % (
             job.name, job.name, escape(str(job.report_description()))
-        )
+        ))
         if exc is not None:
-            res += '<pre>%s\n\n%s</pre>' % (
-                escape(job.error_repr), escape(exc[1])
-            )
+            fh.write('<pre>')
+            self._write_escaped(fh, job.error_repr)
+            fh.write('\n\n')
+            self._write_escaped(fh, exc[1])
+            fh.write('</pre>')
         elif unfinished:
-            res += '<pre>%s</pre>\n<strong>JOB NOT FINISHED.</strong>' \
-                   '' % escape(job.error_repr)
+            fh.write('<pre>')
+            self._write_escaped(fh, job.error_repr)
+            fh.write('</pre>\n<strong>JOB NOT FINISHED.</strong>')
         elif job.skip is not None:
-            res += '<p>Job Skipped: %s</p>' % escape(job.skip)
+            fh.write('<p>Job Skipped: %s</p>' % escape(job.skip))
         else:
-            res += '<pre>%s</pre>' % escape(job.output)
-        res += '</div>' + "\n"
+            uri, url = self._upload_output(job)
+            fh.write('<pre>')
+            self._write_output(fh, job, s3_uri=uri)
+            fh.write('</pre>')
+            if url is not None:
+                fh.write('<p>Full output: <a href="%s">%s</a></p>' % (
+                    escape(url), escape(uri)
+                ))
+            elif uri is not None:
+                fh.write('<p>Full output: %s</p>' % escape(uri))
+        if job.resource_usage is not None:
+            fh.write(self._usage_for_job(job.resource_usage))
+        capacity_wait = job.capacity_wait_sec
+        if capacity_wait:
+            fh.write(
+                '<p>Waited %.2fs for ECS cluster capacity.</p>' % capacity_wait
+            )
+        lifecycle = job.lifecycle
+        if lifecycle is not None:
+            fh.write(self._lifecycle_for_job(lifecycle))
+        shards = job.shards
+        if shards is not None:
+            fh.write(self._shards_table(shards))
+        timings = job.timings.records
+        if len(timings) > 0:
+            fh.write(self._timings_table('Timings', timings))
+        fh.write('</div>' + "\n")
+
+    def _timings_table(self, title, timings):
+        """
+        Generate a collapsible table of phase timings.
+
+        :param title: summary line for the collapsible section
+        :type title: str
+        :param timings: phase timings, as returned by
+          :py:attr:`ecsjobs.timing.Timings.records`
+        :type timings: list
+        :return: HTML details element for the report
+        :rtype: str
+        """
+        res = '<details><summary>%s</summary>\n' % escape(title)
+        res += '<table style="border: 1px solid black; ' \
+               'border-collapse: collapse;">\n<tr>'
+        for h in ['Phase', 'Start', 'Wall (s)', 'CPU (s)', 'Count']:
+            res += self.th(h)
+        res += '</tr>\n'
+        for t in timings:
+            res += '<tr>%s%s%s%s%s</tr>\n' % (
+                self.td(escape(t['name'])), self.td(t['start_time']),
+                self.td('%.3f' % t['wall_sec']),
+                self.td('%.3f' % t['cpu_sec']), self.td(t['count'])
+            )
+        res += '</table></details>\n'
+        return res
+
+    def _api_calls_table(self, api_calls):
+        """
+        Generate a collapsible table of AWS API call statistics.
+
+        :param api_calls: AWS API call statistics, as returned by
+          :py:attr:`ecsjobs.aws.ApiAccounting.records`
+        :type api_calls: list
+        :return: HTML details element for the report
+        :rtype: str
+        """
+        res = '<details><summary>AWS API Calls</summary>\n'
+        res += '<table style="border: 1px solid black; ' \
+               'border-collapse: collapse;">\n<tr>'
+        for h in [
+            'Service', 'Operation', 'Job', 'Calls', 'Errors', 'Retries',
+            'Throttles', 'Total Latency (s)', 'Max Latency (s)',
+            'Rate Limit Wait (s)'
+        ]:
+            res += self.th(h)
+        res += '</tr>\n'
+        for c in api_calls:
+            res += '<tr>%s%s%s%s%s%s%s%s%s%s</tr>\n' % (
+                self.td(escape(c['service'])), self.td(escape(c['operation'])),
+                self.td('&nbsp;' if c['job'] is None else escape(c['job'])),
+                self.td(c['calls']), self.td(c['errors']),
+                self.td(c['retries']), self.td(c['throttles']),
+                self.td('%.3f' % c['latency_sec']),
+                self.td('%.3f' % c['max_latency_sec']),
+                self.td('%.3f' % c.get('rate_limit_wait_sec', 0))
+            )
+        res += '</table></details>\n'
+        return res
+
+    def _shards_table(self, shards):
+        """
+        Generate a collapsible table of the results of each of a job's shards.
+
+        :param shards: the job's :py:attr:`~ecsjobs.jobs.base.Job.shards`
+        :type shards: list
+        :return: HTML details element for the report
+        :rtype: str
+        """
+        counts = {}
+        for s in shards:
+            state = s['state']
+            if state == 'stopped':
+                state = 'succeeded' if s['exit_code'] == 0 else 'failed'
+            elif state == 'failed':
+                state = 'not started'
+            counts[state] = counts.get(state, 0) + 1
+        res = '<details><summary>Shards (%s)</summary>\n' % ', '.join(
+            '%d %s' % (counts[k], k) for k in sorted(counts.keys())
+        )
+        res += '<table style="border: 1px solid black; ' \
+               'border-collapse: collapse;">\n<tr>'
+        for h in ['Shard', 'Task', 'State', 'Exit Code', 'Duration (s)',
+                  'Reason']:
+            res += self.th(h)
+        res += '</tr>\n'
+        for s in shards:
+            res += '<tr>%s%s%s%s%s%s</tr>\n' % (
+                self.td(s['index']),
+                self.td('&nbsp;' if s['task_arn'] is None
+                        else escape(s['task_arn'].split('/')[-1])),
+                self.td(s['state']),
+                self.td('&nbsp;' if s['exit_code'] is None
+                        else s['exit_code']),
+                self.td('&nbsp;' if s['duration_sec'] is None
+                        else '%.3f' % s['duration_sec']),
+                self.td('&nbsp;' if s['reason'] is None
+                        else escape(s['reason']))
+            )
+        res += '</table></details>\n'
         return res
+
+    def _lifecycle_for_job(self, lifecycle):
+        """
+        Generate a paragraph describing the lifecycle latencies of each of a
+        job's ECS Tasks.
+
+        :param lifecycle: the job's :py:attr:`~ecsjobs.jobs.base.Job.lifecycle`
+        :type lifecycle: dict
+        :return: HTML paragraph for the report
+        :rtype: str
+        """
+        lines = []
+        for t in lifecycle['tasks']:
+            parts = []
+            for key, title in [
+                ('placement_delay_sec', 'placement delay'),
+                ('image_pull_sec', 'image pull'),
+                ('run_sec', 'run'),
+                ('stop_detection_sec', 'stop detection')
+            ]:
+                if t[key] is not None:
+                    parts.append('%s %.2fs' % (title, t[key]))
+            line = 'Task %s lifecycle: %s' % (
+                escape(t['task_arn'].split('/')[-1]),
+                ', '.join(parts) if len(parts) > 0 else 'unknown'
+            )
+            if t['stopped_reason'] is not None:
+                line += '; stopped reason: %s' % escape(t['stopped_reason'])
+            lines.append(line)
+        return '<p>%s</p>' % '<br />'.join(lines)
+
+    def _usage_for_job(self, usage):
+        """
+        Generate a paragraph describing a job's resource usage.
+
+        :param usage: the job's :py:attr:`~ecsjobs.jobs.base.Job.resource_usage`
+        :type usage: dict
+        :return: HTML paragraph for the report
+        :rtype: str
+        """
+        res = 'Resource usage: user CPU %.2fs, system CPU %.2fs, max RSS ' \
+              '%d KiB, block I/O %d in / %d out, context switches %d ' \
+              'voluntary / %d involuntary' % (
+                  usage['user_cpu_sec'], usage['system_cpu_sec'],
+                  usage['max_rss_kb'], usage['block_input_ops'],
+                  usage['block_output_ops'], usage['voluntary_ctx_switches'],
+                  usage['involuntary_ctx_switches']
+              )
+        cg = [
+            '%s=%s' % (k[7:], usage[k]) for k in sorted(usage.keys())
+            if k.startswith('cgroup_')
+        ]
+        if len(cg) > 0:
+            res += '; cgroup: %s' % ', '.join(cg)
+        return '<p>%s</p>' % res
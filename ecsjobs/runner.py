@@ -39,13 +39,21 @@ import sys
 import argparse
 import logging
 from copy import copy
+from contextlib import contextmanager
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
-from traceback import format_exc
+from traceback import format_exc, format_exception
 
 from ecsjobs.version import VERSION, PROJECT_URL
 from ecsjobs.config import Config
 from ecsjobs.reporter import Reporter
+from ecsjobs.metrics import PrometheusExporter, CloudWatchMetrics
+from ecsjobs.timing import Timings
+from ecsjobs.aws import (
+    api_accounting, rate_limiter, job_context, configure_clients
+)
+from ecsjobs import tracing, profiling
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +74,9 @@ class EcsJobsRunner(object):
         self._start_time = None
         self._timeout = None
         self._only_email_if_problems = only_email_if_problems
+        self._reporter = None
+        self._cloudwatch = None
+        self._timings = Timings()
 
     def run_schedules(self, schedule_names):
         """
@@ -77,7 +88,10 @@ class EcsJobsRunner(object):
         jobs = self._conf.jobs_for_schedules(schedule_names)
         logger.info('Running %d jobs for schedules %s: %s',
                     len(jobs), schedule_names, jobs)
-        self._run_jobs(jobs)
+        with self._root_span(
+            'run_schedules', {'ecsjobs.schedules': ','.join(schedule_names)}
+        ):
+            self._run_jobs(jobs)
 
     def run_job_names(self, job_names):
         """
@@ -89,7 +103,52 @@ class EcsJobsRunner(object):
         jobs = [j for j in self._conf.jobs if j.name in job_names]
         logger.info('Running %d jobs for names %s: %s',
                     len(jobs), job_names, jobs)
-        self._run_jobs(jobs, force_run=True)
+        with self._root_span(
+            'run_job_names', {'ecsjobs.job_names': ','.join(job_names)}
+        ):
+            self._run_jobs(jobs, force_run=True)
+
+    @contextmanager
+    def _root_span(self, name, attributes):
+        """
+        Context manager for the root trace span of a run. The configuration
+        loading phases are added as its children, and all spans are exported
+        when it exits.
+
+        :param name: span name
+        :type name: str
+        :param attributes: span attributes
+        :type attributes: dict
+        """
+        try:
+            with tracing.span(name, attributes=attributes):
+                tracing.add_timings(
+                    self._conf.timings,
+                    ['config.load', 'config.validate', 'config.make_jobs']
+                )
+                yield
+        finally:
+            tracing.flush()
+
+    @staticmethod
+    def _job_span(name, job, parent=None):
+        """
+        Return a trace span for an operation on a job, with the job's name,
+        class and schedule as attributes.
+
+        :param name: span name
+        :type name: str
+        :param job: the Job
+        :type job: ecsjobs.jobs.base.Job
+        :param parent: parent span, if not the current span
+        :type parent: ecsjobs.tracing.Span
+        :rtype: ecsjobs.tracing.Span
+        """
+        return tracing.span(name, parent=parent, attributes={
+            'ecsjobs.job.name': job.name,
+            'ecsjobs.job.class': job.__class__.__name__,
+            'ecsjobs.job.schedule': job.schedule_name
+        })
 
     def _run_jobs(self, jobs, force_run=False):
         """
@@ -103,43 +162,183 @@ class EcsJobsRunner(object):
         self._finished = []
         self._running = []
         self._run_exceptions = {}
+        self._timings = Timings()
+        self._reporter = Reporter(self._conf)
+        self._cloudwatch = None
+        if self._conf.get_global('cloudwatch_namespace') is not None:
+            self._cloudwatch = CloudWatchMetrics(
+                self._conf.get_global('cloudwatch_namespace'),
+                dimensions=self._conf.get_global('cloudwatch_dimensions')
+            )
         logger.info('Running %d jobs: %s', len(jobs), jobs)
         self._start_time = datetime.now()
         self._timeout = self._start_time + timedelta(
             seconds=self._conf.get_global('max_total_runtime_sec')
         )
+        try:
+            with self._timings.time('run.prefetch'):
+                self._prefetch_jobs(jobs, force_run=force_run)
+            with self._timings.time('run.launch'):
+                self._launch_jobs(jobs, force_run=force_run)
+            with self._timings.time('run.poll'):
+                self._poll_jobs()
+            if len(self._running) > 0:
+                with self._timings.time('run.terminate'):
+                    self._terminate_jobs()
+        finally:
+            self._cleanup_jobs(jobs)
+        try:
+            with self._timings.time('run.report'), tracing.span('report'):
+                self._report()
+            profiling.snapshot('report')
+        finally:
+            with self._timings.time('run.export_metrics'):
+                self._export_metrics()
+            self._log_timings()
+
+    def _launch_jobs(self, jobs, force_run=False):
+        """
+        Run each of the specified jobs in turn, unless its prefetch failed, it
+        should be skipped, or the run's time limit has been reached. Jobs that
+        finish are passed to :py:meth:`~._job_done`; jobs that are still
+        running are added to ``self._running``.
+
+        :param jobs: list of Job instances to run
+        :type jobs: list
+        :param force_run: Run each job regardless of cron expression
+        :type force_run: bool
+        """
         for j in jobs:
             logger.debug('now=%s timeout=%s', datetime.now(), self._timeout)
+            if j in self._run_exceptions:
+                logger.debug('Not running job %s; prefetch failed', j.name)
+                continue
             if datetime.now() >= self._timeout:
                 logger.error('Time limit reached; not running any more jobs!')
                 self._running.append(j)
                 continue
             if j.skip is not None and not force_run:
                 logger.debug('Skipping job %s: %s', j.name, j.skip)
-                self._finished.append(j)
+                self._job_done(j)
                 continue
             try:
                 logger.debug('Running job: %s', j)
-                res = j.run()
+                with job_context(j.name), self._job_span('job.run', j) as sp:
+                    res = j.run()
+                    if res is not None:
+                        sp.set_attribute('ecsjobs.job.exit_code', j.exitcode)
             except Exception as ex:
                 logger.error('Job %s failed to run:\n%s', j, j.error_repr,
                              exc_info=True)
                 self._run_exceptions[j] = (ex, format_exc())
-                self._finished.append(j)
+                self._job_done(j)
                 continue
             if res is None:
                 logger.info('Job %s still running; will poll for result', j)
                 self._running.append(j)
             else:
                 logger.info('Job %s finished (success=%s)', j, res)
-                self._finished.append(j)
-        self._poll_jobs()
-        self._report()
+                self._job_done(j)
+
+    def _job_done(self, job):
+        """
+        Handle a job reaching a terminal state: add it to ``self._finished``,
+        render it into the report, gather its CloudWatch metrics (if enabled),
+        and then release its output.
+
+        :param job: the finished Job
+        :type job: ecsjobs.jobs.base.Job
+        """
+        self._finished.append(job)
+        rec = self._reporter.add_job(
+            job, exc=self._run_exceptions.get(job, None)
+        )
+        if self._cloudwatch is not None:
+            self._cloudwatch.add_job(rec)
+        profiling.snapshot('job:%s' % job.name)
+        job.release_output()
+
+    def _prefetch_jobs(self, jobs, force_run=False):
+        """
+        Concurrently call :py:meth:`~ecsjobs.jobs.base.Job.prefetch` on every
+        job that will be run and needs it, waiting no longer than the run's
+        time limit. Jobs whose prefetch raises an exception or does not finish
+        in time are recorded in ``self._run_exceptions`` and added to
+        ``self._finished``, and will not be run. A prefetch that does not
+        finish in time is abandoned; its job's
+        :py:meth:`~ecsjobs.jobs.base.Job.cleanup` is called when it does.
+
+        :param jobs: list of Job instances that will be run
+        :type jobs: list
+        :param force_run: Run each job regardless of cron expression
+        :type force_run: bool
+        """
+        to_fetch = [
+            j for j in jobs
+            if j.needs_prefetch and (force_run or j.skip is None)
+        ]
+        if len(to_fetch) == 0:
+            return
+        workers = min(
+            len(to_fetch), self._conf.get_global('prefetch_concurrency')
+        )
+        logger.info('Prefetching for %d jobs with %d workers',
+                    len(to_fetch), workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = [
+                (j, executor.submit(
+                    self._prefetch_job, j, parent=tracing.current_span()
+                )) for j in to_fetch
+            ]
+            done = wait(
+                [f for _, f in futures],
+                timeout=max(0, (self._timeout - datetime.now()).total_seconds())
+            ).done
+            for j, f in futures:
+                if f in done:
+                    ex = f.exception()
+                    if ex is None:
+                        continue
+                    logger.error('Prefetch for job %s failed', j, exc_info=ex)
+                else:
+                    logger.error('Prefetch for job %s did not finish within '
+                                 'the time limit', j)
+                    f.add_done_callback(
+                        lambda _, job=j: self._cleanup_jobs([job])
+                    )
+                    ex = RuntimeError(
+                        'ERROR: Prefetch for job %s did not finish before '
+                        'max_total_runtime_sec was reached' % j.name
+                    )
+                self._run_exceptions[j] = (ex, ''.join(
+                    format_exception(type(ex), ex, ex.__traceback__)
+                ))
+                self._job_done(j)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        logger.info('Prefetch complete; %d failures', len(self._run_exceptions))
+
+    def _prefetch_job(self, job, parent=None):
+        """
+        Call :py:meth:`~ecsjobs.jobs.base.Job.prefetch` on a job, attributing
+        any AWS API calls it makes to the job.
+
+        :param job: the Job to prefetch for
+        :type job: ecsjobs.jobs.base.Job
+        :param parent: parent trace span (as prefetches run in other threads)
+        :type parent: ecsjobs.tracing.Span
+        """
+        with job_context(job.name), self._job_span(
+            'job.prefetch', job, parent=parent
+        ):
+            job.prefetch()
 
     def _poll_jobs(self):
         """
         Poll the jobs in ``self._running``; if they're finished, move the Job
-        to ``self._finished``.
+        to ``self._finished``. Jobs whose poll raises an exception are
+        recorded in ``self._run_exceptions`` and treated as finished.
         """
         sleep_sec = self._conf.get_global('inter_poll_sleep_sec')
         while len(self._running) > 0:
@@ -148,24 +347,118 @@ class EcsJobsRunner(object):
                 break
             logger.info('Polling %d running jobs...', len(self._running))
             for j in copy(self._running):
-                if j.poll():
+                try:
+                    with job_context(j.name), \
+                            self._job_span('job.poll', j) as sp:
+                        done = j.poll()
+                        if done:
+                            sp.set_attribute(
+                                'ecsjobs.job.exit_code', j.exitcode
+                            )
+                except Exception as ex:
+                    logger.error('Job %s failed while polling:\n%s', j,
+                                 j.error_repr, exc_info=True)
+                    self._run_exceptions[j] = (ex, format_exc())
+                    self._running.remove(j)
+                    self._job_done(j)
+                    continue
+                if done:
                     logger.info('Job %s finished', j)
                     self._running.remove(j)
-                    self._finished.append(j)
+                    self._job_done(j)
                 else:
                     logger.debug('Job %s still running', j)
             if len(self._running) > 0:
                 logger.debug('Sleeping %ss before next poll', sleep_sec)
-                sleep(sleep_sec)
+                with self._timings.time('run.poll_sleep'):
+                    sleep(sleep_sec)
+
+    def _terminate_jobs(self):
+        """
+        Call :py:meth:`~ecsjobs.jobs.base.Job.terminate` on each job still in
+        ``self._running`` once the run's time limit has been reached, so that
+        anything they started is stopped and cleaned up before the report.
+        """
+        for j in self._running:
+            try:
+                with job_context(j.name):
+                    j.terminate()
+            except Exception:
+                logger.error('Unable to terminate job %s', j, exc_info=True)
+
+    def _cleanup_jobs(self, jobs):
+        """
+        Call :py:meth:`~ecsjobs.jobs.base.Job.cleanup` on each job, so that
+        anything prefetched for jobs that were never run (such as temporary
+        scripts) is removed.
+
+        :param jobs: list of Job instances
+        :type jobs: list
+        """
+        for j in jobs:
+            try:
+                j.cleanup()
+            except Exception:
+                logger.error('Unable to clean up job %s', j, exc_info=True)
 
     def _report(self):
-        """Generate and send email report."""
-        Reporter(self._conf).run(
+        """
+        Generate and send email report, from the job fragments already
+        rendered by ``self._reporter`` plus any unfinished jobs.
+        """
+        self._reporter.run(
             self._finished, self._running, self._run_exceptions,
             self._start_time, datetime.now(),
-            only_email_if_problems=self._only_email_if_problems
+            only_email_if_problems=self._only_email_if_problems,
+            timings=self._conf.timings.records + self._timings.records,
+            api_calls=api_accounting.records
         )
 
+    def _log_timings(self):
+        """
+        Log the wall-clock and CPU time of each phase of configuration loading
+        and of this run, including phases (such as delivering the report)
+        that finished too late to be included in the report itself.
+        """
+        for t in self._conf.timings.records + self._timings.records:
+            logger.info(
+                'Phase %s: %.3fs wall, %.3fs CPU (%d call(s))',
+                t['name'], t['wall_sec'], t['cpu_sec'], t['count']
+            )
+
+    def _export_metrics(self):
+        """
+        Export metrics for this run. If the ``prometheus_textfile_path`` or
+        ``prometheus_pushgateway_url`` global settings are set, export them
+        via :py:class:`~ecsjobs.metrics.PrometheusExporter`. If
+        ``cloudwatch_namespace`` is set, gather datapoints for any jobs that
+        did not finish and send all datapoints via
+        :py:class:`~ecsjobs.metrics.CloudWatchMetrics`. Failures are logged,
+        but otherwise ignored.
+        """
+        end_dt = datetime.now()
+        textfile = self._conf.get_global('prometheus_textfile_path')
+        pushgw = self._conf.get_global('prometheus_pushgateway_url')
+        if textfile is not None or pushgw is not None:
+            try:
+                PrometheusExporter(
+                    textfile_path=textfile, pushgateway_url=pushgw,
+                    pushgateway_job=self._conf.get_global(
+                        'prometheus_pushgateway_job'
+                    )
+                ).export(self._reporter.records, self._start_time, end_dt)
+            except Exception:
+                logger.error('Unable to export Prometheus metrics',
+                             exc_info=True)
+        if self._cloudwatch is None:
+            return
+        try:
+            for rec in self._reporter.records[self._cloudwatch.num_jobs:]:
+                self._cloudwatch.add_job(rec, default_dt=end_dt)
+            self._cloudwatch.flush(self._start_time, end_dt)
+        except Exception:
+            logger.error('Unable to send CloudWatch metrics', exc_info=True)
+
 
 def parse_args(argv):
     actions = ['validate', 'run', 'list-schedules']
@@ -183,6 +476,19 @@ def parse_args(argv):
     p.add_argument('-j', '--job', action='append', dest='jobs', default=[],
                    help='Job names to run, regardless of specified schedules '
                         'or cron expressions.')
+    p.add_argument('--profile', action='store', dest='profile', default=None,
+                   metavar='PATH',
+                   help='Run under cProfile; write pstats data to PATH and '
+                        'a summary of the top functions to PATH.txt')
+    p.add_argument('--tracemalloc', action='store', dest='tracemalloc',
+                   default=None, metavar='PATH',
+                   help='Trace memory allocations; write a summary of '
+                        'snapshots taken at start, after config load, after '
+                        'each job and after reporting to PATH')
+    p.add_argument('--profile-top', action='store', dest='profile_top',
+                   type=int, default=25,
+                   help='Number of entries in --profile and --tracemalloc '
+                        'summaries (default: 25)')
     p.add_argument('SCHEDULES', action='store', nargs='*',
                    help='Schedule names to run; one or more.')
     args = p.parse_args(argv)
@@ -252,22 +558,36 @@ def main(argv=None):
     elif args.verbose == 1:
         set_log_info(logger)
 
-    conf = Config()
-    if args.ACTION == 'validate':
-        # this was done when loading the config
-        raise SystemExit(0)
-    if args.ACTION == 'list-schedules':
-        for s in conf.schedule_names:
-            print(s)
-        raise SystemExit(0)
-    if len(args.SCHEDULES) > 0:
-        EcsJobsRunner(
-            conf, only_email_if_problems=args.only_email_if_problems
-        ).run_schedules(args.SCHEDULES)
-    else:
-        EcsJobsRunner(
-            conf, only_email_if_problems=args.only_email_if_problems
-        ).run_job_names(args.jobs)
+    profiling.start(
+        profile_path=args.profile, tracemalloc_path=args.tracemalloc,
+        top=args.profile_top
+    )
+    try:
+        api_accounting.install()
+        rate_limiter.install()
+        conf = Config()
+        profiling.snapshot('config.load')
+        api_accounting.budgets = conf.get_global('aws_api_budgets')
+        configure_clients(conf.get_global('aws_clients'))
+        rate_limiter.limits = conf.get_global('aws_rate_limits')
+        tracing.configure(conf)
+        if args.ACTION == 'validate':
+            # this was done when loading the config
+            raise SystemExit(0)
+        if args.ACTION == 'list-schedules':
+            for s in conf.schedule_names:
+                print(s)
+            raise SystemExit(0)
+        if len(args.SCHEDULES) > 0:
+            EcsJobsRunner(
+                conf, only_email_if_problems=args.only_email_if_problems
+            ).run_schedules(args.SCHEDULES)
+        else:
+            EcsJobsRunner(
+                conf, only_email_if_problems=args.only_email_if_problems
+            ).run_job_names(args.jobs)
+    finally:
+        profiling.stop()
 
 
 if __name__ == "__main__":
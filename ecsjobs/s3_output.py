@@ -0,0 +1,228 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import re
+import gzip
+import logging
+from io import TextIOWrapper
+
+from ecsjobs import aws
+
+logger = logging.getLogger(__name__)
+
+
+class S3OutputStore(object):
+    """
+    Stores the full output of each job in S3, as a gzip-compressed object
+    under a run-scoped key prefix, so that the email report can link to it
+    instead of including it inline.
+
+    Output is compressed as it is uploaded, a part at a time, using S3
+    multipart upload; outputs that compress to less than a single part are
+    uploaded with a single ``PutObject``.
+    """
+
+    #: Size of each part of a multipart upload, in bytes. S3 requires all
+    #: parts but the last to be at least 5 MiB.
+    PART_SIZE_BYTES = 8 * 1024 * 1024
+
+    #: Number of characters of output to encode and compress at a time.
+    CHUNK_CHARS = 65536
+
+    def __init__(self, bucket, prefix, presign_sec=604800):
+        """
+        :param bucket: name of the S3 bucket to store output in
+        :type bucket: str
+        :param prefix: key prefix for this run's output
+        :type prefix: str
+        :param presign_sec: lifetime in seconds of presigned URLs to link to
+          output objects; if 0 or None, no URLs are generated
+        :type presign_sec: int
+        """
+        self._bucket = bucket
+        self._prefix = prefix
+        self._presign_sec = presign_sec
+        self._s3 = None
+
+    @property
+    def client(self):
+        """
+        Return the S3 client, creating it if necessary.
+
+        :return: boto3 S3 client
+        :rtype: ``botocore.client.S3``
+        """
+        if self._s3 is None:
+            self._s3 = aws.client('s3')
+        return self._s3
+
+    def key_for(self, name):
+        """
+        Return the S3 key to store output for the given job name at.
+
+        :param name: job name
+        :type name: str
+        :return: S3 key
+        :rtype: str
+        """
+        return '%s%s.txt.gz' % (
+            self._prefix, re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        )
+
+    def upload(self, name, output):
+        """
+        Compress and upload the output of a job.
+
+        :param name: job name
+        :type name: str
+        :param output: job output
+        :type output: str
+        :return: 2-tuple of the ``s3://`` URI of the uploaded object and a
+          presigned HTTPS URL for it (or None, if presigning is disabled)
+        :rtype: tuple
+        """
+        key = self.key_for(name)
+        writer = _MultipartWriter(
+            self.client, self._bucket, key, self.PART_SIZE_BYTES
+        )
+        gz = gzip.GzipFile(
+            filename=key.split('/')[-1][:-3], fileobj=writer, mode='wb'
+        )
+        try:
+            txt = TextIOWrapper(gz, encoding='utf-8')
+            for i in range(0, len(output), self.CHUNK_CHARS):
+                txt.write(output[i:i + self.CHUNK_CHARS])
+            txt.flush()
+            txt.detach()
+            gz.close()
+            writer.close()
+        except Exception:
+            writer.abort()
+            gz.close()
+            raise
+        uri = 's3://%s/%s' % (self._bucket, key)
+        logger.info('Uploaded %d characters of output for %s to %s',
+                    len(output), name, uri)
+        if not self._presign_sec:
+            return uri, None
+        url = self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self._bucket, 'Key': key},
+            ExpiresIn=self._presign_sec
+        )
+        return uri, url
+
+
+class _MultipartWriter(object):
+    """
+    Minimal binary file-like object that uploads everything written to it to
+    a single S3 object, using multipart upload once more than one part has
+    been written.
+    """
+
+    def __init__(self, client, bucket, key, part_size):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._buf = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._aborted = False
+
+    def write(self, data):
+        if self._aborted:
+            return len(data)
+        self._buf += data
+        while len(self._buf) >= self._part_size:
+            self._upload_part(self._part_size)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, size=None):
+        if size is None:
+            size = len(self._buf)
+        if self._upload_id is None:
+            self._upload_id = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key, ContentType='text/plain',
+                ContentEncoding='gzip'
+            )['UploadId']
+        num = len(self._parts) + 1
+        resp = self._client.upload_part(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            PartNumber=num, Body=bytes(self._buf[:size])
+        )
+        self._parts.append({'ETag': resp['ETag'], 'PartNumber': num})
+        del self._buf[:size]
+
+    def close(self):
+        """
+        Upload any remaining data and complete the upload.
+        """
+        if self._upload_id is None:
+            self._client.put_object(
+                Bucket=self._bucket, Key=self._key, Body=bytes(self._buf),
+                ContentType='text/plain', ContentEncoding='gzip'
+            )
+            self._buf = bytearray()
+            return
+        if len(self._buf) > 0:
+            self._upload_part()
+        self._client.complete_multipart_upload(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts}
+        )
+
+    def abort(self):
+        """
+        Abort the multipart upload, if one was started, and discard anything
+        written afterwards.
+        """
+        self._aborted = True
+        self._buf = bytearray()
+        if self._upload_id is None:
+            return
+        try:
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=self._upload_id
+            )
+        except Exception:
+            logger.error('Unable to abort multipart upload %s of s3://%s/%s',
+                         self._upload_id, self._bucket, self._key,
+                         exc_info=True)
@@ -91,7 +91,158 @@ class Schema(object):
                     'max_total_runtime_sec': {'type': 'integer'},
                     'email_subject': {'type': 'string'},
                     'failure_html_path': {'type': 'string'},
-                    'failure_command': {'type': 'array'}
+                    'failure_command': {'type': 'array'},
+                    'script_cache_dir': {'type': 'string'},
+                    'script_cache_max_bytes': {'type': 'integer'},
+                    'script_fetch_timeout_sec': {
+                        'type': 'number', 'minimum': 0, 'exclusiveMinimum': True
+                    },
+                    'prefetch_concurrency': {'type': 'integer', 'minimum': 1},
+                    'report_inline_output_chars': {
+                        'type': 'integer', 'minimum': 2
+                    },
+                    'report_inline_total_chars': {
+                        'type': 'integer', 'minimum': 0
+                    },
+                    'email_max_bytes': {'type': 'integer', 'minimum': 1},
+                    'output_s3_bucket': {'type': 'string'},
+                    'output_s3_prefix': {'type': 'string'},
+                    'output_s3_presign_sec': {
+                        'type': 'integer', 'minimum': 0, 'maximum': 604800
+                    },
+                    'report_sinks': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'required': ['type'],
+                            'properties': {
+                                'type': {
+                                    'enum': [
+                                        'ses', 'file', 's3', 'webhook', 'json',
+                                        'command'
+                                    ]
+                                },
+                                'timeout_sec': {
+                                    'type': 'integer', 'minimum': 1
+                                },
+                                'retries': {'type': 'integer', 'minimum': 0},
+                                'retry_delay_sec': {
+                                    'type': 'number', 'minimum': 0
+                                },
+                                'path': {'type': 'string'},
+                                'bucket': {'type': 'string'},
+                                'key': {'type': 'string'},
+                                'url': {'type': 'string'},
+                                'headers': {'type': 'object'},
+                                'include_html': {'type': 'boolean'},
+                                'command': {'type': 'array'},
+                                'format': {'enum': ['json', 'jsonl']}
+                            },
+                            'additionalProperties': False,
+                            'oneOf': [
+                                {'properties': {'type': {'enum': ['ses']}}},
+                                {
+                                    'properties': {
+                                        'type': {'enum': ['file']}
+                                    },
+                                    'required': ['path']
+                                },
+                                {
+                                    'properties': {'type': {'enum': ['s3']}},
+                                    'required': ['bucket']
+                                },
+                                {
+                                    'properties': {
+                                        'type': {'enum': ['webhook']}
+                                    },
+                                    'required': ['url']
+                                },
+                                {'properties': {'type': {'enum': ['json']}}},
+                                {
+                                    'properties': {
+                                        'type': {'enum': ['command']}
+                                    },
+                                    'required': ['command']
+                                }
+                            ]
+                        }
+                    },
+                    'run_result_path': {'type': 'string'},
+                    'run_result_format': {'enum': ['json', 'jsonl']},
+                    'prometheus_textfile_path': {'type': 'string'},
+                    'prometheus_pushgateway_url': {'type': 'string'},
+                    'prometheus_pushgateway_job': {'type': 'string'},
+                    'cloudwatch_namespace': {'type': 'string'},
+                    'cloudwatch_dimensions': {
+                        'type': 'object',
+                        'additionalProperties': {'type': 'string'},
+                        'maxProperties': 26
+                    },
+                    'aws_api_budgets': {
+                        'type': 'object',
+                        'patternProperties': {
+                            '^[a-z0-9-]+:([A-Za-z0-9]+|\\*)$': {
+                                'type': 'integer', 'minimum': 0
+                            }
+                        },
+                        'additionalProperties': False
+                    },
+                    'aws_clients': {
+                        'type': 'object',
+                        'patternProperties': {
+                            '^[a-z0-9-]+$': {
+                                'type': 'object',
+                                'properties': {
+                                    'endpoint_url': {'type': 'string'},
+                                    'region_name': {'type': 'string'},
+                                    'connect_timeout': {
+                                        'type': 'number', 'minimum': 0
+                                    },
+                                    'read_timeout': {
+                                        'type': 'number', 'minimum': 0
+                                    },
+                                    'retry_mode': {
+                                        'type': 'string',
+                                        'enum': [
+                                            'legacy', 'standard', 'adaptive'
+                                        ]
+                                    },
+                                    'max_attempts': {
+                                        'type': 'integer', 'minimum': 1
+                                    },
+                                    'max_pool_connections': {
+                                        'type': 'integer', 'minimum': 1
+                                    }
+                                },
+                                'additionalProperties': False
+                            }
+                        },
+                        'additionalProperties': False
+                    },
+                    'aws_rate_limits': {
+                        'type': 'object',
+                        'patternProperties': {
+                            '^[a-z0-9-]+:([A-Za-z0-9]+|\\*)$': {
+                                'type': 'object',
+                                'properties': {
+                                    'rate': {
+                                        'type': 'number', 'minimum': 0,
+                                        'exclusiveMinimum': True
+                                    },
+                                    'burst': {'type': 'integer', 'minimum': 1}
+                                },
+                                'required': ['rate'],
+                                'additionalProperties': False
+                            }
+                        },
+                        'additionalProperties': False
+                    },
+                    'trace_file_path': {'type': 'string'},
+                    'trace_otlp_url': {'type': 'string'},
+                    'trace_otlp_headers': {
+                        'type': 'object',
+                        'additionalProperties': {'type': 'string'}
+                    }
                 }
             }
         }
@@ -0,0 +1,402 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import hashlib
+import threading
+from contextlib import contextmanager
+from stat import S_IRUSR, S_IWUSR, S_IXUSR
+from tempfile import mkstemp
+
+import requests
+from botocore.exceptions import ClientError
+
+from ecsjobs import aws
+
+logger = logging.getLogger(__name__)
+
+
+class ScriptCache(object):
+    """
+    Persistent, content-addressed cache of scripts downloaded for
+    :py:class:`~ecsjobs.jobs.local_command.LocalCommand` ``script_source``.
+
+    Scripts are stored in ``cache_dir`` as executable files named by the
+    SHA-256 of their content. An index (``index.json``) maps each source URL to
+    the hash of its most recent content, along with the ``ETag`` and
+    ``Last-Modified`` values used to revalidate it. Cached content is
+    revalidated with a conditional request on each :py:meth:`~.get`, unless
+    an expected hash is given and the cached content already matches it. When
+    the total size of cached scripts exceeds ``max_bytes``, the least recently
+    used scripts are evicted, except for those pinned by a running process.
+    Each :py:meth:`~.get` pins the returned script until it is passed to
+    :py:meth:`~.release`, so that scripts prefetched for a run are not evicted
+    before they are executed.
+
+    The cache directory may be shared by several ecsjobs processes. The index
+    is re-read and updated while holding an exclusive ``flock`` on a lock file
+    in the cache directory, and written atomically via rename, so concurrent
+    updates are not lost.
+    """
+
+    #: Name of the index file within the cache directory.
+    INDEX_NAME = 'index.json'
+
+    #: Name of the lock file within the cache directory.
+    LOCK_NAME = '.lock'
+
+    def __init__(self, cache_dir, max_bytes=104857600, timeout=60):
+        """
+        :param cache_dir: directory to store cached scripts in; will be created
+          if it does not exist
+        :type cache_dir: str
+        :param max_bytes: maximum total size of cached scripts, in bytes
+        :type max_bytes: int
+        :param timeout: connect and read timeout, in seconds, for HTTP(S)
+          requests
+        :type timeout: float
+        """
+        self._dir = cache_dir
+        self._max_bytes = max_bytes
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+        self._s3 = None
+        # URL to number of unreleased get() calls in this process
+        self._refs = {}
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, self.INDEX_NAME)
+        self._lock_path = os.path.join(cache_dir, self.LOCK_NAME)
+        self._index = self._load_index()
+
+    @contextmanager
+    def _locked(self):
+        """
+        Context manager to hold the in-process lock and an exclusive ``flock``
+        on the cache's lock file, with ``self._index`` reloaded from disk to
+        include changes made by other processes.
+        """
+        with self._lock:
+            with open(self._lock_path, 'a') as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    self._index = self._load_index()
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _load_index(self):
+        """
+        Load the cache index from disk, dropping any entries whose content is
+        no longer present.
+
+        :return: cache index; dict of URL to dict of entry information
+        :rtype: dict
+        """
+        if not os.path.exists(self._index_path):
+            return {}
+        try:
+            with open(self._index_path, 'r') as fh:
+                index = json.load(fh)
+        except Exception:
+            logger.warning('Unable to read script cache index %s; starting '
+                           'with an empty cache', self._index_path,
+                           exc_info=True)
+            return {}
+        return {
+            url: entry for url, entry in index.items()
+            if os.path.exists(self._path_for(entry['sha256']))
+        }
+
+    def _save_index(self):
+        """
+        Atomically write the cache index to disk.
+        """
+        fd, tmp = mkstemp(prefix='.index-', dir=self._dir)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(self._index, fh, sort_keys=True, indent=1)
+        os.replace(tmp, self._index_path)
+
+    def _path_for(self, sha256):
+        """
+        Return the cache path for content with the given hash.
+
+        :param sha256: hex SHA-256 of the content
+        :type sha256: str
+        :rtype: str
+        """
+        return os.path.join(self._dir, sha256)
+
+    def get(self, url, sha256=None):
+        """
+        Return the path to an executable, cached copy of the script at
+        ``url``, downloading or revalidating it as needed.
+
+        :param url: URL of the script; ``s3://``, ``http://`` or ``https://``
+        :type url: str
+        :param sha256: if specified, the expected hex SHA-256 of the script
+          content. Cached content matching this hash is used without any
+          network request; downloaded content that doesn't match raises an
+          exception.
+        :type sha256: str
+        :return: path to the executable cached script
+        :rtype: str
+        :raises: RuntimeError
+        """
+        if sha256 is not None:
+            sha256 = sha256.lower()
+        with self._locked():
+            entry = self._index.get(url)
+        if entry is not None and sha256 is not None and \
+                entry['sha256'] == sha256:
+            logger.debug('Using pinned cached script for %s: %s', url,
+                         entry['sha256'])
+            return self._touch(url, entry)
+        if url.startswith('s3://'):
+            content, validators = self._fetch_s3(url, entry)
+        elif url.startswith('http'):
+            content, validators = self._fetch_http(url, entry)
+        else:
+            raise RuntimeError('Error: unsupported URL scheme: %s' % url)
+        if content is None:
+            logger.debug('Cached script for %s is current: %s', url,
+                         entry['sha256'])
+            if sha256 is not None:
+                raise RuntimeError(
+                    'ERROR: script from %s has SHA-256 %s; expected %s' % (
+                        url, entry['sha256'], sha256
+                    )
+                )
+            return self._touch(url, entry)
+        digest = hashlib.sha256(content).hexdigest()
+        if sha256 is not None and digest != sha256:
+            raise RuntimeError(
+                'ERROR: script from %s has SHA-256 %s; expected %s' % (
+                    url, digest, sha256
+                )
+            )
+        path = self._store(digest, content)
+        entry = {
+            'sha256': digest,
+            'size': len(content),
+            'etag': validators.get('etag'),
+            'last_modified': validators.get('last_modified')
+        }
+        logger.info('Cached script for %s as %s', url, path)
+        res = self._touch(url, entry)
+        self._evict()
+        return res
+
+    def release(self, url):
+        """
+        Release the pin on the script for ``url`` taken by a previous
+        :py:meth:`~.get`, once it is no longer needed, and evict scripts that
+        are no longer pinned if the cache is over its size limit.
+
+        :param url: URL of the script, as passed to :py:meth:`~.get`
+        :type url: str
+        """
+        with self._locked():
+            if self._refs.get(url, 0) == 0:
+                return
+            self._refs[url] -= 1
+            if self._refs[url] > 0:
+                return
+            del self._refs[url]
+            entry = self._index.get(url)
+            if entry is not None and os.getpid() in entry.get('pins', []):
+                entry['pins'].remove(os.getpid())
+                self._save_index()
+        self._evict()
+
+    def _touch(self, url, entry):
+        """
+        Update the last-access time of a cache entry, pin it for this process
+        and persist the index.
+
+        :param url: URL of the entry
+        :type url: str
+        :param entry: the index entry
+        :type entry: dict
+        :return: path to the cached content
+        :rtype: str
+        """
+        with self._locked():
+            entry['atime'] = time.time()
+            pins = set(self._index.get(url, {}).get('pins', []))
+            pins.add(os.getpid())
+            entry['pins'] = sorted(pins)
+            self._index[url] = entry
+            self._refs[url] = self._refs.get(url, 0) + 1
+            self._save_index()
+        return self._path_for(entry['sha256'])
+
+    @staticmethod
+    def _pid_alive(pid):
+        """
+        Return whether or not a process with the given PID exists.
+
+        :param pid: process ID
+        :type pid: int
+        :rtype: bool
+        """
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    def _store(self, digest, content):
+        """
+        Write content to its content-addressed path, if not already present,
+        and make it executable.
+
+        :param digest: hex SHA-256 of the content
+        :type digest: str
+        :param content: script content
+        :type content: bytes
+        :return: path to the stored content
+        :rtype: str
+        """
+        path = self._path_for(digest)
+        if os.path.exists(path):
+            return path
+        fd, tmp = mkstemp(prefix='.tmp-', dir=self._dir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(content)
+        os.chmod(tmp, S_IRUSR | S_IWUSR | S_IXUSR)
+        os.replace(tmp, path)
+        return path
+
+    def _evict(self):
+        """
+        Remove least-recently-used content until the total size of cached
+        content is no more than ``self._max_bytes``. Entries pinned by a
+        running process (see :py:meth:`~.release`) are never evicted.
+        """
+        with self._locked():
+            sizes = {}
+            for url, entry in self._index.items():
+                sizes[entry['sha256']] = entry['size']
+            total = sum(sizes.values())
+            by_atime = sorted(
+                self._index.items(), key=lambda x: x[1]['atime']
+            )
+            for url, entry in by_atime:
+                if total <= self._max_bytes:
+                    break
+                if any(self._pid_alive(p) for p in entry.get('pins', [])):
+                    continue
+                del self._index[url]
+                digest = entry['sha256']
+                if any(
+                    e['sha256'] == digest for e in self._index.values()
+                ):
+                    continue
+                logger.debug('Evicting cached script %s (%s)', digest, url)
+                try:
+                    os.unlink(self._path_for(digest))
+                except OSError:
+                    logger.warning('Unable to remove cached script %s',
+                                   digest, exc_info=True)
+                total -= sizes[digest]
+            self._save_index()
+
+    def _fetch_http(self, url, entry):
+        """
+        Retrieve a script over HTTP/HTTPS, using a conditional request if a
+        cached copy exists.
+
+        :param url: URL to retrieve
+        :type url: str
+        :param entry: existing cache index entry for the URL, or None
+        :type entry: ``dict`` or ``None``
+        :return: 2-tuple of the content (or None if the cached copy is
+          current) and a dict of cache validators
+        :rtype: tuple
+        """
+        headers = {}
+        if entry is not None:
+            if entry.get('etag') is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified') is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        logger.debug('Retrieving script from %s (headers=%s)', url, headers)
+        r = self._session.get(url, headers=headers, timeout=self._timeout)
+        if r.status_code == 304 and entry is not None:
+            return None, {}
+        r.raise_for_status()
+        return r.content, {
+            'etag': r.headers.get('ETag'),
+            'last_modified': r.headers.get('Last-Modified')
+        }
+
+    def _fetch_s3(self, url, entry):
+        """
+        Retrieve a script from S3, using a conditional request if a cached
+        copy exists.
+
+        :param url: ``s3://`` URL to retrieve
+        :type url: str
+        :param entry: existing cache index entry for the URL, or None
+        :type entry: ``dict`` or ``None``
+        :return: 2-tuple of the content (or None if the cached copy is
+          current) and a dict of cache validators
+        :rtype: tuple
+        """
+        bkt, key = url[5:].split('/', 1)
+        kwargs = {'Bucket': bkt, 'Key': key}
+        if entry is not None and entry.get('etag') is not None:
+            kwargs['IfNoneMatch'] = entry['etag']
+        if self._s3 is None:
+            self._s3 = aws.client('s3')
+        logger.debug('Retrieving script from S3: %s', kwargs)
+        try:
+            resp = self._s3.get_object(**kwargs)
+        except ClientError as ex:
+            if entry is not None and ex.response.get(
+                'Error', {}
+            ).get('Code') in ['304', 'NotModified']:
+                return None, {}
+            raise
+        return resp['Body'].read(), {'etag': resp.get('ETag')}
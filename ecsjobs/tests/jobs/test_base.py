@@ -133,6 +133,10 @@ class TestBaseJob(object):
     def test_name(self):
         assert self.cls.name == 'jname'
 
+    def test_prefetch(self):
+        assert self.cls.needs_prefetch is False
+        assert self.cls.prefetch() is None
+
     def test_skip(self):
         assert self.cls.skip is None
 
@@ -176,6 +180,14 @@ class TestBaseJob(object):
         self.cls._finish_time = self.cls._start_time + td
         assert self.cls.duration == td
 
+    def test_start_finish_time(self):
+        assert self.cls.start_time is None
+        assert self.cls.finish_time is None
+        self.cls._start_time = datetime(2017, 11, 23, 14, 52, 34)
+        self.cls._finish_time = datetime(2017, 11, 23, 14, 53, 34)
+        assert self.cls.start_time == datetime(2017, 11, 23, 14, 52, 34)
+        assert self.cls.finish_time == datetime(2017, 11, 23, 14, 53, 34)
+
     def test_error_repr(self):
         self.cls._started = True
         self.cls._output = 'foobar'
@@ -41,6 +41,7 @@ from datetime import datetime
 from freezegun import freeze_time
 import pytest
 from ecsjobs.jobs.docker_exec_mixin import DockerExecMixin
+from ecsjobs.timing import Timings
 
 pbm = 'ecsjobs.jobs.docker_exec_mixin'
 pb = '%s.DockerExecMixin' % pbm
@@ -55,6 +56,7 @@ class TestDockerExecMixin(object):
         type(self.m_container).short_id = PropertyMock(return_value='cid')
         type(self.m_container).id = PropertyMock(return_value='longcid')
         self.cls._docker = self.m_docker
+        self.cls._timings = Timings()
 
     def test_defaults(self):
         self.frozen = None
@@ -107,6 +109,10 @@ class TestDockerExecMixin(object):
             call().api.exec_start('execid', tty=False),
             call().api.exec_inspect('execid')
         ]
+        assert [t['name'] for t in self.cls._timings.records] == [
+            'docker_connect', 'container_get', 'exec_create', 'exec_start',
+            'exec_inspect'
+        ]
 
     def test_non_defaults(self):
         self.frozen = None
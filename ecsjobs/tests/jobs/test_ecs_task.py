@@ -38,7 +38,7 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 from unittest.mock import patch, call, Mock
 from freezegun import freeze_time
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from ecsjobs.jobs.ecs_task import EcsTask
 
@@ -117,6 +117,102 @@ class TestEcsTask(object):
         self.cls._overrides = {'foo': 'bar'}
         assert self.cls.report_description() == 'famname (with overrides)'
 
+    def test_run_task_failure(self):
+        self.cls._ecs = self.mock_ecs
+        self.mock_ecs.run_task.return_value = {
+            'tasks': [],
+            'failures': [{'arn': 'arn::ci/x', 'reason': 'ATTRIBUTE'}]
+        }
+        with pytest.raises(RuntimeError) as exc:
+            self.cls._run_task()
+        assert str(exc.value) == 'ERROR: RunTask for job jname failed: ' \
+                                 'ATTRIBUTE (arn::ci/x)'
+        assert self.cls._task_arn is None
+
+    def test_run_task_capacity(self):
+        self.cls._ecs = self.mock_ecs
+        self.cls._log_sources = {}
+        capacity = {
+            'tasks': [],
+            'failures': [
+                {'arn': 'arn::ci/x', 'reason': 'RESOURCE:MEMORY'},
+                {'arn': 'arn::ci/y', 'reason': 'AGENT'}
+            ]
+        }
+        self.mock_ecs.run_task.side_effect = [
+            capacity, capacity, {'tasks': [{'taskArn': 'tarn'}]}
+        ]
+        with freeze_time('2017-10-20 12:30:00') as frozen:
+            self.cls._started = True
+            self.cls._start_time = datetime.now()
+            self.cls._run_task()
+            assert self.cls._task_arn is None
+            assert self.cls.capacity_wait_sec == 0.0
+            frozen.tick(timedelta(seconds=4))
+            assert self.cls.poll() is False
+            assert len(self.mock_ecs.run_task.mock_calls) == 1
+            assert self.cls.capacity_wait_sec == 4.0
+            frozen.tick(timedelta(seconds=1))
+            assert self.cls.poll() is False
+            assert len(self.mock_ecs.run_task.mock_calls) == 2
+            frozen.tick(timedelta(seconds=9))
+            assert self.cls.poll() is False
+            assert len(self.mock_ecs.run_task.mock_calls) == 2
+            frozen.tick(timedelta(seconds=1))
+            assert self.cls.poll() is False
+            assert len(self.mock_ecs.run_task.mock_calls) == 3
+            assert self.cls._task_arn == 'tarn'
+            assert self.cls.capacity_wait_sec == 15.0
+            assert self.cls.start_time == datetime(2017, 10, 20, 12, 30, 15)
+            frozen.tick(timedelta(seconds=60))
+            assert self.cls.capacity_wait_sec == 15.0
+        assert self.mock_ecs.describe_tasks.mock_calls == []
+        waits = [
+            t for t in self.cls.timings.records if t['name'] == 'capacity_wait'
+        ]
+        assert waits == [{
+            'name': 'capacity_wait', 'start_time': '2017-10-20T12:30:00',
+            'wall_sec': 15.0, 'cpu_sec': 0.0, 'count': 1
+        }]
+
+    def test_run_task_capacity_then_failure(self):
+        self.cls._ecs = self.mock_ecs
+        self.mock_ecs.run_task.side_effect = [
+            {'tasks': [], 'failures': [{'reason': 'RESOURCE:MEMORY'}]},
+            {'tasks': [], 'failures': [{'reason': 'MISSING'}]}
+        ]
+        with freeze_time('2017-10-20 12:30:00') as frozen:
+            self.cls._started = True
+            self.cls._start_time = datetime.now()
+            self.cls._run_task()
+            frozen.tick(timedelta(seconds=5))
+            with pytest.raises(RuntimeError) as exc:
+                self.cls.poll()
+        assert str(exc.value) == 'ERROR: RunTask for job jname failed: ' \
+                                 'MISSING'
+        assert self.cls.is_finished is True
+        assert self.cls.finish_time == datetime(2017, 10, 20, 12, 30, 5)
+        assert self.cls.capacity_wait_sec == 5.0
+        assert self.cls._task_arn is None
+        assert self.mock_ecs.describe_tasks.mock_calls == []
+
+    def test_capacity_backoff_max(self):
+        failures = [{'reason': 'RESOURCE:CPU'}]
+        backoffs = []
+        for _ in range(8):
+            self.cls._capacity_queued(failures)
+            backoffs.append(self.cls._capacity_backoff)
+        assert backoffs == [5, 10, 20, 40, 80, 120, 120, 120]
+
+    def test_is_capacity_failure(self):
+        assert EcsTask._is_capacity_failure([]) is False
+        assert EcsTask._is_capacity_failure([
+            {'reason': 'RESOURCE:PORTS'}, {'reason': 'AGENT'}
+        ]) is True
+        assert EcsTask._is_capacity_failure([
+            {'reason': 'RESOURCE:MEMORY'}, {'reason': 'MISSING'}
+        ]) is False
+
     def test_log_info_for_task(self):
         self.cls._ecs = self.mock_ecs
         self.mock_ecs.describe_task_definition.return_value = {
@@ -184,7 +280,7 @@ class TestEcsTask(object):
                 return self.mock_ecs
             return self.mock_cw
 
-        with patch('%s.boto3' % pbm) as m_boto:
+        with patch('%s.aws' % pbm) as m_boto:
             m_boto.client.side_effect = se_client
             with patch('%s._log_info_for_task' % pb, autospec=True) as m_lift:
                 m_lift.return_value = {'c1': ('g1', 'p1'), 'c2': ('g2', 'p2')}
@@ -197,6 +293,9 @@ class TestEcsTask(object):
         assert self.cls._start_time == datetime(2017, 10, 20, 12, 30, 00)
         assert self.cls._finished is False
         assert self.cls._task_arn == 'tarn'
+        assert [t['name'] for t in self.cls.timings.records] == [
+            '_log_info_for_task', 'run_task'
+        ]
         assert m_boto.mock_calls == [
             call.client('ecs'),
             call.client('logs')
@@ -230,7 +329,7 @@ class TestEcsTask(object):
                 return self.mock_ecs
             return self.mock_cw
 
-        with patch('%s.boto3' % pbm) as m_boto:
+        with patch('%s.aws' % pbm) as m_boto:
             m_boto.client.side_effect = se_client
             with patch('%s._log_info_for_task' % pb, autospec=True) as m_lift:
                 m_lift.return_value = {'c1': ('g1', 'p1'), 'c2': ('g2', 'p2')}
@@ -479,6 +578,100 @@ class TestEcsTask(object):
         ]
         assert m_oftc.mock_calls == []
 
+    @freeze_time(datetime(2017, 10, 20, 12, 30, 00))
+    def test_poll_lifecycle(self):
+        self.cls._task_arn = 'arn::task/task-id'
+        self.cls._log_sources = {}
+        self.cls._ecs = self.mock_ecs
+        assert self.cls.lifecycle is None
+        task = {
+            'taskArn': self.cls._task_arn,
+            'lastStatus': 'RUNNING',
+            'createdAt': datetime(2017, 10, 20, 12, 28, 0, tzinfo=timezone.utc),
+            'pullStartedAt': datetime(
+                2017, 10, 20, 12, 28, 30, tzinfo=timezone.utc
+            ),
+            'pullStoppedAt': datetime(
+                2017, 10, 20, 12, 28, 45, 500000, tzinfo=timezone.utc
+            ),
+            'startedAt': datetime(
+                2017, 10, 20, 12, 28, 50, tzinfo=timezone.utc
+            ),
+            'containers': [
+                {
+                    'containerArn': 'arn:container/cont_id',
+                    'name': 'contname',
+                    'lastStatus': 'RUNNING'
+                }
+            ]
+        }
+        self.mock_ecs.describe_tasks.return_value = {'tasks': [task]}
+        assert self.cls.poll() is False
+        res = self.cls.lifecycle
+        assert res == {
+            'placement_delay_sec': 30.0,
+            'image_pull_sec': 15.5,
+            'run_sec': None,
+            'stop_detection_sec': None,
+            'tasks': [{
+                'task_arn': 'arn::task/task-id',
+                'created_at': '2017-10-20T12:28:00+00:00',
+                'pull_started_at': '2017-10-20T12:28:30+00:00',
+                'pull_stopped_at': '2017-10-20T12:28:45.500000+00:00',
+                'started_at': '2017-10-20T12:28:50+00:00',
+                'stopping_at': None,
+                'stopped_at': None,
+                'observed_stopped_at': None,
+                'stopped_reason': None,
+                'placement_delay_sec': 30.0,
+                'image_pull_sec': 15.5,
+                'run_sec': None,
+                'stop_detection_sec': None
+            }]
+        }
+        task = dict(task)
+        task.update({
+            'lastStatus': 'STOPPED',
+            'stoppingAt': datetime(
+                2017, 10, 20, 12, 29, 50, tzinfo=timezone.utc
+            ),
+            'stoppedAt': datetime(
+                2017, 10, 20, 12, 29, 52, tzinfo=timezone.utc
+            ),
+            'stoppedReason': 'Essential container in task exited'
+        })
+        task['containers'][0]['exitCode'] = 0
+        self.mock_ecs.describe_tasks.return_value = {'tasks': [task]}
+        assert self.cls.poll() is True
+        res = self.cls.lifecycle
+        assert res['run_sec'] == 60.0
+        assert res['stop_detection_sec'] == 8.0
+        assert res['tasks'][0]['stopped_at'] == '2017-10-20T12:29:52+00:00'
+        assert res['tasks'][0]['observed_stopped_at'] == \
+            '2017-10-20T12:30:00+00:00'
+        assert res['tasks'][0]['stopped_reason'] == \
+            'Essential container in task exited'
+
+    def test_lifecycle_no_pull(self):
+        t = datetime(2017, 10, 20, 12, 28, 0, tzinfo=timezone.utc)
+        self.cls._update_lifecycle({
+            'taskArn': 'arn1',
+            'createdAt': t,
+            'startedAt': t + timedelta(seconds=5),
+            'stoppedAt': t + timedelta(seconds=65)
+        })
+        self.cls._update_lifecycle({
+            'taskArn': 'arn2',
+            'createdAt': t,
+            'startedAt': t + timedelta(seconds=7),
+        })
+        res = self.cls.lifecycle
+        assert [x['placement_delay_sec'] for x in res['tasks']] == [5.0, 7.0]
+        assert [x['run_sec'] for x in res['tasks']] == [60.0, None]
+        assert res['placement_delay_sec'] == 7.0
+        assert res['image_pull_sec'] is None
+        assert res['run_sec'] == 60.0
+
     def test_output_for_container(self):
         self.cls._log_sources = {'cname': ('grpname', 'sprefix')}
         m_paginator = Mock()
@@ -536,3 +729,263 @@ class TestEcsTask(object):
         assert str(exc.value) == 'No log configuration found for task ' \
                                  'tid container cname'
         assert self.mock_cw.mock_calls == []
+
+
+class TestEcsTaskArray(object):
+
+    def setup(self):
+        self.mock_ecs = Mock()
+        self.ids = iter(range(1, 1000))
+
+        def se_run_task(**kwargs):
+            return {
+                'tasks': [
+                    {'taskArn': 'arn::task/t%d' % next(self.ids)}
+                    for _ in range(kwargs['count'])
+                ],
+                'failures': []
+            }
+
+        self.mock_ecs.run_task.side_effect = se_run_task
+
+    def make(self, **kwargs):
+        cls = EcsTask(
+            'jname', 'sname', cluster_name='clname',
+            task_definition_family='famname', **kwargs
+        )
+        cls._ecs = self.mock_ecs
+        cls._log_sources = {}
+        return cls
+
+    def stopped(self, arn, code):
+        return {
+            'taskArn': arn, 'lastStatus': 'STOPPED',
+            'stoppedReason': 'Essential container in task exited',
+            'containers': [
+                {'name': 'c1', 'containerArn': 'arn::container/c1',
+                 'exitCode': code}
+            ]
+        }
+
+    def test_init_count(self):
+        cls = self.make(count=3, overrides={'foo': 'bar'})
+        assert [s['overrides'] for s in cls._shards] == [{'foo': 'bar'}] * 3
+        assert [s['state'] for s in cls._shards] == ['pending'] * 3
+        assert cls.report_description() == 'famname (3 shards)'
+
+    def test_init_overrides_list(self):
+        cls = self.make(overrides=[{'a': 1}, {'b': 2}])
+        assert [s['overrides'] for s in cls._shards] == [{'a': 1}, {'b': 2}]
+        assert [s['index'] for s in cls._shards] == [0, 1]
+
+    def test_init_count_and_list(self):
+        with pytest.raises(RuntimeError) as exc:
+            self.make(overrides=[{'a': 1}], count=2)
+        assert str(exc.value) == 'ERROR: EcsTask jname: count and a list ' \
+                                 'of overrides are mutually exclusive'
+
+    def test_init_single(self):
+        cls = self.make(overrides={'a': 1})
+        assert cls._shards is None
+        assert cls.shards is None
+
+    def test_run_batches(self):
+        cls = self.make(
+            overrides=[{'a': 1}] * 12 + [{'b': 2}] * 3 + [{'a': 1}] * 5,
+            max_concurrency=18, network_configuration={'nc': 1}
+        )
+        with patch('%s.aws' % pbm) as m_aws:
+            m_aws.client.side_effect = [self.mock_ecs, Mock()]
+            with patch('%s._log_info_for_task' % pb, autospec=True):
+                cls.run()
+        kw = {
+            'cluster': 'clname', 'taskDefinition': 'famname',
+            'networkConfiguration': {'nc': 1}
+        }
+        assert self.mock_ecs.mock_calls == [
+            call.run_task(count=10, overrides={'a': 1}, **kw),
+            call.run_task(count=2, overrides={'a': 1}, **kw),
+            call.run_task(count=3, overrides={'b': 2}, **kw),
+            call.run_task(count=3, overrides={'a': 1}, **kw)
+        ]
+        assert cls.is_started is True
+        assert [s['state'] for s in cls._shards] == \
+            ['running'] * 18 + ['pending'] * 2
+        assert cls._shards[17]['task_arn'] == 'arn::task/t18'
+
+    def test_run_failures(self):
+        cls = self.make(count=3)
+        self.mock_ecs.run_task.side_effect = [{
+            'tasks': [{'taskArn': 'arn::task/t1'}],
+            'failures': [
+                {'arn': 'arn::ci/x', 'reason': 'ATTRIBUTE'},
+                {'reason': 'RESOURCE:MEMORY'}
+            ]
+        }]
+        cls._launch_shards()
+        assert self.mock_ecs.mock_calls == [
+            call.run_task(cluster='clname', taskDefinition='famname', count=3)
+        ]
+        assert [s['state'] for s in cls._shards] == [
+            'running', 'failed', 'failed'
+        ]
+        assert cls._shards[1]['reason'] == 'RunTask failure: ' \
+            'ATTRIBUTE (arn::ci/x); RESOURCE:MEMORY'
+
+    def test_run_capacity(self):
+        cls = self.make(count=3)
+        self.mock_ecs.run_task.side_effect = [
+            {
+                'tasks': [{'taskArn': 'arn::task/t1'}],
+                'failures': [{'reason': 'RESOURCE:CPU'}] * 2
+            },
+            {
+                'tasks': [{'taskArn': 'arn::task/t2'}],
+                'failures': [{'reason': 'RESOURCE:CPU'}]
+            },
+            {'tasks': [{'taskArn': 'arn::task/t3'}], 'failures': []}
+        ]
+        with freeze_time('2017-10-20 12:30:00') as frozen:
+            cls._start_time = datetime.now()
+            cls._launch_shards()
+            assert [s['state'] for s in cls._shards] == [
+                'running', 'pending', 'pending'
+            ]
+            frozen.tick(timedelta(seconds=2))
+            cls._launch_shards()
+            assert len(self.mock_ecs.run_task.mock_calls) == 1
+            frozen.tick(timedelta(seconds=3))
+            cls._launch_shards()
+            frozen.tick(timedelta(seconds=10))
+            cls._launch_shards()
+            assert [s['state'] for s in cls._shards] == ['running'] * 3
+            assert cls.capacity_wait_sec == 15.0
+            assert cls.start_time == datetime(2017, 10, 20, 12, 30, 0)
+        assert self.mock_ecs.mock_calls == [
+            call.run_task(cluster='clname', taskDefinition='famname', count=3),
+            call.run_task(cluster='clname', taskDefinition='famname', count=2),
+            call.run_task(cluster='clname', taskDefinition='famname', count=1)
+        ]
+
+    def test_run_capacity_first_launch(self):
+        cls = self.make(count=1)
+        self.mock_ecs.run_task.side_effect = [
+            {'tasks': [], 'failures': [{'reason': 'AGENT'}]},
+            {'tasks': [{'taskArn': 'arn::task/t1'}], 'failures': []}
+        ]
+        with freeze_time('2017-10-20 12:30:00') as frozen:
+            cls._start_time = datetime.now()
+            cls._launch_shards()
+            frozen.tick(timedelta(seconds=5))
+            cls._launch_shards()
+        assert cls.start_time == datetime(2017, 10, 20, 12, 30, 5)
+        assert cls.capacity_wait_sec == 5.0
+        assert cls._shards[0]['state'] == 'running'
+
+    def test_run_exception(self):
+        cls = self.make(count=2)
+        self.mock_ecs.run_task.side_effect = RuntimeError('foo')
+        cls._launch_shards()
+        assert [s['state'] for s in cls._shards] == ['failed', 'failed']
+        assert cls._shards[0]['reason'] == 'RunTask failed: RuntimeError: foo'
+
+    def test_poll(self):
+        cls = self.make(count=3, max_concurrency=2)
+        cls._launch_shards()
+        self.mock_ecs.describe_tasks.side_effect = [
+            {'tasks': [
+                self.stopped('arn::task/t1', 0),
+                {'taskArn': 'arn::task/t2', 'lastStatus': 'RUNNING'}
+            ]},
+            {'tasks': [
+                self.stopped('arn::task/t2', 3),
+                self.stopped('arn::task/t3', 0)
+            ]}
+        ]
+        assert cls.poll() is False
+        assert cls.is_finished is False
+        assert [s['state'] for s in cls._shards] == [
+            'stopped', 'running', 'running'
+        ]
+        assert cls.poll() is True
+        assert cls.is_finished is True
+        assert cls.exitcode == 3
+        assert self.mock_ecs.mock_calls == [
+            call.run_task(cluster='clname', taskDefinition='famname', count=2),
+            call.describe_tasks(
+                cluster='clname', tasks=['arn::task/t1', 'arn::task/t2']
+            ),
+            call.run_task(cluster='clname', taskDefinition='famname', count=1),
+            call.describe_tasks(
+                cluster='clname', tasks=['arn::task/t2', 'arn::task/t3']
+            )
+        ]
+        assert cls.output == '==== Shard 0 (task t1, exit code 0)\n' \
+            'No output available for Task t1 containers:\n' \
+            'c1 c1 (exit code 0)\n' \
+            '==== Shard 1 (task t2, exit code 3)\n' \
+            'No output available for Task t2 containers:\n' \
+            'c1 c1 (exit code 3)\n' \
+            '==== Shard 2 (task t3, exit code 0)\n' \
+            'No output available for Task t3 containers:\n' \
+            'c1 c1 (exit code 0)\n'
+        assert len(cls.lifecycle['tasks']) == 3
+        shards = cls.shards
+        assert [(s['index'], s['state'], s['exit_code']) for s in shards] == [
+            (0, 'stopped', 0), (1, 'stopped', 3), (2, 'stopped', 0)
+        ]
+        assert shards[1]['reason'] == 'Essential container in task exited'
+        assert shards[1]['duration_sec'] >= 0
+
+    def test_poll_describe_chunks(self):
+        cls = self.make(count=150)
+        cls._launch_shards()
+        self.mock_ecs.describe_tasks.side_effect = [
+            RuntimeError('foo'), {'tasks': []}
+        ]
+        assert cls.poll() is False
+        calls = self.mock_ecs.describe_tasks.mock_calls
+        assert [len(c[2]['tasks']) for c in calls] == [100, 50]
+
+    def test_poll_failed_shard(self):
+        cls = self.make(count=2)
+        self.mock_ecs.run_task.side_effect = [{
+            'tasks': [{'taskArn': 'arn::task/t1'}],
+            'failures': [{'reason': 'MISSING'}]
+        }]
+        cls._launch_shards()
+        self.mock_ecs.describe_tasks.return_value = {
+            'tasks': [self.stopped('arn::task/t1', 0)]
+        }
+        assert cls.poll() is True
+        assert cls.exitcode == 1
+        assert cls.output.startswith(
+            '==== Shard 0 (task t1, exit code 0)\n'
+        )
+        assert cls.output.endswith(
+            '==== Shard 1: RunTask failure: MISSING\n'
+        )
+        assert cls.shards[1]['state'] == 'failed'
+        assert cls.shards[1]['duration_sec'] is None
+
+    def test_poll_describe_failure(self):
+        cls = self.make(count=2)
+        cls._launch_shards()
+        self.mock_ecs.describe_tasks.return_value = {
+            'tasks': [self.stopped('arn::task/t1', 0)],
+            'failures': [
+                {'arn': 'arn::task/t2', 'reason': 'MISSING'},
+                {'arn': 'arn::task/other', 'reason': 'MISSING'}
+            ]
+        }
+        assert cls.poll() is True
+        assert cls.is_finished is True
+        assert cls.exitcode == 1
+        assert [s['state'] for s in cls.shards] == ['stopped', 'failed']
+        assert cls.shards[1]['reason'] == \
+            'DescribeTasks failure: MISSING (arn::task/t2)'
+        assert cls.shards[1]['exit_code'] is None
+        assert cls.output.endswith(
+            '==== Shard 1 (task t2): '
+            'DescribeTasks failure: MISSING (arn::task/t2)\n'
+        )
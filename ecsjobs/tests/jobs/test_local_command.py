@@ -35,7 +35,11 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 ##################################################################################
 """
 
+import os
 import subprocess
+import sys
+import time
+import tracemalloc
 from datetime import datetime
 from unittest.mock import Mock, patch, call, DEFAULT, PropertyMock
 from stat import S_IRUSR, S_IWUSR, S_IXUSR
@@ -43,7 +47,7 @@ from stat import S_IRUSR, S_IWUSR, S_IXUSR
 import pytest
 from freezegun import freeze_time
 
-from ecsjobs.jobs.local_command import LocalCommand
+from ecsjobs.jobs.local_command import LocalCommand, OutputBuffer
 
 pbm = 'ecsjobs.jobs.local_command'
 pb = '%s.LocalCommand' % pbm
@@ -61,11 +65,13 @@ class TestLocalCommand(object):
         assert cls._summary_regex is None
         assert cls._command == 'foo'
         assert cls._exit_code is None
+        assert cls._background is False
+        assert cls._process is None
 
     def test_init_all_options(self):
         cls = LocalCommand(
             'jname', 'sname', summary_regex='foo', command='/bin/bar',
-            shell=True, timeout=23
+            shell=True, timeout=23, background=True
         )
         assert cls.name == 'jname'
         assert cls.schedule_name == 'sname'
@@ -75,14 +81,12 @@ class TestLocalCommand(object):
         assert cls._script_source is None
         assert cls._summary_regex == 'foo'
         assert cls._exit_code is None
+        assert cls._background is True
 
     def test_init_no_cmd_or_script(self):
         with pytest.raises(RuntimeError):
             LocalCommand('jname', 'sname')
 
-
-class TestLocalCommandRun(object):
-
     def setup(self):
         self.cls = LocalCommand(
             'jname',
@@ -105,7 +109,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -120,15 +124,46 @@ class TestLocalCommandRun(object):
         assert self.cls._finish_time == self.second_dt
         assert m_unlink.mock_calls == []
         assert m_gs.mock_calls == []
-        assert m_run.mock_calls == [
-            call(
-                ['/usr/bin/cmd', '-h'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=False,
-                timeout=None
-            )
-        ]
+        assert m_run.mock_calls == [call(self.cls)]
+
+    def test_cgroup(self):
+        m_cg = Mock()
+        m_cg.usage.return_value = {'cgroup_oom_kills': 0}
+
+        def se_make(klass):
+            klass._cgroup = m_cg
+
+        def se_run(klass):
+            klass._resource_usage = {'max_rss_kb': 2048}
+            return Mock(returncode=0, stdout=b'hello')
+
+        with patch('%s._make_cgroup' % pb, autospec=True) as m_make:
+            m_make.side_effect = se_make
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
+                m_run.side_effect = se_run
+                assert self.cls.run() is True
+        assert m_run.mock_calls == [call(self.cls)]
+        assert m_cg.mock_calls == [call.usage(), call.remove()]
+        assert self.cls.resource_usage == {
+            'max_rss_kb': 2048, 'cgroup_oom_kills': 0
+        }
+
+    def test_cgroup_timeout(self):
+        m_cg = Mock()
+        m_cg.usage.return_value = {}
+
+        def se_make(klass):
+            klass._cgroup = m_cg
+
+        with patch('%s._make_cgroup' % pb, autospec=True) as m_make:
+            m_make.side_effect = se_make
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
+                m_run.side_effect = subprocess.TimeoutExpired(
+                    ['/usr/bin/cmd', '-h'], 120, output=b'foo'
+                )
+                with pytest.raises(subprocess.TimeoutExpired):
+                    self.cls.run()
+        assert m_cg.mock_calls == [call.usage(), call.remove()]
 
     def test_success_script_command_arr(self):
         self.cls._script_source = 's3://foo/bar'
@@ -147,7 +182,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -163,15 +198,7 @@ class TestLocalCommandRun(object):
         assert self.cls._command == ['/my/temp/file', 'foo', 'bar']
         assert m_unlink.mock_calls == [call('/my/temp/file')]
         assert m_gs.mock_calls == [call(self.cls, 's3://foo/bar')]
-        assert m_run.mock_calls == [
-            call(
-                ['/my/temp/file', 'foo', 'bar'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=False,
-                timeout=None
-            )
-        ]
+        assert m_run.mock_calls == [call(self.cls)]
 
     def test_success_script_command_str(self):
         self.cls._script_source = 's3://foo/bar'
@@ -190,7 +217,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -206,15 +233,7 @@ class TestLocalCommandRun(object):
         assert self.cls._command == '/my/temp/file'
         assert m_unlink.mock_calls == [call('/my/temp/file')]
         assert m_gs.mock_calls == [call(self.cls, 's3://foo/bar')]
-        assert m_run.mock_calls == [
-            call(
-                '/my/temp/file',
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=False,
-                timeout=None
-            )
-        ]
+        assert m_run.mock_calls == [call(self.cls)]
 
     def test_timeout(self):
         self.frozen = None
@@ -229,7 +248,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -244,15 +263,7 @@ class TestLocalCommandRun(object):
         assert self.cls._finish_time == self.second_dt
         assert m_unlink.mock_calls == []
         assert m_gs.mock_calls == []
-        assert m_run.mock_calls == [
-            call(
-                ['/usr/bin/cmd', '-h'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=False,
-                timeout=None
-            )
-        ]
+        assert m_run.mock_calls == [call(self.cls)]
 
     def test_timeout_script_command_str(self):
         self.cls._script_source = 's3://foo/bar'
@@ -269,7 +280,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -285,15 +296,7 @@ class TestLocalCommandRun(object):
         assert self.cls._command == '/my/temp/file'
         assert m_unlink.mock_calls == [call('/my/temp/file')]
         assert m_gs.mock_calls == [call(self.cls, 's3://foo/bar')]
-        assert m_run.mock_calls == [
-            call(
-                '/my/temp/file',
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=False,
-                timeout=None
-            )
-        ]
+        assert m_run.mock_calls == [call(self.cls)]
 
     def test_timeout_script_command_arr(self):
         self.cls._script_source = 's3://foo/bar'
@@ -310,7 +313,7 @@ class TestLocalCommandRun(object):
         initial_dt = datetime(2017, 10, 20, 12, 30, 00)
         with freeze_time(initial_dt) as frozen:
             self.frozen = frozen
-            with patch('%s.subprocess.run' % pbm) as m_run:
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
                 m_run.side_effect = se_run
                 with patch('%s.unlink' % pbm) as m_unlink:
                     with patch('%s._get_script' % pb, autospec=True) as m_gs:
@@ -326,15 +329,546 @@ class TestLocalCommandRun(object):
         assert self.cls._command == ['/my/temp/file', 'foo', 'bar']
         assert m_unlink.mock_calls == [call('/my/temp/file')]
         assert m_gs.mock_calls == [call(self.cls, 's3://foo/bar')]
-        assert m_run.mock_calls == [
+        assert m_run.mock_calls == [call(self.cls)]
+
+
+class TestLocalCommandPrefetch(object):
+
+    def setup(self):
+        self.cls = LocalCommand(
+            'jname',
+            'sname',
+            command=['foo']
+        )
+
+    def test_no_script(self):
+        assert self.cls.needs_prefetch is False
+        with patch('%s._get_script' % pb, autospec=True) as m_gs:
+            self.cls.prefetch()
+        assert m_gs.mock_calls == []
+        assert self.cls._prefetched_command is None
+
+    def test_prefetch_and_run(self):
+        self.cls._script_source = 's3://foo/bar'
+        assert self.cls.needs_prefetch is True
+        with patch('%s._get_script' % pb, autospec=True) as m_gs:
+            m_gs.return_value = ['/my/temp/file', 'foo']
+            self.cls.prefetch()
+            assert self.cls._prefetched_command == ['/my/temp/file', 'foo']
+            with patch('%s._run_process' % pb, autospec=True) as m_run:
+                m_run.return_value.returncode = 0
+                m_run.return_value.stdout = b'hello'
+                with patch('%s.unlink' % pbm) as m_unlink:
+                    assert self.cls.run() is True
+        assert m_gs.mock_calls == [call(self.cls, 's3://foo/bar')]
+        assert m_run.mock_calls == [call(self.cls)]
+        assert m_unlink.mock_calls == [call('/my/temp/file')]
+        assert self.cls._prefetched_command is None
+        with patch('%s.unlink' % pbm) as m_unlink:
+            self.cls.cleanup()
+        assert m_unlink.mock_calls == []
+
+    def test_cleanup_not_run(self):
+        self.cls._script_source = 's3://foo/bar'
+        self.cls._prefetched_command = ['/my/temp/file', 'foo']
+        with patch('%s.unlink' % pbm) as m_unlink:
+            self.cls.cleanup()
+            self.cls.cleanup()
+        assert m_unlink.mock_calls == [call('/my/temp/file')]
+        assert self.cls._prefetched_command is None
+        assert self.cls._command == ['foo']
+
+    def test_cleanup_cached(self):
+        self.cls._script_source = 's3://foo/bar'
+        self.cls._script_is_cached = True
+        self.cls._script_pinned = True
+        self.cls._script_cache = Mock()
+        self.cls._prefetched_command = '/cache/file'
+        with patch('%s.unlink' % pbm) as m_unlink:
+            self.cls.cleanup()
+        assert m_unlink.mock_calls == []
+        assert self.cls._prefetched_command is None
+        assert self.cls._script_cache.mock_calls == [
+            call.release('s3://foo/bar')
+        ]
+        assert self.cls._script_pinned is False
+        # only released once
+        self.cls.cleanup()
+        assert len(self.cls._script_cache.mock_calls) == 1
+
+    def test_cleanup_unlink_fails(self):
+        self.cls._script_source = 's3://foo/bar'
+        self.cls._prefetched_command = '/my/temp/file'
+        with patch('%s.unlink' % pbm) as m_unlink:
+            m_unlink.side_effect = OSError('foo')
+            self.cls.cleanup()
+        assert self.cls._prefetched_command is None
+
+
+class TestOutputBuffer(object):
+
+    def test_under_limit(self):
+        b = OutputBuffer(10)
+        b.write(b'foo')
+        b.write(b'bar')
+        assert b.dropped_bytes == 0
+        assert b.getvalue() == 'foobar'
+
+    def test_over_limit(self):
+        b = OutputBuffer(5)
+        b.write(b'foo')
+        b.write(b'barbaz')
+        b.write(b'q')
+        assert b.dropped_bytes == 5
+        assert b.getvalue() == '[... 5 bytes of earlier output ' \
+                               'discarded ...]\nrbazq'
+
+    def test_invalid_utf8(self):
+        b = OutputBuffer(10)
+        b.write(b'foo\xff')
+        assert b.getvalue() == 'foo\ufffd'
+
+
+class TestLocalCommandBackground(object):
+
+    def setup(self):
+        self.cls = LocalCommand(
+            'jname',
+            'sname',
+            command=['/usr/bin/cmd', '-h'],
+            background=True,
+            timeout=60
+        )
+        self.rusage = Mock(
+            ru_utime=1.5, ru_stime=0.25, ru_maxrss=2048, ru_inblock=10,
+            ru_oublock=20, ru_nvcsw=30, ru_nivcsw=40
+        )
+        self.expected_usage = {
+            'user_cpu_sec': 1.5,
+            'system_cpu_sec': 0.25,
+            'max_rss_kb': 2048,
+            'block_input_ops': 10,
+            'block_output_ops': 20,
+            'voluntary_ctx_switches': 30,
+            'involuntary_ctx_switches': 40
+        }
+
+    @freeze_time('2017-10-20 12:30:00')
+    def test_run(self):
+        with patch('%s.subprocess.Popen' % pbm) as m_popen:
+            with patch('%s.threading.Thread' % pbm) as m_thread:
+                with patch('%s._run_process' % pb, autospec=True) as m_run:
+                    res = self.cls.run()
+        assert res is None
+        assert self.cls._started is True
+        assert self.cls._finished is False
+        assert self.cls._start_time == datetime(2017, 10, 20, 12, 30, 00)
+        assert self.cls._process is m_popen.return_value
+        assert m_run.mock_calls == []
+        assert m_popen.mock_calls == [
             call(
-                ['/my/temp/file', 'foo', 'bar'],
+                ['/usr/bin/cmd', '-h'],
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 shell=False,
-                timeout=None
+                preexec_fn=None
             )
         ]
+        assert m_thread.mock_calls == [
+            call(target=self.cls._drain_output, name='ecsjobs-jname-output'),
+            call().start()
+        ]
+        assert m_thread.return_value.daemon is True
+
+    def test_run_popen_exception(self):
+        self.cls._script_source = 's3://foo/bar'
+        with patch('%s.subprocess.Popen' % pbm) as m_popen:
+            m_popen.side_effect = OSError('foo')
+            with patch('%s.unlink' % pbm) as m_unlink:
+                with patch('%s._get_script' % pb, autospec=True) as m_gs:
+                    m_gs.return_value = '/my/temp/file'
+                    with pytest.raises(OSError):
+                        self.cls.run()
+        assert self.cls._started is True
+        assert self.cls._finished is True
+        assert m_unlink.mock_calls == [call('/my/temp/file')]
+
+    def test_drain_output(self):
+        m_stream = Mock()
+        m_stream.read1.side_effect = [b'foo', b'bar', b'']
+        self.cls._process = Mock(stdout=m_stream)
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls._drain_output()
+        assert self.cls._output_buffer.getvalue() == 'foobar'
+        assert m_stream.mock_calls == [
+            call.read1(65536), call.read1(65536), call.read1(65536),
+            call.close()
+        ]
+
+    def test_poll_not_started(self):
+        assert self.cls.poll() is False
+
+    def test_poll_running(self):
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._start_time = datetime(2017, 10, 20, 12, 30, 00)
+        with freeze_time('2017-10-20 12:30:30'):
+            with patch('%s.os.wait4' % pbm) as m_wait4:
+                m_wait4.return_value = (0, 0, None)
+                assert self.cls.poll() is False
+        assert self.cls._finished is False
+        assert m_wait4.mock_calls == [call(1234, os.WNOHANG)]
+        assert self.cls._process.returncode is None
+
+    def test_poll_finished(self):
+        self.cls._script_source = 's3://foo/bar'
+        self.cls._command = '/my/temp/file'
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls._output_buffer.write(b'foo')
+        self.cls._start_time = datetime(2017, 10, 20, 12, 30, 00)
+        with freeze_time('2017-10-20 12:30:30'):
+            with patch('%s.unlink' % pbm) as m_unlink:
+                with patch('%s.os.wait4' % pbm) as m_wait4:
+                    m_wait4.return_value = (1234, 3 << 8, self.rusage)
+                    assert self.cls.poll() is True
+        assert self.cls._finished is True
+        assert self.cls._exit_code == 3
+        assert self.cls._output == 'foo'
+        assert self.cls._finish_time == datetime(2017, 10, 20, 12, 30, 30)
+        assert self.cls._reader.mock_calls == [call.join(1), call.is_alive()]
+        assert m_unlink.mock_calls == [call('/my/temp/file')]
+        assert m_wait4.mock_calls == [call(1234, os.WNOHANG)]
+        assert self.cls.resource_usage == self.expected_usage
+        # subsequent polls don't touch the process
+        with patch('%s.os.wait4' % pbm) as m_wait4:
+            assert self.cls.poll() is True
+        assert m_wait4.mock_calls == []
+
+    def test_poll_already_reaped(self):
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._process.poll.return_value = 0
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        with patch('%s.os.wait4' % pbm) as m_wait4:
+            m_wait4.side_effect = ChildProcessError()
+            assert self.cls.poll() is True
+        assert self.cls._process.mock_calls == [call.poll()]
+        assert self.cls.resource_usage is None
+
+    def test_poll_timeout(self):
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls._output_buffer.write(b'foo')
+        self.cls._start_time = datetime(2017, 10, 20, 12, 30, 00)
+        with freeze_time('2017-10-20 12:31:00'):
+            with patch('%s.os.wait4' % pbm) as m_wait4:
+                m_wait4.side_effect = [
+                    (0, 0, None), (1234, 9, self.rusage)
+                ]
+                assert self.cls.poll() is True
+        assert self.cls._finished is True
+        assert self.cls._exit_code == -9
+        assert self.cls._output == 'foo\nLocalCommand jname timed out ' \
+                                   'after 60 seconds and was killed.\n'
+        assert self.cls._process.mock_calls == [call.kill()]
+        assert m_wait4.mock_calls == [
+            call(1234, os.WNOHANG), call(1234, 0)
+        ]
+        assert self.cls.resource_usage == self.expected_usage
+
+    def test_make_cgroup_no_limits(self):
+        with patch('%s.CgroupV2' % pbm, autospec=True) as m_cg:
+            self.cls._make_cgroup()
+        assert m_cg.mock_calls == []
+        assert self.cls._cgroup is None
+
+    def test_make_cgroup(self):
+        self.cls._name = 'my/job'
+        self.cls._cpu_quota = 0.5
+        self.cls._io_weight = 10
+        with patch('%s.CgroupV2' % pbm, autospec=True) as m_cg:
+            m_cg.return_value.create.return_value = True
+            with patch('%s.os.getpid' % pbm) as m_getpid:
+                m_getpid.return_value = 123
+                self.cls._make_cgroup()
+        assert m_cg.mock_calls == [
+            call(
+                'ecsjobs-my_job-123', cpu_quota=0.5, memory_max=None,
+                io_weight=10
+            ),
+            call().create()
+        ]
+        assert self.cls._cgroup == m_cg.return_value
+
+    def test_make_cgroup_unavailable(self):
+        self.cls._memory_max = 1024
+        with patch('%s.CgroupV2' % pbm, autospec=True) as m_cg:
+            m_cg.return_value.create.return_value = False
+            self.cls._make_cgroup()
+        assert self.cls._cgroup is None
+
+    def test_run_cgroup(self):
+        m_cg = Mock()
+
+        def se_make(klass):
+            klass._cgroup = m_cg
+
+        with patch('%s._make_cgroup' % pb, autospec=True) as m_make:
+            m_make.side_effect = se_make
+            with patch('%s.subprocess.Popen' % pbm) as m_popen:
+                m_popen.return_value.pid = 1234
+                with patch('%s.threading.Thread' % pbm):
+                    assert self.cls.run() is None
+        assert m_popen.mock_calls[0] == call(
+            ['/usr/bin/cmd', '-h'], stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, shell=False, preexec_fn=m_cg.join
+        )
+        assert m_cg.mock_calls == []
+        assert self.cls._cgroup == m_cg
+
+    def test_poll_timeout_cgroup(self):
+        self.cls._cgroup = Mock()
+        self.cls._cgroup.usage.return_value = {'cgroup_oom_kills': 1}
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls._start_time = datetime(2017, 10, 20, 12, 30, 00)
+        with freeze_time('2017-10-20 12:31:00'):
+            with patch('%s.os.wait4' % pbm) as m_wait4:
+                m_wait4.side_effect = [
+                    (0, 0, None), (1234, 9, self.rusage)
+                ]
+                assert self.cls.poll() is True
+        assert self.cls._cgroup.mock_calls == [
+            call.kill(), call.usage(), call.remove()
+        ]
+        expected = dict(self.expected_usage)
+        expected['cgroup_oom_kills'] = 1
+        assert self.cls.resource_usage == expected
+
+    def test_terminate(self):
+        self.cls._cgroup = Mock()
+        self.cls._cgroup.usage.return_value = {}
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls._output_buffer.write(b'partial')
+        with patch('%s.os.wait4' % pbm) as m_wait4:
+            m_wait4.side_effect = [
+                (0, 0, None), (0, 0, None), (1234, 15, self.rusage)
+            ]
+            with patch('%s.sleep' % pbm) as m_sleep:
+                self.cls.terminate()
+        assert self.cls._process.mock_calls == [call.terminate()]
+        assert m_sleep.mock_calls == [call(0.1)]
+        assert self.cls._cgroup.mock_calls == [
+            call.kill(), call.usage(), call.remove()
+        ]
+        assert self.cls._output == 'partial\nLocalCommand jname was ' \
+                                   'terminated when the run time limit ' \
+                                   'was reached.\n'
+        assert self.cls._exit_code == -15
+        assert self.cls.is_finished is False
+        assert self.cls.resource_usage == self.expected_usage
+
+    def test_terminate_kill(self):
+        self.cls.TERMINATE_GRACE_SEC = 0
+        self.cls._process = Mock(pid=1234, returncode=None)
+        self.cls._reader = Mock()
+        self.cls._reader.is_alive.return_value = False
+        self.cls._output_buffer = OutputBuffer(100)
+        with patch('%s.os.wait4' % pbm) as m_wait4:
+            m_wait4.side_effect = [
+                (0, 0, None), (0, 0, None), (1234, 9, self.rusage)
+            ]
+            with patch('%s.sleep' % pbm) as m_sleep:
+                self.cls.terminate()
+        assert self.cls._process.mock_calls == [
+            call.terminate(), call.kill()
+        ]
+        assert m_wait4.mock_calls == [
+            call(1234, os.WNOHANG), call(1234, os.WNOHANG), call(1234, 0)
+        ]
+        assert m_sleep.mock_calls == []
+        assert self.cls._exit_code == -9
+
+    def test_terminate_not_running(self):
+        self.cls._process = None
+        self.cls.terminate()
+        self.cls._process = Mock()
+        self.cls._finished = True
+        self.cls.terminate()
+        assert self.cls._process.mock_calls == []
+
+    def test_real_process_release_output_memory(self):
+        cls = LocalCommand(
+            'jname', 'sname', command='head -c 8000000 /dev/zero | tr "\\0" a',
+            shell=True, background=True
+        )
+        tracemalloc.start()
+        try:
+            assert cls.run() is None
+            for _ in range(500):
+                if cls.poll():
+                    break
+                time.sleep(0.02)
+            assert cls.output == 'a' * 8000000
+            assert cls._output_buffer is None
+            cls.release_output()
+            current = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        assert cls.output is None
+        assert current < 1000000
+
+    def test_release_output(self):
+        self.cls._output = 'foo'
+        self.cls._output_buffer = OutputBuffer(100)
+        self.cls.release_output()
+        assert self.cls._output is None
+        assert self.cls._output_buffer is None
+
+    def test_real_process_terminate(self):
+        cls = LocalCommand(
+            'jname', 'sname', command='echo foo; sleep 30', shell=True,
+            background=True
+        )
+        assert cls.run() is None
+        time.sleep(0.2)
+        cls.terminate()
+        assert cls.is_finished is False
+        assert cls._exit_code is not None
+        assert cls._output.startswith('foo\n')
+
+    def test_real_process(self):
+        cls = LocalCommand(
+            'jname', 'sname', command='echo foo; echo bar >&2; exit 2',
+            shell=True, background=True
+        )
+        assert cls.run() is None
+        for _ in range(100):
+            if cls.poll():
+                break
+            time.sleep(0.1)
+        assert cls.is_finished is True
+        assert cls.exitcode == 2
+        assert cls.output == "foo\nbar\n"
+        assert cls.resource_usage['max_rss_kb'] > 0
+
+    def test_real_process_sync(self):
+        cls = LocalCommand(
+            'jname', 'sname', command='echo foo', shell=True
+        )
+        assert cls.run() is True
+        assert cls.output == "foo\n"
+        assert sorted(cls.resource_usage.keys()) == [
+            'block_input_ops', 'block_output_ops', 'involuntary_ctx_switches',
+            'max_rss_kb', 'system_cpu_sec', 'user_cpu_sec',
+            'voluntary_ctx_switches'
+        ]
+
+
+class TestLocalCommandUsage(object):
+
+    def setup(self):
+        self.rusage = Mock(
+            ru_utime=3.5, ru_stime=0.75, ru_maxrss=2048, ru_inblock=10,
+            ru_oublock=20, ru_nvcsw=30, ru_nivcsw=40
+        )
+
+    def test_usage_dict(self):
+        assert LocalCommand._usage_dict(self.rusage) == {
+            'user_cpu_sec': 3.5,
+            'system_cpu_sec': 0.75,
+            'max_rss_kb': 2048,
+            'block_input_ops': 10,
+            'block_output_ops': 20,
+            'voluntary_ctx_switches': 30,
+            'involuntary_ctx_switches': 40
+        }
+
+    def test_run_process(self):
+        cls = LocalCommand('jname', 'sname', command=['foo', 'bar'])
+        cls._start_time = datetime.now()
+        with patch('%s.subprocess.Popen' % pbm) as m_popen:
+            m_popen.return_value.pid = 1234
+            m_popen.return_value.returncode = None
+            m_popen.return_value.stdout.read1.side_effect = [b'hello', b'']
+            with patch('%s.os.wait4' % pbm) as m_wait4:
+                m_wait4.return_value = (1234, 2 << 8, self.rusage)
+                res = cls._run_process()
+        assert res.returncode == 2
+        assert res.stdout == b'hello'
+        assert m_popen.mock_calls[0] == call(
+            ['foo', 'bar'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            shell=False,
+            preexec_fn=None
+        )
+        assert m_wait4.mock_calls == [call(1234, os.WNOHANG)]
+        assert cls.resource_usage['max_rss_kb'] == 2048
+
+    def test_run_process_timeout(self):
+        cls = LocalCommand('jname', 'sname', command='foo', timeout=0.01)
+        cls._start_time = datetime.now()
+        cls._cgroup = Mock()
+        with patch('%s.subprocess.Popen' % pbm) as m_popen:
+            m_popen.return_value.pid = 1234
+            m_popen.return_value.returncode = None
+            m_popen.return_value.stdout.read1.side_effect = [b'foo', b'']
+            with patch('%s.os.wait4' % pbm) as m_wait4:
+                m_wait4.side_effect = lambda pid, opts: (
+                    (0, 0, None) if opts == os.WNOHANG
+                    else (1234, 9, self.rusage)
+                )
+                with pytest.raises(subprocess.TimeoutExpired) as exc:
+                    cls._run_process()
+        assert exc.value.output == b'foo'
+        assert cls._cgroup.mock_calls == [call.kill()]
+        assert call.kill() in m_popen.return_value.mock_calls
+        assert m_wait4.mock_calls[-1] == call(1234, 0)
+        assert cls.resource_usage['max_rss_kb'] == 2048
+
+    def test_real_process_timeout(self):
+        cls = LocalCommand(
+            'jname', 'sname', command='echo foo; sleep 5', shell=True,
+            timeout=0.5
+        )
+        with pytest.raises(subprocess.TimeoutExpired):
+            cls.run()
+        assert cls.output == 'foo\n'
+        assert cls.resource_usage is not None
+
+    def test_real_process_sync_rss_per_job(self):
+        # Run in a fresh interpreter; on Linux a child's max RSS includes the
+        # RSS of the parent at fork time, which for the test runner is large.
+        script = '\n'.join([
+            'import sys',
+            'from ecsjobs.jobs.local_command import LocalCommand',
+            'big = LocalCommand("big", "s", command=[',
+            '    sys.executable, "-c", "b = bytearray(200 * 1024 * 1024)"',
+            '])',
+            'small = LocalCommand("small", "s", command=["true"])',
+            'assert big.run() is True',
+            'assert small.run() is True',
+            'print(big.resource_usage["max_rss_kb"])',
+            'print(small.resource_usage["max_rss_kb"])'
+        ])
+        res = subprocess.run(
+            [sys.executable, '-c', script], stdout=subprocess.PIPE,
+            check=True
+        )
+        big_rss, small_rss = [int(x) for x in res.stdout.split()]
+        assert big_rss > 200 * 1024
+        assert small_rss < big_rss - 100 * 1024
 
 
 class TestLocalCommandReportDescription(object):
@@ -381,14 +915,14 @@ class TestLocalCommandGetScript(object):
         with patch.multiple(
             pbm,
             **{
-                'boto3': DEFAULT,
+                'aws': DEFAULT,
                 'requests': DEFAULT,
                 'mkstemp': DEFAULT,
                 'chmod': DEFAULT,
                 'fdopen': DEFAULT
             }
         ) as mocks:
-            mocks['boto3'].client.return_value = m_client
+            mocks['aws'].client.return_value = m_client
             mocks['mkstemp'].return_value = m_fd, '/tmp/tmpfile'
             res = self.cls._get_script('s3://bktname/path/to/key')
         assert res == '/tmp/tmpfile'
@@ -396,7 +930,7 @@ class TestLocalCommandGetScript(object):
         assert self.cls.is_finished is False
         assert self.cls.exitcode is None
         assert self.cls.output is None
-        assert mocks['boto3'].mock_calls == [
+        assert mocks['aws'].mock_calls == [
             call.client('s3'),
             call.client().get_object(Bucket='bktname', Key='path/to/key')
         ]
@@ -434,14 +968,14 @@ class TestLocalCommandGetScript(object):
         with patch.multiple(
             pbm,
             **{
-                'boto3': DEFAULT,
+                'aws': DEFAULT,
                 'requests': DEFAULT,
                 'mkstemp': DEFAULT,
                 'chmod': DEFAULT,
                 'fdopen': DEFAULT
             }
         ) as mocks:
-            mocks['boto3'].client.return_value = m_client
+            mocks['aws'].client.return_value = m_client
             mocks['mkstemp'].return_value = m_fd, '/tmp/tmpfile'
             res = self.cls._get_script('s3://bktname/path/to/key')
         assert res == ['/tmp/tmpfile', 'foo', 'bar', 'baz']
@@ -449,7 +983,7 @@ class TestLocalCommandGetScript(object):
         assert self.cls.is_finished is False
         assert self.cls.exitcode is None
         assert self.cls.output is None
-        assert mocks['boto3'].mock_calls == [
+        assert mocks['aws'].mock_calls == [
             call.client('s3'),
             call.client().get_object(Bucket='bktname', Key='path/to/key')
         ]
@@ -483,7 +1017,7 @@ class TestLocalCommandGetScript(object):
         with patch.multiple(
             pbm,
             **{
-                'boto3': DEFAULT,
+                'aws': DEFAULT,
                 'requests': DEFAULT,
                 'mkstemp': DEFAULT,
                 'chmod': DEFAULT,
@@ -498,9 +1032,9 @@ class TestLocalCommandGetScript(object):
         assert self.cls.is_finished is False
         assert self.cls.exitcode is None
         assert self.cls.output is None
-        assert mocks['boto3'].mock_calls == []
+        assert mocks['aws'].mock_calls == []
         assert mocks['requests'].mock_calls == [
-            call.get('http://bar')
+            call.get('http://bar', timeout=60)
         ]
         assert mocks['mkstemp'].mock_calls == [
             call('ecsjobs-jname')
@@ -520,6 +1054,7 @@ class TestLocalCommandGetScript(object):
         assert self.cls.exitcode is None
         assert self.cls.output is None
         self.cls._command = 'foobar'
+        self.cls.set_script_fetch_timeout(5)
 
         m_resp = Mock()
         type(m_resp).text = PropertyMock(return_value='foobar')
@@ -528,7 +1063,7 @@ class TestLocalCommandGetScript(object):
         with patch.multiple(
             pbm,
             **{
-                'boto3': DEFAULT,
+                'aws': DEFAULT,
                 'requests': DEFAULT,
                 'mkstemp': DEFAULT,
                 'chmod': DEFAULT,
@@ -543,9 +1078,9 @@ class TestLocalCommandGetScript(object):
         assert self.cls.is_finished is False
         assert self.cls.exitcode is None
         assert self.cls.output is None
-        assert mocks['boto3'].mock_calls == []
+        assert mocks['aws'].mock_calls == []
         assert mocks['requests'].mock_calls == [
-            call.get('http://bar')
+            call.get('http://bar', timeout=5)
         ]
         assert mocks['mkstemp'].mock_calls == [
             call('ecsjobs-jname')
@@ -559,6 +1094,84 @@ class TestLocalCommandGetScript(object):
             call().close()
         ]
 
+    def test_cached(self):
+        self.cls._command = ['foo']
+        self.cls._script_sha256 = 'ab' * 32
+        m_cache = Mock()
+        m_cache.get.return_value = '/cache/abcd'
+        self.cls.set_script_cache(m_cache)
+        with patch.multiple(
+            pbm,
+            **{
+                'aws': DEFAULT,
+                'requests': DEFAULT,
+                'mkstemp': DEFAULT,
+                'chmod': DEFAULT,
+                'fdopen': DEFAULT
+            }
+        ) as mocks:
+            res = self.cls._get_script('s3://bktname/path/to/key')
+        assert res == ['/cache/abcd', 'foo']
+        assert self.cls._script_is_cached is True
+        assert self.cls._script_pinned is True
+        assert m_cache.mock_calls == [
+            call.get('s3://bktname/path/to/key', sha256='ab' * 32)
+        ]
+        for m in mocks.values():
+            assert m.mock_calls == []
+        # cached scripts must not be removed after running
+        self.cls._script_source = 's3://bktname/path/to/key'
+        self.cls._command = res
+        with patch('%s.unlink' % pbm) as m_unlink:
+            self.cls._remove_script()
+        assert m_unlink.mock_calls == []
+
+    def test_http_sha256_mismatch(self):
+        self.cls._command = []
+        self.cls._script_sha256 = '0' * 64
+        m_resp = Mock()
+        type(m_resp).text = PropertyMock(return_value='foobar')
+        with patch.multiple(
+            pbm,
+            **{
+                'aws': DEFAULT,
+                'requests': DEFAULT,
+                'mkstemp': DEFAULT,
+                'chmod': DEFAULT,
+                'fdopen': DEFAULT
+            }
+        ) as mocks:
+            mocks['requests'].get.return_value = m_resp
+            with pytest.raises(RuntimeError) as exc:
+                self.cls._get_script('http://bar')
+        assert str(exc.value) == 'ERROR: script from http://bar has ' \
+                                 'SHA-256 c3ab8ff13720e8ad9047dd39466b3c89' \
+                                 '74e592c2fa383d4a3960714caef0c4f2; ' \
+                                 'expected %s' % ('0' * 64)
+        assert mocks['mkstemp'].mock_calls == []
+
+    def test_http_sha256_match(self):
+        self.cls._command = []
+        self.cls._script_sha256 = 'C3AB8FF13720E8AD9047DD39466B3C89' \
+                                  '74E592C2FA383D4A3960714CAEF0C4F2'
+        m_resp = Mock()
+        type(m_resp).text = PropertyMock(return_value='foobar')
+        m_fd = Mock()
+        with patch.multiple(
+            pbm,
+            **{
+                'aws': DEFAULT,
+                'requests': DEFAULT,
+                'mkstemp': DEFAULT,
+                'chmod': DEFAULT,
+                'fdopen': DEFAULT
+            }
+        ) as mocks:
+            mocks['requests'].get.return_value = m_resp
+            mocks['mkstemp'].return_value = m_fd, '/tmp/tmpfile'
+            res = self.cls._get_script('http://bar')
+        assert res == '/tmp/tmpfile'
+
     def test_unsupported_url(self):
         assert self.cls.is_started is False
         assert self.cls.is_finished is False
@@ -567,7 +1180,7 @@ class TestLocalCommandGetScript(object):
         with patch.multiple(
             pbm,
             **{
-                'boto3': DEFAULT,
+                'aws': DEFAULT,
                 'requests': DEFAULT,
                 'mkstemp': DEFAULT,
                 'chmod': DEFAULT,
@@ -577,7 +1190,7 @@ class TestLocalCommandGetScript(object):
             with pytest.raises(RuntimeError) as exc:
                 self.cls._get_script('foo://bar')
         assert str(exc.value) == 'Error: unsupported URL scheme: foo://bar'
-        assert mocks['boto3'].mock_calls == []
+        assert mocks['aws'].mock_calls == []
         assert mocks['requests'].mock_calls == []
         assert mocks['mkstemp'].mock_calls == []
         assert mocks['chmod'].mock_calls == []
@@ -0,0 +1,723 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from itertools import count
+from urllib.parse import urlsplit, parse_qs, unquote
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+#: Fake AWS account ID used in ARNs.
+ACCOUNT_ID = '123456789012'
+
+#: Regex matching the service name in a SigV4 Authorization header.
+CREDENTIAL_RE = re.compile(r'Credential=[^/]+/[^/]+/[^/]+/([^/]+)/')
+
+
+class TaskScript(object):
+    """
+    Scripted lifecycle and output of the ECS Tasks of a task definition
+    family, in :py:class:`~.AwsStandin`.
+    """
+
+    def __init__(self, statuses=None, exit_code=0,
+                 stopped_reason='Essential container in task exited',
+                 containers=None, log_lines=10, line_bytes=None,
+                 capacity=None):
+        """
+        :param statuses: ``lastStatus`` values reported by successive
+          DescribeTasks calls for each task, after which it is STOPPED.
+          Defaults to PROVISIONING, PENDING and RUNNING.
+        :type statuses: list
+        :param exit_code: exit code of each container
+        :type exit_code: int
+        :param stopped_reason: ``stoppedReason`` of stopped tasks
+        :type stopped_reason: str
+        :param containers: container names in the task definition; defaults
+          to ``['main']``. Each uses the ``awslogs`` log driver.
+        :type containers: list
+        :param log_lines: number of CloudWatch Logs events per container
+        :type log_lines: int
+        :param line_bytes: if set, pad each log message to this many bytes
+        :type line_bytes: int
+        :param capacity: if set, the maximum number of tasks of the family
+          that can be running (not yet STOPPED) at once; RunTask fails to
+          place any more with reason ``RESOURCE:MEMORY``
+        :type capacity: int
+        """
+        if statuses is None:
+            statuses = ['PROVISIONING', 'PENDING', 'RUNNING']
+        self.statuses = statuses
+        self.exit_code = exit_code
+        self.stopped_reason = stopped_reason
+        self.containers = containers or ['main']
+        self.log_lines = log_lines
+        self.line_bytes = line_bytes
+        self.capacity = capacity
+
+    def message(self, task_id, container, num):
+        """
+        Return log message number ``num`` for a task's container.
+
+        :rtype: str
+        """
+        msg = 'task %s container %s line %d' % (task_id, container, num)
+        if self.line_bytes is not None and len(msg) < self.line_bytes:
+            msg += ' ' + 'x' * (self.line_bytes - len(msg) - 1)
+        return msg
+
+
+class StandinError(Exception):
+    """
+    An AWS API error response to return from :py:class:`~.AwsStandin`.
+    """
+
+    def __init__(self, status, code, message):
+        super(StandinError, self).__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler that passes each request to
+    :py:meth:`AwsStandin.handle`.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length > 0 else b''
+        status, headers, body = self.server.standin.handle(
+            self.command, self.path, self.headers, body
+        )
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class AwsStandin(object):
+    """
+    In-process HTTP stand-in for the ECS, CloudWatch Logs, S3 and SES API
+    calls that ecsjobs makes, for end-to-end and load tests that exercise the
+    real botocore code paths. Point clients at it with the environment
+    variables returned by :py:meth:`~.environ` (botocore's endpoint URL
+    override settings).
+
+    * ECS - DescribeTaskDefinition, RunTask and DescribeTasks. Tasks follow
+      the :py:class:`~.TaskScript` in :py:attr:`~.task_scripts` for their
+      family, or :py:attr:`~.default_script`; task definitions are generated
+      from the script.
+    * CloudWatch Logs - FilterLogEvents, paginated by :py:attr:`~.log_page_size`
+      events, for the ``awslogs`` streams of tasks that have been run.
+    * S3 - ListObjects, ListObjectsV2, GetObject (honoring If-None-Match),
+      HeadObject, PutObject, DeleteObject and multipart uploads, against
+      :py:attr:`~.s3_objects`.
+    * SES - SendEmail and SendRawEmail; messages are recorded in
+      :py:attr:`~.emails`.
+
+    Latency and throttling can be injected per operation. ``latency`` and
+    ``throttle_rate`` are either a number applied to every operation, or a
+    dict keyed by ``service:Operation`` (e.g. ``ecs:DescribeTasks``) or
+    ``service:*``. Throttled calls return each protocol's throttling error.
+    Calls and throttled calls are counted in :py:attr:`~.calls` and
+    :py:attr:`~.throttled`.
+    """
+
+    #: Environment variables (botocore endpoint URL overrides) for each
+    #: service.
+    ENDPOINT_VARS = [
+        'AWS_ENDPOINT_URL_ECS', 'AWS_ENDPOINT_URL_CLOUDWATCH_LOGS',
+        'AWS_ENDPOINT_URL_S3', 'AWS_ENDPOINT_URL_SES'
+    ]
+
+    def __init__(self, latency=0, throttle_rate=0, seed=0, log_page_size=1000):
+        """
+        :param latency: seconds to wait before responding
+        :type latency: ``float`` or ``dict``
+        :param throttle_rate: probability of throttling a call
+        :type throttle_rate: ``float`` or ``dict``
+        :param seed: seed for the throttling random number generator
+        :type seed: int
+        :param log_page_size: maximum FilterLogEvents events per response
+        :type log_page_size: int
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.log_page_size = log_page_size
+        self.default_script = TaskScript()
+        self.task_scripts = {}
+        self.tasks = {}
+        self.s3_objects = {}
+        self.emails = []
+        self.calls = {}
+        self.throttled = {}
+        self._uploads = {}
+        self._ids = count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        """Start the server on an ephemeral port on 127.0.0.1."""
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        """
+        Return the base URL of the server.
+
+        :rtype: str
+        """
+        return 'http://127.0.0.1:%d' % self._server.server_port
+
+    def environ(self):
+        """
+        Return environment variables that point botocore clients at the
+        stand-in, with fake credentials and region.
+
+        :rtype: dict
+        """
+        res = dict((k, self.url) for k in self.ENDPOINT_VARS)
+        res.update({
+            'AWS_ACCESS_KEY_ID': 'standin',
+            'AWS_SECRET_ACCESS_KEY': 'standin',
+            'AWS_DEFAULT_REGION': 'us-east-1'
+        })
+        return res
+
+    def _setting(self, setting, service, op):
+        """
+        Return the value of a per-operation setting.
+        """
+        if not isinstance(setting, dict):
+            return setting
+        for k in ['%s:%s' % (service, op), '%s:*' % service]:
+            if k in setting:
+                return setting[k]
+        return 0
+
+    def handle(self, method, path, headers, body):
+        """
+        Handle one API request.
+
+        :return: 3-tuple of HTTP status, dict of headers, body bytes
+        :rtype: tuple
+        """
+        m = CREDENTIAL_RE.search(headers.get('Authorization', ''))
+        service = m.group(1) if m else 's3'
+        if service in ['ecs', 'logs']:
+            return self._handle_json(service, headers, body)
+        if service == 'ses':
+            return self._handle_query(service, body)
+        return self._handle_s3(method, path, headers, body)
+
+    def _before(self, service, op):
+        """
+        Count a call and apply injected latency; raise
+        :py:class:`~.StandinError` if it is to be throttled.
+        """
+        key = '%s:%s' % (service, op)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            throttle = self._random.random() < self._setting(
+                self.throttle_rate, service, op
+            )
+            if throttle:
+                self.throttled[key] = self.throttled.get(key, 0) + 1
+        delay = self._setting(self.latency, service, op)
+        if delay:
+            time.sleep(delay)
+        if throttle:
+            raise StandinError(400, 'Throttling', 'Rate exceeded')
+
+    def _handle_json(self, service, headers, body):
+        op = headers.get('X-Amz-Target', '').split('.')[-1]
+        ctype = {'Content-Type': 'application/x-amz-json-1.1'}
+        try:
+            self._before(service, op)
+            handler = getattr(self, '_%s_%s' % (service, op), None)
+            if handler is None:
+                raise StandinError(
+                    400, 'InvalidAction', 'Unsupported operation %s' % op
+                )
+            res = handler(json.loads(body.decode('utf-8') or '{}'))
+        except StandinError as ex:
+            code = 'ThrottlingException' if ex.code == 'Throttling' \
+                else ex.code
+            return ex.status, ctype, json.dumps({
+                '__type': code, 'message': ex.message
+            }).encode('utf-8')
+        return 200, ctype, json.dumps(res).encode('utf-8')
+
+    def _handle_query(self, service, body):
+        params = dict(
+            (k, v[0]) for k, v in parse_qs(body.decode('utf-8')).items()
+        )
+        op = params.get('Action', '')
+        ctype = {'Content-Type': 'text/xml'}
+        try:
+            self._before(service, op)
+            handler = getattr(self, '_%s_%s' % (service, op), None)
+            if handler is None:
+                raise StandinError(
+                    400, 'InvalidAction', 'Unsupported operation %s' % op
+                )
+            res = handler(params)
+        except StandinError as ex:
+            return ex.status, ctype, (
+                '<ErrorResponse><Error><Type>Sender</Type><Code>%s</Code>'
+                '<Message>%s</Message></Error><RequestId>standin</RequestId>'
+                '</ErrorResponse>' % (ex.code, escape(ex.message))
+            ).encode('utf-8')
+        return 200, ctype, (
+            '<%sResponse xmlns="http://%s.amazonaws.com/doc/2010-12-01/">'
+            '<%sResult>%s</%sResult><ResponseMetadata><RequestId>standin'
+            '</RequestId></ResponseMetadata></%sResponse>' % (
+                op, service, op, res, op, op
+            )
+        ).encode('utf-8')
+
+    # ECS
+
+    def _script(self, family):
+        return self.task_scripts.get(family, self.default_script)
+
+    def _ecs_DescribeTaskDefinition(self, req):
+        family = req['taskDefinition'].split(':')[0]
+        containers = [
+            {
+                'name': c,
+                'logConfiguration': {
+                    'logDriver': 'awslogs',
+                    'options': {
+                        'awslogs-group': 'standin',
+                        'awslogs-stream-prefix': family
+                    }
+                }
+            } for c in self._script(family).containers
+        ]
+        return {'taskDefinition': {
+            'family': family,
+            'taskDefinitionArn': 'arn:aws:ecs:us-east-1:%s:task-definition/'
+                                 '%s:1' % (ACCOUNT_ID, family),
+            'containerDefinitions': containers
+        }}
+
+    def _ecs_RunTask(self, req):
+        family = req['taskDefinition'].split(':')[0]
+        cluster = req.get('cluster', 'default')
+        tasks = []
+        failures = []
+        with self._lock:
+            script = self._script(family)
+            free = req.get('count', 1)
+            if script.capacity is not None:
+                running = len([
+                    t for t in self.tasks.values()
+                    if t['family'] == family and
+                    max(t['describes'] - 1, 0) < len(t['script'].statuses)
+                ])
+                free = max(min(free, script.capacity - running), 0)
+            for _ in range(req.get('count', 1) - free):
+                failures.append({
+                    'arn': 'arn:aws:ecs:us-east-1:%s:container-instance/%s/'
+                           'standin' % (ACCOUNT_ID, cluster),
+                    'reason': 'RESOURCE:MEMORY'
+                })
+            for _ in range(free):
+                task_id = '%032x' % next(self._ids)
+                arn = 'arn:aws:ecs:us-east-1:%s:task/%s/%s' % (
+                    ACCOUNT_ID, cluster, task_id
+                )
+                self.tasks[arn] = {
+                    'arn': arn, 'id': task_id, 'family': family,
+                    'cluster': cluster, 'script': self._script(family),
+                    'overrides': req.get('overrides'), 'describes': 0,
+                    'times': {'createdAt': time.time()}
+                }
+                tasks.append(self._describe(self.tasks[arn]))
+        return {'tasks': tasks, 'failures': failures}
+
+    def _ecs_DescribeTasks(self, req):
+        tasks = []
+        failures = []
+        with self._lock:
+            for arn in req['tasks']:
+                if arn not in self.tasks:
+                    failures.append({'arn': arn, 'reason': 'MISSING'})
+                    continue
+                self.tasks[arn]['describes'] += 1
+                tasks.append(self._describe(self.tasks[arn]))
+        return {'tasks': tasks, 'failures': failures}
+
+    def _describe(self, task):
+        """
+        Return the current description of a task. The RunTask response and
+        first DescribeTasks call report the first status in its script, and
+        each subsequent DescribeTasks call the next one.
+        """
+        script = task['script']
+        times = task['times']
+        idx = max(task['describes'] - 1, 0)
+        if idx < len(script.statuses):
+            status = script.statuses[idx]
+        else:
+            status = 'STOPPED'
+        now = time.time()
+        if status in ['PENDING', 'ACTIVATING', 'RUNNING', 'DEACTIVATING',
+                      'STOPPING', 'STOPPED']:
+            times.setdefault('pullStartedAt', now)
+        if status in ['RUNNING', 'DEACTIVATING', 'STOPPING', 'STOPPED']:
+            times.setdefault('pullStoppedAt', now)
+            times.setdefault('startedAt', now)
+        if status in ['DEACTIVATING', 'STOPPING', 'STOPPED']:
+            times.setdefault('stoppingAt', now)
+        if status == 'STOPPED':
+            times.setdefault('stoppedAt', now)
+        res = {
+            'taskArn': task['arn'],
+            'clusterArn': 'arn:aws:ecs:us-east-1:%s:cluster/%s' % (
+                ACCOUNT_ID, task['cluster']
+            ),
+            'lastStatus': status,
+            'desiredStatus': 'STOPPED' if status == 'STOPPED' else 'RUNNING',
+            'containers': []
+        }
+        res.update(times)
+        if status == 'STOPPED':
+            res['stoppedReason'] = script.stopped_reason
+        for c in script.containers:
+            cont = {
+                'containerArn': 'arn:aws:ecs:us-east-1:%s:container/%s/%s' % (
+                    ACCOUNT_ID, task['id'], c
+                ),
+                'taskArn': task['arn'],
+                'name': c,
+                'lastStatus': status
+            }
+            if status == 'STOPPED':
+                cont['exitCode'] = script.exit_code
+            res['containers'].append(cont)
+        return res
+
+    # CloudWatch Logs
+
+    def _logs_FilterLogEvents(self, req):
+        stream = req['logStreamNames'][0]
+        task_id = stream.split('/')[-1]
+        container = stream.split('/')[-2]
+        task = next(
+            (t for t in list(self.tasks.values()) if t['id'] == task_id), None
+        )
+        if task is None:
+            raise StandinError(
+                400, 'ResourceNotFoundException',
+                'The specified log stream does not exist.'
+            )
+        script = task['script']
+        start = int(req.get('nextToken', '0'))
+        end = min(start + self.log_page_size, script.log_lines)
+        ts = int(task['times'].get('startedAt', time.time()) * 1000)
+        res = {
+            'events': [
+                {
+                    'logStreamName': stream,
+                    'timestamp': ts + i,
+                    'ingestionTime': ts + i,
+                    'message': script.message(task_id, container, i),
+                    'eventId': '%s-%d' % (task_id, i)
+                } for i in range(start, end)
+            ],
+            'searchedLogStreams': []
+        }
+        if end < script.log_lines:
+            res['nextToken'] = str(end)
+        return res
+
+    # SES
+
+    def _ses_SendEmail(self, params):
+        self.emails.append({
+            'operation': 'SendEmail',
+            'source': params.get('Source'),
+            'destinations': [
+                v for k, v in sorted(params.items())
+                if k.startswith('Destination.ToAddresses.member.')
+            ],
+            'subject': params.get('Message.Subject.Data'),
+            'body': params.get('Message.Body.Html.Data', '').encode('utf-8')
+        })
+        return '<MessageId>standin-%d</MessageId>' % len(self.emails)
+
+    def _ses_SendRawEmail(self, params):
+        self.emails.append({
+            'operation': 'SendRawEmail',
+            'source': params.get('Source'),
+            'destinations': [
+                v for k, v in sorted(params.items())
+                if k.startswith('Destinations.member.')
+            ],
+            'subject': None,
+            'body': base64.b64decode(params['RawMessage.Data'])
+        })
+        return '<MessageId>standin-%d</MessageId>' % len(self.emails)
+
+    # S3
+
+    def _handle_s3(self, method, path, headers, body):
+        url = urlsplit(path)
+        bucket, _, key = unquote(url.path).lstrip('/').partition('/')
+        q = dict(
+            (k, v[0]) for k, v in parse_qs(
+                url.query, keep_blank_values=True
+            ).items()
+        )
+        if method == 'GET' and key == '':
+            op = 'ListObjectsV2' if q.get('list-type') == '2' \
+                else 'ListObjects'
+        elif method == 'GET':
+            op = 'GetObject'
+        elif method == 'HEAD':
+            op = 'HeadObject'
+        elif method == 'PUT' and 'uploadId' in q:
+            op = 'UploadPart'
+        elif method == 'PUT':
+            op = 'PutObject'
+        elif method == 'POST' and 'uploads' in q:
+            op = 'CreateMultipartUpload'
+        elif method == 'POST':
+            op = 'CompleteMultipartUpload'
+        elif method == 'DELETE' and 'uploadId' in q:
+            op = 'AbortMultipartUpload'
+        else:
+            op = 'DeleteObject'
+        if 'aws-chunked' in headers.get('Content-Encoding', ''):
+            body = self._decode_chunked(body)
+        try:
+            self._before('s3', op)
+            return getattr(self, '_s3_%s' % op)(
+                bucket, key, q, headers, body
+            )
+        except StandinError as ex:
+            if ex.code == 'Throttling':
+                ex.status, ex.code = 503, 'SlowDown'
+            return ex.status, {'Content-Type': 'application/xml'}, (
+                '<Error><Code>%s</Code><Message>%s</Message></Error>' % (
+                    ex.code, escape(ex.message)
+                )
+            ).encode('utf-8') if op != 'HeadObject' else b''
+
+    @staticmethod
+    def _decode_chunked(body):
+        """
+        Decode an ``aws-chunked`` request body, discarding any trailers.
+        """
+        res = b''
+        while True:
+            line, _, body = body.partition(b'\r\n')
+            size = int(line.split(b';')[0], 16)
+            if size == 0:
+                return res
+            res += body[:size]
+            body = body[size + 2:]
+
+    def _obj(self, bucket, key):
+        if (bucket, key) not in self.s3_objects:
+            raise StandinError(
+                404, 'NoSuchKey', 'The specified key does not exist.'
+            )
+        return self.s3_objects[(bucket, key)]
+
+    def put_object(self, bucket, key, body):
+        """
+        Store an object in the stand-in's S3.
+
+        :param bucket: bucket name
+        :type bucket: str
+        :param key: object key
+        :type key: str
+        :param body: object content
+        :type body: bytes
+        :return: the object's ETag
+        :rtype: str
+        """
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.s3_objects[(bucket, key)] = {
+            'body': body, 'etag': etag, 'last_modified': time.time()
+        }
+        return etag
+
+    @staticmethod
+    def _obj_headers(obj):
+        return {
+            'ETag': obj['etag'],
+            'Last-Modified': formatdate(obj['last_modified'], usegmt=True),
+            'Content-Type': 'binary/octet-stream'
+        }
+
+    def _s3_ListObjects(self, bucket, key, q, headers, body, v2=False):
+        prefix = q.get('prefix', '')
+        after = q.get('continuation-token', q.get('start-after', '')) \
+            if v2 else q.get('marker', '')
+        max_keys = int(q.get('max-keys', '1000'))
+        keys = sorted(
+            k for b, k in list(self.s3_objects.keys())
+            if b == bucket and k.startswith(prefix) and k > after
+        )
+        truncated = len(keys) > max_keys
+        keys = keys[:max_keys]
+        res = '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/' \
+              '2006-03-01/"><Name>%s</Name><Prefix>%s</Prefix>' \
+              '<MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>' % (
+                  escape(bucket), escape(prefix), max_keys,
+                  'true' if truncated else 'false'
+              )
+        if v2:
+            res += '<KeyCount>%d</KeyCount>' % len(keys)
+            if truncated:
+                res += '<NextContinuationToken>%s</NextContinuationToken>' % (
+                    escape(keys[-1])
+                )
+        for k in keys:
+            obj = self.s3_objects[(bucket, k)]
+            res += '<Contents><Key>%s</Key><LastModified>%s</LastModified>' \
+                   '<ETag>%s</ETag><Size>%d</Size><StorageClass>STANDARD' \
+                   '</StorageClass></Contents>' % (
+                       escape(k), datetime.fromtimestamp(
+                           obj['last_modified'], tz=timezone.utc
+                       ).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                       escape(obj['etag']), len(obj['body'])
+                   )
+        return 200, {'Content-Type': 'application/xml'}, (
+            res + '</ListBucketResult>'
+        ).encode('utf-8')
+
+    def _s3_ListObjectsV2(self, bucket, key, q, headers, body):
+        return self._s3_ListObjects(bucket, key, q, headers, body, v2=True)
+
+    def _s3_GetObject(self, bucket, key, q, headers, body):
+        obj = self._obj(bucket, key)
+        if headers.get('If-None-Match') == obj['etag']:
+            return 304, self._obj_headers(obj), b''
+        return 200, self._obj_headers(obj), obj['body']
+
+    def _s3_HeadObject(self, bucket, key, q, headers, body):
+        obj = self._obj(bucket, key)
+        h = self._obj_headers(obj)
+        return 200, h, obj['body']
+
+    def _s3_PutObject(self, bucket, key, q, headers, body):
+        return 200, {'ETag': self.put_object(bucket, key, body)}, b''
+
+    def _s3_DeleteObject(self, bucket, key, q, headers, body):
+        self.s3_objects.pop((bucket, key), None)
+        return 204, {}, b''
+
+    def _s3_CreateMultipartUpload(self, bucket, key, q, headers, body):
+        upload_id = 'upload-%d' % next(self._ids)
+        self._uploads[upload_id] = {}
+        return 200, {'Content-Type': 'application/xml'}, (
+            '<InitiateMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key>'
+            '<UploadId>%s</UploadId></InitiateMultipartUploadResult>' % (
+                escape(bucket), escape(key), upload_id
+            )
+        ).encode('utf-8')
+
+    def _s3_UploadPart(self, bucket, key, q, headers, body):
+        if q['uploadId'] not in self._uploads:
+            raise StandinError(404, 'NoSuchUpload', 'No such upload.')
+        self._uploads[q['uploadId']][int(q['partNumber'])] = body
+        return 200, {'ETag': '"%s"' % hashlib.md5(body).hexdigest()}, b''
+
+    def _s3_CompleteMultipartUpload(self, bucket, key, q, headers, body):
+        parts = self._uploads.pop(q['uploadId'], None)
+        if parts is None:
+            raise StandinError(404, 'NoSuchUpload', 'No such upload.')
+        etag = self.put_object(
+            bucket, key, b''.join(parts[n] for n in sorted(parts))
+        )
+        return 200, {'Content-Type': 'application/xml'}, (
+            '<CompleteMultipartUploadResult><Bucket>%s</Bucket><Key>%s</Key>'
+            '<ETag>%s</ETag></CompleteMultipartUploadResult>' % (
+                escape(bucket), escape(key), escape(etag)
+            )
+        ).encode('utf-8')
+
+    def _s3_AbortMultipartUpload(self, bucket, key, q, headers, body):
+        self._uploads.pop(q['uploadId'], None)
+        return 204, {}, b''
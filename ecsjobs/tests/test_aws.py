@@ -0,0 +1,346 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+from unittest.mock import patch, call, Mock
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from botocore.exceptions import ClientError
+
+from ecsjobs.aws import (
+    ApiAccounting, TokenBucket, RateLimiter, job_context, configure_clients,
+    client_kwargs, client, resource
+)
+
+pbm = 'ecsjobs.aws'
+
+
+class TestApiAccounting(object):
+
+    def setup(self):
+        self.cls = ApiAccounting()
+        self.session = boto3.Session(
+            region_name='us-east-1', aws_access_key_id='a',
+            aws_secret_access_key='s'
+        )
+        self.cls.install(self.session)
+        self.client = self.session.client('ecs')
+        self.stubber = Stubber(self.client)
+
+    def test_install_default_session(self):
+        with patch('%s.boto3' % pbm) as m_boto3:
+            m_boto3.DEFAULT_SESSION = None
+
+            def se_setup():
+                m_boto3.DEFAULT_SESSION = Mock()
+
+            m_boto3.setup_default_session.side_effect = se_setup
+            cls = ApiAccounting()
+            cls.install()
+            cls.install()
+        assert m_boto3.setup_default_session.mock_calls == [call()]
+        assert len(m_boto3.DEFAULT_SESSION.events.register.mock_calls) == 4
+
+    def test_calls_by_job(self):
+        self.stubber.add_response('list_clusters', {'clusterArns': []})
+        self.stubber.add_response('describe_tasks', {'tasks': []})
+        self.stubber.add_response('list_clusters', {'clusterArns': []})
+        with self.stubber:
+            with job_context('j1'):
+                self.client.list_clusters()
+                self.client.describe_tasks(tasks=['t'])
+            self.client.list_clusters()
+        res = self.cls.records
+        for r in res:
+            assert r.pop('latency_sec') >= r.pop('max_latency_sec') >= 0
+        base = {
+            'calls': 1, 'errors': 0, 'retries': 0, 'throttles': 0,
+            'rate_limit_wait_sec': 0.0
+        }
+        assert res == [
+            dict(base, service='ecs', operation='DescribeTasks', job='j1'),
+            dict(base, service='ecs', operation='ListClusters', job=None),
+            dict(base, service='ecs', operation='ListClusters', job='j1')
+        ]
+
+    def test_errors_and_throttles(self):
+        self.stubber.add_client_error(
+            'list_clusters', service_error_code='ThrottlingException',
+            http_status_code=400
+        )
+        self.stubber.add_client_error(
+            'list_clusters', service_error_code='ClusterNotFoundException',
+            http_status_code=400
+        )
+        with self.stubber:
+            for _ in range(2):
+                with pytest.raises(ClientError):
+                    self.client.list_clusters()
+        res = self.cls.records
+        assert len(res) == 1
+        assert res[0]['calls'] == 2
+        assert res[0]['errors'] == 2
+        assert res[0]['throttles'] == 1
+
+    def test_needs_retry(self):
+        state = {'throttles': 0}
+        rd = {'context': {ApiAccounting.CONTEXT_KEY: state}}
+        throttled = (Mock(), {'Error': {'Code': 'ThrottlingException'}})
+        other = (Mock(), {'Error': {'Code': 'InternalError'}})
+        assert self.cls._needs_retry(
+            response=throttled, request_dict=rd
+        ) is None
+        self.cls._needs_retry(response=other, request_dict=rd)
+        self.cls._needs_retry(response=None, request_dict=rd)
+        self.cls._needs_retry(response=throttled, request_dict={})
+        assert state == {'throttles': 1}
+
+    def test_after_call_retries(self):
+        context = {}
+        model = Mock(name='ListClusters')
+        type(model).name = 'ListClusters'
+        model.service_model.service_name = 'ecs'
+        self.cls._before_call(model=model, context=context)
+        context[ApiAccounting.CONTEXT_KEY]['throttles'] = 2
+        self.cls._after_call(
+            http_response=Mock(status_code=200),
+            parsed={'ResponseMetadata': {'RetryAttempts': 2}},
+            context=context
+        )
+        res = self.cls.records[0]
+        assert res['retries'] == 2
+        assert res['throttles'] == 2
+        assert res['errors'] == 0
+
+    def test_after_call_error(self):
+        context = {}
+        model = Mock()
+        type(model).name = 'ListClusters'
+        model.service_model.service_name = 'ecs'
+        self.cls._before_call(model=model, context=context)
+        self.cls._after_call_error(exception=RuntimeError(), context=context)
+        self.cls._after_call_error(exception=RuntimeError(), context={})
+        res = self.cls.records
+        assert len(res) == 1
+        assert res[0]['errors'] == 1
+
+    def test_budgets(self):
+        self.cls.budgets = {'ecs:ListClusters': 1, 'ecs:*': 2}
+        for _ in range(4):
+            self.stubber.add_response('list_clusters', {'clusterArns': []})
+        with self.stubber:
+            with patch('%s.logger' % pbm) as m_logger:
+                for _ in range(4):
+                    self.client.list_clusters()
+        assert m_logger.mock_calls == [
+            call.warning(
+                'AWS API call budget exceeded for %s: %d calls (budget %d)',
+                'ecs:ListClusters', 2, 1
+            ),
+            call.warning(
+                'AWS API call budget exceeded for %s: %d calls (budget %d)',
+                'ecs:*', 3, 2
+            )
+        ]
+
+
+class TestJobContext(object):
+
+    def test_nested(self):
+        cls = ApiAccounting()
+        model = Mock()
+        type(model).name = 'Op'
+        model.service_model.service_name = 'svc'
+        ctxs = [{}, {}, {}]
+        with job_context('a'):
+            with job_context('b'):
+                cls._before_call(model=model, context=ctxs[0])
+            cls._before_call(model=model, context=ctxs[1])
+        cls._before_call(model=model, context=ctxs[2])
+        assert [
+            c[ApiAccounting.CONTEXT_KEY]['job'] for c in ctxs
+        ] == ['b', 'a', None]
+
+
+class TestTokenBucket(object):
+
+    def test_acquire(self):
+        with patch('%s.monotonic' % pbm) as m_mono:
+            with patch('%s.sleep' % pbm) as m_sleep:
+                m_mono.return_value = 100.0
+                cls = TokenBucket(2, 2)
+                waits = [cls.acquire() for _ in range(4)]
+                m_mono.return_value = 103.0
+                waits.append(cls.acquire())
+        assert waits == [0.0, 0.0, 0.5, 1.0, 0.0]
+        assert m_sleep.mock_calls == [call(0.5), call(1.0)]
+
+
+class TestRateLimiter(object):
+
+    def setup(self):
+        self.cls = RateLimiter()
+        self.model = Mock()
+        type(self.model).name = 'RunTask'
+        self.model.service_model.service_name = 'ecs'
+
+    def test_install_default_session(self):
+        with patch('%s.boto3' % pbm) as m_boto3:
+            m_boto3.DEFAULT_SESSION = None
+
+            def se_setup():
+                m_boto3.DEFAULT_SESSION = Mock()
+
+            m_boto3.setup_default_session.side_effect = se_setup
+            self.cls.install()
+            self.cls.install()
+        assert m_boto3.setup_default_session.mock_calls == [call()]
+        assert len(m_boto3.DEFAULT_SESSION.events.register.mock_calls) == 2
+
+    def test_limits(self):
+        self.cls.limits = {
+            'ecs:RunTask': {'rate': 0.5},
+            'ecs:*': {'rate': 2.5},
+            'logs:*': {'rate': 5, 'burst': 20}
+        }
+        assert sorted(self.cls.limits.keys()) == [
+            'ecs:*', 'ecs:RunTask', 'logs:*'
+        ]
+        assert {
+            k: (v.rate, v.burst) for k, v in self.cls._buckets.items()
+        } == {
+            'ecs:RunTask': (0.5, 1),
+            'ecs:*': (2.5, 3),
+            'logs:*': (5, 20)
+        }
+        self.cls.limits = None
+        assert self.cls.limits == {}
+        assert self.cls._buckets == {}
+
+    def test_before_send(self):
+        self.cls.limits = {
+            'ecs:RunTask': {'rate': 1}, 'ecs:*': {'rate': 1},
+            'logs:*': {'rate': 1}
+        }
+        self.cls._buckets['ecs:RunTask'] = Mock()
+        self.cls._buckets['ecs:RunTask'].acquire.return_value = 1.5
+        self.cls._buckets['ecs:*'] = Mock()
+        self.cls._buckets['ecs:*'].acquire.return_value = 0.0
+        self.cls._buckets['logs:*'] = Mock()
+        context = {}
+        self.cls._before_call(model=self.model, context=context)
+        request = Mock(context=context)
+        for _ in range(2):
+            assert self.cls._before_send(request=request) is None
+        assert context[RateLimiter.CONTEXT_KEY]['wait_sec'] == 3.0
+        assert len(self.cls._buckets['ecs:RunTask'].acquire.mock_calls) == 2
+        assert len(self.cls._buckets['ecs:*'].acquire.mock_calls) == 2
+        assert self.cls._buckets['logs:*'].mock_calls == []
+        acct = ApiAccounting()
+        acct._before_call(model=self.model, context=context)
+        acct._after_call_error(context=context)
+        assert acct.records[0]['rate_limit_wait_sec'] == 3.0
+
+    def test_before_send_no_state(self):
+        assert self.cls._before_send(request=Mock(context=None)) is None
+
+
+class TestClientSettings(object):
+
+    def teardown(self):
+        configure_clients(None)
+
+    def test_defaults(self):
+        configure_clients(None)
+        assert client_kwargs('ecs') == {}
+
+    def test_merged(self):
+        configure_clients({
+            'default': {
+                'region_name': 'us-west-2',
+                'connect_timeout': 5,
+                'retry_mode': 'standard'
+            },
+            'ecs': {
+                'endpoint_url': 'https://ecs.example.com',
+                'retry_mode': 'adaptive',
+                'max_attempts': 10,
+                'max_pool_connections': 50
+            }
+        })
+        res = client_kwargs('ecs')
+        conf = res.pop('config')
+        assert res == {
+            'endpoint_url': 'https://ecs.example.com',
+            'region_name': 'us-west-2'
+        }
+        assert conf.connect_timeout == 5
+        assert conf.max_pool_connections == 50
+        assert conf.retries == {'mode': 'adaptive', 'total_max_attempts': 10}
+        res = client_kwargs('logs')
+        conf = res.pop('config')
+        assert res == {'region_name': 'us-west-2'}
+        assert conf.connect_timeout == 5
+        assert conf.retries == {'mode': 'standard'}
+
+    def test_no_botocore_config(self):
+        configure_clients({'s3': {'region_name': 'eu-west-1'}})
+        assert client_kwargs('s3') == {'region_name': 'eu-west-1'}
+
+    def test_client_resource(self):
+        configure_clients({'s3': {'region_name': 'eu-west-1'}})
+        with patch('%s.boto3' % pbm) as m_boto3:
+            assert client('s3') is m_boto3.client.return_value
+            assert resource('s3') is m_boto3.resource.return_value
+        assert m_boto3.mock_calls == [
+            call.client('s3', region_name='eu-west-1'),
+            call.resource('s3', region_name='eu-west-1')
+        ]
+
+    def test_real_client(self):
+        configure_clients({
+            'ecs': {
+                'endpoint_url': 'http://localhost:1234',
+                'region_name': 'us-east-2',
+                'read_timeout': 7
+            }
+        })
+        cli = client('ecs')
+        assert cli.meta.endpoint_url == 'http://localhost:1234'
+        assert cli.meta.region_name == 'us-east-2'
+        assert cli.meta.config.read_timeout == 7
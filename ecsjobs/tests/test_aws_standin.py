@@ -0,0 +1,236 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+from ecsjobs.aws import configure_clients
+from ecsjobs.config import Config
+from ecsjobs.jobs.ecs_task import EcsTask
+from ecsjobs.runner import EcsJobsRunner
+from ecsjobs.tests.support.aws_standin import AwsStandin, TaskScript
+
+
+@pytest.fixture
+def standin():
+    """
+    Yield a running :py:class:`~.AwsStandin`, with botocore pointed at it
+    via the environment and a fresh default boto3 session.
+    """
+    with AwsStandin() as s:
+        env = s.environ()
+        env.pop('ECSJOBS_LOCAL_CONF_PATH', None)
+        with patch.dict(os.environ, env), \
+                patch('boto3.DEFAULT_SESSION', None):
+            yield s
+
+
+def put_config(standin, conf):
+    """
+    Write a config to the stand-in's S3, one file per job, and point ecsjobs
+    at it.
+    """
+    standin.put_object(
+        'confbkt', 'conf/global.yml', yaml.safe_dump(conf['global']).encode()
+    )
+    for j in conf['jobs']:
+        standin.put_object(
+            'confbkt', 'conf/%s.yml' % j['name'], yaml.safe_dump(j).encode()
+        )
+    os.environ['ECSJOBS_BUCKET'] = 'confbkt'
+    os.environ['ECSJOBS_KEY'] = 'conf/'
+
+
+class TestEcsTask(object):
+
+    def test_run_and_poll(self, standin):
+        standin.log_page_size = 10
+        standin.task_scripts['fam'] = TaskScript(
+            statuses=['PENDING', 'RUNNING'], exit_code=3,
+            containers=['a', 'b'], log_lines=25
+        )
+        job = EcsTask(
+            'j1', 'sched', cluster_name='cl', task_definition_family='fam'
+        )
+        job.run()
+        polls = 1
+        while not job.poll():
+            polls += 1
+            assert polls < 10
+        assert polls == 3
+        assert job.exitcode == 3
+        out = job.output.splitlines()
+        assert out[0] == 'Output for container "a" (exitCode 3)'
+        assert len(out) == 54
+        assert out[25].endswith('container a line 24')
+        assert out[27] == 'Output for container "b" (exitCode 3)'
+        assert out[28].endswith('container b line 0')
+        lc = job.lifecycle
+        assert lc['placement_delay_sec'] >= 0
+        assert lc['run_sec'] >= 0
+        assert lc['tasks'][0]['stopped_reason'] == \
+            'Essential container in task exited'
+        assert standin.calls == {
+            'ecs:DescribeTaskDefinition': 1,
+            'ecs:RunTask': 1,
+            'ecs:DescribeTasks': 3,
+            'logs:FilterLogEvents': 6
+        }
+
+    def test_client_settings(self, standin):
+        standin.task_scripts['fam'] = TaskScript(exit_code=0)
+        for k in ['AWS_ENDPOINT_URL_ECS', 'AWS_ENDPOINT_URL_CLOUDWATCH_LOGS']:
+            del os.environ[k]
+        configure_clients({
+            'default': {'endpoint_url': standin.url},
+            'logs': {'retry_mode': 'standard', 'max_attempts': 2}
+        })
+        try:
+            job = EcsTask(
+                'j1', 'sched', cluster_name='cl',
+                task_definition_family='fam'
+            )
+            job.run()
+            while not job.poll():
+                pass
+        finally:
+            configure_clients(None)
+        assert job.exitcode == 0
+        assert job._cw.meta.config.retries == {
+            'mode': 'standard', 'total_max_attempts': 2
+        }
+        assert standin.calls['ecs:RunTask'] == 1
+        assert standin.calls['logs:FilterLogEvents'] == 1
+
+    def test_array(self, standin):
+        standin.task_scripts['fam'] = TaskScript(
+            statuses=['PENDING', 'RUNNING'], exit_code=0, log_lines=2
+        )
+        job = EcsTask(
+            'j1', 'sched', cluster_name='cl', task_definition_family='fam',
+            count=25, max_concurrency=20
+        )
+        job.run()
+        polls = 1
+        while not job.poll():
+            polls += 1
+            assert polls < 20
+        assert job.exitcode == 0
+        assert [s['state'] for s in job.shards] == ['stopped'] * 25
+        assert len(set(s['task_arn'] for s in job.shards)) == 25
+        assert job.output.count('==== Shard ') == 25
+        assert len(job.lifecycle['tasks']) == 25
+        assert standin.calls['ecs:DescribeTaskDefinition'] == 1
+        assert standin.calls['ecs:RunTask'] == 3
+        assert standin.calls['logs:FilterLogEvents'] == 25
+
+    def test_capacity(self, standin):
+        standin.task_scripts['fam'] = TaskScript(
+            statuses=['RUNNING'], exit_code=0, log_lines=1, capacity=4
+        )
+        job = EcsTask(
+            'j1', 'sched', cluster_name='cl', task_definition_family='fam',
+            count=6
+        )
+        with patch.object(EcsTask, 'CAPACITY_BACKOFF_INITIAL_SEC', 0):
+            job.run()
+            assert [s['state'] for s in job.shards] == \
+                ['running'] * 4 + ['pending'] * 2
+            polls = 1
+            while not job.poll():
+                polls += 1
+                assert polls < 10
+        assert job.exitcode == 0
+        assert [s['state'] for s in job.shards] == ['stopped'] * 6
+        assert job.capacity_wait_sec > 0
+        assert standin.calls['ecs:RunTask'] == 3
+
+
+class TestConfig(object):
+
+    def test_load_s3(self, standin):
+        put_config(standin, {
+            'global': {'from_email': 'a@example.com', 'to_email': 'b@ex.com'},
+            'jobs': [
+                {
+                    'name': 'job%d' % i, 'schedule': 's',
+                    'class_name': 'LocalCommand', 'command': 'true'
+                } for i in range(3)
+            ]
+        })
+        conf = Config()
+        assert [j.name for j in conf.jobs] == ['job0', 'job1', 'job2']
+        assert conf.get_global('from_email') == 'a@example.com'
+        assert standin.calls == {'s3:ListObjects': 1, 's3:GetObject': 4}
+
+
+class TestEndToEnd(object):
+
+    def test_run_with_throttling(self, standin):
+        standin.latency = 0.001
+        standin.throttle_rate = {'ecs:DescribeTasks': 0.2}
+        standin.task_scripts['fam3'] = TaskScript(exit_code=1)
+        put_config(standin, {
+            'global': {
+                'from_email': 'a@example.com', 'to_email': 'b@example.com',
+                'inter_poll_sleep_sec': 0
+            },
+            'jobs': [
+                {
+                    'name': 'job%02d' % i, 'schedule': 's',
+                    'class_name': 'EcsTask', 'cluster_name': 'cl',
+                    'task_definition_family': 'fam%d' % i
+                } for i in range(12)
+            ]
+        })
+        with patch('botocore.endpoint.time.sleep'):
+            conf = Config()
+            runner = EcsJobsRunner(conf)
+            runner.run_schedules(['s'])
+        states = [r['state'] for r in runner._reporter.records]
+        assert states == ['succeeded'] * 3 + ['failed'] + ['succeeded'] * 8
+        assert standin.throttled['ecs:DescribeTasks'] > 0
+        assert standin.calls['ecs:RunTask'] == 12
+        assert len(standin.emails) == 1
+        email = standin.emails[0]
+        assert email['operation'] == 'SendEmail'
+        assert email['destinations'] == ['b@example.com']
+        for i in range(12):
+            assert b'job%02d' % i in email['body']
@@ -0,0 +1,240 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import errno
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from ecsjobs.cgroup import CgroupV2
+
+pbm = 'ecsjobs.cgroup'
+pb = '%s.CgroupV2' % pbm
+
+
+class CgroupTester(object):
+
+    @pytest.fixture(autouse=True)
+    def fake_fs(self, tmpdir):
+        self.root = tmpdir.mkdir('cgroup')
+        self.parent = self.root.mkdir('system.slice').mkdir('ecsjobs.service')
+        self.parent.join('cgroup.controllers').write('cpuset cpu io memory\n')
+        self.parent.join('cgroup.subtree_control').write('cpu\n')
+        self.parent.join('cgroup.procs').write('')
+        mounts = tmpdir.join('mounts')
+        mounts.write(
+            'proc /proc proc rw 0 0\n'
+            'cgroup2 %s cgroup2 rw,nosuid 0 0\n' % self.root
+        )
+        proc_cg = tmpdir.join('proc_self_cgroup')
+        proc_cg.write('0::/system.slice/ecsjobs.service\n')
+        with patch('%s.MOUNTS_PATH' % pb, str(mounts)):
+            with patch('%s.PROC_CGROUP_PATH' % pb, str(proc_cg)):
+                self.mounts = mounts
+                yield
+
+
+class TestCreate(CgroupTester):
+
+    def test_controllers(self):
+        assert CgroupV2('foo').controllers == []
+        assert CgroupV2(
+            'foo', cpu_quota=1, memory_max=2, io_weight=3
+        ).controllers == ['cpu', 'memory', 'io']
+
+    def test_create(self):
+        cls = CgroupV2('foo', cpu_quota=0.5, memory_max='512M', io_weight=50)
+        assert cls.create() is True
+        cg = self.parent.join('foo')
+        assert cls.path == str(cg)
+        assert cg.join('cpu.max').read() == '50000 100000'
+        assert cg.join('memory.max').read() == '512M'
+        assert cg.join('io.weight').read() == 'default 50'
+        assert self.parent.join('cgroup.subtree_control').read() == \
+            '+memory +io'
+
+    def test_create_memory_only(self):
+        cls = CgroupV2('foo', memory_max=1048576)
+        assert cls.create() is True
+        cg = self.parent.join('foo')
+        assert cg.join('memory.max').read() == '1048576'
+        assert not cg.join('cpu.max').exists()
+
+    def test_create_moves_processes_to_leaf(self):
+        self.parent.join('cgroup.procs').write('100\n200\n')
+        cls = CgroupV2('foo', memory_max=1024)
+        real_write = cls._write
+        writes = []
+
+        def se_write(path, value):
+            writes.append((os.path.relpath(path, str(self.parent)), value))
+            real_write(path, value)
+
+        with patch.object(cls, '_write', side_effect=se_write):
+            assert cls.create() is True
+        assert writes == [
+            ('runner/cgroup.procs', '100'),
+            ('runner/cgroup.procs', '200'),
+            ('cgroup.subtree_control', '+memory'),
+            ('foo/memory.max', '1024')
+        ]
+        assert self.parent.join('runner').isdir()
+
+    def test_create_leaf_process_exited(self):
+        self.parent.join('cgroup.procs').write('100\n200\n')
+        cls = CgroupV2('foo', memory_max=1024)
+        real_write = cls._write
+
+        def se_write(path, value):
+            if value == '100':
+                raise OSError(errno.ESRCH, 'No such process')
+            real_write(path, value)
+
+        with patch.object(cls, '_write', side_effect=se_write):
+            assert cls.create() is True
+        assert self.parent.join('runner', 'cgroup.procs').read() == '200'
+
+    def test_create_no_move_if_enabled(self):
+        self.parent.join('cgroup.procs').write('100\n')
+        cls = CgroupV2('foo', cpu_quota=1)
+        assert cls.create() is True
+        assert not self.parent.join('runner').exists()
+
+    def test_parent_path_in_leaf(self, tmpdir):
+        tmpdir.join('proc_self_cgroup').write(
+            '0::/system.slice/ecsjobs.service/runner\n'
+        )
+        assert CgroupV2('foo')._parent_path() == str(self.parent)
+
+    def test_no_cgroup2(self):
+        self.mounts.write('proc /proc proc rw 0 0\n')
+        cls = CgroupV2('foo', cpu_quota=1)
+        assert cls.create() is False
+        assert cls.path is None
+
+    def test_missing_controller(self):
+        self.parent.join('cgroup.controllers').write('cpu\n')
+        cls = CgroupV2('foo', memory_max=1024)
+        assert cls.create() is False
+        assert cls.path is None
+        assert not self.parent.join('foo').exists()
+
+    def test_write_failure_cleans_up(self):
+        cls = CgroupV2('foo', cpu_quota=1)
+        real_write = cls._write
+
+        def se_write(path, value):
+            if path.endswith('cpu.max'):
+                raise OSError('EBUSY')
+            real_write(path, value)
+
+        with patch.object(cls, '_write', side_effect=se_write):
+            assert cls.create() is False
+        assert cls.path is None
+        assert not self.parent.join('foo').exists()
+
+
+class TestProcessAndUsage(CgroupTester):
+
+    def setup_cgroup(self):
+        self.cls = CgroupV2('foo', cpu_quota=1)
+        assert self.cls.create() is True
+        self.cg = self.parent.join('foo')
+
+    def test_join(self):
+        self.setup_cgroup()
+        self.cg.join('cgroup.procs').write('')
+        with patch('%s.os.getpid' % pbm) as m_getpid:
+            m_getpid.return_value = 1234
+            self.cls.join()
+        assert self.cg.join('cgroup.procs').read() == '1234'
+
+    def test_join_failure(self):
+        self.setup_cgroup()
+        with pytest.raises(OSError):
+            self.cls.join()
+
+    def test_join_real_process(self):
+        self.setup_cgroup()
+        self.cg.join('cgroup.procs').write('')
+        p = subprocess.run(
+            ['true'], preexec_fn=self.cls.join, stdout=subprocess.PIPE
+        )
+        assert p.returncode == 0
+        assert self.cg.join('cgroup.procs').read() != ''
+
+    def test_kill(self):
+        self.setup_cgroup()
+        self.cls.kill()
+        assert self.cg.join('cgroup.kill').read() == '1'
+
+    def test_usage(self):
+        self.setup_cgroup()
+        self.cg.join('cpu.stat').write(
+            'usage_usec 1500\nuser_usec 1000\nsystem_usec 500\n'
+            'nr_throttled 2\nthrottled_usec 300\n'
+        )
+        self.cg.join('memory.peak').write('4096\n')
+        self.cg.join('memory.events').write('low 0\nhigh 0\noom_kill 1\n')
+        self.cg.join('io.stat').write(
+            '8:0 rbytes=100 wbytes=200 rios=1 wios=2\n'
+            '8:16 rbytes=10 wbytes=20 rios=1 wios=2\n'
+        )
+        assert self.cls.usage() == {
+            'cgroup_cpu_usec': 1500,
+            'cgroup_cpu_throttled_usec': 300,
+            'cgroup_memory_peak_bytes': 4096,
+            'cgroup_oom_kills': 1,
+            'cgroup_io_read_bytes': 110,
+            'cgroup_io_write_bytes': 220
+        }
+
+    def test_usage_missing(self):
+        self.setup_cgroup()
+        assert self.cls.usage() == {}
+
+    def test_remove(self):
+        self.setup_cgroup()
+        for f in os.listdir(str(self.cg)):
+            os.unlink(os.path.join(str(self.cg), f))
+        self.cls.remove()
+        assert not self.cg.exists()
+        assert self.cls.path is None
+        # idempotent
+        self.cls.remove()
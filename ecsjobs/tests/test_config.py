@@ -42,6 +42,7 @@ import pytest
 import yaml
 
 from ecsjobs.config import Config
+from ecsjobs.jobs.local_command import LocalCommand
 
 pbm = 'ecsjobs.config'
 pb = '%s.Config' % pbm
@@ -52,7 +53,7 @@ class ConfigTester(object):
     def setup(self):
         with patch('%s.logger' % pbm, autospec=True) as self.mock_logger:
             with patch(
-                '%s.boto3.resource' % pbm, autospec=True
+                '%s.aws.resource' % pbm, autospec=True
             ) as self.mock_s3:
                 with patch.multiple(
                     '%s.Config' % pbm,
@@ -71,7 +72,7 @@ class TestInit(object):
         m_s3 = Mock()
         with patch('%s.logger' % pbm, autospec=True) as mock_logger:
             with patch(
-                '%s.boto3.resource' % pbm, autospec=True
+                '%s.aws.resource' % pbm, autospec=True
             ) as mock_s3:
                 mock_s3.return_value = m_s3
                 with patch.multiple(
@@ -93,6 +94,9 @@ class TestInit(object):
         assert mocks['_load_config'].mock_calls == [call(cls)]
         assert mocks['_validate_config'].mock_calls == [call(cls)]
         assert mocks['_make_jobs'].mock_calls == [call(cls)]
+        assert [t['name'] for t in cls.timings.records] == [
+            'config.load', 'config.validate', 'config.make_jobs'
+        ]
 
 
 class TestJobs(ConfigTester):
@@ -596,6 +600,37 @@ class TestValidate(ConfigTester):
             call().validate(self.cls._raw_conf)
         ]
 
+    @freeze_time('2017-11-23 12:34:56')
+    def test_validate_output_s3_prefix(self):
+        self.cls._raw_conf = {
+            'global': {
+                'output_s3_bucket': 'bkt'
+            },
+            'jobs': ['one', 'two']
+        }
+        with patch('%s.Schema' % pbm, autospec=True):
+            self.cls._validate_config()
+        assert self.cls._global_conf == {
+            'output_s3_bucket': 'bkt',
+            'output_s3_prefix': 'ecsjobs/2017-11-23T12-34-56/'
+        }
+
+    @freeze_time('2017-11-23 12:34:56')
+    def test_validate_output_s3_prefix_custom(self):
+        self.cls._raw_conf = {
+            'global': {
+                'output_s3_bucket': 'bkt',
+                'output_s3_prefix': 'foo/{date}-'
+            },
+            'jobs': ['one', 'two']
+        }
+        with patch('%s.Schema' % pbm, autospec=True):
+            self.cls._validate_config()
+        assert self.cls._global_conf == {
+            'output_s3_bucket': 'bkt',
+            'output_s3_prefix': 'foo/2017-11-23T12-34-56-'
+        }
+
 
 class TestMakeJobs(ConfigTester):
 
@@ -623,6 +658,47 @@ class TestMakeJobs(ConfigTester):
             'name': 'bar', 'schedule': 's1'
         }
 
+    def test_script_cache(self):
+        jclasses = {
+            'Foo': FakeJob,
+            'LocalCommand': LocalCommand
+        }
+        self.cls._global_conf = {
+            'script_cache_dir': '/cache', 'script_cache_max_bytes': 1234,
+            'script_fetch_timeout_sec': 12
+        }
+        self.cls._raw_conf['jobs'] = [
+            {'class_name': 'Foo', 'name': 'foo', 'schedule': 's1'},
+            {
+                'class_name': 'LocalCommand', 'name': 'bar', 'schedule': 's1',
+                'script_source': 'http://foo'
+            },
+        ]
+        with patch('%s.get_job_classes' % pbm) as mock_gjc:
+            mock_gjc.return_value = jclasses
+            with patch('%s.ScriptCache' % pbm, autospec=True) as m_cache:
+                self.cls._make_jobs()
+        assert m_cache.mock_calls == [call(
+            '/cache', max_bytes=1234, timeout=12
+        )]
+        assert self.cls._script_cache == m_cache.return_value
+        assert self.cls._jobs[1]._script_cache == m_cache.return_value
+        assert self.cls._jobs[1]._script_fetch_timeout == 12
+
+    def test_script_fetch_timeout_no_cache(self):
+        self.cls._global_conf = {'script_fetch_timeout_sec': 7}
+        self.cls._raw_conf['jobs'] = [{
+            'class_name': 'LocalCommand', 'name': 'bar', 'schedule': 's1',
+            'script_source': 'http://foo'
+        }]
+        with patch('%s.get_job_classes' % pbm) as mock_gjc:
+            mock_gjc.return_value = {'LocalCommand': LocalCommand}
+            with patch('%s.ScriptCache' % pbm, autospec=True) as m_cache:
+                self.cls._make_jobs()
+        assert m_cache.mock_calls == []
+        assert self.cls._script_cache is None
+        assert self.cls._jobs[0]._script_fetch_timeout == 7
+
     def test_error(self):
         jclasses = {
             'Foo': FakeJob
@@ -0,0 +1,445 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import json
+import os
+import time
+import threading
+from datetime import datetime, timezone
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import boto3
+import pytest
+from botocore.serialize import create_serializer
+from botocore.stub import Stubber
+from requests.exceptions import HTTPError
+
+from ecsjobs.metrics import PrometheusExporter, CloudWatchMetrics
+
+
+class FakePushgateway(object):
+    """
+    Local HTTP stand-in for a Pushgateway, recording each request.
+    """
+
+    def __init__(self, status=200):
+        self.requests = []
+        self.status = status
+        gw = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                gw.requests.append(
+                    ('PUT', self.path, self.headers['Content-Type'], body)
+                )
+                self.send_response(gw.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def ts(*args):
+    return repr(datetime(*args).timestamp())
+
+
+START = datetime(2017, 11, 23, 12, 00, 00)
+END = datetime(2017, 11, 23, 12, 10, 00)
+END_UTC = END.astimezone(timezone.utc)
+
+RECORDS = [
+    {
+        'name': 'j1', 'class': 'LocalCommand', 'schedule': 'daily',
+        'state': 'succeeded', 'exit_code': 0, 'duration_sec': 12.5,
+        'finish_time': '2017-11-23T12:05:00'
+    },
+    {
+        'name': 'j"2', 'class': 'EcsTask', 'schedule': 'daily',
+        'state': 'failed', 'exit_code': 2, 'duration_sec': 3.0,
+        'finish_time': '2017-11-23T12:06:00'
+    },
+    {
+        'name': 'j3', 'class': 'EcsTask', 'schedule': 'daily',
+        'state': 'skipped', 'exit_code': None, 'duration_sec': None,
+        'finish_time': None
+    },
+    {
+        'name': 'j4', 'class': 'DockerExec', 'schedule': 'daily',
+        'state': 'unfinished', 'exit_code': None, 'duration_sec': None,
+        'finish_time': None
+    }
+]
+
+J1 = 'class="LocalCommand",job_name="j1",schedule="daily"'
+J2 = 'class="EcsTask",job_name="j\\"2",schedule="daily"'
+J4 = 'class="DockerExec",job_name="j4",schedule="daily"'
+
+LIFECYCLE_REC = {
+    'name': 'j5', 'class': 'EcsTask', 'schedule': 'daily',
+    'state': 'succeeded', 'exit_code': None, 'duration_sec': None,
+    'finish_time': '2017-11-23T12:07:00',
+    'lifecycle': {
+        'placement_delay_sec': 30.0, 'image_pull_sec': None,
+        'run_sec': 60.5, 'stop_detection_sec': 4.0, 'tasks': []
+    }
+}
+
+
+class TestRender(object):
+
+    def test_render(self):
+        res = PrometheusExporter().render(RECORDS, START, END)
+        assert res == '\n'.join([
+            '# HELP ecsjobs_job_duration_seconds Duration of the most recent '
+            'run of the job.',
+            '# TYPE ecsjobs_job_duration_seconds gauge',
+            'ecsjobs_job_duration_seconds{%s} 12.5' % J1,
+            'ecsjobs_job_duration_seconds{%s} 3.0' % J2,
+            '# HELP ecsjobs_job_exit_code Exit code (or 0/1 status) of the '
+            'most recent run of the job.',
+            '# TYPE ecsjobs_job_exit_code gauge',
+            'ecsjobs_job_exit_code{%s} 0' % J1,
+            'ecsjobs_job_exit_code{%s} 2' % J2,
+            '# HELP ecsjobs_job_success Whether the most recent run of the '
+            'job succeeded.',
+            '# TYPE ecsjobs_job_success gauge',
+            'ecsjobs_job_success{%s} 1' % J1,
+            'ecsjobs_job_success{%s} 0' % J2,
+            'ecsjobs_job_success{%s} 0' % J4,
+            '# HELP ecsjobs_job_last_success_timestamp_seconds Time the job '
+            'most recently finished successfully.',
+            '# TYPE ecsjobs_job_last_success_timestamp_seconds gauge',
+            'ecsjobs_job_last_success_timestamp_seconds{%s} %s' % (
+                J1, ts(2017, 11, 23, 12, 5, 0)
+            ),
+            '# HELP ecsjobs_run_jobs Number of jobs in the run, by state.',
+            '# TYPE ecsjobs_run_jobs gauge',
+            'ecsjobs_run_jobs{state="exception"} 0',
+            'ecsjobs_run_jobs{state="failed"} 1',
+            'ecsjobs_run_jobs{state="skipped"} 1',
+            'ecsjobs_run_jobs{state="succeeded"} 1',
+            'ecsjobs_run_jobs{state="unfinished"} 1',
+            '# HELP ecsjobs_run_failures Whether any job in the run failed, '
+            'raised an exception or was unfinished.',
+            '# TYPE ecsjobs_run_failures gauge',
+            'ecsjobs_run_failures 1',
+            '# HELP ecsjobs_run_duration_seconds Duration of the run.',
+            '# TYPE ecsjobs_run_duration_seconds gauge',
+            'ecsjobs_run_duration_seconds 600.0',
+            '# HELP ecsjobs_run_start_timestamp_seconds Time the run started.',
+            '# TYPE ecsjobs_run_start_timestamp_seconds gauge',
+            'ecsjobs_run_start_timestamp_seconds %s' % ts(
+                2017, 11, 23, 12, 0, 0
+            ),
+            '# HELP ecsjobs_run_end_timestamp_seconds Time the run finished.',
+            '# TYPE ecsjobs_run_end_timestamp_seconds gauge',
+            'ecsjobs_run_end_timestamp_seconds %s' % ts(
+                2017, 11, 23, 12, 10, 0
+            ),
+            ''
+        ])
+
+    def test_render_lifecycle(self):
+        res = PrometheusExporter().render(
+            RECORDS + [LIFECYCLE_REC], START, END
+        )
+        j5 = 'class="EcsTask",job_name="j5",schedule="daily"'
+        assert '\n'.join([
+            '# HELP ecsjobs_job_placement_delay_seconds Time from ECS Task '
+            'creation until image pull or start.',
+            '# TYPE ecsjobs_job_placement_delay_seconds gauge',
+            'ecsjobs_job_placement_delay_seconds{%s} 30.0' % j5,
+            '# HELP ecsjobs_job_task_run_seconds Time from ECS Task start '
+            'until stopping.',
+            '# TYPE ecsjobs_job_task_run_seconds gauge',
+            'ecsjobs_job_task_run_seconds{%s} 60.5' % j5,
+            '# HELP ecsjobs_job_stop_detection_seconds Time from ECS Task '
+            'stop until ecsjobs observed it.',
+            '# TYPE ecsjobs_job_stop_detection_seconds gauge',
+            'ecsjobs_job_stop_detection_seconds{%s} 4.0' % j5,
+            '# HELP ecsjobs_run_jobs '
+        ]) in res
+        assert 'ecsjobs_job_image_pull_seconds' not in res
+
+    def test_render_no_lifecycle(self):
+        res = PrometheusExporter().render(RECORDS, START, END)
+        assert 'ecsjobs_job_placement_delay_seconds' not in res
+
+    def test_render_no_failures(self):
+        res = PrometheusExporter().render(RECORDS[:1], START, END)
+        assert 'ecsjobs_run_failures 0\n' in res
+
+
+class TestTextfile(object):
+
+    def test_export_carries_over_last_success(self, tmpdir):
+        path = str(tmpdir.join('ecsjobs.prom'))
+        cls = PrometheusExporter(textfile_path=path)
+        cls.export(RECORDS, START, END)
+        # second run: j1 fails, j2 succeeds
+        records = [dict(x) for x in RECORDS[:2]]
+        records[0]['state'] = 'failed'
+        records[0]['exit_code'] = 1
+        records[1]['state'] = 'succeeded'
+        records[1]['exit_code'] = 0
+        records[1]['finish_time'] = '2017-11-24T12:06:00'
+        cls.export(records, START, END)
+        with open(path, 'r') as fh:
+            content = fh.read()
+        assert 'ecsjobs_job_last_success_timestamp_seconds{%s} %s\n' % (
+            J1, ts(2017, 11, 23, 12, 5, 0)
+        ) in content
+        assert 'ecsjobs_job_last_success_timestamp_seconds{%s} %s\n' % (
+            J2, ts(2017, 11, 24, 12, 6, 0)
+        ) in content
+        assert 'ecsjobs_job_success{%s} 0\n' % J1 in content
+        assert os.listdir(str(tmpdir)) == ['ecsjobs.prom']
+        assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+
+    def test_write_failure_cleans_up(self, tmpdir):
+        path = str(tmpdir.join('ecsjobs.prom'))
+        cls = PrometheusExporter(textfile_path=path)
+        with pytest.raises(TypeError):
+            cls.write_textfile(None)
+        assert os.listdir(str(tmpdir)) == []
+
+
+class TestPush(object):
+
+    def setup(self):
+        self.gw = FakePushgateway()
+
+    def teardown(self):
+        self.gw.stop()
+
+    def test_push(self):
+        cls = PrometheusExporter(
+            pushgateway_url=self.gw.url + '/', pushgateway_job='ecs/jobs'
+        )
+        cls.export(RECORDS, START, END)
+        assert len(self.gw.requests) == 1
+        method, path, ctype, body = self.gw.requests[0]
+        assert method == 'PUT'
+        assert path == '/metrics/job/ecs%2Fjobs'
+        assert ctype == 'text/plain; version=0.0.4; charset=utf-8'
+        assert body.decode('utf-8') == cls.render(RECORDS, START, END)
+
+    def test_push_error(self):
+        self.gw.status = 400
+        cls = PrometheusExporter(pushgateway_url=self.gw.url)
+        with pytest.raises(HTTPError):
+            cls.push('foo 1\n')
+
+
+class TestCloudWatch(object):
+
+    def setup(self):
+        self.client = boto3.client(
+            'cloudwatch', region_name='us-east-1',
+            aws_access_key_id='a', aws_secret_access_key='s'
+        )
+        self.stubber = Stubber(self.client)
+        self.cls = CloudWatchMetrics(
+            'ecsjobs', dimensions={'Env': 'test'}, client=self.client
+        )
+        for rec in RECORDS:
+            self.cls.add_job(rec, default_dt=END)
+
+    def dims(self, name, cls):
+        return [
+            {'Name': 'Env', 'Value': 'test'},
+            {'Name': 'JobName', 'Value': name},
+            {'Name': 'Schedule', 'Value': 'daily'},
+            {'Name': 'Class', 'Value': cls}
+        ]
+
+    def expected(self):
+        d1 = self.dims('j1', 'LocalCommand')
+        d2 = self.dims('j"2', 'EcsTask')
+        d4 = self.dims('j4', 'DockerExec')
+        t1 = datetime(2017, 11, 23, 12, 5, 0).astimezone(timezone.utc)
+        t2 = datetime(2017, 11, 23, 12, 6, 0).astimezone(timezone.utc)
+        env = [{'Name': 'Env', 'Value': 'test'}]
+        res = [
+            {'MetricName': 'JobDuration', 'Dimensions': d1, 'Timestamp': t1,
+             'Value': 12.5, 'Unit': 'Seconds'},
+            {'MetricName': 'JobExitCode', 'Dimensions': d1, 'Timestamp': t1,
+             'Value': 0, 'Unit': 'None'},
+            {'MetricName': 'JobSuccess', 'Dimensions': d1, 'Timestamp': t1,
+             'Value': 1, 'Unit': 'Count'},
+            {'MetricName': 'JobDuration', 'Dimensions': d2, 'Timestamp': t2,
+             'Value': 3.0, 'Unit': 'Seconds'},
+            {'MetricName': 'JobExitCode', 'Dimensions': d2, 'Timestamp': t2,
+             'Value': 2, 'Unit': 'None'},
+            {'MetricName': 'JobSuccess', 'Dimensions': d2, 'Timestamp': t2,
+             'Value': 0, 'Unit': 'Count'},
+            {'MetricName': 'JobSuccess', 'Dimensions': d4, 'Timestamp': END_UTC,
+             'Value': 0, 'Unit': 'Count'},
+            {'MetricName': 'RunDuration', 'Dimensions': env,
+             'Timestamp': END_UTC, 'Unit': 'Seconds', 'Value': 600.0}
+        ]
+        for state, count in [
+            ('exception', 0), ('failed', 1), ('skipped', 1),
+            ('succeeded', 1), ('unfinished', 1)
+        ]:
+            res.append({
+                'MetricName': 'JobCount', 'Timestamp': END_UTC,
+                'Dimensions': env + [{'Name': 'State', 'Value': state}],
+                'Value': count, 'Unit': 'Count'
+            })
+        res.append({
+            'MetricName': 'JobDuration', 'Dimensions': env,
+            'Timestamp': END_UTC,
+            'Unit': 'Seconds', 'StatisticValues': {
+                'SampleCount': 2, 'Sum': 15.5, 'Minimum': 3.0, 'Maximum': 12.5
+            }
+        })
+        res.append({
+            'MetricName': 'JobExitCode', 'Dimensions': env,
+            'Timestamp': END_UTC,
+            'Unit': 'None', 'Values': [0.0, 2.0], 'Counts': [1.0, 1.0]
+        })
+        return res
+
+    def test_num_jobs(self):
+        assert self.cls.num_jobs == 4
+
+    @pytest.fixture
+    def tokyo_tz(self):
+        orig = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Tokyo'
+        time.tzset()
+        yield
+        if orig is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = orig
+        time.tzset()
+
+    def test_timestamps_non_utc(self, tokyo_tz):
+        cls = CloudWatchMetrics('ecsjobs', client=self.client)
+        cls.add_job(RECORDS[0])
+        data = cls._data[:1] + cls._run_data(START, END)[:1]
+        req = create_serializer('query').serialize_to_request(
+            {'Namespace': 'ecsjobs', 'MetricData': data},
+            self.client.meta.service_model.operation_model('PutMetricData')
+        )
+        # naive datetimes are local (UTC+9) time
+        assert req['body']['MetricData.member.1.Timestamp'] == \
+            '2017-11-23T03:05:00Z'
+        assert req['body']['MetricData.member.2.Timestamp'] == \
+            '2017-11-23T03:10:00Z'
+
+    def test_add_job_lifecycle(self):
+        cls = CloudWatchMetrics('ecsjobs', client=self.client)
+        cls.add_job(LIFECYCLE_REC)
+        t = datetime(2017, 11, 23, 12, 7, 0).astimezone(timezone.utc)
+        d = [
+            {'Name': 'JobName', 'Value': 'j5'},
+            {'Name': 'Schedule', 'Value': 'daily'},
+            {'Name': 'Class', 'Value': 'EcsTask'}
+        ]
+        assert cls._data[1:] == [
+            {'MetricName': 'JobPlacementDelay', 'Dimensions': d,
+             'Timestamp': t, 'Value': 30.0, 'Unit': 'Seconds'},
+            {'MetricName': 'JobTaskRun', 'Dimensions': d,
+             'Timestamp': t, 'Value': 60.5, 'Unit': 'Seconds'},
+            {'MetricName': 'JobStopDetection', 'Dimensions': d,
+             'Timestamp': t, 'Value': 4.0, 'Unit': 'Seconds'}
+        ]
+
+    def test_flush(self):
+        self.stubber.add_response(
+            'put_metric_data', {},
+            {'Namespace': 'ecsjobs', 'MetricData': self.expected()}
+        )
+        with self.stubber:
+            assert self.cls.flush(START, END) == 1
+        self.stubber.assert_no_pending_responses()
+
+    def test_flush_batches(self):
+        self.cls.MAX_DATUMS_PER_CALL = 6
+        data = self.expected()
+        for i in range(0, len(data), 6):
+            self.stubber.add_response(
+                'put_metric_data', {},
+                {'Namespace': 'ecsjobs', 'MetricData': data[i:i + 6]}
+            )
+        with self.stubber:
+            assert self.cls.flush(START, END) == 3
+        self.stubber.assert_no_pending_responses()
+
+    def test_batches_payload_size(self):
+        self.cls.MAX_PAYLOAD_BYTES = 400
+        data = self.expected()
+        batches = list(self.cls._batches(data))
+        assert len(batches) > 1
+        assert [d for b in batches for d in b] == data
+        for b in batches:
+            size = sum(len(json.dumps(d, default=str)) for d in b)
+            assert len(b) == 1 or size <= 400
+
+    def test_exit_code_values_chunked(self):
+        cls = CloudWatchMetrics('ecsjobs')
+        cls.MAX_VALUES_PER_DATUM = 2
+        for code in [3, 1, 2, 1]:
+            cls.add_job({
+                'name': 'j', 'state': 'failed', 'exit_code': code,
+                'duration_sec': None, 'finish_time': None
+            }, default_dt=END)
+        res = [
+            d for d in cls._run_data(START, END)
+            if d['MetricName'] == 'JobExitCode'
+        ]
+        assert [(d['Values'], d['Counts']) for d in res] == [
+            ([1.0, 2.0], [2.0, 1.0]),
+            ([3.0], [1.0])
+        ]
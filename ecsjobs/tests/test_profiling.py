@@ -0,0 +1,108 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import pstats
+import tracemalloc
+from unittest.mock import patch
+
+from ecsjobs import profiling
+
+pbm = 'ecsjobs.profiling'
+
+
+def busy():
+    return sum(i * i for i in range(10000))
+
+
+class TestProfiling(object):
+
+    def teardown(self):
+        profiling.stop()
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def test_disabled(self):
+        with patch('%s.tracemalloc' % pbm) as m_tm:
+            profiling.start()
+            profiling.snapshot('foo')
+            profiling.stop()
+        assert m_tm.mock_calls == []
+        assert profiling._profiler is None
+        assert profiling._memory_tracker is None
+
+    def test_profile(self, tmpdir):
+        path = str(tmpdir.join('ecsjobs.prof'))
+        profiling.start(profile_path=path, top=5)
+        busy()
+        profiling.stop()
+        assert profiling._profiler is None
+        stats = pstats.Stats(path)
+        assert any(
+            k[2] == 'busy' for k in stats.stats.keys()
+        )
+        with open(path + '.txt', 'r') as fh:
+            summary = fh.read()
+        assert 'cumulative' in summary
+        assert 'busy' in summary
+
+    def test_tracemalloc(self, tmpdir):
+        path = str(tmpdir.join('mem.txt'))
+        profiling.start(tracemalloc_path=path, top=3)
+        assert tracemalloc.is_tracing()
+        data = ['x' * 1000 for _ in range(1000)]  # noqa
+        profiling.snapshot('job:foo')
+        del data
+        profiling.stop()
+        assert not tracemalloc.is_tracing()
+        assert profiling._memory_tracker is None
+        with open(path, 'r') as fh:
+            content = fh.read()
+        sections = content.strip().split('\n\n')
+        assert [s.split(' ')[1] for s in sections] == [
+            'start', 'job:foo', 'end'
+        ]
+        assert 'previous snapshot' not in sections[0]
+        assert 'Top 3 changes since previous snapshot' in sections[1]
+        assert 'test_profiling.py' in sections[1]
+        assert 'tracemalloc.py' not in content
+
+    def test_tracemalloc_truncates(self, tmpdir):
+        path = tmpdir.join('mem.txt')
+        path.write('old content\n')
+        profiling.start(tracemalloc_path=str(path))
+        profiling.stop()
+        assert 'old content' not in path.read()
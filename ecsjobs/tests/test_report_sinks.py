@@ -0,0 +1,568 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import gzip
+import json
+import time
+import threading
+import tracemalloc
+from io import BytesIO
+from tempfile import TemporaryFile
+from datetime import datetime
+from email import message_from_bytes
+from unittest.mock import patch, Mock, call
+
+import pytest
+
+from ecsjobs.report_sinks import (
+    RunReport, ReportSink, SesSink, FileSink, S3Sink, WebhookSink, JsonSink,
+    CommandSink, make_sinks, deliver_all
+)
+
+pbm = 'ecsjobs.report_sinks'
+
+
+class SinkTester(object):
+
+    def setup(self):
+        self.client = Mock()
+        self.config = Mock()
+        self.to_email = ['to1@foo.com', 'to2@foo.com']
+        self.email_max_bytes = None
+
+        def se_conf_get(k):
+            if k == 'from_email':
+                return 'from@example.com'
+            elif k == 'to_email':
+                return self.to_email
+            elif k == 'email_max_bytes':
+                return self.email_max_bytes
+            return None
+
+        self.config.get_global.side_effect = se_conf_get
+        self.report = RunReport(
+            '<p>report</p>', 'MySubject', [{'name': 'j1', 'state': 'failed'}],
+            datetime(2017, 11, 23, 12, 00, 00),
+            datetime(2017, 11, 23, 12, 1, 30), True
+        )
+
+
+class FakeSink(ReportSink):
+
+    def __init__(self, config, results=None, delay=0, **kwargs):
+        super(FakeSink, self).__init__(config, **kwargs)
+        self.results = results if results is not None else [None]
+        self.delay = delay
+        self.calls = 0
+
+    def deliver(self, report):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        res = self.results.pop(0)
+        if res is not None:
+            raise res
+
+
+class TestRunReport(SinkTester):
+
+    def test_as_dict(self):
+        assert self.report.as_dict() == {
+            'subject': 'MySubject',
+            'start_time': '2017-11-23T12:00:00',
+            'end_time': '2017-11-23T12:01:30',
+            'duration_sec': 90.0,
+            'have_failures': True,
+            'timings': [],
+            'api_calls': [],
+            'jobs': [{'name': 'j1', 'state': 'failed'}]
+        }
+        assert self.report.attachments == []
+
+    def test_as_dict_timings(self):
+        t = [{'name': 'run.poll', 'wall_sec': 1.0}]
+        report = RunReport(
+            '<p>report</p>', 'MySubject', [],
+            datetime(2017, 11, 23, 12, 00, 00),
+            datetime(2017, 11, 23, 12, 1, 30), False, timings=t
+        )
+        assert report.as_dict()['timings'] == t
+
+
+class TestReportSink(SinkTester):
+
+    def test_abstract(self):
+        class IncompleteSink(ReportSink):
+            pass
+
+        with pytest.raises(TypeError):
+            ReportSink(self.config)
+        with pytest.raises(TypeError):
+            IncompleteSink(self.config)
+
+    def test_run_success(self):
+        s = FakeSink(self.config)
+        s.run(self.report)
+        assert s.calls == 1
+        assert s.exception is None
+
+    def test_run_retry(self):
+        exc = RuntimeError('foo')
+        s = FakeSink(
+            self.config, results=[exc, None], retries=2, retry_delay_sec=3
+        )
+        with patch('%s.time.sleep' % pbm) as m_sleep:
+            s.run(self.report)
+        assert s.calls == 2
+        assert s.exception is None
+        assert m_sleep.mock_calls == [call(3)]
+
+    def test_run_retries_exhausted(self):
+        exc1 = RuntimeError('foo')
+        exc2 = RuntimeError('bar')
+        s = FakeSink(
+            self.config, results=[exc1, exc2], retries=1, retry_delay_sec=3
+        )
+        with patch('%s.time.sleep' % pbm) as m_sleep:
+            s.run(self.report)
+        assert s.calls == 2
+        assert s.exception == exc2
+        assert m_sleep.mock_calls == [call(3)]
+
+    def test_run_no_retry_past_timeout(self):
+        exc = RuntimeError('foo')
+        s = FakeSink(
+            self.config, results=[exc, None], retries=2, retry_delay_sec=30,
+            timeout_sec=10
+        )
+        with patch('%s.time.sleep' % pbm) as m_sleep:
+            s.run(self.report)
+        assert s.calls == 1
+        assert s.exception == exc
+        assert m_sleep.mock_calls == []
+
+
+class TestDeliverAll(SinkTester):
+
+    def test_parallel(self):
+        exc = RuntimeError('foo')
+        s1 = FakeSink(self.config, delay=0.2)
+        s2 = FakeSink(self.config, results=[exc], delay=0.2)
+        s3 = FakeSink(self.config, delay=0.2)
+        start = time.time()
+        res = deliver_all([s1, s2, s3], self.report)
+        assert time.time() - start < 0.5
+        assert res == [(s2, exc)]
+        assert [s.calls for s in [s1, s2, s3]] == [1, 1, 1]
+
+    def test_timeout(self):
+        done = threading.Event()
+
+        class SlowSink(FakeSink):
+
+            def deliver(self, report):
+                done.wait(5)
+
+        s1 = FakeSink(self.config)
+        s2 = SlowSink(self.config, timeout_sec=0.2)
+        start = time.time()
+        res = deliver_all([s2, s1], self.report)
+        assert s2.running is True
+        assert s1.running is False
+        done.set()
+        assert time.time() - start < 1
+        assert len(res) == 1
+        assert res[0][0] == s2
+        assert str(res[0][1]) == 'ERROR: Report sink <SlowSink> timed out ' \
+                                 'after 0.2 seconds'
+        assert s1.calls == 1
+        for _ in range(100):
+            if not s2.running:
+                break
+            time.sleep(0.01)
+        assert s2.running is False
+
+
+class TestMakeSinks(SinkTester):
+
+    def test_default(self):
+        with patch('%s.aws.client' % pbm) as m_client:
+            res = make_sinks(self.config)
+        assert len(res) == 1
+        assert isinstance(res[0], SesSink)
+        assert res[0].timeout_sec == 300
+        assert res[0].retries == 0
+        assert m_client.mock_calls == [call('ses')]
+
+    def test_configured(self):
+        self.config.get_global.side_effect = {
+            'report_sinks': [
+                {'type': 'file', 'path': '/foo', 'timeout_sec': 5},
+                {'type': 'json', 'retries': 3, 'retry_delay_sec': 1.5},
+                {'type': 'webhook', 'url': 'http://x'}
+            ]
+        }.get
+        res = make_sinks(self.config)
+        assert [type(x) for x in res] == [FileSink, JsonSink, WebhookSink]
+        assert res[0]._path == '/foo'
+        assert res[0].timeout_sec == 5
+        assert res[1]._path == '-'
+        assert res[1].retries == 3
+        assert res[1].retry_delay_sec == 1.5
+        assert res[2]._url == 'http://x'
+
+    def test_run_result(self):
+        self.config.get_global.side_effect = {
+            'report_sinks': [{'type': 'file', 'path': '/foo'}],
+            'run_result_path': '/bar.jsonl',
+            'run_result_format': 'jsonl'
+        }.get
+        res = make_sinks(self.config)
+        assert [type(x) for x in res] == [FileSink, JsonSink]
+        assert res[1]._path == '/bar.jsonl'
+        assert res[1]._format == 'jsonl'
+
+    def test_run_result_default(self):
+        self.config.get_global.side_effect = {
+            'run_result_path': '-'
+        }.get
+        with patch('%s.aws.client' % pbm):
+            res = make_sinks(self.config)
+        assert [type(x) for x in res] == [SesSink, JsonSink]
+        assert res[1]._path == '-'
+        assert res[1]._format == 'json'
+
+    def test_unknown(self):
+        self.config.get_global.side_effect = {
+            'report_sinks': [{'type': 'foo'}]
+        }.get
+        with pytest.raises(RuntimeError) as exc:
+            make_sinks(self.config)
+        assert str(exc.value) == 'ERROR: Unknown report sink type "foo"'
+
+
+class TestSesSink(SinkTester):
+
+    def setup(self):
+        super(TestSesSink, self).setup()
+        with patch('%s.aws.client' % pbm) as m_client:
+            m_client.return_value = self.client
+            self.cls = SesSink(self.config)
+
+    def _attachment(self, name, content):
+        fh = BytesIO(gzip.compress(content.encode('utf-8')))
+        fh.seek(0, 2)
+        self.report.attachments.append((name, fh))
+
+    def _sent(self):
+        assert len(self.client.mock_calls) == 1
+        name, args, kwargs = self.client.mock_calls[0]
+        assert name == 'send_raw_email'
+        assert args == ()
+        assert kwargs['Source'] == 'from@example.com'
+        assert kwargs['Destinations'] == ['to1@foo.com', 'to2@foo.com']
+        return message_from_bytes(kwargs['RawMessage']['Data'])
+
+    def test_deliver(self):
+        self.to_email = 'to1@foo.com'
+        self.cls.deliver(self.report)
+        assert self.client.mock_calls == [
+            call.send_email(
+                Source='from@example.com',
+                Destination={
+                    'ToAddresses': ['to1@foo.com']
+                },
+                Message={
+                    'Subject': {
+                        'Data': 'MySubject',
+                        'Charset': 'utf-8'
+                    },
+                    'Body': {
+                        'Html': {
+                            'Data': '<p>report</p>',
+                            'Charset': 'utf-8'
+                        }
+                    }
+                },
+                ReturnPath='from@example.com'
+            )
+        ]
+
+    def test_deliver_only_if_problems(self):
+        self.report.have_failures = False
+        self.report.only_email_if_problems = True
+        self.cls.deliver(self.report)
+        assert self.client.mock_calls == []
+
+    def test_deliver_raw(self):
+        self._attachment('a.txt.gz', 'aaa')
+        self._attachment('b.txt.gz', 'bbb')
+        self.cls.deliver(self.report)
+        msg = self._sent()
+        assert msg['Subject'] == 'MySubject'
+        assert msg['From'] == 'from@example.com'
+        assert msg['To'] == 'to1@foo.com, to2@foo.com'
+        parts = msg.get_payload()
+        assert len(parts) == 3
+        assert parts[0].get_content_type() == 'text/html'
+        assert parts[0].get_payload(decode=True) == b'<p>report</p>'
+        assert parts[1].get_content_type() == 'application/gzip'
+        assert parts[1].get_filename() == 'a.txt.gz'
+        assert gzip.decompress(parts[1].get_payload(decode=True)) == b'aaa'
+        assert parts[2].get_filename() == 'b.txt.gz'
+        assert gzip.decompress(parts[2].get_payload(decode=True)) == b'bbb'
+
+    def test_serialize_streams_attachments(self):
+        content = os.urandom(8 * 1024 * 1024)
+        with TemporaryFile() as fh:
+            fh.write(content)
+            tracemalloc.start()
+            try:
+                raw = self.cls._serialize(
+                    self.report, ['to1@foo.com'], '<p>report</p>',
+                    [('a.txt.gz', fh)]
+                )
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        with raw:
+            raw.seek(0)
+            msg = message_from_bytes(raw.read())
+        assert peak < len(content) / 4
+        parts = msg.get_payload()
+        assert parts[1].get_filename() == 'a.txt.gz'
+        assert parts[1].get_payload(decode=True) == content
+
+    def test_deliver_raw_over_budget(self):
+        self.email_max_bytes = 1800
+        self._attachment('a.txt.gz', 'aaa')
+        self.report.attachments.append(('b.txt.gz', BytesIO(b'b' * 3000)))
+        self._attachment('c.txt.gz', 'ccc')
+        self.cls.deliver(self.report)
+        assert self.report.html == '<p>report</p>'
+        msg = self._sent()
+        parts = msg.get_payload()
+        assert [p.get_filename() for p in parts] == [
+            None, 'a.txt.gz', 'c.txt.gz'
+        ]
+        assert parts[0].get_payload(decode=True).decode('utf-8') == \
+            '<p>report</p><p>Full output not attached (message size ' \
+            'limit of 1800 bytes): b.txt.gz</p>'
+
+    def test_deliver_raw_measured_over_budget(self):
+        # estimates fit, but the serialized message does not
+        self.cls.MIME_PART_OVERHEAD_BYTES = 0
+        self._attachment('a.txt.gz', 'aaa')
+        self._attachment('b.txt.gz', 'bbb')
+        with self.cls._build_message(self.report, self.to_email)[2] as raw:
+            self.email_max_bytes = raw.tell() - 1
+        self.cls.deliver(self.report)
+        msg = self._sent()
+        parts = msg.get_payload()
+        assert [p.get_filename() for p in parts] == [None, 'a.txt.gz']
+        assert parts[0].get_payload(decode=True).decode('utf-8') == \
+            '<p>report</p><p>Full output not attached (message size ' \
+            'limit of %d bytes): b.txt.gz</p>' % self.email_max_bytes
+
+    def test_deliver_all_omitted(self):
+        self.email_max_bytes = 1400
+        self.report.attachments.append(('a.txt.gz', BytesIO(b'a' * 3000)))
+        self.cls.deliver(self.report)
+        assert self.client.mock_calls == [
+            call.send_email(
+                Source='from@example.com',
+                Destination={
+                    'ToAddresses': ['to1@foo.com', 'to2@foo.com']
+                },
+                Message={
+                    'Subject': {
+                        'Data': 'MySubject',
+                        'Charset': 'utf-8'
+                    },
+                    'Body': {
+                        'Html': {
+                            'Data': '<p>report</p><p>Full output not '
+                                    'attached (message size limit of 1400 '
+                                    'bytes): a.txt.gz</p>',
+                            'Charset': 'utf-8'
+                        }
+                    }
+                },
+                ReturnPath='from@example.com'
+            )
+        ]
+
+    def test_deliver_too_large(self):
+        self.email_max_bytes = 100
+        with pytest.raises(RuntimeError) as exc:
+            self.cls.deliver(self.report)
+        assert str(exc.value).startswith('ERROR: Report email is ')
+        assert str(exc.value).endswith(
+            'bytes, larger than email_max_bytes (100) even without '
+            'attachments'
+        )
+        assert self.client.mock_calls == []
+
+    def test_encoded_size(self):
+        self.cls.MIME_PART_OVERHEAD_BYTES = 0
+        assert self.cls._encoded_size(0) == 0
+        assert self.cls._encoded_size(3) == 4
+        assert self.cls._encoded_size(57) == 78
+
+
+class TestFileSink(SinkTester):
+
+    def test_deliver(self, tmpdir):
+        path = str(tmpdir.join('report-{date}.html'))
+        FileSink(self.config, path).deliver(self.report)
+        with open(
+            str(tmpdir.join('report-2017-11-23T12-00-00.html')), 'r'
+        ) as fh:
+            assert fh.read() == '<p>report</p>'
+
+
+class TestS3Sink(SinkTester):
+
+    def test_deliver(self):
+        with patch('%s.aws.client' % pbm) as m_client:
+            cls = S3Sink(self.config, 'bkt', key='foo/{date}.html')
+        assert m_client.mock_calls == [call('s3')]
+        cls.deliver(self.report)
+        assert m_client.return_value.mock_calls == [
+            call.put_object(
+                Bucket='bkt', Key='foo/2017-11-23T12-00-00.html',
+                Body=b'<p>report</p>', ContentType='text/html; charset=utf-8'
+            )
+        ]
+
+
+class TestWebhookSink(SinkTester):
+
+    def test_deliver(self):
+        cls = WebhookSink(
+            self.config, 'https://example.com/hook', headers={'X-Foo': 'bar'},
+            timeout_sec=30
+        )
+        with patch('%s.requests.post' % pbm) as m_post:
+            cls.deliver(self.report)
+        assert m_post.mock_calls == [
+            call(
+                'https://example.com/hook', json=self.report.as_dict(),
+                headers={'X-Foo': 'bar'}, timeout=30
+            ),
+            call().raise_for_status()
+        ]
+
+    def test_deliver_html(self):
+        cls = WebhookSink(
+            self.config, 'https://example.com/hook', include_html=True
+        )
+        with patch('%s.requests.post' % pbm) as m_post:
+            cls.deliver(self.report)
+        doc = m_post.mock_calls[0][2]['json']
+        assert doc['html'] == '<p>report</p>'
+        assert doc['subject'] == 'MySubject'
+
+
+class TestJsonSink(SinkTester):
+
+    def test_stdout(self, capsys):
+        JsonSink(self.config).deliver(self.report)
+        out, err = capsys.readouterr()
+        assert json.loads(out) == self.report.as_dict()
+
+    def test_file(self, tmpdir):
+        path = str(tmpdir.join('{date}.json'))
+        JsonSink(self.config, path=path).deliver(self.report)
+        with open(str(tmpdir.join('2017-11-23T12-00-00.json')), 'r') as fh:
+            assert json.loads(fh.read()) == self.report.as_dict()
+
+    def test_jsonl(self, tmpdir):
+        self.report.records.append({'name': 'j2', 'state': 'succeeded'})
+        path = str(tmpdir.join('results.jsonl'))
+        cls = JsonSink(self.config, path=path, format='jsonl')
+        cls.deliver(self.report)
+        cls.deliver(self.report)
+        with open(path, 'r') as fh:
+            lines = [json.loads(x) for x in fh.readlines()]
+        run = {
+            'record_type': 'run',
+            'subject': 'MySubject',
+            'start_time': '2017-11-23T12:00:00',
+            'end_time': '2017-11-23T12:01:30',
+            'duration_sec': 90.0,
+            'have_failures': True,
+            'timings': [],
+            'api_calls': []
+        }
+        j1 = {
+            'record_type': 'job', 'run_start_time': '2017-11-23T12:00:00',
+            'name': 'j1', 'state': 'failed'
+        }
+        j2 = {
+            'record_type': 'job', 'run_start_time': '2017-11-23T12:00:00',
+            'name': 'j2', 'state': 'succeeded'
+        }
+        assert lines == [run, j1, j2, run, j1, j2]
+        # records in the report are not modified
+        assert self.report.records == [
+            {'name': 'j1', 'state': 'failed'},
+            {'name': 'j2', 'state': 'succeeded'}
+        ]
+
+    def test_jsonl_stdout(self, capsys):
+        JsonSink(self.config, format='jsonl').deliver(self.report)
+        out, err = capsys.readouterr()
+        lines = [json.loads(x) for x in out.splitlines()]
+        assert [x['record_type'] for x in lines] == ['run', 'job']
+
+
+class TestCommandSink(SinkTester):
+
+    def test_deliver(self, tmpdir):
+        path = str(tmpdir.join('out'))
+        cls = CommandSink(self.config, ['/bin/sh', '-c', 'cat > %s' % path])
+        cls.deliver(self.report)
+        with open(path, 'r') as fh:
+            assert fh.read() == '<p>report</p>'
+
+    def test_deliver_failure(self):
+        cls = CommandSink(self.config, ['/bin/sh', '-c', 'echo nope; exit 3'])
+        with pytest.raises(RuntimeError) as exc:
+            cls.deliver(self.report)
+        assert 'exited 3: nope' in str(exc.value)
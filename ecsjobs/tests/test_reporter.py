@@ -35,7 +35,12 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 ##################################################################################
 """
 
-from unittest.mock import patch, Mock, call, DEFAULT, PropertyMock, mock_open
+from unittest.mock import (
+    patch, Mock, call, DEFAULT, PropertyMock, mock_open, ANY
+)
+from io import StringIO
+import tracemalloc
+import gzip
 from datetime import datetime, timedelta
 from subprocess import PIPE, STDOUT
 
@@ -43,10 +48,13 @@ import pytest
 from freezegun import freeze_time
 
 from ecsjobs.reporter import Reporter
+from ecsjobs.report_sinks import SesSink
 from ecsjobs.jobs.base import Job
+from ecsjobs.timing import Timings
 
 pbm = 'ecsjobs.reporter'
 pb = '%s.Reporter' % pbm
+pbs = 'ecsjobs.report_sinks'
 
 
 class ReportTester(object):
@@ -58,6 +66,8 @@ class ReportTester(object):
         self.to_email = ['to1@foo.com', 'to2@foo.com']
         self.failure_html_path = None
         self.failure_command = None
+        self.inline_chars = None
+        self.email_max_bytes = None
 
         def se_conf_get(k):
             if k == 'from_email':
@@ -70,10 +80,14 @@ class ReportTester(object):
                 return self.failure_html_path
             elif k == 'failure_command':
                 return self.failure_command
+            elif k == 'report_inline_output_chars':
+                return self.inline_chars
+            elif k == 'email_max_bytes':
+                return self.email_max_bytes
             return None
 
         self.mock_conf.get_global.side_effect = se_conf_get
-        with patch('%s.boto3.client' % pbm) as m_boto:
+        with patch('%s.aws.client' % pbs) as m_boto:
             m_boto.return_value = self.client
             self.cls = Reporter(self.mock_conf)
 
@@ -82,11 +96,35 @@ class TestInit(object):
 
     def test_init(self):
         conf = Mock()
-        with patch('%s.boto3.client' % pbm) as m_boto:
+        conf.get_global.return_value = None
+        with patch('%s.aws.client' % pbs) as m_boto:
             cls = Reporter(conf)
         assert cls._config == conf
         assert m_boto.mock_calls == [call('ses')]
-        assert cls._ses == m_boto.return_value
+        assert len(cls._sinks) == 1
+        assert isinstance(cls._sinks[0], SesSink)
+        assert cls._sinks[0]._ses == m_boto.return_value
+        assert cls._records == []
+
+    def test_init_s3_output(self):
+        conf = Mock()
+        conf.get_global.side_effect = {
+            'output_s3_bucket': 'bkt',
+            'output_s3_prefix': 'pre/',
+            'output_s3_presign_sec': 60
+        }.get
+        with patch('%s.aws.client' % pbs):
+            with patch('%s.S3OutputStore' % pbm, autospec=True) as m_store:
+                cls = Reporter(conf)
+        assert m_store.mock_calls == [call('bkt', 'pre/', presign_sec=60)]
+        assert cls._s3_output == m_store.return_value
+
+    def test_init_no_s3_output(self):
+        conf = Mock()
+        conf.get_global.return_value = None
+        with patch('%s.aws.client' % pbs):
+            cls = Reporter(conf)
+        assert cls._s3_output is None
 
 
 class TestRun(ReportTester):
@@ -113,7 +151,10 @@ class TestRun(ReportTester):
                         m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt
                     )
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -164,7 +205,10 @@ class TestRun(ReportTester):
                         only_email_if_problems=True
                     )
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == []
         assert m_open.mock_calls == []
@@ -195,7 +239,10 @@ class TestRun(ReportTester):
                         m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt
                     )
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -250,7 +297,10 @@ class TestRun(ReportTester):
                         )
         assert str(exc.value) == 'foo'
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -316,7 +366,10 @@ class TestRun(ReportTester):
                         )
         assert str(exc.value) == 'foo'
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -385,7 +438,10 @@ class TestRun(ReportTester):
                         )
         assert str(exc.value) == 'foo'
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -452,7 +508,10 @@ class TestRun(ReportTester):
                         )
         assert str(exc.value) == 'foo'
         assert mock_mr.mock_calls == [
-            call(m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt)
+            call(
+                m_finished, m_unfinished, m_excs, m_start_dt, m_end_dt,
+                timings=None, api_calls=None
+            )
         ]
         assert self.client.mock_calls == [
             call.send_email(
@@ -486,6 +545,233 @@ class TestRun(ReportTester):
         assert mocks['Popen'].mock_calls == []
 
 
+class TestRunAttachments(ReportTester):
+
+    @freeze_time('2017-11-23 12:34:56')
+    def test_run_report(self):
+        fh = Mock()
+        self.cls._attachments = [('foo.txt.gz', fh)]
+        self.cls._records = [{'name': 'foo'}]
+        self.cls._have_failures = True
+        m_sink = Mock(running=False)
+        self.cls._sinks = [m_sink]
+        s_dt = datetime(2017, 11, 23, 12, 00, 00)
+        e_dt = datetime(2017, 11, 23, 12, 30, 00)
+
+        def se_deliver(sinks, report):
+            assert sinks == [m_sink]
+            assert report.html == 'my_html_report'
+            assert report.subject == 'MySubject'
+            assert report.records == [{'name': 'foo'}]
+            assert report.start_dt == s_dt
+            assert report.end_dt == e_dt
+            assert report.have_failures is True
+            assert report.attachments == [('foo.txt.gz', fh)]
+            assert report.only_email_if_problems is True
+            return []
+
+        with patch('%s._make_report' % pb) as mock_mr:
+            with patch('%s.deliver_all' % pbm) as mock_deliver:
+                mock_mr.return_value = 'my_html_report'
+                mock_deliver.side_effect = se_deliver
+                self.cls.run(1, 2, 3, s_dt, e_dt, only_email_if_problems=True)
+        assert len(mock_deliver.mock_calls) == 1
+        assert fh.mock_calls == [call.close()]
+        assert self.cls._attachments == []
+        assert self.cls.records == [{'name': 'foo'}]
+
+    def test_run_sink_failure(self):
+        exc1 = RuntimeError('foo')
+        exc2 = RuntimeError('bar')
+        s1 = Mock(running=False)
+        s2 = Mock(running=False)
+        self.cls._sinks = [s1, s2]
+        m_open = mock_open()
+        with patch('%s._make_report' % pb) as mock_mr:
+            with patch('%s.deliver_all' % pbm) as mock_deliver:
+                with patch('%s.open' % pbm, m_open, create=True):
+                    with patch.multiple(
+                        pbm, mkstemp=DEFAULT, os_close=DEFAULT
+                    ) as mocks:
+                        mocks['mkstemp'].return_value = (999, '/tmp/path')
+                        mock_mr.return_value = 'my_html_report'
+                        mock_deliver.return_value = [
+                            (s1, exc1), (s2, exc2)
+                        ]
+                        with pytest.raises(RuntimeError) as exc:
+                            self.cls.run(1, 2, 3, 4, 5)
+        assert exc.value == exc1
+        assert call().write('my_html_report') in m_open.mock_calls
+
+    def test_run_secondary_sink_failure(self):
+        s1 = Mock(running=False)
+        s2 = Mock(running=False)
+        self.cls._sinks = [s1, s2]
+        m_open = mock_open()
+        with patch('%s._make_report' % pb) as mock_mr:
+            with patch('%s.deliver_all' % pbm) as mock_deliver:
+                with patch('%s.open' % pbm, m_open, create=True):
+                    with patch.multiple(
+                        pbm, mkstemp=DEFAULT, os_close=DEFAULT
+                    ) as mocks:
+                        mock_mr.return_value = 'my_html_report'
+                        mock_deliver.return_value = [
+                            (s2, RuntimeError('bar'))
+                        ]
+                        self.cls.run(1, 2, 3, 4, 5)
+        assert m_open.mock_calls == []
+        assert mocks['mkstemp'].mock_calls == []
+
+    def test_run_sink_still_running(self):
+        fh = Mock()
+        self.cls._attachments = [('foo.txt.gz', fh)]
+        s1 = Mock(running=True)
+        self.cls._sinks = [s1]
+        exc1 = RuntimeError('timed out')
+        with patch('%s._make_report' % pb) as mock_mr:
+            with patch('%s.deliver_all' % pbm) as mock_deliver:
+                with patch('%s.open' % pbm, mock_open(), create=True):
+                    with patch.multiple(
+                        pbm, mkstemp=DEFAULT, os_close=DEFAULT
+                    ) as mocks:
+                        mocks['mkstemp'].return_value = (999, '/tmp/path')
+                        mock_mr.return_value = 'my_html_report'
+                        mock_deliver.return_value = [(s1, exc1)]
+                        with pytest.raises(RuntimeError):
+                            self.cls.run(1, 2, 3, 4, 5)
+        assert fh.mock_calls == []
+        assert self.cls._attachments == []
+
+    def test_run_exception_closes(self):
+        fh = Mock()
+        self.cls._attachments = [('foo.txt.gz', fh)]
+
+        with patch('%s._make_report' % pb) as mock_mr:
+            mock_mr.side_effect = RuntimeError('foo')
+            with pytest.raises(RuntimeError):
+                self.cls.run(1, 2, 3, 4, 5)
+        assert fh.mock_calls == [call.close()]
+        assert self.cls._attachments == []
+
+
+class TestWriteOutput(ReportTester):
+
+    def setup(self):
+        super(TestWriteOutput, self).setup()
+        self.job = Mock(spec_set=Job)
+        type(self.job).name = PropertyMock(return_value='my job/1')
+
+    def test_no_limit(self):
+        type(self.job).output = PropertyMock(return_value='<a>' * 10)
+        fh = StringIO()
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == '&lt;a&gt;' * 10
+        assert self.cls._attachments == []
+
+    def test_under_limit(self):
+        self.inline_chars = 30
+        type(self.job).output = PropertyMock(return_value='<a>' * 10)
+        fh = StringIO()
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == '&lt;a&gt;' * 10
+        assert self.cls._attachments == []
+
+    def test_truncated(self):
+        self.inline_chars = 8
+        self.cls.ESCAPE_CHUNK_CHARS = 3
+        output = 'head<' + ('x' * 1000) + '>tail'
+        type(self.job).output = PropertyMock(return_value=output)
+        fh = StringIO()
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == 'head\n\n<strong>[... 1002 characters ' \
+                                'omitted; full output attached as ' \
+                                'my_job_1.txt.gz ...]</strong>\n\n' \
+                                'tail'
+        assert len(self.cls._attachments) == 1
+        fname, afh = self.cls._attachments[0]
+        assert fname == 'my_job_1.txt.gz'
+        afh.seek(0)
+        assert gzip.decompress(afh.read()).decode('utf-8') == output
+
+    def test_total_budget(self):
+        self.inline_chars = 8
+        self.cls._inline_remaining = 12
+        fh = StringIO()
+        type(self.job).output = PropertyMock(return_value='a' * 6)
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == 'a' * 6
+        assert self.cls._inline_remaining == 6
+        fh = StringIO()
+        type(self.job).output = PropertyMock(return_value='b' * 8)
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == 'bbb\n\n<strong>[... 2 characters ' \
+                                'omitted; full output attached as ' \
+                                'my_job_1.txt.gz ...]</strong>\n\nbbb'
+        assert self.cls._inline_remaining == 0
+        fh = StringIO()
+        type(self.job).output = PropertyMock(return_value='c' * 4)
+        self.cls._write_output(fh, self.job)
+        assert fh.getvalue() == '\n\n<strong>[... 4 characters ' \
+                                'omitted; full output attached as ' \
+                                'my_job_1.txt.gz ...]</strong>\n\n'
+        assert len(self.cls._attachments) == 2
+
+
+class TestS3Output(ReportTester):
+
+    def setup(self):
+        super(TestS3Output, self).setup()
+        self.job = Mock(spec_set=Job)
+        type(self.job).name = PropertyMock(return_value='myjob')
+        type(self.job).skip = PropertyMock(return_value=None)
+        type(self.job).resource_usage = PropertyMock(return_value=None)
+        type(self.job).lifecycle = PropertyMock(return_value=None)
+        type(self.job).shards = PropertyMock(return_value=None)
+        type(self.job).capacity_wait_sec = PropertyMock(return_value=None)
+        type(self.job).timings = PropertyMock(return_value=Timings())
+        self.job.report_description.return_value = 'desc'
+        self.store = Mock()
+        self.cls._s3_output = self.store
+
+    def test_div_presigned(self):
+        self.inline_chars = 8
+        type(self.job).output = PropertyMock(return_value='a' * 20)
+        self.store.upload.return_value = (
+            's3://bkt/pre/myjob.txt.gz', 'https://x/y?a=1&b=2'
+        )
+        res = self.cls._div_for_job(self.job)
+        assert res == '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
+                      'desc</p><pre>aaaa\n\n<strong>[... 12 characters ' \
+                      'omitted; full output at s3://bkt/pre/myjob.txt.gz ' \
+                      '...]</strong>\n\naaaa</pre><p>Full output: <a ' \
+                      'href="https://x/y?a=1&amp;b=2">' \
+                      's3://bkt/pre/myjob.txt.gz</a></p></div>\n'
+        assert self.store.mock_calls == [call.upload('myjob', 'a' * 20)]
+        assert self.cls._attachments == []
+
+    def test_div_no_presign(self):
+        type(self.job).output = PropertyMock(return_value='out')
+        self.store.upload.return_value = ('s3://bkt/pre/myjob.txt.gz', None)
+        res = self.cls._div_for_job(self.job)
+        assert res == '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
+                      'desc</p><pre>out</pre><p>Full output: ' \
+                      's3://bkt/pre/myjob.txt.gz</p></div>\n'
+
+    def test_div_upload_fails(self):
+        self.inline_chars = 8
+        type(self.job).output = PropertyMock(return_value='a' * 20)
+        self.store.upload.side_effect = RuntimeError('foo')
+        res = self.cls._div_for_job(self.job)
+        assert 'full output attached as myjob.txt.gz' in res
+        assert 'Full output:' not in res
+        assert len(self.cls._attachments) == 1
+
+    def test_no_output(self):
+        type(self.job).output = PropertyMock(return_value=None)
+        assert self.cls._upload_output(self.job) == (None, None)
+        assert self.store.mock_calls == []
+
+
 class TestMakeReport(ReportTester):
 
     @freeze_time('2017-11-23 12:34:56')
@@ -521,17 +807,18 @@ class TestMakeReport(ReportTester):
         def se_tr(cls, j, exc=None, unfinished=False):
             return "tr-%s\n" % j.name
 
-        def se_div(cls, j, exc=None, unfinished=False):
-            return "div-%s\n" % j.name
+        def se_div(cls, fh, j, exc=None, unfinished=False):
+            fh.write("div-%s\n" % j.name)
 
         with patch.multiple(
             pb,
             autospec=True,
             _tr_for_job=DEFAULT,
-            _div_for_job=DEFAULT
+            _write_div_for_job=DEFAULT,
+            _record_for_job=DEFAULT
         ) as mocks:
             mocks['_tr_for_job'].side_effect = se_tr
-            mocks['_div_for_job'].side_effect = se_div
+            mocks['_write_div_for_job'].side_effect = se_div
             with patch.multiple(
                 pbm,
                 autospec=True,
@@ -550,14 +837,257 @@ class TestMakeReport(ReportTester):
             call(self.cls, j2, exc=m_exc),
             call(self.cls, j3, unfinished=True)
         ]
-        assert mocks['_div_for_job'].mock_calls == [
-            call(self.cls, j1, exc=None),
-            call(self.cls, j2, exc=m_exc),
-            call(self.cls, j3, unfinished=True)
+        assert mocks['_write_div_for_job'].mock_calls == [
+            call(self.cls, ANY, j1, exc=None),
+            call(self.cls, ANY, j2, exc=m_exc),
+            call(self.cls, ANY, j3, unfinished=True)
         ]
         assert modmocks['getuser'].mock_calls == [call()]
         assert modmocks['gethostname'].mock_calls == [call()]
 
+    def test_make_report_timings(self):
+        timings = [{'name': 'run.poll'}]
+        with patch('%s._timings_table' % pb) as m_tt:
+            m_tt.return_value = '<details />\n'
+            res = self.cls._make_report(
+                [], [], {}, datetime(2017, 11, 12, 13, 00, 00),
+                datetime(2017, 11, 12, 14, 2, 33), timings=timings
+            )
+        assert res.endswith('</table>\n<details />\n')
+        assert m_tt.mock_calls == [call('Run Phase Timings', timings)]
+
+
+class TestAddJob(ReportTester):
+
+    @freeze_time('2017-11-23 12:34:56')
+    def test_prerendered(self):
+        j1 = Mock(spec_set=Job, name='job1')
+        type(j1).name = PropertyMock(return_value='job1')
+        j2 = Mock(spec_set=Job, name='job2')
+        type(j2).name = PropertyMock(return_value='job2')
+        j3 = Mock(spec_set=Job, name='job3')
+        type(j3).name = PropertyMock(return_value='job3')
+        m_exc = Mock()
+        s_dt = datetime(2017, 11, 12, 13, 00, 00)
+        e_dt = datetime(2017, 11, 12, 14, 2, 33)
+
+        def se_tr(cls, j, exc=None, unfinished=False):
+            return "tr-%s\n" % j.name
+
+        def se_div(cls, fh, j, exc=None, unfinished=False):
+            fh.write("div-%s\n" % j.name)
+
+        with patch.multiple(
+            pb,
+            autospec=True,
+            _tr_for_job=DEFAULT,
+            _write_div_for_job=DEFAULT,
+            _record_for_job=DEFAULT
+        ) as mocks:
+            mocks['_tr_for_job'].side_effect = se_tr
+            mocks['_write_div_for_job'].side_effect = se_div
+            self.cls.add_job(j2, exc=m_exc)
+            self.cls.add_job(j1)
+            assert self.cls._rows == ['tr-job2\n', 'tr-job1\n']
+            with patch.multiple(
+                pbm,
+                autospec=True,
+                getuser=DEFAULT,
+                gethostname=DEFAULT
+            ) as modmocks:
+                modmocks['getuser'].return_value = 'uname'
+                modmocks['gethostname'].return_value = 'hname'
+                res = self.cls._make_report(
+                    [j2, j1], [j3], {j2: m_exc}, s_dt, e_dt
+                )
+        assert 'tr-job2\ntr-job1\ntr-job3\n</table>\n' \
+               'div-job2\n<hr />\ndiv-job1\n<hr />\n' \
+               'div-job3\n<hr />\n' in res
+        assert mocks['_tr_for_job'].mock_calls == [
+            call(self.cls, j2, exc=m_exc),
+            call(self.cls, j1, exc=None),
+            call(self.cls, j3, unfinished=True)
+        ]
+        assert mocks['_write_div_for_job'].mock_calls == [
+            call(self.cls, ANY, j2, exc=m_exc),
+            call(self.cls, ANY, j1, exc=None),
+            call(self.cls, ANY, j3, unfinished=True)
+        ]
+        # fragments are cleared after the report is written
+        assert self.cls._rows == []
+        assert self.cls._rendered == set()
+
+
+class TestWriteEscaped(ReportTester):
+
+    def test_chunks(self):
+        fh = Mock()
+        self.cls.ESCAPE_CHUNK_CHARS = 4
+        self.cls._write_escaped(fh, '<a>&"bc\'d')
+        assert fh.mock_calls == [
+            call.write('&lt;a&gt;&amp;'),
+            call.write('&quot;bc&#x27;'),
+            call.write('d')
+        ]
+
+    def test_empty(self):
+        fh = StringIO()
+        self.cls._write_escaped(fh, '')
+        assert fh.getvalue() == ''
+
+
+class TestWriteReportMemory(ReportTester):
+
+    def test_large_output_not_copied(self, tmpdir):
+        """
+        Writing a report containing a large job output to a file should not
+        allocate any additional full-size copies of that output.
+        """
+        j = Mock(spec_set=Job)
+        type(j).name = PropertyMock(return_value='myjob')
+        type(j).exitcode = PropertyMock(return_value=0)
+        type(j).duration = PropertyMock(return_value=timedelta(seconds=65))
+        type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
+        output = '<foo> & "bar"\n' * (1024 * 1024)
+        type(j).output = PropertyMock(return_value=output)
+        j.summary.return_value = 'summary'
+        j.report_description.return_value = 'desc'
+        s_dt = datetime(2017, 11, 12, 13, 00, 00)
+        e_dt = datetime(2017, 11, 12, 14, 2, 33)
+        path = str(tmpdir.join('report.html'))
+        with open(path, 'w') as fh:
+            tracemalloc.start()
+            try:
+                self.cls._write_report(fh, [j], [], {}, s_dt, e_dt)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        assert peak < len(output) / 4
+        with open(path, 'r') as fh:
+            content = fh.read()
+        assert '&lt;foo&gt; &amp; &quot;bar&quot;\n' * 3 in content
+        assert len(content) > len(output)
+
+
+class TestRecordForJob(ReportTester):
+
+    def setup(self):
+        super(TestRecordForJob, self).setup()
+        self.job = Mock(spec_set=Job)
+        type(self.job).name = PropertyMock(return_value='myjob')
+        type(self.job).exitcode = PropertyMock(return_value=0)
+        type(self.job).duration = PropertyMock(
+            return_value=timedelta(seconds=65)
+        )
+        type(self.job).skip = PropertyMock(return_value=None)
+        type(self.job).schedule_name = PropertyMock(return_value='sched')
+        type(self.job).start_time = PropertyMock(
+            return_value=datetime(2017, 11, 23, 12, 34, 56)
+        )
+        type(self.job).finish_time = PropertyMock(
+            return_value=datetime(2017, 11, 23, 12, 36, 1)
+        )
+        type(self.job).output = PropertyMock(return_value='foo\u00e9bar')
+        self.timings = Timings()
+        self.timings.add(
+            'run_task', datetime(2017, 11, 23, 12, 34, 56), 1.5, 0.25
+        )
+        type(self.job).timings = PropertyMock(return_value=self.timings)
+        type(self.job).lifecycle = PropertyMock(return_value=None)
+        type(self.job).shards = PropertyMock(return_value=None)
+        type(self.job).capacity_wait_sec = PropertyMock(return_value=None)
+        type(self.job).resource_usage = PropertyMock(
+            return_value={'user_cpu_sec': 1.5, 'max_rss_kb': 2048}
+        )
+        self.job.summary.return_value = 'sum'
+
+    def test_succeeded(self):
+        assert self.cls._record_for_job(self.job) == {
+            'name': 'myjob',
+            'class': 'Job',
+            'schedule': 'sched',
+            'state': 'succeeded',
+            'exit_code': 0,
+            'start_time': '2017-11-23T12:34:56',
+            'finish_time': '2017-11-23T12:36:01',
+            'duration_sec': 65.0,
+            'summary': 'sum',
+            'output_bytes': 8,
+            'exception': None,
+            'timings': [{
+                'name': 'run_task', 'start_time': '2017-11-23T12:34:56',
+                'wall_sec': 1.5, 'cpu_sec': 0.25, 'count': 1
+            }],
+            'resource_usage': {'user_cpu_sec': 1.5, 'max_rss_kb': 2048},
+            'lifecycle': None,
+            'shards': None,
+            'capacity_wait_sec': None
+        }
+
+    def test_failed(self):
+        type(self.job).exitcode = PropertyMock(return_value=3)
+        res = self.cls._record_for_job(self.job)
+        assert res['state'] == 'failed'
+        assert res['exit_code'] == 3
+
+    def test_skipped(self):
+        type(self.job).skip = PropertyMock(return_value='reason')
+        type(self.job).duration = PropertyMock(return_value=None)
+        type(self.job).start_time = PropertyMock(return_value=None)
+        type(self.job).finish_time = PropertyMock(return_value=None)
+        type(self.job).output = PropertyMock(return_value=None)
+        type(self.job).resource_usage = PropertyMock(return_value=None)
+        assert self.cls._record_for_job(self.job) == {
+            'name': 'myjob',
+            'class': 'Job',
+            'schedule': 'sched',
+            'state': 'skipped',
+            'exit_code': None,
+            'start_time': None,
+            'finish_time': None,
+            'duration_sec': None,
+            'summary': None,
+            'output_bytes': None,
+            'exception': None,
+            'timings': [{
+                'name': 'run_task', 'start_time': '2017-11-23T12:34:56',
+                'wall_sec': 1.5, 'cpu_sec': 0.25, 'count': 1
+            }],
+            'resource_usage': None,
+            'lifecycle': None,
+            'shards': None,
+            'capacity_wait_sec': None
+        }
+
+    def test_unfinished(self):
+        res = self.cls._record_for_job(self.job, unfinished=True)
+        assert res['state'] == 'unfinished'
+        assert res['exit_code'] is None
+
+    def test_exception(self):
+        res = self.cls._record_for_job(
+            self.job, exc=(RuntimeError('foo'), 'tb')
+        )
+        assert res['state'] == 'exception'
+        assert res['exception'] == 'RuntimeError'
+        assert res['summary'] is None
+
+
+class TestUtf8Len(ReportTester):
+
+    def test_ascii(self):
+        assert self.cls._utf8_len('foo bar') == 7
+
+    def test_chunks(self):
+        self.cls.ESCAPE_CHUNK_CHARS = 3
+        s = 'a\u00e9\u20ac\U0001f600b' * 5
+        assert self.cls._utf8_len(s) == len(s.encode('utf-8'))
+
 
 class TestTd(ReportTester):
 
@@ -726,6 +1256,11 @@ class TestDivForJob(ReportTester):
         type(j).error_repr = PropertyMock(return_value='erpr')
         type(j).output = PropertyMock(return_value='jobOutput')
         type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
         j.summary.return_value = 'summary'
         j.report_description.return_value = 'Job Description'
         expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
@@ -741,6 +1276,11 @@ class TestDivForJob(ReportTester):
         type(j).error_repr = PropertyMock(return_value='erpr')
         type(j).output = PropertyMock(return_value='jobOutput')
         type(j).skip = PropertyMock(return_value='skip reason')
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
         j.summary.return_value = 'summary'
         j.report_description.return_value = 'Job Description'
         expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
@@ -757,6 +1297,11 @@ class TestDivForJob(ReportTester):
         type(j).error_repr = PropertyMock(return_value='erpr')
         type(j).output = PropertyMock(return_value='jobOutput')
         type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
         j.summary.return_value = 'summary'
         j.report_description.return_value = 'Job Description'
         expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
@@ -773,6 +1318,11 @@ class TestDivForJob(ReportTester):
         type(j).error_repr = PropertyMock(return_value='erpr')
         type(j).output = PropertyMock(return_value='jobOutput')
         type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
         j.summary.return_value = 'summary'
         j.report_description.return_value = 'Job Description'
         expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
@@ -780,3 +1330,213 @@ class TestDivForJob(ReportTester):
                    '</div>' + "\n"
         assert self.cls._div_for_job(
             j, exc=(RuntimeError('foo'), 'tb')) == expected
+
+    def test_resource_usage(self):
+        j = Mock(spec_set=Job)
+        type(j).name = PropertyMock(return_value='myjob')
+        type(j).exitcode = PropertyMock(return_value=0)
+        type(j).duration = PropertyMock(return_value=timedelta(seconds=65))
+        type(j).is_finished = PropertyMock(return_value=True)
+        type(j).error_repr = PropertyMock(return_value='erpr')
+        type(j).output = PropertyMock(return_value='jobOutput')
+        type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value={
+            'user_cpu_sec': 1.5,
+            'system_cpu_sec': 0.25,
+            'max_rss_kb': 2048,
+            'block_input_ops': 10,
+            'block_output_ops': 20,
+            'voluntary_ctx_switches': 30,
+            'involuntary_ctx_switches': 40
+        })
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).timings = PropertyMock(return_value=Timings())
+        j.summary.return_value = 'summary'
+        j.report_description.return_value = 'Job Description'
+        expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
+                   'Job Description</p><pre>jobOutput</pre>' \
+                   '<p>Resource usage: user CPU 1.50s, system CPU 0.25s, ' \
+                   'max RSS 2048 KiB, block I/O 10 in / 20 out, context ' \
+                   'switches 30 voluntary / 40 involuntary</p></div>' + "\n"
+        assert self.cls._div_for_job(j) == expected
+
+    def test_capacity_wait(self):
+        j = Mock(spec_set=Job)
+        type(j).name = PropertyMock(return_value='myjob')
+        type(j).exitcode = PropertyMock(return_value=0)
+        type(j).output = PropertyMock(return_value='jobOutput')
+        type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=12.5)
+        type(j).timings = PropertyMock(return_value=Timings())
+        j.report_description.return_value = 'Job Description'
+        expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
+                   'Job Description</p><pre>jobOutput</pre>' \
+                   '<p>Waited 12.50s for ECS cluster capacity.</p></div>\n'
+        assert self.cls._div_for_job(j) == expected
+
+    def test_lifecycle(self):
+        j = Mock(spec_set=Job)
+        type(j).name = PropertyMock(return_value='myjob')
+        type(j).exitcode = PropertyMock(return_value=0)
+        type(j).output = PropertyMock(return_value='jobOutput')
+        type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value={
+            'placement_delay_sec': 12.5,
+            'image_pull_sec': 3.25,
+            'run_sec': 60.0,
+            'stop_detection_sec': 4.0,
+            'tasks': [
+                {
+                    'task_arn': 'arn:aws:ecs:us-east-1:1234:task/cl/t1',
+                    'placement_delay_sec': 12.5,
+                    'image_pull_sec': 3.25,
+                    'run_sec': 60.0,
+                    'stop_detection_sec': 4.0,
+                    'stopped_reason': 'Essential container <main> exited'
+                },
+                {
+                    'task_arn': 'arn:aws:ecs:us-east-1:1234:task/cl/t2',
+                    'placement_delay_sec': 1.0,
+                    'image_pull_sec': None,
+                    'run_sec': None,
+                    'stop_detection_sec': None,
+                    'stopped_reason': None
+                },
+                {
+                    'task_arn': 'arn:aws:ecs:us-east-1:1234:task/cl/t3',
+                    'placement_delay_sec': None,
+                    'image_pull_sec': None,
+                    'run_sec': None,
+                    'stop_detection_sec': None,
+                    'stopped_reason': None
+                }
+            ]
+        })
+        type(j).timings = PropertyMock(return_value=Timings())
+        j.report_description.return_value = 'Job Description'
+        expected = '<div><p><strong><a name="myjob">myjob</a></strong> - ' \
+                   'Job Description</p><pre>jobOutput</pre>' \
+                   '<p>Task t1 lifecycle: placement delay 12.50s, image ' \
+                   'pull 3.25s, run 60.00s, stop detection 4.00s; stopped ' \
+                   'reason: Essential container &lt;main&gt; exited<br />' \
+                   'Task t2 lifecycle: placement delay 1.00s<br />' \
+                   'Task t3 lifecycle: unknown</p></div>' + "\n"
+        assert self.cls._div_for_job(j) == expected
+
+    def test_timings(self):
+        j = Mock(spec_set=Job)
+        type(j).name = PropertyMock(return_value='myjob')
+        type(j).exitcode = PropertyMock(return_value=0)
+        type(j).output = PropertyMock(return_value='jobOutput')
+        type(j).skip = PropertyMock(return_value=None)
+        type(j).resource_usage = PropertyMock(return_value=None)
+        type(j).lifecycle = PropertyMock(return_value=None)
+        type(j).shards = PropertyMock(return_value=None)
+        type(j).capacity_wait_sec = PropertyMock(return_value=None)
+        t = Timings()
+        t.add('run_task', datetime(2017, 11, 23, 12, 0, 0), 1.5, 0.25)
+        type(j).timings = PropertyMock(return_value=t)
+        j.report_description.return_value = 'Job Description'
+        with patch('%s._timings_table' % pb) as m_tt:
+            m_tt.return_value = '<details />'
+            res = self.cls._div_for_job(j)
+        assert res == '<div><p><strong><a name="myjob">myjob</a></strong> ' \
+                      '- Job Description</p><pre>jobOutput</pre>' \
+                      '<details /></div>' + "\n"
+        assert m_tt.mock_calls == [call('Timings', t.records)]
+
+    def test_timings_table(self):
+        res = self.cls._timings_table('Run <Timings>', [{
+            'name': 'run.poll', 'start_time': '2017-11-23T12:00:00',
+            'wall_sec': 1.5, 'cpu_sec': 0.25, 'count': 3
+        }])
+        assert res == '<details><summary>Run &lt;Timings&gt;</summary>\n' \
+            '<table style="border: 1px solid black; ' \
+            'border-collapse: collapse;">\n<tr>' + \
+            self.cls.th('Phase') + self.cls.th('Start') + \
+            self.cls.th('Wall (s)') + self.cls.th('CPU (s)') + \
+            self.cls.th('Count') + '</tr>\n<tr>' + \
+            self.cls.td('run.poll') + self.cls.td('2017-11-23T12:00:00') + \
+            self.cls.td('1.500') + self.cls.td('0.250') + self.cls.td(3) + \
+            '</tr>\n</table></details>\n'
+
+    def test_api_calls_table(self):
+        res = self.cls._api_calls_table([
+            {
+                'service': 'ecs', 'operation': 'RunTask', 'job': None,
+                'calls': 2, 'errors': 1, 'retries': 3, 'throttles': 1,
+                'latency_sec': 1.25, 'max_latency_sec': 1.0,
+                'rate_limit_wait_sec': 0.75
+            },
+            {
+                'service': 'logs', 'operation': 'FilterLogEvents',
+                'job': '<j1>', 'calls': 1, 'errors': 0, 'retries': 0,
+                'throttles': 0, 'latency_sec': 0.5, 'max_latency_sec': 0.5
+            }
+        ])
+        td = self.cls.td
+        assert res.startswith('<details><summary>AWS API Calls</summary>\n')
+        assert '<tr>' + td('ecs') + td('RunTask') + td('&nbsp;') + \
+            td(2) + td(1) + td(3) + td(1) + td('1.250') + td('1.000') + \
+            td('0.750') + '</tr>\n' in res
+        assert '<tr>' + td('logs') + td('FilterLogEvents') + \
+            td('&lt;j1&gt;') + td(1) + td(0) + td(0) + td(0) + \
+            td('0.500') + td('0.500') + td('0.000') + '</tr>\n' in res
+        assert res.endswith('</table></details>\n')
+
+    def test_shards_table(self):
+        res = self.cls._shards_table([
+            {
+                'index': 0, 'task_arn': 'arn:aws:ecs:r:1:task/cl/t1',
+                'state': 'stopped', 'exit_code': 0, 'duration_sec': 1.5,
+                'reason': 'Essential container in task exited'
+            },
+            {
+                'index': 1, 'task_arn': 'arn:aws:ecs:r:1:task/cl/t2',
+                'state': 'stopped', 'exit_code': 2, 'duration_sec': 2.0,
+                'reason': None
+            },
+            {
+                'index': 2, 'task_arn': None, 'state': 'failed',
+                'exit_code': None, 'duration_sec': None,
+                'reason': 'RunTask failure: <AGENT>'
+            }
+        ])
+        td = self.cls.td
+        assert res.startswith(
+            '<details><summary>Shards (1 failed, 1 not started, 1 succeeded)'
+            '</summary>\n'
+        )
+        assert '<tr>' + td(0) + td('t1') + td('stopped') + td(0) + \
+            td('1.500') + td('Essential container in task exited') + \
+            '</tr>\n' in res
+        assert '<tr>' + td(2) + td('&nbsp;') + td('failed') + \
+            td('&nbsp;') + td('&nbsp;') + \
+            td('RunTask failure: &lt;AGENT&gt;') + '</tr>\n' in res
+        assert res.endswith('</table></details>\n')
+
+    def test_usage_for_job_cgroup(self):
+        usage = {
+            'user_cpu_sec': 1.5,
+            'system_cpu_sec': 0.25,
+            'max_rss_kb': 2048,
+            'block_input_ops': 10,
+            'block_output_ops': 20,
+            'voluntary_ctx_switches': 30,
+            'involuntary_ctx_switches': 40,
+            'cgroup_oom_kills': 1,
+            'cgroup_cpu_usec': 1500
+        }
+        assert self.cls._usage_for_job(usage) == \
+            '<p>Resource usage: user CPU 1.50s, system CPU 0.25s, max RSS ' \
+            '2048 KiB, block I/O 10 in / 20 out, context switches 30 ' \
+            'voluntary / 40 involuntary; cgroup: cpu_usec=1500, ' \
+            'oom_kills=1</p>'
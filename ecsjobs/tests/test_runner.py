@@ -36,8 +36,11 @@ Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
 """
 
 import logging
+import threading
+import time
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, call, Mock, DEFAULT, PropertyMock
 
 from freezegun import freeze_time
@@ -59,6 +62,9 @@ class MockArgs(object):
         self.ACTION = None
         self.SCHEDULES = []
         self.only_email_if_problems = False
+        self.profile = None
+        self.tracemalloc = None
+        self.profile_top = 25
         for k, v in kwargs.items():
             setattr(self, k, v)
 
@@ -121,6 +127,19 @@ class TestParseArgs(object):
         assert res.jobs == ['bar', 'baz']
         assert res.only_email_if_problems is True
 
+    def test_parse_args_profiling(self):
+        res = parse_args(['run', 'foo'])
+        assert res.profile is None
+        assert res.tracemalloc is None
+        assert res.profile_top == 25
+        res = parse_args([
+            '--profile', '/tmp/p', '--tracemalloc=/tmp/m', '--profile-top',
+            '10', 'run', 'foo'
+        ])
+        assert res.profile == '/tmp/p'
+        assert res.tracemalloc == '/tmp/m'
+        assert res.profile_top == 10
+
     def test_parse_args_jobs_and_schedules(self):
         with pytest.raises(RuntimeError) as exc:
             parse_args(['-v', '-j', 'bar', '--job=baz', 'run', 'foo'])
@@ -179,7 +198,12 @@ class TestMain(object):
             set_log_debug=DEFAULT,
             set_log_info=DEFAULT,
             Config=DEFAULT,
-            EcsJobsRunner=DEFAULT
+            EcsJobsRunner=DEFAULT,
+            api_accounting=DEFAULT,
+            rate_limiter=DEFAULT,
+            configure_clients=DEFAULT,
+            tracing=DEFAULT,
+            profiling=DEFAULT
         ) as mocks:
             mocks['parse_args'].side_effect = SystemExit(0)
             with patch('%s.sys.argv' % pbm, ['foo', '-V']):
@@ -201,7 +225,12 @@ class TestMain(object):
             set_log_debug=DEFAULT,
             set_log_info=DEFAULT,
             Config=DEFAULT,
-            EcsJobsRunner=DEFAULT
+            EcsJobsRunner=DEFAULT,
+            api_accounting=DEFAULT,
+            rate_limiter=DEFAULT,
+            configure_clients=DEFAULT,
+            tracing=DEFAULT,
+            profiling=DEFAULT
         ) as mocks:
             mocks['parse_args'].return_value = MockArgs(
                 ACTION='validate', verbose=2
@@ -213,8 +242,29 @@ class TestMain(object):
         assert mocks['parse_args'].mock_calls == [call(['validate'])]
         assert mocks['set_log_debug'].mock_calls == [call(logging.getLogger())]
         assert mocks['set_log_info'].mock_calls == []
-        assert mocks['Config'].mock_calls == [call()]
+        assert mocks['Config'].mock_calls == [
+            call(), call().get_global('aws_api_budgets'),
+            call().get_global('aws_clients'),
+            call().get_global('aws_rate_limits')
+        ]
+        assert mocks['api_accounting'].install.mock_calls == [call()]
+        assert mocks['tracing'].configure.mock_calls == [
+            call(mocks['Config'].return_value)
+        ]
+        assert mocks['api_accounting'].budgets == \
+            mocks['Config'].return_value.get_global.return_value
+        assert mocks['configure_clients'].mock_calls == [
+            call(mocks['Config'].return_value.get_global.return_value)
+        ]
+        assert mocks['rate_limiter'].install.mock_calls == [call()]
+        assert mocks['rate_limiter'].limits == \
+            mocks['Config'].return_value.get_global.return_value
         assert mocks['EcsJobsRunner'].mock_calls == []
+        assert mocks['profiling'].mock_calls == [
+            call.start(profile_path=None, tracemalloc_path=None, top=25),
+            call.snapshot('config.load'),
+            call.stop()
+        ]
 
     def test_list_schedules(self, capsys):
         with patch.multiple(
@@ -225,7 +275,12 @@ class TestMain(object):
             set_log_debug=DEFAULT,
             set_log_info=DEFAULT,
             Config=DEFAULT,
-            EcsJobsRunner=DEFAULT
+            EcsJobsRunner=DEFAULT,
+            api_accounting=DEFAULT,
+            rate_limiter=DEFAULT,
+            configure_clients=DEFAULT,
+            tracing=DEFAULT,
+            profiling=DEFAULT
         ) as mocks:
             mocks['parse_args'].return_value = MockArgs(ACTION='list-schedules')
             type(mocks['Config'].return_value).schedule_names = \
@@ -237,7 +292,17 @@ class TestMain(object):
         assert mocks['parse_args'].mock_calls == [call(['list-schedules'])]
         assert mocks['set_log_debug'].mock_calls == []
         assert mocks['set_log_info'].mock_calls == []
-        assert mocks['Config'].mock_calls == [call()]
+        assert mocks['Config'].mock_calls == [
+            call(), call().get_global('aws_api_budgets'),
+            call().get_global('aws_clients'),
+            call().get_global('aws_rate_limits')
+        ]
+        assert mocks['api_accounting'].install.mock_calls == [call()]
+        assert mocks['tracing'].configure.mock_calls == [
+            call(mocks['Config'].return_value)
+        ]
+        assert mocks['api_accounting'].budgets == \
+            mocks['Config'].return_value.get_global.return_value
         assert mocks['EcsJobsRunner'].mock_calls == []
         out, err = capsys.readouterr()
         assert err == ''
@@ -252,7 +317,12 @@ class TestMain(object):
             set_log_debug=DEFAULT,
             set_log_info=DEFAULT,
             Config=DEFAULT,
-            EcsJobsRunner=DEFAULT
+            EcsJobsRunner=DEFAULT,
+            api_accounting=DEFAULT,
+            rate_limiter=DEFAULT,
+            configure_clients=DEFAULT,
+            tracing=DEFAULT,
+            profiling=DEFAULT
         ) as mocks:
             mocks['parse_args'].return_value = MockArgs(
                 ACTION='run', SCHEDULES=['foo', 'baz'], verbose=1, jobs=[]
@@ -262,7 +332,17 @@ class TestMain(object):
         assert mocks['parse_args'].mock_calls == [call(['run', 'foo', 'baz'])]
         assert mocks['set_log_debug'].mock_calls == []
         assert mocks['set_log_info'].mock_calls == [call(logging.getLogger())]
-        assert mocks['Config'].mock_calls == [call()]
+        assert mocks['Config'].mock_calls == [
+            call(), call().get_global('aws_api_budgets'),
+            call().get_global('aws_clients'),
+            call().get_global('aws_rate_limits')
+        ]
+        assert mocks['api_accounting'].install.mock_calls == [call()]
+        assert mocks['tracing'].configure.mock_calls == [
+            call(mocks['Config'].return_value)
+        ]
+        assert mocks['api_accounting'].budgets == \
+            mocks['Config'].return_value.get_global.return_value
         assert mocks['EcsJobsRunner'].mock_calls == [
             call(mocks['Config'].return_value, only_email_if_problems=False),
             call().run_schedules(['foo', 'baz'])
@@ -277,7 +357,12 @@ class TestMain(object):
             set_log_debug=DEFAULT,
             set_log_info=DEFAULT,
             Config=DEFAULT,
-            EcsJobsRunner=DEFAULT
+            EcsJobsRunner=DEFAULT,
+            api_accounting=DEFAULT,
+            rate_limiter=DEFAULT,
+            configure_clients=DEFAULT,
+            tracing=DEFAULT,
+            profiling=DEFAULT
         ) as mocks:
             mocks['parse_args'].return_value = MockArgs(
                 ACTION='run', SCHEDULES=[], verbose=1, jobs=['joba', 'jobb'],
@@ -290,7 +375,17 @@ class TestMain(object):
         ]
         assert mocks['set_log_debug'].mock_calls == []
         assert mocks['set_log_info'].mock_calls == [call(logging.getLogger())]
-        assert mocks['Config'].mock_calls == [call()]
+        assert mocks['Config'].mock_calls == [
+            call(), call().get_global('aws_api_budgets'),
+            call().get_global('aws_clients'),
+            call().get_global('aws_rate_limits')
+        ]
+        assert mocks['api_accounting'].install.mock_calls == [call()]
+        assert mocks['tracing'].configure.mock_calls == [
+            call(mocks['Config'].return_value)
+        ]
+        assert mocks['api_accounting'].budgets == \
+            mocks['Config'].return_value.get_global.return_value
         assert mocks['EcsJobsRunner'].mock_calls == [
             call(mocks['Config'].return_value, only_email_if_problems=True),
             call().run_job_names(['joba', 'jobb'])
@@ -301,7 +396,10 @@ class TestEcsJobsRunner(object):
 
     def setup(self):
         self.config = Mock()
+        self.config.timings.records = []
         self.cls = EcsJobsRunner(self.config)
+        self.mock_reporter = Mock()
+        self.cls._reporter = self.mock_reporter
 
     def test_init(self):
         cls = EcsJobsRunner(self.config)
@@ -312,6 +410,8 @@ class TestEcsJobsRunner(object):
         assert cls._start_time is None
         assert cls._timeout is None
         assert cls._only_email_if_problems is False
+        assert cls._reporter is None
+        assert cls._cloudwatch is None
 
     def test_init_only_if_problems(self):
         cls = EcsJobsRunner(self.config, only_email_if_problems=True)
@@ -384,19 +484,60 @@ class TestEcsJobsRunner(object):
         with patch('%s._poll_jobs' % pb, autospec=True) as mock_poll:
             with patch('%s._report' % pb, autospec=True) as mock_report:
                 with patch('%s.format_exc' % pbm) as m_fmt_exc:
-                    m_fmt_exc.return_value = 'm_traceback'
-                    self.cls._run_jobs([j1, j2, j3, j4, j5])
+                    with patch(
+                        '%s._prefetch_jobs' % pb, autospec=True
+                    ) as mock_prefetch:
+                        with patch('%s.Reporter' % pbm) as mock_rptr:
+                            with patch(
+                                '%s._export_metrics' % pb, autospec=True
+                            ) as mock_metrics:
+                                with patch(
+                                    '%s.CloudWatchMetrics' % pbm
+                                ) as mock_cw:
+                                    m_fmt_exc.return_value = 'm_traceback'
+                                    self.cls._run_jobs([j1, j2, j3, j4, j5])
+        assert mock_prefetch.mock_calls == [
+            call(self.cls, [j1, j2, j3, j4, j5], force_run=False)
+        ]
         assert self.cls._finished == [j1, j3, j4, j5]
         assert self.cls._running == [j2]
         assert self.cls._run_exceptions == {j4: (exc, 'm_traceback')}
+        assert self.cls._reporter is mock_rptr.return_value
+        assert mock_rptr.mock_calls == [
+            call(self.config),
+            call().add_job(j1, exc=None),
+            call().add_job(j3, exc=None),
+            call().add_job(j4, exc=(exc, 'm_traceback')),
+            call().add_job(j5, exc=None)
+        ]
+        rec = mock_rptr.return_value.add_job.return_value
+        assert self.cls._cloudwatch is mock_cw.return_value
+        assert mock_cw.mock_calls == [
+            call(3600, dimensions=3600),
+            call().add_job(rec),
+            call().add_job(rec),
+            call().add_job(rec),
+            call().add_job(rec)
+        ]
         assert mock_poll.mock_calls == [call(self.cls)]
         assert mock_report.mock_calls == [call(self.cls)]
+        assert mock_metrics.mock_calls == [call(self.cls)]
+        assert [t['name'] for t in self.cls._timings.records] == [
+            'run.prefetch', 'run.launch', 'run.poll', 'run.terminate',
+            'run.report', 'run.export_metrics'
+        ]
         assert self.config.jobs_for_schedules.mock_calls == []
-        assert j1.mock_calls == [call.run()]
-        assert j2.mock_calls == [call.run()]
-        assert j3.mock_calls == [call.run()]
-        assert j4.mock_calls == [call.run()]
-        assert j5.mock_calls == []
+        assert j1.mock_calls == [
+            call.run(), call.release_output(), call.cleanup()
+        ]
+        assert j2.mock_calls == [call.run(), call.terminate(), call.cleanup()]
+        assert j3.mock_calls == [
+            call.run(), call.release_output(), call.cleanup()
+        ]
+        assert j4.mock_calls == [
+            call.run(), call.release_output(), call.cleanup()
+        ]
+        assert j5.mock_calls == [call.release_output(), call.cleanup()]
         assert m_fmt_exc.mock_calls == [call()]
 
     @freeze_time('2017-10-20 12:30:00')
@@ -420,7 +561,9 @@ class TestEcsJobsRunner(object):
         exc = RuntimeError('foo')
         j4.run.side_effect = exc
         type(j4).skip = PropertyMock(return_value=None)
-        self.config.get_global.return_value = 3600
+        self.config.get_global.side_effect = {
+            'max_total_runtime_sec': 3600
+        }.get
         self.cls._finished = ['a']
         self.cls._running = ['b']
         self.cls._run_exceptions['foo'] = 6
@@ -428,23 +571,254 @@ class TestEcsJobsRunner(object):
             with patch('%s._report' % pb, autospec=True) as mock_report:
                 with patch('%s.logger' % pbm) as mock_logger:
                     with patch('%s.format_exc' % pbm) as m_fmt_exc:
-                        m_fmt_exc.return_value = 'm_traceback'
-                        self.cls._run_jobs([j1, j2, j3, j4])
+                        with patch('%s._prefetch_jobs' % pb, autospec=True):
+                            with patch('%s.Reporter' % pbm):
+                                with patch(
+                                    '%s._export_metrics' % pb, autospec=True
+                                ):
+                                    m_fmt_exc.return_value = 'm_traceback'
+                                    self.cls._run_jobs([j1, j2, j3, j4])
         assert self.cls._finished == [j1]
         assert self.cls._running == [j2, j3, j4]
         assert self.cls._run_exceptions == {}
         assert mock_poll.mock_calls == [call(self.cls)]
         assert mock_report.mock_calls == [call(self.cls)]
         assert self.config.jobs_for_schedules.mock_calls == []
-        assert j1.mock_calls == [call.run()]
-        assert j2.mock_calls == [call.run()]
-        assert j3.mock_calls == []
-        assert j4.mock_calls == []
+        assert j1.mock_calls == [
+            call.run(), call.release_output(), call.cleanup()
+        ]
+        assert j2.mock_calls == [call.run(), call.terminate(), call.cleanup()]
+        assert j3.mock_calls == [call.terminate(), call.cleanup()]
+        assert j4.mock_calls == [call.terminate(), call.cleanup()]
         assert call.error(
             'Time limit reached; not running any more jobs!'
         ) in mock_logger.mock_calls
         assert m_fmt_exc.mock_calls == []
 
+    @freeze_time('2017-10-20 12:30:00')
+    def test_run_jobs_prefetch_failed(self):
+        j1 = Mock(name='job1')
+        j1.run.return_value = True
+        type(j1).skip = PropertyMock(return_value=None)
+        j2 = Mock(name='job2')
+        type(j2).skip = PropertyMock(return_value=None)
+        exc = RuntimeError('foo')
+
+        def se_prefetch(klass, jobs, force_run=False):
+            klass._run_exceptions[j2] = (exc, 'tb')
+            klass._finished.append(j2)
+
+        self.config.get_global.side_effect = {
+            'max_total_runtime_sec': 3600
+        }.get
+        with patch('%s._poll_jobs' % pb, autospec=True):
+            with patch('%s._report' % pb, autospec=True):
+                with patch(
+                    '%s._prefetch_jobs' % pb, autospec=True
+                ) as mock_prefetch:
+                    with patch('%s.Reporter' % pbm):
+                        with patch('%s._export_metrics' % pb, autospec=True):
+                            mock_prefetch.side_effect = se_prefetch
+                            self.cls._run_jobs([j1, j2])
+        assert self.cls._finished == [j2, j1]
+        assert self.cls._run_exceptions == {j2: (exc, 'tb')}
+        assert j1.mock_calls == [
+            call.run(), call.release_output(), call.cleanup()
+        ]
+        assert j2.mock_calls == [call.cleanup()]
+
+    @freeze_time('2017-10-20 12:30:00')
+    def test_run_jobs_report_fails(self):
+        self.config.get_global.side_effect = {
+            'max_total_runtime_sec': 3600
+        }.get
+        with patch('%s._poll_jobs' % pb, autospec=True):
+            with patch('%s._report' % pb, autospec=True) as mock_report:
+                with patch('%s._prefetch_jobs' % pb, autospec=True):
+                    with patch('%s.Reporter' % pbm):
+                        with patch(
+                            '%s._export_metrics' % pb, autospec=True
+                        ) as mock_metrics:
+                            mock_report.side_effect = RuntimeError('foo')
+                            with pytest.raises(RuntimeError):
+                                self.cls._run_jobs([])
+        assert mock_metrics.mock_calls == [call(self.cls)]
+
+    def test_export_metrics_none(self):
+        self.config.get_global.return_value = None
+        with patch('%s.PrometheusExporter' % pbm) as m_exp:
+            self.cls._export_metrics()
+        assert m_exp.mock_calls == []
+
+    @freeze_time('2017-10-20 12:30:00')
+    def test_export_metrics(self):
+        self.config.get_global.side_effect = {
+            'prometheus_textfile_path': '/foo.prom',
+            'prometheus_pushgateway_job': 'ecsjobs'
+        }.get
+        self.cls._start_time = datetime(2017, 10, 20, 12, 00, 00)
+        with patch('%s.PrometheusExporter' % pbm) as m_exp:
+            self.cls._export_metrics()
+        assert m_exp.mock_calls == [
+            call(
+                textfile_path='/foo.prom', pushgateway_url=None,
+                pushgateway_job='ecsjobs'
+            ),
+            call().export(
+                self.mock_reporter.records,
+                datetime(2017, 10, 20, 12, 00, 00),
+                datetime(2017, 10, 20, 12, 30, 00)
+            )
+        ]
+
+    def test_export_metrics_exception(self):
+        self.config.get_global.side_effect = {
+            'prometheus_pushgateway_url': 'http://pgw'
+        }.get
+        with patch('%s.PrometheusExporter' % pbm) as m_exp:
+            with patch('%s.logger' % pbm) as m_logger:
+                m_exp.return_value.export.side_effect = RuntimeError('foo')
+                self.cls._export_metrics()
+        assert m_logger.mock_calls == [
+            call.error('Unable to export Prometheus metrics', exc_info=True)
+        ]
+
+    @freeze_time('2017-10-20 12:30:00')
+    def test_export_metrics_cloudwatch(self):
+        self.config.get_global.return_value = None
+        self.mock_reporter.records = ['r1', 'r2', 'r3']
+        self.cls._start_time = datetime(2017, 10, 20, 12, 00, 00)
+        self.cls._cloudwatch = Mock(num_jobs=2)
+        with patch('%s.PrometheusExporter' % pbm) as m_exp:
+            self.cls._export_metrics()
+        assert m_exp.mock_calls == []
+        assert self.cls._cloudwatch.mock_calls == [
+            call.add_job('r3', default_dt=datetime(2017, 10, 20, 12, 30, 00)),
+            call.flush(
+                datetime(2017, 10, 20, 12, 00, 00),
+                datetime(2017, 10, 20, 12, 30, 00)
+            )
+        ]
+
+    def test_export_metrics_cloudwatch_exception(self):
+        self.config.get_global.return_value = None
+        self.mock_reporter.records = []
+        self.cls._cloudwatch = Mock(num_jobs=0)
+        self.cls._cloudwatch.flush.side_effect = RuntimeError('foo')
+        with patch('%s.logger' % pbm) as m_logger:
+            self.cls._export_metrics()
+        assert m_logger.mock_calls == [
+            call.error('Unable to send CloudWatch metrics', exc_info=True)
+        ]
+
+    def test_prefetch_jobs(self):
+        j1 = Mock(name='job1')
+        type(j1).needs_prefetch = PropertyMock(return_value=True)
+        type(j1).skip = PropertyMock(return_value=None)
+        j2 = Mock(name='job2')
+        type(j2).needs_prefetch = PropertyMock(return_value=False)
+        type(j2).skip = PropertyMock(return_value=None)
+        j3 = Mock(name='job3')
+        type(j3).needs_prefetch = PropertyMock(return_value=True)
+        type(j3).skip = PropertyMock(return_value=None)
+        exc = RuntimeError('foo')
+        j3.prefetch.side_effect = exc
+        j4 = Mock(name='job4')
+        type(j4).needs_prefetch = PropertyMock(return_value=True)
+        type(j4).skip = PropertyMock(return_value='some reason')
+        self.config.get_global.return_value = 4
+        self.cls._timeout = datetime.now() + timedelta(hours=1)
+        with patch(
+            '%s.ThreadPoolExecutor' % pbm, wraps=ThreadPoolExecutor
+        ) as m_tpe:
+            self.cls._prefetch_jobs([j1, j2, j3, j4])
+        assert m_tpe.mock_calls[0] == call(max_workers=2)
+        assert self.config.get_global.mock_calls == [
+            call('prefetch_concurrency')
+        ]
+        assert j1.mock_calls == [call.prefetch()]
+        assert j2.mock_calls == []
+        assert j3.mock_calls == [call.prefetch(), call.release_output()]
+        assert j4.mock_calls == []
+        assert self.cls._finished == [j3]
+        assert list(self.cls._run_exceptions.keys()) == [j3]
+        assert self.cls._run_exceptions[j3][0] == exc
+        assert 'RuntimeError: foo' in self.cls._run_exceptions[j3][1]
+        assert self.mock_reporter.mock_calls == [
+            call.add_job(j3, exc=self.cls._run_exceptions[j3])
+        ]
+
+    def test_prefetch_jobs_force_run(self):
+        j1 = Mock(name='job1')
+        type(j1).needs_prefetch = PropertyMock(return_value=True)
+        type(j1).skip = PropertyMock(return_value='some reason')
+        self.config.get_global.return_value = 4
+        self.cls._timeout = datetime.now() + timedelta(hours=1)
+        self.cls._prefetch_jobs([j1], force_run=True)
+        assert j1.mock_calls == [call.prefetch()]
+        assert self.cls._finished == []
+
+    def test_prefetch_jobs_time_limit(self):
+        done = threading.Event()
+        j1 = Mock(name='job1')
+        j1.name = 'job1'
+        type(j1).needs_prefetch = PropertyMock(return_value=True)
+        type(j1).skip = PropertyMock(return_value=None)
+        j1.prefetch.side_effect = lambda: done.wait(5)
+        j2 = Mock(name='job2')
+        type(j2).needs_prefetch = PropertyMock(return_value=True)
+        type(j2).skip = PropertyMock(return_value=None)
+        self.config.get_global.return_value = 4
+        self.cls._timeout = datetime.now() + timedelta(seconds=0.2)
+        start = time.time()
+        self.cls._prefetch_jobs([j1, j2])
+        assert time.time() - start < 1
+        assert self.cls._finished == [j1]
+        assert list(self.cls._run_exceptions.keys()) == [j1]
+        assert str(self.cls._run_exceptions[j1][0]) == 'ERROR: Prefetch ' \
+            'for job job1 did not finish before max_total_runtime_sec was ' \
+            'reached'
+        assert j2.mock_calls == [call.prefetch()]
+        assert call.cleanup() not in j1.mock_calls
+        done.set()
+        for _ in range(100):
+            if call.cleanup() in j1.mock_calls:
+                break
+            time.sleep(0.01)
+        assert j1.mock_calls == [
+            call.prefetch(), call.release_output(), call.cleanup()
+        ]
+
+    def test_cleanup_jobs(self):
+        j1 = Mock(name='job1')
+        j1.cleanup.side_effect = RuntimeError('foo')
+        j2 = Mock(name='job2')
+        with patch('%s.logger' % pbm) as mock_logger:
+            self.cls._cleanup_jobs([j1, j2])
+        assert j1.mock_calls == [call.cleanup()]
+        assert j2.mock_calls == [call.cleanup()]
+        assert mock_logger.mock_calls == [
+            call.error('Unable to clean up job %s', j1, exc_info=True)
+        ]
+
+    def test_prefetch_job(self):
+        j = Mock()
+        j.name = 'job1'
+        with patch('%s.job_context' % pbm) as m_ctx:
+            self.cls._prefetch_job(j)
+        assert m_ctx.mock_calls == [
+            call('job1'), call().__enter__(), call().__exit__(None, None, None)
+        ]
+        assert j.mock_calls == [call.prefetch()]
+
+    def test_prefetch_jobs_none(self):
+        j1 = Mock(name='job1')
+        type(j1).needs_prefetch = PropertyMock(return_value=False)
+        with patch('%s.ThreadPoolExecutor' % pbm) as m_tpe:
+            self.cls._prefetch_jobs([j1])
+        assert m_tpe.mock_calls == []
+        assert self.config.get_global.mock_calls == []
+
     @freeze_time('2017-10-20 12:30:00')
     def test_poll_jobs(self):
         self.config.get_global.return_value = 3600
@@ -461,11 +835,59 @@ class TestEcsJobsRunner(object):
             self.cls._poll_jobs()
         assert self.cls._finished == [j1, j3, j2]
         assert self.cls._running == []
-        assert j1.mock_calls == [call.poll()]
-        assert j2.mock_calls == [call.poll(), call.poll(), call.poll()]
-        assert j3.mock_calls == [call.poll()]
+        assert j1.mock_calls == [call.poll(), call.release_output()]
+        assert j2.mock_calls == [
+            call.poll(), call.poll(), call.poll(), call.release_output()
+        ]
+        assert j3.mock_calls == [call.poll(), call.release_output()]
+        assert self.mock_reporter.mock_calls == [
+            call.add_job(j1, exc=None),
+            call.add_job(j3, exc=None),
+            call.add_job(j2, exc=None)
+        ]
         assert mock_sleep.mock_calls == [call(3600), call(3600)]
 
+    @freeze_time('2017-10-20 12:30:00')
+    def test_poll_jobs_exception(self):
+        self.config.get_global.return_value = 3600
+        self.cls._timeout = datetime(2017, 10, 20, 13, 30, 00)
+        self.cls._run_exceptions = {}
+        j1 = Mock(name='job1')
+        ex = RuntimeError('foo')
+        j1.poll.side_effect = [False, ex]
+        j2 = Mock(name='job2')
+        j2.poll.side_effect = [False, False, True]
+        self.cls._running = [j1, j2]
+        self.cls._finished = []
+        with patch('%s.sleep' % pbm):
+            with patch('%s.format_exc' % pbm) as m_fmt:
+                m_fmt.return_value = 'tb'
+                self.cls._poll_jobs()
+        assert self.cls._finished == [j1, j2]
+        assert self.cls._running == []
+        assert self.cls._run_exceptions == {j1: (ex, 'tb')}
+        assert j1.mock_calls == [
+            call.poll(), call.poll(), call.release_output()
+        ]
+        assert self.mock_reporter.mock_calls == [
+            call.add_job(j1, exc=(ex, 'tb')),
+            call.add_job(j2, exc=None)
+        ]
+
+    def test_terminate_jobs(self):
+        j1 = Mock(name='job1')
+        j1.terminate.side_effect = RuntimeError('foo')
+        j2 = Mock(name='job2')
+        self.cls._running = [j1, j2]
+        with patch('%s.logger' % pbm) as mock_logger:
+            self.cls._terminate_jobs()
+        assert j1.mock_calls == [call.terminate()]
+        assert j2.mock_calls == [call.terminate()]
+        assert self.cls._running == [j1, j2]
+        assert mock_logger.mock_calls == [
+            call.error('Unable to terminate job %s', j1, exc_info=True)
+        ]
+
     @freeze_time('2017-10-20 12:30:00')
     def test_poll_jobs_timeout(self):
         self.poll_num = 0
@@ -491,9 +913,9 @@ class TestEcsJobsRunner(object):
                 self.cls._poll_jobs()
         assert self.cls._finished == [j1, j3]
         assert self.cls._running == [j2]
-        assert j1.mock_calls == [call.poll()]
+        assert j1.mock_calls == [call.poll(), call.release_output()]
         assert j2.mock_calls == [call.poll(), call.poll()]
-        assert j3.mock_calls == [call.poll()]
+        assert j3.mock_calls == [call.poll(), call.release_output()]
         assert mock_sleep.mock_calls == [call(3600), call(3600)]
         assert call.error(
             'Time limit reached; not polling any more jobs!'
@@ -505,17 +927,30 @@ class TestEcsJobsRunner(object):
         self.cls._running = Mock()
         self.cls._run_exceptions = Mock()
         self.cls._start_time = datetime(2017, 10, 20, 11, 45, 00)
-        with patch('%s.Reporter' % pbm, autospec=True) as mock_report:
+        self.config.timings.records = [{'name': 'config.load'}]
+        self.cls._timings.add(
+            'run.poll', datetime(2017, 10, 20, 12, 00, 00), 2.0, 0.5
+        )
+        with patch('%s.api_accounting' % pbm) as m_acct:
+            m_acct.records = [{'service': 'ecs'}]
             self.cls._report()
-        assert mock_report.mock_calls == [
-            call(self.config),
-            call().run(
+        assert self.mock_reporter.mock_calls == [
+            call.run(
                 self.cls._finished,
                 self.cls._running,
                 self.cls._run_exceptions,
                 datetime(2017, 10, 20, 11, 45, 00),
                 datetime(2017, 10, 20, 12, 30, 00),
-                only_email_if_problems=False
+                only_email_if_problems=False,
+                timings=[
+                    {'name': 'config.load'},
+                    {
+                        'name': 'run.poll',
+                        'start_time': '2017-10-20T12:00:00',
+                        'wall_sec': 2.0, 'cpu_sec': 0.5, 'count': 1
+                    }
+                ],
+                api_calls=[{'service': 'ecs'}]
             )
         ]
 
@@ -526,16 +961,16 @@ class TestEcsJobsRunner(object):
         self.cls._run_exceptions = Mock()
         self.cls._only_email_if_problems = True
         self.cls._start_time = datetime(2017, 10, 20, 11, 45, 00)
-        with patch('%s.Reporter' % pbm, autospec=True) as mock_report:
-            self.cls._report()
-        assert mock_report.mock_calls == [
-            call(self.config),
-            call().run(
+        self.cls._report()
+        assert self.mock_reporter.mock_calls == [
+            call.run(
                 self.cls._finished,
                 self.cls._running,
                 self.cls._run_exceptions,
                 datetime(2017, 10, 20, 11, 45, 00),
                 datetime(2017, 10, 20, 12, 30, 00),
-                only_email_if_problems=True
+                only_email_if_problems=True,
+                timings=[],
+                api_calls=[]
             )
         ]
@@ -0,0 +1,171 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import gzip
+from unittest.mock import patch, call
+
+import pytest
+
+from ecsjobs.s3_output import S3OutputStore
+
+pbm = 'ecsjobs.s3_output'
+pb = '%s.S3OutputStore' % pbm
+
+
+class FakeS3(object):
+    """
+    In-memory stand-in for the subset of the S3 client API used by
+    :py:class:`~ecsjobs.s3_output.S3OutputStore`.
+    """
+
+    def __init__(self, fail_part=None):
+        self.objects = {}
+        self.uploads = {}
+        self.uploads_done = []
+        self.calls = []
+        self.fail_part = fail_part
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append('put_object')
+        self.objects[(Bucket, Key)] = (Body, kwargs)
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.calls.append('create_multipart_upload')
+        upload_id = 'upload%d' % len(self.uploads)
+        self.uploads[upload_id] = (Bucket, Key, {}, kwargs)
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        if PartNumber == self.fail_part:
+            raise RuntimeError('part failed')
+        self.uploads[UploadId][2][PartNumber] = Body
+        return {'ETag': '"etag%d"' % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        b, k, parts, kwargs = self.uploads.pop(UploadId)
+        self.uploads_done.append(parts)
+        assert (b, k) == (Bucket, Key)
+        nums = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        assert nums == sorted(parts.keys())
+        assert [p['ETag'] for p in MultipartUpload['Parts']] == [
+            '"etag%d"' % n for n in nums
+        ]
+        self.objects[(Bucket, Key)] = (
+            b''.join(parts[n] for n in nums), kwargs
+        )
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        del self.uploads[UploadId]
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return 'https://%s.s3.amazonaws.com/%s?expires=%d' % (
+            Params['Bucket'], Params['Key'], ExpiresIn
+        )
+
+
+class TestS3OutputStore(object):
+
+    def setup(self):
+        self.s3 = FakeS3()
+        self.cls = S3OutputStore('bkt', 'pre/fix/', presign_sec=3600)
+        self.cls._s3 = self.s3
+
+    def test_client(self):
+        cls = S3OutputStore('bkt', 'pre/')
+        with patch('%s.aws.client' % pbm) as m_client:
+            assert cls.client is m_client.return_value
+            assert cls.client is m_client.return_value
+        assert m_client.mock_calls == [call('s3')]
+
+    def test_key_for(self):
+        assert self.cls.key_for('my job/1') == 'pre/fix/my_job_1.txt.gz'
+
+    def test_upload_small(self):
+        res = self.cls.upload('myjob', 'some output\n')
+        assert res == (
+            's3://bkt/pre/fix/myjob.txt.gz',
+            'https://bkt.s3.amazonaws.com/pre/fix/myjob.txt.gz?expires=3600'
+        )
+        assert self.s3.calls == ['put_object']
+        body, kwargs = self.s3.objects[('bkt', 'pre/fix/myjob.txt.gz')]
+        assert gzip.decompress(body) == b'some output\n'
+        assert kwargs == {
+            'ContentType': 'text/plain', 'ContentEncoding': 'gzip'
+        }
+
+    def test_upload_no_presign(self):
+        self.cls._presign_sec = 0
+        res = self.cls.upload('myjob', 'some output\n')
+        assert res == ('s3://bkt/pre/fix/myjob.txt.gz', None)
+
+    def test_upload_multipart(self):
+        self.cls.PART_SIZE_BYTES = 1024
+        self.cls.CHUNK_CHARS = 100
+        # incompressible, so that it spans several parts
+        output = os.urandom(8000).hex()
+        self.cls.upload('myjob', output)
+        assert self.s3.calls[0] == 'create_multipart_upload'
+        assert self.s3.calls[-1] == 'complete_multipart_upload'
+        assert self.s3.calls.count('upload_part') > 2
+        assert all(
+            len(b) == 1024 for n, b in self.s3.uploads_done[-1].items()
+            if n < max(self.s3.uploads_done[-1].keys())
+        )
+        assert self.s3.uploads == {}
+        body, kwargs = self.s3.objects[('bkt', 'pre/fix/myjob.txt.gz')]
+        assert gzip.decompress(body).decode('utf-8') == output
+        assert kwargs == {
+            'ContentType': 'text/plain', 'ContentEncoding': 'gzip'
+        }
+
+    def test_upload_multipart_failure(self):
+        self.s3.fail_part = 2
+        self.cls.PART_SIZE_BYTES = 1024
+        output = os.urandom(4000).hex()
+        with pytest.raises(RuntimeError):
+            self.cls.upload('myjob', output)
+        assert self.s3.calls == [
+            'create_multipart_upload', 'upload_part', 'upload_part',
+            'abort_multipart_upload'
+        ]
+        assert self.s3.uploads == {}
+        assert self.s3.objects == {}
@@ -151,3 +151,51 @@ class TestValidateExamples(object):
         assert list(exc.value.relative_schema_path) == [
             'properties', 'jobs', 'items', 'anyOf'
         ]
+
+    def test_report_sinks_success(self):
+        config_yaml = dedent("""
+        global:
+          from_email: you@example.com
+          to_email:
+            - target@example.com
+          report_sinks:
+            - type: ses
+            - type: file
+              path: /tmp/report.html
+            - type: s3
+              bucket: foo
+            - type: webhook
+              url: https://example.com/hook
+            - type: json
+            - type: command
+              command: [/bin/cat]
+        jobs:
+        - name: jobTwo
+          class_name: LocalCommand
+          schedule: foo
+          command: uptime
+        """)
+        conf = yaml.load(config_yaml, Loader=yaml.FullLoader)
+        Schema().validate(conf)
+
+    def test_report_sink_missing_key(self):
+        config_yaml = dedent("""
+        global:
+          from_email: you@example.com
+          to_email:
+            - target@example.com
+          report_sinks:
+            - type: ses
+            - type: webhook
+              timeout_sec: 10
+        jobs:
+        - name: jobTwo
+          class_name: LocalCommand
+          schedule: foo
+          command: uptime
+        """)
+        conf = yaml.load(config_yaml, Loader=yaml.FullLoader)
+        with pytest.raises(ValidationError) as exc:
+            Schema().validate(conf)
+        assert list(exc.value.relative_path) == ['global', 'report_sinks', 1]
+        assert exc.value.validator == 'oneOf'
@@ -0,0 +1,336 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import json
+from hashlib import sha256
+from unittest.mock import patch, Mock, call
+
+import pytest
+from botocore.exceptions import ClientError
+
+from ecsjobs.script_cache import ScriptCache
+
+pbm = 'ecsjobs.script_cache'
+pb = '%s.ScriptCache' % pbm
+
+
+def _digest(content):
+    return sha256(content).hexdigest()
+
+
+class CacheTester(object):
+
+    @pytest.fixture(autouse=True)
+    def make_cache(self, tmpdir):
+        self.dir = str(tmpdir.join('cache'))
+        self.session = Mock()
+        self.s3 = Mock()
+        with patch('%s.requests.Session' % pbm) as m_session:
+            m_session.return_value = self.session
+            self.cls = ScriptCache(self.dir, max_bytes=10)
+        self.cls._s3 = self.s3
+
+    def http_resp(self, status, content=b'', headers=None):
+        r = Mock(status_code=status, content=content, headers=headers or {})
+        if status >= 400:
+            r.raise_for_status.side_effect = RuntimeError('HTTP %s' % status)
+        return r
+
+
+class TestInit(CacheTester):
+
+    def test_init(self):
+        assert os.path.isdir(self.dir)
+        assert self.cls._index == {}
+        assert self.cls._index_path == os.path.join(self.dir, 'index.json')
+
+    def test_load_index_drops_missing(self):
+        content = b'#!/bin/sh\necho hi\n'
+        self.session.get.return_value = self.http_resp(200, content)
+        self.cls.get('http://foo/a')
+        with open(os.path.join(self.dir, 'index.json'), 'r') as fh:
+            index = json.load(fh)
+        index['http://foo/b'] = {'sha256': 'abcd', 'size': 2, 'atime': 1}
+        with open(os.path.join(self.dir, 'index.json'), 'w') as fh:
+            json.dump(index, fh)
+        cls = ScriptCache(self.dir)
+        assert list(cls._index.keys()) == ['http://foo/a']
+
+    def test_load_index_corrupt(self):
+        with open(os.path.join(self.dir, 'index.json'), 'w') as fh:
+            fh.write('not json')
+        assert ScriptCache(self.dir)._index == {}
+
+    def test_shared_between_instances(self):
+        with patch('%s.requests.Session' % pbm) as m_session:
+            m_session.return_value = self.session
+            other = ScriptCache(self.dir, max_bytes=10)
+        self.session.get.return_value = self.http_resp(200, b'aa')
+        self.cls.get('http://foo/a')
+        self.session.get.return_value = self.http_resp(200, b'bb')
+        other.get('http://foo/b')
+        with open(os.path.join(self.dir, 'index.json'), 'r') as fh:
+            index = json.load(fh)
+        assert sorted(index.keys()) == ['http://foo/a', 'http://foo/b']
+        assert os.path.exists(os.path.join(self.dir, '.lock'))
+
+
+class TestGetHttp(CacheTester):
+
+    def test_miss(self):
+        content = b'#!/bin/sh\necho hi\n'
+        self.session.get.return_value = self.http_resp(
+            200, content, {'ETag': '"e1"', 'Last-Modified': 'lm1'}
+        )
+        res = self.cls.get('http://foo/a')
+        assert res == os.path.join(self.dir, _digest(content))
+        assert os.access(res, os.X_OK)
+        with open(res, 'rb') as fh:
+            assert fh.read() == content
+        assert self.session.get.mock_calls[0] == call(
+            'http://foo/a', headers={}, timeout=60
+        )
+        entry = self.cls._index['http://foo/a']
+        assert entry['etag'] == '"e1"'
+        assert entry['last_modified'] == 'lm1'
+        assert entry['size'] == len(content)
+
+    def test_revalidate_not_modified(self):
+        content = b'abc'
+        self.session.get.return_value = self.http_resp(
+            200, content, {'ETag': '"e1"', 'Last-Modified': 'lm1'}
+        )
+        first = self.cls.get('http://foo/a')
+        self.session.reset_mock()
+        self.session.get.return_value = self.http_resp(304)
+        assert self.cls.get('http://foo/a') == first
+        assert self.session.get.mock_calls == [
+            call(
+                'http://foo/a',
+                headers={'If-None-Match': '"e1"', 'If-Modified-Since': 'lm1'},
+                timeout=60
+            )
+        ]
+
+    def test_revalidate_changed(self):
+        self.session.get.return_value = self.http_resp(200, b'abc')
+        first = self.cls.get('http://foo/a')
+        self.session.get.return_value = self.http_resp(200, b'def')
+        second = self.cls.get('http://foo/a')
+        assert second != first
+        assert second == os.path.join(self.dir, _digest(b'def'))
+
+    def test_http_error(self):
+        self.session.get.return_value = self.http_resp(404)
+        with pytest.raises(RuntimeError):
+            self.cls.get('http://foo/a')
+        assert self.cls._index == {}
+
+    def test_pinned_hit_no_request(self):
+        self.session.get.return_value = self.http_resp(200, b'abc')
+        first = self.cls.get('http://foo/a')
+        self.session.reset_mock()
+        assert self.cls.get(
+            'http://foo/a', sha256=_digest(b'abc').upper()
+        ) == first
+        assert self.session.mock_calls == []
+
+    def test_pinned_mismatch(self):
+        self.session.get.return_value = self.http_resp(200, b'abc')
+        with pytest.raises(RuntimeError) as exc:
+            self.cls.get('http://foo/a', sha256='0' * 64)
+        assert 'expected %s' % ('0' * 64) in str(exc.value)
+        assert self.cls._index == {}
+
+    def test_pinned_not_modified_mismatch(self):
+        self.session.get.return_value = self.http_resp(
+            200, b'abc', {'ETag': '"e1"'}
+        )
+        self.cls.get('http://foo/a')
+        self.session.get.return_value = self.http_resp(304)
+        with pytest.raises(RuntimeError):
+            self.cls.get('http://foo/a', sha256='0' * 64)
+
+    def test_unsupported(self):
+        with pytest.raises(RuntimeError) as exc:
+            self.cls.get('ftp://foo/a')
+        assert str(exc.value) == 'Error: unsupported URL scheme: ftp://foo/a'
+
+
+class TestGetS3(CacheTester):
+
+    def test_miss(self):
+        body = Mock()
+        body.read.return_value = b'abc'
+        self.s3.get_object.return_value = {'Body': body, 'ETag': '"e1"'}
+        res = self.cls.get('s3://bkt/path/to/key')
+        assert res == os.path.join(self.dir, _digest(b'abc'))
+        assert self.s3.mock_calls == [
+            call.get_object(Bucket='bkt', Key='path/to/key')
+        ]
+        assert self.cls._index['s3://bkt/path/to/key']['etag'] == '"e1"'
+
+    def test_not_modified(self):
+        body = Mock()
+        body.read.return_value = b'abc'
+        self.s3.get_object.return_value = {'Body': body, 'ETag': '"e1"'}
+        first = self.cls.get('s3://bkt/key')
+        self.s3.reset_mock()
+        self.s3.get_object.side_effect = ClientError(
+            {'Error': {'Code': '304'}}, 'GetObject'
+        )
+        assert self.cls.get('s3://bkt/key') == first
+        assert self.s3.mock_calls == [
+            call.get_object(Bucket='bkt', Key='key', IfNoneMatch='"e1"')
+        ]
+
+    def test_error(self):
+        self.s3.get_object.side_effect = ClientError(
+            {'Error': {'Code': 'AccessDenied'}}, 'GetObject'
+        )
+        with pytest.raises(ClientError):
+            self.cls.get('s3://bkt/key')
+
+    def test_lazy_client(self):
+        self.cls._s3 = None
+        body = Mock()
+        body.read.return_value = b'abc'
+        with patch('%s.aws.client' % pbm) as m_client:
+            m_client.return_value.get_object.return_value = {
+                'Body': body, 'ETag': '"e1"'
+            }
+            self.cls.get('s3://bkt/key')
+            self.cls.get('s3://bkt/key2')
+        assert m_client.mock_calls[0] == call('s3')
+        assert len([c for c in m_client.mock_calls if c == call('s3')]) == 1
+
+
+class TestEvict(CacheTester):
+
+    def test_lru_eviction(self):
+        contents = [b'aaaa', b'bbbb', b'cccc']
+        for idx, c in enumerate(contents):
+            self.session.get.return_value = self.http_resp(200, c)
+            with patch('%s.time.time' % pbm) as m_time:
+                m_time.return_value = 100 + idx
+                self.cls.get('http://foo/%d' % idx)
+            self.cls.release('http://foo/%d' % idx)
+        assert sorted(self.cls._index.keys()) == [
+            'http://foo/1', 'http://foo/2'
+        ]
+        assert not os.path.exists(os.path.join(self.dir, _digest(b'aaaa')))
+        assert os.path.exists(os.path.join(self.dir, _digest(b'bbbb')))
+        assert os.path.exists(os.path.join(self.dir, _digest(b'cccc')))
+
+    def test_pinned_not_evicted(self):
+        paths = []
+        for idx, c in enumerate([b'aaaa', b'bbbb', b'cccc', b'dddd']):
+            self.session.get.return_value = self.http_resp(200, c)
+            with patch('%s.time.time' % pbm) as m_time:
+                m_time.return_value = 100 + idx
+                paths.append(self.cls.get('http://foo/%d' % idx))
+        for path in paths:
+            assert os.path.exists(path)
+        assert len(self.cls._index) == 4
+        self.cls.release('http://foo/0')
+        assert not os.path.exists(paths[0])
+        assert sorted(self.cls._index.keys()) == [
+            'http://foo/1', 'http://foo/2', 'http://foo/3'
+        ]
+        self.cls.release('http://foo/1')
+        assert not os.path.exists(paths[1])
+        self.cls.release('http://foo/2')
+        self.cls.release('http://foo/3')
+        assert sorted(self.cls._index.keys()) == [
+            'http://foo/2', 'http://foo/3'
+        ]
+        assert self.cls._refs == {}
+        assert self.cls._index['http://foo/3']['pins'] == []
+
+    def test_pinned_by_other_process(self):
+        self.session.get.return_value = self.http_resp(200, b'a' * 12)
+        path = self.cls.get('http://foo/a')
+        with open(os.path.join(self.dir, 'index.json'), 'r') as fh:
+            index = json.load(fh)
+        index['http://foo/a']['pins'] = [os.getpid() + 1]
+        with open(os.path.join(self.dir, 'index.json'), 'w') as fh:
+            json.dump(index, fh)
+        self.session.get.return_value = self.http_resp(200, b'bbbb')
+        with patch('%s._pid_alive' % pb) as m_alive:
+            m_alive.return_value = True
+            self.cls.get('http://foo/b')
+            self.cls.release('http://foo/b')
+        assert os.path.exists(path)
+        with patch('%s._pid_alive' % pb) as m_alive:
+            m_alive.return_value = False
+            self.cls.release('http://foo/a')
+        assert not os.path.exists(path)
+
+    def test_release_not_pinned(self):
+        self.cls.release('http://foo/a')
+        assert self.cls._refs == {}
+
+    def test_pid_alive(self):
+        assert ScriptCache._pid_alive(os.getpid()) is True
+        with patch('%s.os.kill' % pbm) as m_kill:
+            m_kill.side_effect = ProcessLookupError()
+            assert ScriptCache._pid_alive(1234) is False
+            m_kill.side_effect = PermissionError()
+            assert ScriptCache._pid_alive(1234) is True
+
+    def test_never_evict_most_recent(self):
+        self.session.get.return_value = self.http_resp(200, b'x' * 20)
+        res = self.cls.get('http://foo/big')
+        assert os.path.exists(res)
+        assert list(self.cls._index.keys()) == ['http://foo/big']
+
+    def test_shared_content(self):
+        with patch('%s.time.time' % pbm) as m_time:
+            self.session.get.return_value = self.http_resp(200, b'aaaa')
+            m_time.return_value = 100
+            self.cls.get('http://foo/a')
+            m_time.return_value = 101
+            self.cls.get('http://foo/b')
+            self.session.get.return_value = self.http_resp(200, b'bbbbbb')
+            m_time.return_value = 102
+            self.cls.get('http://foo/c')
+        # shared content is only counted once, so 10 bytes total
+        assert sorted(self.cls._index.keys()) == [
+            'http://foo/a', 'http://foo/b', 'http://foo/c'
+        ]
+        assert os.path.exists(os.path.join(self.dir, _digest(b'aaaa')))
@@ -0,0 +1,86 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from freezegun import freeze_time
+
+from ecsjobs.timing import Timings
+
+pbm = 'ecsjobs.timing'
+
+
+class TestTimings(object):
+
+    def setup(self):
+        self.cls = Timings()
+
+    @freeze_time('2017-11-23 12:00:00')
+    def test_time(self):
+        with patch('%s.perf_counter' % pbm) as m_wall:
+            with patch('%s.thread_time' % pbm) as m_cpu:
+                m_wall.side_effect = [10.0, 12.5]
+                m_cpu.side_effect = [1.0, 1.25]
+                with self.cls.time('foo'):
+                    pass
+        assert self.cls.records == [{
+            'name': 'foo', 'start_time': '2017-11-23T12:00:00',
+            'wall_sec': 2.5, 'cpu_sec': 0.25, 'count': 1
+        }]
+
+    def test_time_exception(self):
+        with pytest.raises(RuntimeError):
+            with self.cls.time('foo'):
+                raise RuntimeError('bar')
+        assert [t['name'] for t in self.cls.records] == ['foo']
+
+    def test_add_accumulates(self):
+        self.cls.add('b', datetime(2017, 11, 23, 12, 0, 0), 1.0, 0.5)
+        self.cls.add('a', datetime(2017, 11, 23, 12, 0, 1), 2.0, 0.0)
+        self.cls.add('b', datetime(2017, 11, 23, 12, 0, 2), 3.0, 0.25)
+        assert self.cls.records == [
+            {
+                'name': 'b', 'start_time': '2017-11-23T12:00:00',
+                'wall_sec': 4.0, 'cpu_sec': 0.75, 'count': 2
+            },
+            {
+                'name': 'a', 'start_time': '2017-11-23T12:00:01',
+                'wall_sec': 2.0, 'cpu_sec': 0.0, 'count': 1
+            }
+        ]
@@ -0,0 +1,245 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import json
+import threading
+from datetime import datetime
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch, Mock
+
+import pytest
+
+from ecsjobs import tracing
+from ecsjobs.timing import Timings
+from ecsjobs.tracing import Tracer, Span
+
+pbm = 'ecsjobs.tracing'
+
+
+class FakeCollector(object):
+    """
+    Local HTTP stand-in for an OTLP/HTTP collector, recording each request.
+    """
+
+    def __init__(self):
+        self.requests = []
+        coll = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                coll.requests.append((self.path, dict(self.headers), body))
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d/v1/traces' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestDisabled(object):
+
+    def test_noop(self):
+        with patch('%s._tracer' % pbm, None):
+            sp = tracing.span('foo', attributes={'a': 1})
+            with sp as s:
+                s.set_attribute('b', 2)
+                assert tracing.current_span() is sp
+            tracing.add_timings(Timings(), ['foo'])
+            tracing.flush()
+        assert sp is tracing._NOOP_SPAN
+
+    def test_configure(self):
+        conf = Mock()
+        conf.get_global.side_effect = {
+            'trace_file_path': '/tmp/t.jsonl'
+        }.get
+        with patch('%s._tracer' % pbm, None):
+            tracing.configure(conf)
+            assert tracing._tracer._file_path == '/tmp/t.jsonl'
+            assert tracing._tracer._otlp_url is None
+            conf.get_global.side_effect = {}.get
+            tracing.configure(conf)
+            assert tracing._tracer is None
+
+
+class TestSpans(object):
+
+    def setup(self):
+        self.tracer = Tracer()
+        self.patcher = patch('%s._tracer' % pbm, self.tracer)
+        self.patcher.start()
+
+    def teardown(self):
+        self.patcher.stop()
+
+    def test_nesting(self):
+        with tracing.span('root', attributes={'x': 'y'}) as root:
+            assert tracing.current_span() is root
+            with tracing.span('child') as child:
+                child.set_attribute('n', 3)
+            with pytest.raises(RuntimeError):
+                with tracing.span('bad'):
+                    raise RuntimeError('foo')
+        assert tracing.current_span() is tracing._NOOP_SPAN
+        spans = self.tracer._spans
+        assert [s.name for s in spans] == ['child', 'bad', 'root']
+        assert spans[0].parent is root
+        assert spans[0].trace_id == root.trace_id
+        assert spans[0].attributes == {'n': 3}
+        assert spans[1].error == 'RuntimeError: foo'
+        assert root.parent is None
+        assert root.start_ns <= spans[0].start_ns <= spans[0].end_ns
+        assert spans[1].end_ns <= root.end_ns
+
+    def test_explicit_parent(self):
+        with tracing.span('root') as root:
+            parent = tracing.current_span()
+        res = []
+
+        def in_thread():
+            with tracing.span('t', parent=parent) as s:
+                res.append(s)
+
+        t = threading.Thread(target=in_thread)
+        t.start()
+        t.join()
+        assert res[0].parent is root
+
+    def test_add_timings(self):
+        t = Timings()
+        t.add('config.load', datetime(2017, 11, 23, 12, 0, 0), 1.5, 0.5)
+        t.add('config.other', datetime(2017, 11, 23, 12, 0, 0), 1.0, 0.5)
+        with tracing.span('root') as root:
+            tracing.add_timings(t, ['config.load'])
+        spans = self.tracer._spans
+        assert [s.name for s in spans] == ['config.load', 'root']
+        start = int(datetime(2017, 11, 23, 12, 0, 0).timestamp() * 1e9)
+        assert spans[0].start_ns == start
+        assert spans[0].end_ns == start + 1500000000
+        assert spans[0].parent is root
+        assert root.start_ns == start
+
+    def test_to_otlp(self):
+        parent = Span(self.tracer, 'root')
+        s = Span(self.tracer, 'child', parent=parent, attributes={
+            'str': 'a', 'int': 2, 'float': 1.5, 'bool': True, 'other': None
+        })
+        s.start_ns = 1000
+        s.error = 'RuntimeError: foo'
+        s.end(end_ns=2000)
+        res = self.tracer.to_otlp([s])
+        rs = res['resourceSpans'][0]
+        assert {
+            'key': 'service.name', 'value': {'stringValue': 'ecsjobs'}
+        } in rs['resource']['attributes']
+        assert rs['scopeSpans'][0]['scope']['name'] == 'ecsjobs'
+        assert rs['scopeSpans'][0]['spans'] == [{
+            'traceId': parent.trace_id,
+            'spanId': s.span_id,
+            'parentSpanId': parent.span_id,
+            'name': 'child',
+            'kind': 1,
+            'startTimeUnixNano': '1000',
+            'endTimeUnixNano': '2000',
+            'attributes': [
+                {'key': 'bool', 'value': {'boolValue': True}},
+                {'key': 'float', 'value': {'doubleValue': 1.5}},
+                {'key': 'int', 'value': {'intValue': '2'}},
+                {'key': 'other', 'value': {'stringValue': 'None'}},
+                {'key': 'str', 'value': {'stringValue': 'a'}}
+            ],
+            'status': {'code': 2, 'message': 'RuntimeError: foo'}
+        }]
+        assert len(parent.trace_id) == 32
+        assert len(s.span_id) == 16
+
+
+class TestFlush(object):
+
+    def test_file(self, tmpdir):
+        path = str(tmpdir.join('trace.jsonl'))
+        tracer = Tracer(file_path=path)
+        Span(tracer, 'one').end()
+        tracer.flush()
+        tracer.flush()
+        Span(tracer, 'two').end()
+        tracer.flush()
+        with open(path, 'r') as fh:
+            lines = [json.loads(x) for x in fh.readlines()]
+        assert [
+            [
+                s['name']
+                for s in x['resourceSpans'][0]['scopeSpans'][0]['spans']
+            ] for x in lines
+        ] == [['one'], ['two']]
+
+    def test_file_error(self, tmpdir):
+        tracer = Tracer(file_path=str(tmpdir.join('no', 'such', 'dir')))
+        Span(tracer, 'one').end()
+        with patch('%s.logger' % pbm) as m_logger:
+            tracer.flush()
+        assert m_logger.error.call_count == 1
+
+    def test_otlp(self):
+        coll = FakeCollector()
+        try:
+            tracer = Tracer(
+                otlp_url=coll.url, otlp_headers={'X-Token': 'secret'}
+            )
+            Span(tracer, 'one').end()
+            tracer.flush()
+        finally:
+            coll.stop()
+        assert len(coll.requests) == 1
+        path, headers, body = coll.requests[0]
+        assert path == '/v1/traces'
+        assert headers['Content-Type'] == 'application/json'
+        assert headers['X-Token'] == 'secret'
+        doc = json.loads(body.decode('utf-8'))
+        assert doc['resourceSpans'][0]['scopeSpans'][0]['spans'][0][
+            'name'] == 'one'
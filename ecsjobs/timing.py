@@ -0,0 +1,127 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from threading import Lock
+from time import perf_counter, thread_time
+
+logger = logging.getLogger(__name__)
+
+
+class Timings(object):
+    """
+    Lightweight recorder of the wall-clock and CPU time spent in named phases
+    of a run or of a job, via the :py:meth:`~.time` context manager.
+
+    CPU time is that of the calling thread, so phases that run concurrently
+    in other threads (such as job prefetches) are measured independently.
+    A phase entered more than once (such as polling sleeps) is accumulated
+    into one entry, which keeps the start time of its first occurrence and
+    counts the number of occurrences. Phases are kept in the order they were
+    first entered.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._phases = {}
+
+    @contextmanager
+    def time(self, name):
+        """
+        Context manager to time the enclosed block as phase ``name``. The
+        phase is recorded even if the block raises an exception.
+
+        :param name: phase name
+        :type name: str
+        """
+        start_dt = datetime.now()
+        wall = perf_counter()
+        cpu = thread_time()
+        try:
+            yield
+        finally:
+            self.add(
+                name, start_dt, perf_counter() - wall, thread_time() - cpu
+            )
+
+    def add(self, name, start_dt, wall_sec, cpu_sec):
+        """
+        Record (or accumulate) time spent in a phase.
+
+        :param name: phase name
+        :type name: str
+        :param start_dt: when the phase started
+        :type start_dt: datetime.datetime
+        :param wall_sec: wall-clock time spent in the phase, in seconds
+        :type wall_sec: float
+        :param cpu_sec: CPU time spent in the phase, in seconds
+        :type cpu_sec: float
+        """
+        with self._lock:
+            if name not in self._phases:
+                self._phases[name] = {
+                    'name': name, 'start_dt': start_dt, 'wall_sec': 0.0,
+                    'cpu_sec': 0.0, 'count': 0
+                }
+            phase = self._phases[name]
+            phase['wall_sec'] += wall_sec
+            phase['cpu_sec'] += cpu_sec
+            phase['count'] += 1
+        logger.debug('Phase %s took %.6fs wall, %.6fs CPU',
+                     name, wall_sec, cpu_sec)
+
+    @property
+    def records(self):
+        """
+        Return the recorded phases, in the order they were first entered, as
+        JSON-serializable dicts with keys ``name``, ``start_time`` (ISO 8601),
+        ``wall_sec``, ``cpu_sec`` and ``count``.
+
+        :rtype: list
+        """
+        with self._lock:
+            return [
+                {
+                    'name': p['name'],
+                    'start_time': p['start_dt'].isoformat(),
+                    'wall_sec': round(p['wall_sec'], 6),
+                    'cpu_sec': round(p['cpu_sec'], 6),
+                    'count': p['count']
+                } for p in self._phases.values()
+            ]
@@ -0,0 +1,370 @@
+"""
+The latest version of this package is available at:
+<http://github.com/jantman/ecsjobs>
+
+##################################################################################
+Copyright 2017 Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+
+    This file is part of ecsjobs, also known as ecsjobs.
+
+    ecsjobs is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    ecsjobs is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with ecsjobs.  If not, see <http://www.gnu.org/licenses/>.
+
+The Copyright and Authors attributions contained herein may not be removed or
+otherwise altered, except to add the Author attribution of a contributor to
+this work. (Additional Terms pursuant to Section 7b of the AGPL v3)
+##################################################################################
+While not legally required, I sincerely request that anyone who finds
+bugs please submit them at <https://github.com/jantman/ecsjobs> or
+to me via email, and that you send any contributions or improvements
+either as a pull request on GitHub, or to me via email.
+##################################################################################
+
+AUTHORS:
+Jason Antman <jason@jasonantman.com> <http://www.jasonantman.com>
+##################################################################################
+"""
+
+import os
+import json
+import logging
+from contextvars import ContextVar
+from datetime import datetime
+from threading import Lock
+from time import time_ns
+
+import requests
+
+from ecsjobs.version import VERSION
+
+logger = logging.getLogger(__name__)
+
+#: The active :py:class:`~.Tracer`, or None if tracing is disabled.
+_tracer = None
+
+#: The :py:class:`~.Span` that new spans are children of, by default.
+_current_span = ContextVar('ecsjobs_current_span', default=None)
+
+
+class Span(object):
+    """
+    A single timed operation within a trace. Use as a context manager, via
+    :py:func:`~.span`; the span becomes the current span while the context
+    is active, and is ended (with an error status if an exception was
+    raised) when it exits.
+    """
+
+    def __init__(self, tracer, name, parent=None, attributes=None):
+        """
+        :param tracer: the tracer that will export this span
+        :type tracer: Tracer
+        :param name: span name
+        :type name: str
+        :param parent: parent span; None for a root span
+        :type parent: Span
+        :param attributes: initial span attributes
+        :type attributes: dict
+        """
+        self._tracer = tracer
+        self.name = name
+        self.parent = parent
+        if parent is None:
+            self.trace_id = os.urandom(16).hex()
+        else:
+            self.trace_id = parent.trace_id
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.start_ns = time_ns()
+        self.end_ns = None
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        """
+        Set an attribute on the span.
+
+        :param key: attribute name
+        :type key: str
+        :param value: attribute value; values other than str, bool, int and
+          float are exported as strings
+        """
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        """
+        End the span and hand it to the tracer for export.
+
+        :param end_ns: end time in nanoseconds since the epoch; defaults to now
+        :type end_ns: int
+        """
+        self.end_ns = time_ns() if end_ns is None else end_ns
+        self._tracer.finish(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        _current_span.reset(self._token)
+        if exc_value is not None:
+            self.error = '%s: %s' % (exc_type.__name__, exc_value)
+        self.end()
+        return False
+
+
+class _NoopSpan(object):
+    """
+    Span used when tracing is disabled; does nothing, as cheaply as possible.
+    """
+
+    def set_attribute(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer(object):
+    """
+    Collects finished spans for one run, and exports them as OTLP/JSON
+    ``ExportTraceServiceRequest`` documents when :py:meth:`~.flush`\\ ed;
+    appended as a line to a local file, and/or POSTed to an OTLP/HTTP
+    endpoint.
+    """
+
+    def __init__(self, file_path=None, otlp_url=None, otlp_headers=None,
+                 timeout=10):
+        """
+        :param file_path: path of a local file to append spans to, one JSON
+          document per line
+        :type file_path: str
+        :param otlp_url: full URL of an OTLP/HTTP traces endpoint (e.g.
+          ``http://localhost:4318/v1/traces``) to POST spans to
+        :type otlp_url: str
+        :param otlp_headers: additional headers for requests to ``otlp_url``
+        :type otlp_headers: dict
+        :param timeout: timeout in seconds for requests to ``otlp_url``
+        :type timeout: int
+        """
+        self._file_path = file_path
+        self._otlp_url = otlp_url
+        self._otlp_headers = dict(otlp_headers or {})
+        self._timeout = timeout
+        self._lock = Lock()
+        self._spans = []
+
+    def finish(self, span):
+        """
+        Store a finished span for export.
+
+        :param span: the finished span
+        :type span: Span
+        """
+        with self._lock:
+            self._spans.append(span)
+
+    def to_otlp(self, spans):
+        """
+        Return an OTLP/JSON ``ExportTraceServiceRequest`` for a list of spans.
+
+        :param spans: finished spans
+        :type spans: list
+        :rtype: dict
+        """
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': self._attributes({
+                    'service.name': 'ecsjobs',
+                    'service.version': VERSION
+                })},
+                'scopeSpans': [{
+                    'scope': {'name': 'ecsjobs', 'version': VERSION},
+                    'spans': [self._span_otlp(s) for s in spans]
+                }]
+            }]
+        }
+
+    def _span_otlp(self, span):
+        """
+        Return the OTLP/JSON representation of a span.
+
+        :param span: a finished span
+        :type span: Span
+        :rtype: dict
+        """
+        res = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': self._attributes(span.attributes),
+            'status': {'code': 1}
+        }
+        if span.parent is not None:
+            res['parentSpanId'] = span.parent.span_id
+        if span.error is not None:
+            res['status'] = {'code': 2, 'message': span.error}
+        return res
+
+    @staticmethod
+    def _attributes(attrs):
+        """
+        Return a list of OTLP/JSON ``KeyValue`` objects for a dict.
+
+        :param attrs: attributes
+        :type attrs: dict
+        :rtype: list
+        """
+        res = []
+        for k in sorted(attrs.keys()):
+            v = attrs[k]
+            if isinstance(v, bool):
+                val = {'boolValue': v}
+            elif isinstance(v, int):
+                val = {'intValue': str(v)}
+            elif isinstance(v, float):
+                val = {'doubleValue': v}
+            else:
+                val = {'stringValue': str(v)}
+            res.append({'key': k, 'value': val})
+        return res
+
+    def flush(self):
+        """
+        Export and discard all finished spans. Export failures are logged,
+        but otherwise ignored.
+        """
+        with self._lock:
+            spans = self._spans
+            self._spans = []
+        if len(spans) == 0:
+            return
+        doc = self.to_otlp(spans)
+        if self._file_path is not None:
+            try:
+                with open(self._file_path, 'a') as fh:
+                    fh.write(json.dumps(doc, sort_keys=True) + "\n")
+                logger.info('Wrote %d spans to %s', len(spans), self._file_path)
+            except Exception:
+                logger.error('Unable to write trace spans to %s',
+                             self._file_path, exc_info=True)
+        if self._otlp_url is not None:
+            try:
+                resp = requests.post(
+                    self._otlp_url, json=doc, headers=self._otlp_headers,
+                    timeout=self._timeout
+                )
+                resp.raise_for_status()
+                logger.info('Exported %d spans to %s', len(spans),
+                            self._otlp_url)
+            except Exception:
+                logger.error('Unable to export trace spans to %s',
+                             self._otlp_url, exc_info=True)
+
+
+def configure(config):
+    """
+    Enable tracing if either of the ``trace_file_path`` or ``trace_otlp_url``
+    global settings is set; otherwise, disable it.
+
+    :param config: Configuration
+    :type config: ecsjobs.config.Config
+    """
+    global _tracer
+    file_path = config.get_global('trace_file_path')
+    otlp_url = config.get_global('trace_otlp_url')
+    if file_path is None and otlp_url is None:
+        _tracer = None
+        return
+    _tracer = Tracer(
+        file_path=file_path, otlp_url=otlp_url,
+        otlp_headers=config.get_global('trace_otlp_headers')
+    )
+
+
+def span(name, attributes=None, parent=None):
+    """
+    Return a new span, for use as a context manager. If tracing is disabled,
+    a shared no-op span is returned instead.
+
+    :param name: span name
+    :type name: str
+    :param attributes: initial span attributes
+    :type attributes: dict
+    :param parent: parent span; defaults to the current span. This must be
+      given explicitly (e.g. as captured by :py:func:`~.current_span`) for
+      spans started in other threads.
+    :type parent: Span
+    :rtype: Span
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    if not isinstance(parent, Span):
+        parent = _current_span.get()
+    return Span(_tracer, name, parent=parent, attributes=attributes)
+
+
+def current_span():
+    """
+    Return the current span, to set attributes on it. If tracing is disabled
+    or there is no current span, a shared no-op span is returned.
+
+    :rtype: Span
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    res = _current_span.get()
+    return _NOOP_SPAN if res is None else res
+
+
+def add_timings(timings, names):
+    """
+    Add already-finished phases recorded by a
+    :py:class:`~ecsjobs.timing.Timings` as children of the current span; for
+    phases (such as loading the configuration) that finish before tracing
+    can be configured. The current span's start time is moved back to cover
+    them, if needed.
+
+    :param timings: recorded phases
+    :type timings: ecsjobs.timing.Timings
+    :param names: names of the phases to add
+    :type names: list
+    """
+    parent = _current_span.get()
+    if _tracer is None or parent is None:
+        return
+    for t in timings.records:
+        if t['name'] not in names:
+            continue
+        s = Span(_tracer, t['name'], parent=parent)
+        s.start_ns = int(
+            datetime.fromisoformat(t['start_time']).timestamp() * 1e9
+        )
+        s.end(end_ns=s.start_ns + int(t['wall_sec'] * 1e9))
+        parent.start_ns = min(parent.start_ns, s.start_ns)
+
+
+def flush():
+    """
+    Export all finished spans, if tracing is enabled.
+    """
+    if _tracer is not None:
+        _tracer.flush()
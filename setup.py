@@ -42,7 +42,8 @@ with open('README.rst') as file:
     long_description = file.read()
 
 requires = [
-    'boto3>=1.0.0,<2.0.0',
+    'boto3>=1.12.0,<2.0.0',
+    'botocore>=1.15.0,<2.0.0',
     'cronex==0.1.0',
     'docker>=2.0.0',
     'jsonschema>=2.0.0,<3.0.0',